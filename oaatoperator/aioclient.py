@@ -0,0 +1,190 @@
+"""
+aioclient.py
+
+Asynchronous Kubernetes API calls for use from async kopf handlers.
+
+Requests are made via kopf's own API client, so they run on kopf's event
+loop and share its aiohttp session (and connection pool), the credentials
+provided by the login handler and the retry/backoff settings, rather than
+tying up a worker thread for each blocking pykube call.
+"""
+import urllib.parse
+import aiohttp
+from types import ModuleType
+from typing import Any, Dict, List, Optional
+import kopf
+from kopf._cogs.helpers import typedefs
+
+# kopf's API client is not part of its public interface, so (as well as
+# kopf being pinned in requirements/common.txt) check that what is used is
+# still there, rather than failing later in a handler
+API_FUNCTIONS = ('get', 'post', 'patch', 'delete', 'stream')
+try:
+    from kopf._cogs.clients import api, errors
+except ImportError as exc:
+    raise ImportError(
+        f'unsupported kopf version {kopf.__version__}: {exc}') from exc
+
+
+def check_kopf_api(client: ModuleType = api) -> None:
+    """Raise ImportError if kopf's API client lacks a function used here."""
+    missing = [name for name in API_FUNCTIONS if not hasattr(client, name)]
+    if missing:
+        raise ImportError(
+            f'unsupported kopf version {kopf.__version__}: API client has '
+            f'no {", ".join(missing)}')
+
+
+check_kopf_api()
+
+APIError = errors.APIError
+APIConflictError = errors.APIConflictError
+APINotFoundError = errors.APINotFoundError
+
+# (apiVersion, plural) of the resources used by the operator
+POD = ('v1', 'pods')
+JOB = ('batch/v1', 'jobs')
+CONFIGMAP = ('v1', 'configmaps')
+OAATGROUP = ('kawaja.net/v1', 'oaatgroups')
+OAATTYPE = ('kawaja.net/v1', 'oaattypes')
+
+_settings: Optional[kopf.OperatorSettings] = None
+
+
+def configure(settings: kopf.OperatorSettings) -> None:
+    """Record the operator settings (called from the startup handler)."""
+    global _settings
+    _settings = settings
+
+
+def get_settings() -> kopf.OperatorSettings:
+    global _settings
+    if _settings is None:
+        _settings = kopf.OperatorSettings()
+    return _settings
+
+
+def url(resource: tuple,
+        namespace: Optional[str],
+        name: Optional[str] = None,
+        query: Optional[Dict[str, str]] = None) -> str:
+    """Build the API URL for a resource (relative to the server)."""
+    api_version, plural = resource
+    path = '/api/v1' if api_version == 'v1' else f'/apis/{api_version}'
+    if namespace:
+        path += f'/namespaces/{namespace}'
+    path += f'/{plural}'
+    if name:
+        path += f'/{name}'
+    if query:
+        path += '?' + urllib.parse.urlencode(query)
+    return path
+
+
+def label_selector(labels: Dict[str, str]) -> str:
+    return ','.join(f'{key}={value}' for key, value in labels.items())
+
+
+async def get_object(resource: tuple,
+                     namespace: Optional[str],
+                     name: str,
+                     *,
+                     logger: typedefs.Logger) -> Dict[str, Any]:
+    """Retrieve an object."""
+    return await api.get(url(resource, namespace, name),
+                         settings=get_settings(), logger=logger)
+
+
+async def list_objects(resource: tuple,
+                       namespace: Optional[str],
+                       *,
+                       labels: Optional[Dict[str, str]] = None,
+                       logger: typedefs.Logger) -> List[Dict[str, Any]]:
+    """List objects, optionally restricted to those matching labels."""
+    query = {'labelSelector': label_selector(labels)} if labels else None
+    result = await api.get(url(resource, namespace, query=query),
+                           settings=get_settings(), logger=logger)
+    return result.get('items', [])
+
+
+async def create_object(resource: tuple,
+                        namespace: Optional[str],
+                        body: Dict[str, Any],
+                        *,
+                        logger: typedefs.Logger) -> Dict[str, Any]:
+    """Create an object, returning the object as created."""
+    return await api.post(url(resource, namespace),
+                          payload=body,
+                          settings=get_settings(), logger=logger)
+
+
+async def patch_object(resource: tuple,
+                       namespace: Optional[str],
+                       name: str,
+                       patch: Dict[str, Any],
+                       *,
+                       logger: typedefs.Logger) -> Dict[str, Any]:
+    """Apply a merge-patch to an object."""
+    return await api.patch(
+        url(resource, namespace, name),
+        headers={'Content-Type': 'application/merge-patch+json'},
+        payload=patch,
+        settings=get_settings(), logger=logger)
+
+
+async def delete_object(resource: tuple,
+                        namespace: Optional[str],
+                        name: str,
+                        *,
+                        propagation_policy: str = 'Background',
+                        grace_period: Optional[int] = None,
+                        logger: typedefs.Logger) -> None:
+    """
+    Delete an object (a pod with grace_period=0 is removed without
+    waiting for it to stop).
+    """
+    payload: Dict[str, Any] = {'propagationPolicy': propagation_policy}
+    if grace_period is not None:
+        payload['gracePeriodSeconds'] = grace_period
+    await api.delete(url(resource, namespace, name),
+                     payload=payload,
+                     settings=get_settings(), logger=logger)
+
+
+async def delete_collection(resource: tuple,
+                            namespace: Optional[str],
+                            *,
+                            label_selector: str,
+                            field_selector: Optional[str] = None,
+                            propagation_policy: str = 'Background',
+                            logger: typedefs.Logger) -> None:
+    """Delete all objects matching the selectors with a single request."""
+    query = {'labelSelector': label_selector}
+    if field_selector:
+        query['fieldSelector'] = field_selector
+    await api.delete(url(resource, namespace, query=query),
+                     payload={'propagationPolicy': propagation_policy},
+                     settings=get_settings(), logger=logger)
+
+
+async def pod_proxy(namespace: Optional[str],
+                    name: str,
+                    port: int,
+                    path: str,
+                    *,
+                    payload: Optional[Dict[str, Any]] = None,
+                    timeout: Optional[float] = None,
+                    logger: typedefs.Logger) -> Dict[str, Any]:
+    """
+    Make a request to a port of a pod, via the API server's pod proxy: a
+    POST of payload, or a GET if there is no payload. The pod must reply
+    with JSON.
+    """
+    path = f'{url(POD, namespace, f"{name}:{port}")}/proxy/{path}'
+    client_timeout = (aiohttp.ClientTimeout(total=timeout)
+                      if timeout is not None else None)
+    if payload is None:
+        return await api.get(path, timeout=client_timeout,
+                             settings=get_settings(), logger=logger)
+    return await api.post(path, payload=payload, timeout=client_timeout,
+                          settings=get_settings(), logger=logger)
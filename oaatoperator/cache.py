@@ -0,0 +1,102 @@
+"""
+cache.py
+
+Lookups against the in-memory indices maintained by the operator: the
+kopf oaattype index (see handlers.py) and the pod index (see podwatch.py).
+
+Each index is kept current from its watch stream (including removing
+entries when an object is deleted), so a lookup here replaces an API
+call. The pod index is only available once the pods have been listed;
+until then callers list the pods from the API instead.
+"""
+from copy import deepcopy
+from typing import Any, Hashable, List, Mapping, Optional, Tuple
+
+
+class CacheStats:
+    """Hit/miss counters for a cache."""
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self) -> None:
+        self.hits += 1
+
+    def miss(self) -> None:
+        self.misses += 1
+
+    def reset(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def hit_ratio(self) -> Optional[float]:
+        total = self.hits + self.misses
+        if total == 0:
+            return None
+        return self.hits / total
+
+    def __str__(self) -> str:
+        return f'{self.name} cache: hits={self.hits}, misses={self.misses}'
+
+
+oaattype_stats = CacheStats('oaattype')
+
+
+def index_lookup(index: Optional[Mapping[Hashable, Any]],
+                 key: Hashable) -> Optional[Any]:
+    """Return the (single) value stored in an index under key."""
+    if index is None or key not in index:
+        return None
+    for value in index[key]:
+        return value
+    return None
+
+
+def get_oaattype(index: Optional[Mapping[Hashable, Any]],
+                 namespace: Optional[str],
+                 name: str) -> Optional[dict]:
+    """
+    Retrieve an OaatType object from the oaattype index.
+
+    Returns a copy, so callers are free to modify it, or None if the
+    OaatType is not in the index.
+    """
+    obj = index_lookup(index, (namespace, name))
+    if obj is None:
+        oaattype_stats.miss()
+        return None
+    oaattype_stats.hit()
+    return deepcopy(obj)
+
+
+RUNNING_PHASES = ('Running', 'Pending')
+
+pod_stats = CacheStats('pod')
+
+
+def pod_key(namespace: Optional[str], parent_name: str,
+            phase: str) -> Tuple[Optional[str], str, str]:
+    """Key used for the pod index."""
+    return (namespace, parent_name, phase)
+
+
+def get_running_pods(index: Optional[Mapping[Hashable, Any]],
+                     namespace: Optional[str],
+                     parent_name: str) -> List[dict]:
+    """
+    Retrieve all Running or Pending pods for an OaatGroup from the pod index.
+
+    Returns copies of the (minimal) pod objects.
+    """
+    pods = []
+    if index is not None:
+        for phase in RUNNING_PHASES:
+            key = pod_key(namespace, parent_name, phase)
+            if key in index:
+                pods.extend(deepcopy(pod) for pod in index[key])
+    if pods:
+        pod_stats.hit()
+    else:
+        pod_stats.miss()
+    return pods
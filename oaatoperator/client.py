@@ -0,0 +1,121 @@
+"""
+client.py
+
+Process-wide Kubernetes API client shared by all overseer objects.
+
+Building a pykube.HTTPClient re-reads the kubeconfig (or service account)
+files and opens a fresh requests session, so each new client pays for new
+TCP/TLS connections. Instead, a single client is created on first use and
+handed out to every Overseer, OaatGroup and OaatType, so that one handler
+invocation (and the next one) reuses warm keep-alive connections.
+
+Configuration (environment variables):
+- OAAT_API_POOL_SIZE: maximum number of pooled connections (default 10)
+- OAAT_API_REFRESH_INTERVAL: seconds after which the credentials are
+  re-read from the environment (default 300). Service account tokens are
+  rotated on disk by the kubelet, so they must be re-read periodically.
+
+Reading the kubeconfig blocks, so it is kept off kopf's event loop: the
+client is created by a (sync, so run in a worker thread) startup handler,
+and credentials which are due to be refreshed when get_api() is called
+from the event loop are re-read in a worker thread, the client being
+returned straight away with the credentials it already has.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Optional
+import pykube
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_REFRESH_INTERVAL = 300.0
+
+_lock = threading.Lock()
+_api: Optional[pykube.HTTPClient] = None
+_loaded_at = 0.0
+
+
+def pool_size() -> int:
+    """Maximum number of pooled connections to the API server."""
+    try:
+        return max(1, int(os.environ.get('OAAT_API_POOL_SIZE',
+                                         DEFAULT_POOL_SIZE)))
+    except ValueError:
+        return DEFAULT_POOL_SIZE
+
+
+def refresh_interval() -> float:
+    """Number of seconds before credentials are re-read."""
+    try:
+        return float(os.environ.get('OAAT_API_REFRESH_INTERVAL',
+                                    DEFAULT_REFRESH_INTERVAL))
+    except ValueError:
+        return DEFAULT_REFRESH_INTERVAL
+
+
+def _new_api() -> pykube.HTTPClient:
+    config = pykube.KubeConfig.from_env()
+    adapter = pykube.http.KubernetesHTTPAdapter(
+        config, pool_connections=pool_size(), pool_maxsize=pool_size())
+    return pykube.HTTPClient(config, http_adapter=adapter)
+
+
+def _refresh_credentials(api: pykube.HTTPClient) -> None:
+    """
+    Re-read credentials without discarding the pooled connections.
+
+    The HTTP adapter reads its kube_config on every request, so replacing
+    the config is enough to pick up a rotated token.
+    """
+    config = pykube.KubeConfig.from_env()
+    api.config = config
+    for adapter in api.session.adapters.values():
+        if isinstance(adapter, pykube.http.KubernetesHTTPAdapter):
+            adapter.kube_config = config
+
+
+def _refresh_in_background(api: pykube.HTTPClient) -> None:
+    """As for _refresh_credentials(), logging (rather than raising) errors."""
+    try:
+        _refresh_credentials(api)
+    except Exception as exc:
+        logging.getLogger(__name__).warning(
+            f'cannot refresh API credentials: {exc!r}')
+
+
+def _event_loop_running() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def get_api() -> pykube.HTTPClient:
+    """Return the shared Kubernetes API client, creating it if required."""
+    global _api, _loaded_at
+    with _lock:
+        now = time.monotonic()
+        if _api is None:
+            _api = _new_api()
+            _loaded_at = now
+        elif now - _loaded_at > refresh_interval():
+            if _event_loop_running():
+                asyncio.get_running_loop().run_in_executor(
+                    None, _refresh_in_background, _api)
+            else:
+                _refresh_credentials(_api)
+            _loaded_at = now
+        return _api
+
+
+def reset_api() -> None:
+    """Discard the shared client (the next get_api() creates a new one)."""
+    global _api, _loaded_at
+    with _lock:
+        if _api is not None and hasattr(_api.session, 'close'):
+            _api.session.close()
+        _api = None
+        _loaded_at = 0.0
@@ -0,0 +1,162 @@
+"""
+deadline.py
+
+Bound the time an item pod may run (or wait to start), so that a hung or
+unstartable item does not block its OaatGroup indefinitely.
+
+For an OaatGroup with runtimeDeadlineFactor, each item pod gets an
+activeDeadlineSeconds of the item's predicted runtime (see
+runtime_stats.py) times the factor, capped at runtimeDeadlineMax. An item
+with no runtime history gets runtimeDeadlineMax (or no deadline, if that
+is not set). Kubernetes fails the pod once the deadline passes; the
+deadline is also recorded in the DEADLINE_ANNOTATION annotation, so the
+operator can fail a straggler which is still running STRAGGLER_GRACE
+after its deadline (for example, on an unresponsive node).
+
+A pod which is still Pending pendingTimeout (default
+DEFAULT_PENDING_TIMEOUT) after it was created (for example, because it
+cannot be scheduled or its image cannot be pulled) is also failed, which
+puts its item into cool-off.
+"""
+import datetime
+import math
+from typing import Any, Iterable, Mapping, Optional, Tuple
+import kopf
+
+from oaatoperator.utility import date_from_isostr, now, parse_duration
+
+# annotation recording the deadline (in seconds) of an item pod
+DEADLINE_ANNOTATION = 'oaatoperator.kawaja.net/deadline'
+# shortest deadline given to a pod, which includes its startup time
+MIN_DEADLINE = 60
+# time after its deadline at which a pod still running is a straggler
+STRAGGLER_GRACE = datetime.timedelta(minutes=5)
+# time an item pod may be Pending before it is failed
+DEFAULT_PENDING_TIMEOUT = datetime.timedelta(minutes=30)
+
+
+def deadline_settings(
+        spec: Mapping[str, Any],
+        name: str) -> Tuple[Optional[float], Optional[datetime.timedelta]]:
+    """
+    Validate the deadline settings of an OaatGroup spec.
+
+    Returns (runtimeDeadlineFactor or None, runtimeDeadlineMax or None).
+    """
+    factor = spec.get('runtimeDeadlineFactor')
+    if factor is not None and (isinstance(factor, bool)
+                               or not isinstance(factor, (int, float))
+                               or factor <= 0):
+        raise kopf.PermanentError(
+            f'invalid runtimeDeadlineFactor {factor} in {name}')
+    cap = None
+    if 'runtimeDeadlineMax' in spec:
+        cap = parse_duration(str(spec['runtimeDeadlineMax']))
+        if cap is None:
+            raise kopf.PermanentError(
+                f'invalid runtimeDeadlineMax {spec["runtimeDeadlineMax"]} '
+                f'in {name}')
+    return factor, cap
+
+
+def item_deadline(predictions: Iterable[Optional[float]],
+                  factor: Optional[float],
+                  cap: Optional[datetime.timedelta]) -> Optional[int]:
+    """
+    The deadline (activeDeadlineSeconds) of a pod running items with the
+    given predicted runtimes (in seconds, None for an item without
+    runtime history), or None if the pod should not have one.
+    """
+    if factor is None:
+        return None
+    predictions = list(predictions)
+    if any(predicted is None for predicted in predictions):
+        seconds = cap.total_seconds() if cap is not None else None
+    else:
+        seconds = factor * sum(predictions)  # type: ignore[arg-type]
+        if cap is not None:
+            seconds = min(seconds, cap.total_seconds())
+    if seconds is None:
+        return None
+    return max(MIN_DEADLINE, math.ceil(seconds))
+
+
+def straggler_at(pod: Mapping[str, Any]) -> Optional[datetime.datetime]:
+    """
+    When a running pod becomes a straggler: STRAGGLER_GRACE after its
+    deadline (DEADLINE_ANNOTATION). None if the pod has no deadline or
+    has not started.
+    """
+    metadata = pod.get('metadata', {})
+    try:
+        deadline = int(metadata.get('annotations', {})[DEADLINE_ANNOTATION])
+    except (KeyError, ValueError):
+        return None
+    started = pod.get('status', {}).get('startTime')
+    if not started:
+        return None
+    return (date_from_isostr(started) + datetime.timedelta(seconds=deadline)
+            + STRAGGLER_GRACE)
+
+
+def is_straggler(pod: Mapping[str, Any],
+                 at: Optional[datetime.datetime] = None) -> bool:
+    """
+    Whether a running pod has not been stopped STRAGGLER_GRACE after its
+    deadline (DEADLINE_ANNOTATION).
+    """
+    due = straggler_at(pod)
+    return due is not None and (at or now()) > due
+
+
+def pending_timeout(spec: Mapping[str, Any],
+                    name: str) -> datetime.timedelta:
+    """Validate the pendingTimeout of an OaatGroup spec."""
+    if 'pendingTimeout' not in spec:
+        return DEFAULT_PENDING_TIMEOUT
+    timeout = parse_duration(str(spec['pendingTimeout']))
+    if timeout is None:
+        raise kopf.PermanentError(
+            f'invalid pendingTimeout {spec["pendingTimeout"]} in {name}')
+    return timeout
+
+
+def pending_reason(pod: Mapping[str, Any]) -> str:
+    """
+    Why a pod is Pending: the reason it has not been scheduled (e.g.
+    Unschedulable), or that one of its containers is waiting (e.g.
+    ImagePullBackOff).
+    """
+    status = pod.get('status', {})
+    for condition in status.get('conditions', []):
+        if (condition.get('type') == 'PodScheduled'
+                and condition.get('status') == 'False'):
+            return condition.get('reason') or 'not scheduled'
+    for containerstatus in status.get('containerStatuses', []):
+        waiting = containerstatus.get('state', {}).get('waiting')
+        if waiting and waiting.get('reason'):
+            return waiting['reason']
+    return 'Pending'
+
+
+def stuck_pending_at(
+        pod: Mapping[str, Any],
+        timeout: datetime.timedelta) -> Optional[datetime.datetime]:
+    """
+    When a Pending pod will have been Pending for longer than timeout.
+    None if the pod is not Pending or its creation time is not known.
+    """
+    if pod.get('status', {}).get('phase') != 'Pending':
+        return None
+    created = pod.get('metadata', {}).get('creationTimestamp')
+    if not created:
+        return None
+    return date_from_isostr(created) + timeout
+
+
+def is_stuck_pending(pod: Mapping[str, Any],
+                     timeout: datetime.timedelta,
+                     at: Optional[datetime.datetime] = None) -> bool:
+    """Whether a pod has been Pending for longer than timeout."""
+    due = stuck_pending_at(pod, timeout)
+    return due is not None and (at or now()) > due
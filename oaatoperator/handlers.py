@@ -1,16 +1,23 @@
 import sys
+import datetime
 import logging
-from typing import Any
+from copy import deepcopy
+from functools import partial
+from typing import Any, List, Optional
 from typing_extensions import Unpack
 import kopf
 
 import oaatoperator
+from oaatoperator import (aioclient, client, itemindex, itemstore,
+                          itemwatch, jobwatch, podgc, podwatch)
+from oaatoperator.job import is_job_pod
 from oaatoperator.oaatitem import OaatItem
 from oaatoperator.py_types import CallbackArgs
-from oaatoperator.utility import now_iso, my_name
+from oaatoperator.utility import date_from_isostr, now, now_iso, my_name
 from oaatoperator.common import ProcessingComplete
 from oaatoperator.oaatgroup import OaatGroup
-from oaatoperator.pod import PodOverseer
+from oaatoperator.pod import JobOverseer, PodOverseer, reconcile_pods_async
+from oaatoperator.scheduler import MIN_INTERVAL, SETTLE_DELAY, scheduler
 
 # TODO: investigate whether pykube will re-connect to k8s if the session drops
 # for some reason
@@ -31,6 +38,22 @@ def is_succeeded(status, **_):
     return status.get('phase') == 'Succeeded'
 
 
+def is_item_failed(labels, **kwargs):
+    """
+    For when= function to test if a pod created by the operator (rather
+    than by a Job, see job_finished) has failed.
+    """
+    return is_failed(**kwargs) and not is_job_pod(labels)
+
+
+def is_item_succeeded(labels, **kwargs):
+    """
+    For when= function to test if a pod created by the operator (rather
+    than by a Job, see job_finished) has succeeded.
+    """
+    return is_succeeded(**kwargs) and not is_job_pod(labels)
+
+
 @kopf.on.startup()
 def configure(settings: kopf.OperatorSettings, **_: Any) -> None:
     """Set kopf configuration."""
@@ -43,6 +66,7 @@ def configure(settings: kopf.OperatorSettings, **_: Any) -> None:
         prefix='oaatoperator.kawaja.net')
     settings.watching.server_timeout = 600
     settings.watching.client_timeout = 660
+    aioclient.configure(settings)
     print('Oaat Operator Version: ' +
           getattr(oaatoperator, '__version__', '<not set>'),
           file=sys.stderr)
@@ -54,6 +78,108 @@ def configure(settings: kopf.OperatorSettings, **_: Any) -> None:
           file=sys.stderr)
 
 
+@kopf.on.startup()
+def load_api_client(**_: Any) -> None:
+    """
+    Create the shared API client (see client.py). kopf runs sync handlers
+    in a worker thread, so the kubeconfig is not read on the event loop.
+    """
+    client.get_api()
+
+
+@kopf.on.startup()
+async def start_pod_watch(settings: kopf.OperatorSettings,
+                          logger: logging.Logger, **_: Any) -> None:
+    """
+    Watch the operator's pods (see podwatch.py). The pods are listed in
+    the background: until then, OaatGroup handlers list running pods from
+    the API rather than using the pod index.
+    """
+    await podwatch.start(settings, logger)
+
+
+@kopf.on.cleanup()
+async def stop_pod_watch(**_: Any) -> None:
+    """Stop watching the operator's pods."""
+    await podwatch.stop()
+
+
+@kopf.on.startup()
+async def start_item_watch(settings: kopf.OperatorSettings,
+                           logger: logging.Logger, **_: Any) -> None:
+    """
+    Watch the item state ConfigMaps (see itemwatch.py). Until they are
+    listed, OaatGroup handlers retrieve item state from the API.
+    """
+    await itemwatch.start(settings, logger)
+
+
+@kopf.on.cleanup()
+async def stop_item_watch(**_: Any) -> None:
+    """Stop watching the item state ConfigMaps."""
+    await itemwatch.stop()
+
+
+@kopf.on.startup()
+async def start_job_watch(settings: kopf.OperatorSettings,
+                          logger: logging.Logger, **_: Any) -> None:
+    """Watch the operator's Jobs (see jobwatch.py)."""
+    await jobwatch.start(settings, logger)
+
+
+@kopf.on.cleanup()
+async def stop_job_watch(**_: Any) -> None:
+    """Stop watching the operator's Jobs."""
+    await jobwatch.stop()
+
+
+@kopf.index('kawaja.net', 'v1', 'oaattypes')  # type: ignore[arg-type]
+async def oaattype_index(name: str, namespace: str, body: kopf.Body,
+                         **_: Any) -> dict:
+    """
+    oaattype_index (oaattype)
+
+    Keep an in-memory copy of each OaatType, keyed by (namespace, name), so
+    OaatGroup handlers do not need to retrieve the OaatType on every run.
+    """
+    return {(namespace, name): {
+        'apiVersion': body.get('apiVersion'),
+        'kind': body.get('kind'),
+        'metadata': {'name': name, 'namespace': namespace},
+        'spec': deepcopy(dict(body.get('spec', {}))),
+    }}
+
+
+def completion_visible(kwargs: CallbackArgs, item: str,
+                       finished_at: datetime.datetime) -> bool:
+    """
+    Whether the (live) item state reflects the completion of item at
+    finished_at.
+    """
+    item_status = itemstore.live_item_status(kwargs, item,
+                                             itemwatch.item_index())
+    return any(
+        date_from_isostr(item_status.get(key, '')) >= finished_at
+        for key in ('last_success', 'last_failure'))
+
+
+def changed_result(kwargs: CallbackArgs, handler_id: str,
+                   result: Optional[dict]) -> Optional[dict]:
+    """
+    Return the result of a handler for kopf to store in the status, or
+    None if the status already holds that result (kopf would otherwise
+    write it again on every run of a timer).
+    """
+    status = kwargs['status'] or {}
+    if result is not None and status.get(handler_id) == result:
+        return None
+    return result
+
+
+# Handlers are async, so they run on kopf's event loop rather than in a
+# worker thread: any API calls made from them must use the async client
+# (oaatoperator.aioclient) rather than pykube, which would block the loop.
+#
 # Not using expansion of kwargs in these handlers because of the
 # way we're passing kwargs to the OaatGroup and PodOverseer classes.
 # If we expand here, then we can't pass the full kwargs dict to those
@@ -61,30 +187,52 @@ def configure(settings: kopf.OperatorSettings, **_: Any) -> None:
 # error-prone than just passing the full kwargs dict as a single
 # argument and letting those classes unpack it as needed.
 @kopf.timer('kawaja.net', 'v1', 'oaatgroups',  # type: ignore[arg-type]
-            initial_delay=90, interval=60,
+            initial_delay=90, interval=1,
             annotations={'oaatoperator.kawaja.net/operator-status': 'active'})
-def oaat_timer(**kwargs: Unpack[CallbackArgs]):
+async def oaat_timer(**kwargs: Unpack[CallbackArgs]):
     """
     oaat_timer (oaatgroup)
 
     Main loop to handle oaatgroup object.
+
+    Waits (see scheduler.py) until the group is due: when the next item
+    becomes eligible to run, or when woken by a change to the OaatGroup
+    or one of its pods.
     """
-    kwargs['logger'].debug(f'[{my_name()}] reason: timer (60sec)')
+    key = (kwargs['namespace'], kwargs['name'])
+    if not await scheduler.wait(key, kwargs.get('stopped')):
+        scheduler.forget(key)
+        itemindex.discard(key)
+        return None
+    if not await scheduler.settle(key, partial(completion_visible, kwargs)):
+        # a pod handler has recorded an item's completion which the live
+        # status does not show yet: acting now could re-run that item
+        scheduler.schedule(key, now() + SETTLE_DELAY)
+        return None
+    kwargs['logger'].debug(f'[{my_name()}] reason: timer (due)')
     memo = kwargs['memo']
     try:
         oaatgroup = OaatGroup(kopf_object=kwargs)
     except ProcessingComplete as exc:
+        scheduler.reschedule(key, None)
         return {'message': f'Error: {exc.ret.get("error")}'}
+    except Exception:
+        # e.g. kopf.PermanentError from validating the OaatGroup: back off,
+        # rather than failing again on each of the timer's (1s) intervals
+        scheduler.reschedule(key, now() + MIN_INTERVAL)
+        raise
     curloop = memo.get('loops', 0)
 
     try:
+        await oaatgroup.load_item_state_async()
         oaatgroup.validate_items()
 
         # Verify that an existing job is running (returns if not)
-        oaatgroup.verify_running()
+        await oaatgroup.verify_running_async()
 
-        # no pod is currently running (verify_running() raises otherwise) -
-        # reflect that in handler_status before checking for a new item to run
+        # no pod is currently running (verify_running_async() raises
+        # otherwise) - reflect that in handler_status before checking for a
+        # new item to run
         memo.state = 'idle'
         memo.currently_running = None
         memo.pod = None
@@ -96,46 +244,51 @@ def oaat_timer(**kwargs: Unpack[CallbackArgs]):
         # No item running, so check to see if we're ready to start another
         next_item: OaatItem = oaatgroup.find_job_to_run()
 
-        # Found an oaatgroup job to run, now run it
-        oaatgroup.info(f'running item {next_item.name}')
-        oaatgroup.set_item_status(next_item.name, 'podphase', 'started')
+        # Found an oaatgroup job to run (along with others, for a batch
+        # pod), now run it
+        batch = [item.name for item in oaatgroup.find_batch(next_item)]
+        oaatgroup.info(f'running item {", ".join(batch)}')
+        for item_name in batch:
+            oaatgroup.set_item_status(item_name, 'podphase', 'started')
         memo.state = 'running'
         memo.currently_running = next_item.name
 
-        podobj = next_item.run()
+        podobj = await next_item.run_async(
+            batch if len(batch) > 1 else None)
         memo.pod = podobj.metadata['name']
+        memo.job = podobj.metadata['name'] if podobj.kind == 'Job' else None
 
         memo.last_run = now_iso()
         memo.children = [podobj.metadata['uid']]
 
-        raise ProcessingComplete(message=f'started item {next_item.name}')
+        raise ProcessingComplete(message=f'started item {", ".join(batch)}')
 
     except ProcessingComplete as exc:
         memo.loops = curloop + 1
         oaatgroup.set_status('handler_status', memo)
-        return oaatgroup.handle_processing_complete(exc)
-
-
-@kopf.on.field('pods',
-               field='status.phase',
-               labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'})
-@kopf.on.resume('pods',
-                labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'},
-                when=is_running)
-@kopf.timer('pods',  # type: ignore[arg-type]
-            interval=0.5 * 3600,
-            labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'})
-def pod_phasechange(**kwargs: Unpack[CallbackArgs]) -> None:
+        if kwargs['annotations'].get('pause_new_jobs'):
+            scheduler.reschedule(key, None)
+        else:
+            scheduler.reschedule(key, oaatgroup.next_due())
+        await oaatgroup.write_item_state_async()
+        return changed_result(kwargs, 'oaat_timer',
+                              oaatgroup.handle_processing_complete(exc))
+    except Exception:
+        scheduler.reschedule(key, now() + MIN_INTERVAL)
+        raise
+
+
+@podwatch.on_change()
+async def pod_phasechange(**kwargs: Unpack[CallbackArgs]) -> None:
     """
     pod_phasechange (pod)
 
     Update parent (OaatGroup) phase information for this item.
-    Triggered by change in the pod's "phase" status field, or every
-    1/2 hour just in case
+    Triggered by change in the pod's "phase" status field (see also
+    pod_sweep)
     """
     logger = kwargs['logger']
-    logger.debug(
-        f'[{my_name()}] reason: {kwargs.get("reason", "timer (30min)")}')
+    logger.debug(f'[{my_name()}] reason: {kwargs.get("reason")}')
     logger.debug(f'[{my_name()}] diff: {kwargs.get("diff")}')
     logger.debug(f'[{my_name()}] status: {kwargs.get("status")}')
     try:
@@ -146,36 +299,49 @@ def pod_phasechange(**kwargs: Unpack[CallbackArgs]) -> None:
     pod.info(f'[{my_name()}] status for {pod.name} has changed')
 
     try:
-        pod.update_phase()
+        await pod.update_phase_async()
     except ProcessingComplete as exc:
         pod.handle_processing_complete(exc)
+        wake_parent(kwargs)
         return
 
     logger.error(f'[{my_name()}] should never happen')
     return
 
 
-@kopf.on.field('', 'v1', 'pods',
-               field='status.phase',
-               labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'},
-               when=is_succeeded)
-@kopf.on.resume('', 'v1', 'pods',
-                labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'},
-                when=is_succeeded)
-@kopf.timer('', 'v1', 'pods',  # type: ignore[arg-type]
-            interval=0.5*3600,
-            labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'},
-            when=is_succeeded)
-def pod_succeeded(**kwargs: Unpack[CallbackArgs]) -> None:
+def wake_parent(kwargs: CallbackArgs) -> None:
+    """
+    Have the pod's parent OaatGroup checked once the pod's status update
+    has settled, rather than waiting until the group is next due.
+    """
+    parent = kwargs.get('labels', {}).get('parent-name')
+    if parent:
+        scheduler.wake((kwargs.get('namespace'), parent),
+                       delay=SETTLE_DELAY)
+
+
+def hand_off(kwargs: CallbackArgs, pod: PodOverseer) -> None:
+    """
+    Have the pod's parent OaatGroup start its next item straight away, now
+    that the pod's item has completed.
+    """
+    parent = kwargs.get('labels', {}).get('parent-name')
+    if parent:
+        scheduler.complete((kwargs.get('namespace'), parent),
+                           pod.get_label('oaat-name', 'unknown'),
+                           pod.finished_at or now())
+
+
+@podwatch.on_change(when=is_item_succeeded)
+async def pod_succeeded(**kwargs: Unpack[CallbackArgs]) -> None:
     """
     pod_succeeded (pod)
 
     Record last_success for successful pod. Triggered by change in the
-    pod's "phase" status field, or every 1/2 hour just in case
+    pod's "phase" status field (see also pod_sweep)
     """
     logger = kwargs['logger']
-    logger.debug(
-        f'[{my_name()}] reason: {kwargs.get("reason", "timer (30min)")}')
+    logger.debug(f'[{my_name()}] reason: {kwargs.get("reason")}')
     logger.debug(f'[{my_name()}] diff: {kwargs.get("diff")}')
     logger.debug(f'[{my_name()}] status: {kwargs.get("status")}')
     try:
@@ -185,36 +351,26 @@ def pod_succeeded(**kwargs: Unpack[CallbackArgs]) -> None:
         return
 
     try:
-        pod.update_success_status()
+        await pod.update_success_status_async()
     except ProcessingComplete as exc:
         pod.handle_processing_complete(exc)
+        hand_off(kwargs, pod)
         return
 
     logger.error(f'[{my_name()}] should never happen')
     return
 
 
-@kopf.on.field('', 'v1', 'pods',
-               field='status.phase',
-               labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'},
-               when=is_failed)
-@kopf.on.resume('', 'v1', 'pods',
-                labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'},
-                when=is_failed)
-@kopf.timer('', 'v1', 'pods',  # type: ignore[arg-type]
-            interval=0.5*3600,
-            labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'},
-            when=is_failed)
-def pod_failed(**kwargs: Unpack[CallbackArgs]) -> None:
+@podwatch.on_change(when=is_item_failed)
+async def pod_failed(**kwargs: Unpack[CallbackArgs]) -> None:
     """
     pod_failed (pod)
 
     Record last_failure for failed pod. Triggered by change in the
-    pod's "phase" status field, or every 1/2 hour just in case
+    pod's "phase" status field (see also pod_sweep)
     """
     logger = kwargs['logger']
-    logger.debug(
-        f'[{my_name()}] reason: {kwargs.get("reason", "timer (30min)")}')
+    logger.debug(f'[{my_name()}] reason: {kwargs.get("reason")}')
     try:
         pod = PodOverseer(**kwargs)
     except ProcessingComplete as exc:
@@ -223,46 +379,88 @@ def pod_failed(**kwargs: Unpack[CallbackArgs]) -> None:
     pod.info(f'[{my_name()}] {pod.name}')
 
     try:
-        pod.update_failure_status()
+        await pod.update_failure_status_async()
     except ProcessingComplete as exc:
         pod.handle_processing_complete(exc)
+        hand_off(kwargs, pod)
         return
 
     logger.error(f'[{my_name()}] should never happen')
     return
 
 
-@kopf.timer('', 'v1', 'pods',  # type: ignore[arg-type]
-            interval=12*3600,
-            labels={'parent-name': kopf.PRESENT, 'app': 'oaat-operator'},
-            when=kopf.any_([is_succeeded, is_failed]))
-def cleanup_pod(**kwargs: Unpack[CallbackArgs]) -> None:
+@podwatch.on_sweep()
+async def pod_sweep(namespace: Optional[str], name: str, pods: List[dict],
+                    settings: kopf.OperatorSettings,
+                    logger: logging.Logger) -> None:
+    """
+    pod_sweep (pods of an oaatgroup)
+
+    When the operator starts, and every 1/2 hour just in case a phase
+    change was missed, reconcile the pods of an OaatGroup with it in bulk
+    (see podwatch.py), recording completed pods and the phase of others
+    with a single update of the OaatGroup. Then delete the completed pods
+    beyond the OaatGroup's retention settings with collection deletes
+    (see podgc.py).
     """
-    cleanup_pod (pod)
+    logger.debug(f'[{my_name()}] {namespace}/{name}: {len(pods)} pods')
+    # the completion of the pods of Jobs is recorded from the Job (see
+    # job_finished), and Kubernetes deletes them along with the Job
+    pods = sorted((pod for pod in pods
+                   if not is_job_pod(pod['metadata'].get('labels', {}))),
+                  key=lambda p: p['status'].get('startTime', ''))
+    try:
+        oaatgroup = await reconcile_pods_async([
+            PodOverseer(**podwatch.handler_kwargs(pod, 'sweep', settings))
+            for pod in pods])
+        if oaatgroup is None:
+            return
+        max_age, keep = oaatgroup.pod_retention()
+        await podgc.delete_pods(namespace, name,
+                                podgc.expired_pods(pods, max_age, keep),
+                                logger=logger)
+    except kopf.PermanentError as exc:
+        logger.error(f'[{my_name()}] cannot clean up pods of '
+                     f'{namespace}/{name}: {exc}')
+    except (kopf.TemporaryError, aioclient.APIError) as exc:
+        logger.warning(f'[{my_name()}] cannot reconcile pods of '
+                       f'{namespace}/{name}: {exc}')
+
+
+@jobwatch.on_finished()
+async def job_finished(**kwargs: Unpack[CallbackArgs]) -> None:
+    """
+    job_finished (job)
 
-    After pod has been in 'Failed' or 'Succeeded' phase for more than twelve
-    hours, delete it.
+    Record last_success or last_failure for a Job which has finished (for
+    an OaatType with spec.type="job"), from the Job's status. Triggered
+    once for each finished Job (see jobwatch.py). Kubernetes deletes the
+    Job and its pod ttlSecondsAfterFinished later.
     """
     logger = kwargs['logger']
-    logger.debug(
-        f'[{my_name()}] reason: {kwargs.get("reason", "timer (12hrs)")}')
+    logger.debug(f'[{my_name()}] reason: {kwargs.get("reason")}')
     try:
-        pod = PodOverseer(**kwargs)
+        job = JobOverseer(**kwargs)
     except ProcessingComplete as exc:
         logger.error(f'Error: {exc.ret.get("error")}')
         return
-    pod.info(f'[{my_name()}] {pod.name}')
 
     try:
-        pod.delete()
-        raise ProcessingComplete(message=f'[{my_name()}] deleted')
+        if job.phase == 'Succeeded':
+            await job.update_success_status_async()
+        else:
+            await job.update_failure_status_async()
     except ProcessingComplete as exc:
-        pod.handle_processing_complete(exc)
+        job.handle_processing_complete(exc)
+        hand_off(kwargs, job)
         return
 
+    logger.error(f'[{my_name()}] should never happen')
+    return
+
 
 @kopf.on.resume('kawaja.net', 'v1', 'oaatgroups')  # type: ignore[arg-type]
-def oaat_resume(**kwargs: Unpack[CallbackArgs]):
+async def oaat_resume(**kwargs: Unpack[CallbackArgs]):
     """
     oaat_resume (oaatgroup)
 
@@ -276,7 +474,8 @@ def oaat_resume(**kwargs: Unpack[CallbackArgs]):
     except ProcessingComplete as exc:
         return {'message': f'Error: {exc.ret.get("error")}'}
 
-    running_pod_info = oaatgroup.resume_running_pod()
+    running_pod_info = oaatgroup.resume_running_pod(
+        await oaatgroup.running_pods_async())
     if running_pod_info is not None:
         memo.state = 'running'
         memo.currently_running = running_pod_info.get('oaat-name', 'unknown')
@@ -294,7 +493,7 @@ def oaat_resume(**kwargs: Unpack[CallbackArgs]):
             interval=300,
             annotations={'oaatoperator.kawaja.net/operator-status':
                          kopf.ABSENT})
-def oaat_action(**kwargs: Unpack[CallbackArgs]):
+async def oaat_action(**kwargs: Unpack[CallbackArgs]):
     """
     oaat_action (oaatgroup)
 
@@ -312,6 +511,7 @@ def oaat_action(**kwargs: Unpack[CallbackArgs]):
         return {'message': f'Error: {exc.ret.get("error")}'}
 
     oaatgroup.info(f'[{my_name()}] {oaatgroup.name}')
+    scheduler.wake((kwargs['namespace'], kwargs['name']))
 
     try:
         oaatgroup.validate_items(
@@ -320,7 +520,8 @@ def oaat_action(**kwargs: Unpack[CallbackArgs]):
         raise ProcessingComplete(message='validated')
     except ProcessingComplete as exc:
         oaatgroup.set_status('handler_status', memo)
-        return oaatgroup.handle_processing_complete(exc)
+        return changed_result(kwargs, 'oaat_action',
+                              oaatgroup.handle_processing_complete(exc))
 
 
 @kopf.on.login()  # type: ignore[arg-type]
@@ -0,0 +1,520 @@
+"""
+itemindex.py
+
+Per-group index of item run history.
+
+Choosing the next item to run (see OaatGroupOverseer.find_job_to_run())
+only needs the items with the oldest last success or the oldest last
+failure, and deciding when the group is next due only needs the item
+which becomes eligible soonest. Rather than building an OaatItem (and
+parsing its timestamps) for every item on every check, each group keeps
+an index of its items' last success, last failure and failure count,
+held in heaps ordered by:
+    * last success (all items)
+    * last success (items which have not failed since their last success)
+    * last failure (items which have failed since their last success)
+    * time at which the item becomes eligible to run
+
+Groups with spec.itemIndex 'array' use ArrayItemIndex instead, which
+holds the same history in columns of integers.
+
+The index is built from the item state (see itemstore.py) the first time
+it is needed (or when the items, frequency or failureCoolOff change, or
+after REBUILD_INTERVAL) and is then updated as items succeed or fail (see
+OaatGroup.mark_item_success() and OaatGroup.mark_item_failed()).
+
+Heap entries are not removed when an item is updated; a new entry is
+added and the old one is ignored (and discarded when the heap is
+compacted).
+"""
+from __future__ import annotations
+import datetime
+import heapq
+import itertools
+import operator
+from array import array
+from typing import (Any, Callable, Dict, Hashable, Iterator, List, Mapping,
+                    Optional, Set, Tuple, Type)
+
+import oaatoperator.utility
+from oaatoperator.oaatitem import ItemState
+
+# rebuild each index from the OaatGroup status at least this often, to pick
+# up changes made to the status other than by the operator
+REBUILD_INTERVAL = datetime.timedelta(hours=1)
+
+# whether an item is eligible to run or, if not, why not
+REASONS = ('candidate', 'recent_success', 'cool_off')
+
+_Entry = Tuple[datetime.datetime, str]
+# predicate selecting the items a query may return (see BaseItemIndex)
+Allow = Callable[[str], bool]
+
+
+class ItemRecord:
+    """Run history of a single item."""
+    __slots__ = ('name', 'success', 'failure', 'numfails')
+
+    def __init__(self, name: str, success: datetime.datetime,
+                 failure: datetime.datetime, numfails: int) -> None:
+        self.name = name
+        self.success = success
+        self.failure = failure
+        self.numfails = numfails
+
+    @classmethod
+    def from_status(cls, name: str, status: Mapping[str, Any]) -> ItemRecord:
+        state = ItemState.from_status(status)
+        return cls(name, state.success, state.failure, state.numfails)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ItemRecord):
+            return NotImplemented
+        return ((self.name, self.success, self.failure, self.numfails) ==
+                (other.name, other.success, other.failure, other.numfails))
+
+    def __repr__(self) -> str:
+        return (f'ItemRecord({self.name}, success={self.success}, '
+                f'failure={self.failure}, numfails={self.numfails})')
+
+
+def _ordered(heap: List[_Entry]) -> Iterator[_Entry]:
+    """Iterate over the entries of a heap in order, without modifying it."""
+    if not heap:
+        return
+    pending = [(heap[0], 0)]
+    while pending:
+        entry, pos = heapq.heappop(pending)
+        yield entry
+        for child in (2 * pos + 1, 2 * pos + 2):
+            if child < len(heap):
+                heapq.heappush(pending, (heap[child], child))
+
+
+class BaseItemIndex:
+    """
+    Index of the run history of the items in a single OaatGroup.
+
+    Subclasses provide the storage: ItemIndex (heaps of ItemRecords) or
+    ArrayItemIndex (columns of integer timestamps).
+    """
+    records: Mapping[str, ItemRecord]
+
+    def __init__(self,
+                 items: List[str],
+                 freq: datetime.timedelta,
+                 cool_off: Optional[datetime.timedelta]) -> None:
+        self.items = list(items)
+        self.freq = freq
+        self.cool_off = cool_off
+        self.built = oaatoperator.utility.now()
+
+    def matches(self, items: List[str], freq: datetime.timedelta,
+                cool_off: Optional[datetime.timedelta]) -> bool:
+        """Whether the index is current for the given group definition."""
+        return (self.freq == freq and self.cool_off == cool_off
+                and self.items == items
+                and oaatoperator.utility.now() < self.built + REBUILD_INTERVAL)
+
+    def eligible_at(self, record: ItemRecord) -> datetime.datetime:
+        """When the item is next eligible to run."""
+        eligible = record.success + self.freq
+        if self.cool_off is not None:
+            eligible = max(eligible, record.failure + self.cool_off)
+        return eligible
+
+    def is_candidate(self, record: ItemRecord,
+                     now: datetime.datetime) -> bool:
+        """Whether the item is eligible to run (see find_job_to_run())."""
+        return self.reason(record, now) == 'candidate'
+
+    def reason(self, record: ItemRecord, now: datetime.datetime) -> str:
+        """Whether the item is eligible to run, or why not (see REASONS)."""
+        if not now > record.success + self.freq:
+            return 'recent_success'
+        if self.cool_off is not None and now < record.failure + self.cool_off:
+            return 'cool_off'
+        return 'candidate'
+
+    def reason_counts(self, now: datetime.datetime) -> Dict[str, int]:
+        """Number of items for each of REASONS."""
+        counts = dict.fromkeys(REASONS, 0)
+        for record in self.records.values():
+            counts[self.reason(record, now)] += 1
+        return counts
+
+    def record(self, name: str,
+               success: Optional[datetime.datetime] = None,
+               failure: Optional[datetime.datetime] = None,
+               numfails: Optional[int] = None) -> None:
+        """Update the run history of an item."""
+        raise NotImplementedError
+
+    # The candidate queries take an optional allow(name) predicate:
+    # items for which it is false are treated as not eligible (it is only
+    # called for items which are otherwise eligible).
+
+    def first_candidates(self, now: datetime.datetime,
+                         limit: int = 2,
+                         allow: Optional[Allow] = None) -> List[str]:
+        """Names of (up to limit) items which are eligible to run."""
+        raise NotImplementedError
+
+    def oldest_success(self, now: datetime.datetime,
+                       exclude_failed: bool = False,
+                       allow: Optional[Allow] = None) -> Set[str]:
+        """
+        Names of the eligible items with the oldest last success
+        (optionally only those which have not failed since).
+        """
+        raise NotImplementedError
+
+    def oldest_failure(self, now: datetime.datetime,
+                       allow: Optional[Allow] = None) -> Set[str]:
+        """
+        Names of the eligible items which have failed since their last
+        success, with the oldest last failure.
+        """
+        raise NotImplementedError
+
+    def next_eligible(self) -> Optional[datetime.datetime]:
+        """Earliest time at which any item becomes eligible to run."""
+        raise NotImplementedError
+
+
+class ItemIndex(BaseItemIndex):
+    """Item index held as heaps of ItemRecords."""
+    def __init__(self,
+                 items: List[str],
+                 items_status: Mapping[str, Any],
+                 freq: datetime.timedelta,
+                 cool_off: Optional[datetime.timedelta]) -> None:
+        super().__init__(items, freq, cool_off)
+        self.records: Dict[str, ItemRecord] = {
+            name: ItemRecord.from_status(name, items_status.get(name, {}))
+            for name in self.items
+        }
+        self._rebuild_heaps()
+
+    def record(self, name: str,
+               success: Optional[datetime.datetime] = None,
+               failure: Optional[datetime.datetime] = None,
+               numfails: Optional[int] = None) -> None:
+        current = self.records.get(name)
+        if current is None:
+            return
+        self.records[name] = ItemRecord(
+            name,
+            current.success if success is None else success,
+            current.failure if failure is None else failure,
+            current.numfails if numfails is None else numfails)
+        self._push(self.records[name])
+        if len(self._by_success) > 2 * len(self.records) + 16:
+            self._rebuild_heaps()
+
+    def _push(self, record: ItemRecord) -> None:
+        heapq.heappush(self._by_success, (record.success, record.name))
+        if record.numfails > 0:
+            heapq.heappush(self._by_failure, (record.failure, record.name))
+        else:
+            heapq.heappush(self._by_success_ok,
+                           (record.success, record.name))
+        heapq.heappush(self._by_eligible,
+                       (self.eligible_at(record), record.name))
+
+    def _rebuild_heaps(self) -> None:
+        records = self.records.values()
+        self._by_success: List[_Entry] = [
+            (r.success, r.name) for r in records]
+        self._by_success_ok: List[_Entry] = [
+            (r.success, r.name) for r in records if r.numfails == 0]
+        self._by_failure: List[_Entry] = [
+            (r.failure, r.name) for r in records if r.numfails > 0]
+        self._by_eligible: List[_Entry] = [
+            (self.eligible_at(r), r.name) for r in records]
+        for heap in (self._by_success, self._by_success_ok,
+                     self._by_failure, self._by_eligible):
+            heapq.heapify(heap)
+
+    def _valid_success(self, entry: _Entry) -> bool:
+        return self.records[entry[1]].success == entry[0]
+
+    def _valid_success_ok(self, entry: _Entry) -> bool:
+        record = self.records[entry[1]]
+        return record.numfails == 0 and record.success == entry[0]
+
+    def _valid_failure(self, entry: _Entry) -> bool:
+        record = self.records[entry[1]]
+        return record.numfails > 0 and record.failure == entry[0]
+
+    def _valid_eligible(self, entry: _Entry) -> bool:
+        return self.eligible_at(self.records[entry[1]]) == entry[0]
+
+    def _candidates(self, heap: List[_Entry],
+                    valid: Callable[[_Entry], bool],
+                    now: datetime.datetime,
+                    before: Optional[datetime.datetime] = None,
+                    allow: Optional[Allow] = None) -> Iterator[_Entry]:
+        """
+        Iterate, in order, over the valid candidate entries of heap
+        (stopping at the first entry not before 'before').
+        """
+        for entry in _ordered(heap):
+            if before is not None and entry[0] >= before:
+                return
+            if (valid(entry)
+                    and self.is_candidate(self.records[entry[1]], now)
+                    and (allow is None or allow(entry[1]))):
+                yield entry
+
+    def _min_set(self, heap: List[_Entry],
+                 valid: Callable[[_Entry], bool],
+                 now: datetime.datetime,
+                 before: Optional[datetime.datetime] = None,
+                 allow: Optional[Allow] = None) -> Set[str]:
+        """Names of the candidate items with the lowest key in heap."""
+        found: Set[str] = set()
+        lowest: Optional[datetime.datetime] = None
+        for key, name in self._candidates(heap, valid, now, before, allow):
+            if lowest is not None and key > lowest:
+                break
+            lowest = key
+            found.add(name)
+        return found
+
+    def first_candidates(self, now: datetime.datetime,
+                         limit: int = 2,
+                         allow: Optional[Allow] = None) -> List[str]:
+        found: List[str] = []
+        # items which succeeded within the last freq are not candidates
+        for _, name in self._candidates(self._by_success,
+                                        self._valid_success, now,
+                                        before=now - self.freq,
+                                        allow=allow):
+            if name in found:
+                continue
+            found.append(name)
+            if len(found) >= limit:
+                break
+        return found
+
+    def oldest_success(self, now: datetime.datetime,
+                       exclude_failed: bool = False,
+                       allow: Optional[Allow] = None) -> Set[str]:
+        if exclude_failed:
+            return self._min_set(self._by_success_ok,
+                                 self._valid_success_ok, now,
+                                 before=now - self.freq, allow=allow)
+        return self._min_set(self._by_success, self._valid_success, now,
+                             before=now - self.freq, allow=allow)
+
+    def oldest_failure(self, now: datetime.datetime,
+                       allow: Optional[Allow] = None) -> Set[str]:
+        return self._min_set(self._by_failure, self._valid_failure, now,
+                             allow=allow)
+
+    def next_eligible(self) -> Optional[datetime.datetime]:
+        while self._by_eligible and not self._valid_eligible(
+                self._by_eligible[0]):
+            heapq.heappop(self._by_eligible)
+        return self._by_eligible[0][0] if self._by_eligible else None
+
+
+_EPOCH = datetime.datetime.fromtimestamp(0, tz=datetime.timezone.utc)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def _to_us(when: datetime.datetime) -> int:
+    """Microseconds since the epoch."""
+    return (when - _EPOCH) // _MICROSECOND
+
+
+def _from_us(microseconds: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(microseconds=microseconds)
+
+
+class _ArrayRecords(Mapping[str, ItemRecord]):
+    """ItemRecords view of the columns of an ArrayItemIndex."""
+    def __init__(self, index: ArrayItemIndex) -> None:
+        self.index = index
+
+    def __getitem__(self, name: str) -> ItemRecord:
+        pos = self.index.positions[name]
+        return ItemRecord(name,
+                          _from_us(self.index.success[pos]),
+                          _from_us(self.index.failure[pos]),
+                          self.index.numfails[pos])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index.names)
+
+    def __len__(self) -> int:
+        return len(self.index.names)
+
+
+class ArrayItemIndex(BaseItemIndex):
+    """
+    Item index held as columns (arrays) of integer timestamps (microseconds
+    since the epoch) and failure counts.
+
+    Candidate filtering and the oldest success/failure selections are
+    evaluated over whole columns with map(), min() and itertools.compress()
+    (which run without executing Python code per item) rather than with
+    per-item objects. Queries are O(n), but with a much smaller constant
+    than examining OaatItems, and updates are O(1).
+    """
+    def __init__(self,
+                 items: List[str],
+                 items_status: Mapping[str, Any],
+                 freq: datetime.timedelta,
+                 cool_off: Optional[datetime.timedelta]) -> None:
+        super().__init__(items, freq, cool_off)
+        self.names = list(dict.fromkeys(self.items))
+        self.positions = {name: pos for pos, name in enumerate(self.names)}
+        records = [
+            ItemRecord.from_status(name, items_status.get(name, {}))
+            for name in self.names
+        ]
+        self.success = array('q', [_to_us(r.success) for r in records])
+        self.failure = array('q', [_to_us(r.failure) for r in records])
+        self.numfails = array('q', [r.numfails for r in records])
+        self.records = _ArrayRecords(self)
+        self._freq = freq // _MICROSECOND
+        self._cool_off = (None if cool_off is None
+                          else cool_off // _MICROSECOND)
+
+    def record(self, name: str,
+               success: Optional[datetime.datetime] = None,
+               failure: Optional[datetime.datetime] = None,
+               numfails: Optional[int] = None) -> None:
+        pos = self.positions.get(name)
+        if pos is None:
+            return
+        if success is not None:
+            self.success[pos] = _to_us(success)
+        if failure is not None:
+            self.failure[pos] = _to_us(failure)
+        if numfails is not None:
+            self.numfails[pos] = numfails
+
+    def _candidate_mask(self, now: datetime.datetime,
+                        allow: Optional[Allow] = None) -> bytes:
+        """1 for each item which is eligible to run, 0 otherwise."""
+        now_us = _to_us(now)
+        mask = map(operator.lt, self.success,
+                   itertools.repeat(now_us - self._freq))
+        if self._cool_off is not None:
+            mask = map(operator.and_, mask,
+                       map(operator.le, self.failure,
+                           itertools.repeat(now_us - self._cool_off)))
+        if allow is None:
+            return bytes(mask)
+        # allow() is only called for the eligible items
+        return bytes(eligible and bool(allow(name))
+                     for eligible, name in zip(mask, self.names))
+
+    def _min_set(self, column: array, mask: Iterator[Any]) -> Set[str]:
+        """Names of the masked items with the lowest value in column."""
+        mask = bytes(mask)
+        lowest = min(itertools.compress(column, mask), default=None)
+        if lowest is None:
+            return set()
+        return set(itertools.compress(
+            self.names,
+            map(operator.and_, mask,
+                map(operator.eq, column, itertools.repeat(lowest)))))
+
+    def first_candidates(self, now: datetime.datetime,
+                         limit: int = 2,
+                         allow: Optional[Allow] = None) -> List[str]:
+        return list(itertools.islice(
+            itertools.compress(self.names,
+                               self._candidate_mask(now, allow)),
+            limit))
+
+    def reason_counts(self, now: datetime.datetime) -> Dict[str, int]:
+        recent = sum(map(operator.ge, self.success,
+                         itertools.repeat(_to_us(now) - self._freq)))
+        candidates = sum(self._candidate_mask(now))
+        return {'candidate': candidates,
+                'recent_success': recent,
+                'cool_off': len(self.names) - recent - candidates}
+
+    def oldest_success(self, now: datetime.datetime,
+                       exclude_failed: bool = False,
+                       allow: Optional[Allow] = None) -> Set[str]:
+        mask: Iterator[Any] = iter(self._candidate_mask(now, allow))
+        if exclude_failed:
+            mask = map(operator.and_, mask,
+                       map(operator.not_, self.numfails))
+        return self._min_set(self.success, mask)
+
+    def oldest_failure(self, now: datetime.datetime,
+                       allow: Optional[Allow] = None) -> Set[str]:
+        return self._min_set(
+            self.failure,
+            map(operator.and_, self._candidate_mask(now, allow),
+                map(bool, self.numfails)))
+
+    def _eligible(self) -> Iterator[int]:
+        """When each item becomes eligible to run."""
+        eligible: Iterator[int] = map(operator.add, self.success,
+                                      itertools.repeat(self._freq))
+        if self._cool_off is not None:
+            eligible = map(max, eligible,
+                           map(operator.add, self.failure,
+                               itertools.repeat(self._cool_off)))
+        return eligible
+
+    def next_eligible(self) -> Optional[datetime.datetime]:
+        earliest = min(self._eligible(), default=None)
+        return None if earliest is None else _from_us(earliest)
+
+
+INDEX_TYPES: Dict[str, Type[Any]] = {
+    'heap': ItemIndex,
+    'array': ArrayItemIndex,
+}
+
+_indices: Dict[Hashable, BaseItemIndex] = {}
+
+
+def get_index(key: Hashable,
+              items: List[str],
+              items_status: Mapping[str, Any],
+              freq: datetime.timedelta,
+              cool_off: Optional[datetime.timedelta],
+              index_type: str = 'heap') -> BaseItemIndex:
+    """Retrieve the index for a group, building it if required."""
+    index = _indices.get(key)
+    cls = INDEX_TYPES[index_type]
+    if (index is None or type(index) is not cls
+            or not index.matches(items, freq, cool_off)):
+        index = cls(items, items_status, freq, cool_off)
+        _indices[key] = index
+    return index
+
+
+def rebuild(key: Hashable, items_status: Mapping[str, Any]) -> BaseItemIndex:
+    """Rebuild an existing index from the group status."""
+    index = _indices[key]
+    _indices[key] = type(index)(index.items, items_status, index.freq,
+                                index.cool_off)
+    return _indices[key]
+
+
+def record(key: Hashable, name: str, **kwargs: Any) -> None:
+    """Update an item in the group's index (if the index exists)."""
+    index = _indices.get(key)
+    if index is not None:
+        index.record(name, **kwargs)
+
+
+def discard(key: Hashable) -> None:
+    """Remove a group's index."""
+    _indices.pop(key, None)
+
+
+def reset() -> None:
+    """Remove all indices."""
+    _indices.clear()
@@ -0,0 +1,363 @@
+"""
+itemstore.py
+
+Storage for the per-item state of an OaatGroup (run history, pod phase and
+runtime statistics).
+
+By default (spec.itemStorage 'status'), item state is kept in the
+OaatGroup's own status, under status.items.<item>. The whole OaatGroup
+object, and every watch event for it, then grows with the number of
+items, and each pod completion rewrites part of it.
+
+With spec.itemStorage 'configmap', item state is instead sharded across
+spec.itemStorageBuckets ConfigMaps (named <group>-items-<bucket>), each
+item being assigned to a bucket by a hash of its name. Each field of an
+item's state is a separate ConfigMap data key, <item>.<field>, and is
+written with a merge patch of only the keys which changed. Recording an
+item's completion then writes only a few keys of one small ConfigMap,
+and handlers changing different fields of the same item (e.g. the timer
+setting last_verified while a pod handler sets last_success) do not
+overwrite each other, however stale their view of the bucket. The
+ConfigMaps are owned by the OaatGroup, so are removed along with it.
+
+A ConfigMap holds at most 1MiB, so each bucket holds at most
+MAX_ITEMS_PER_BUCKET items (allowing for about 800 bytes of state per
+item): a group with more items than that for its itemStorageBuckets is
+rejected, rather than failing when a bucket outgrows the limit. Buckets
+are not resized automatically, as changing the number of buckets moves
+items between buckets, which (as for changing itemStorage) does not
+migrate their state.
+
+Item state is read from:
+    * the itemstate index (see itemwatch.py), which is kept current from
+      a watch of the ConfigMaps, in OaatGroup handlers
+    * the API (see ConfigMapItemStore.load_async()), retrieving only the
+      buckets needed, in Pod handlers (and OaatGroup handlers, until the
+      ConfigMaps have been listed)
+Changes are collected and written when the handler completes (see
+write_async()).
+"""
+from __future__ import annotations
+import zlib
+from typing import (Any, Dict, Hashable, Iterable, Iterator, Mapping,
+                    Optional, Tuple, TYPE_CHECKING)
+
+import kopf
+
+from oaatoperator import aioclient
+from oaatoperator.cache import index_lookup
+from oaatoperator.common import InternalError
+
+if TYPE_CHECKING:
+    from oaatoperator.oaatgroup import OaatGroup
+
+STORAGE_TYPES = ('status', 'configmap')
+DEFAULT_BUCKETS = 64
+MAX_BUCKETS = 4096
+# label holding the bucket number of an item state ConfigMap
+BUCKET_LABEL = 'oaat-item-bucket'
+# items whose state fits in a (1MiB) ConfigMap
+MAX_ITEMS_PER_BUCKET = 1200
+
+
+def bucket_of(item_name: str, buckets: int) -> int:
+    """Bucket holding the state of an item (stable across restarts)."""
+    return zlib.crc32(item_name.encode()) % buckets
+
+
+def bucket_name(group_name: str, bucket: int) -> str:
+    """Name of the ConfigMap holding a bucket of a group's item state."""
+    return f'{group_name}-items-{bucket:03d}'
+
+
+def bucket_key(namespace: Optional[str], group_name: str,
+               bucket: int) -> Tuple[Optional[str], str, int]:
+    """Key used for the itemstate index."""
+    return (namespace, group_name, bucket)
+
+
+def field_key(item_name: str, key: str) -> str:
+    """ConfigMap data key holding a field of an item's state."""
+    return f'{item_name}.{key}'
+
+
+def decode_bucket(data: Optional[Mapping[str, str]]) -> Dict[str, dict]:
+    """Item state held in the data of an item state ConfigMap."""
+    items: Dict[str, dict] = {}
+    for data_key, value in (data or {}).items():
+        # field names have no '.', but item names may
+        item_name, _, key = data_key.rpartition('.')
+        if item_name:
+            items.setdefault(item_name, {})[key] = value
+    return items
+
+
+def storage_settings(spec: Mapping[str, Any], name: str) -> Tuple[str, int]:
+    """
+    Validate the item storage settings of an OaatGroup spec.
+
+    Returns (storage type, number of buckets).
+    """
+    storage = spec.get('itemStorage', 'status')
+    if storage not in STORAGE_TYPES:
+        raise kopf.PermanentError(
+            f'invalid itemStorage {storage} in {name}')
+    buckets = spec.get('itemStorageBuckets', DEFAULT_BUCKETS)
+    if (not isinstance(buckets, int) or isinstance(buckets, bool)
+            or not 0 < buckets <= MAX_BUCKETS):
+        raise kopf.PermanentError(
+            f'invalid itemStorageBuckets {buckets} in {name}')
+    items = len(spec.get('oaatItems') or [])
+    if storage == 'configmap' and items > buckets * MAX_ITEMS_PER_BUCKET:
+        needed = -(-items // MAX_ITEMS_PER_BUCKET)
+        raise kopf.PermanentError(
+            f'{items} items do not fit in {buckets} itemStorageBuckets in '
+            f'{name} (at least {needed} are needed)')
+    return storage, buckets
+
+
+def live_item_status(kwargs: Mapping[str, Any], item_name: str,
+                     index: Optional[Mapping[Hashable, Any]]) -> Mapping:
+    """
+    Current state of an item, from the kwargs of an OaatGroup handler
+    (the live status or, for 'configmap' storage, the itemstate index).
+    """
+    spec = kwargs.get('spec') or {}
+    if spec.get('itemStorage', 'status') != 'configmap':
+        return (kwargs.get('status') or {}).get('items', {}).get(
+            item_name, {})
+    buckets = spec.get('itemStorageBuckets', DEFAULT_BUCKETS)
+    bucket = index_lookup(
+        index,
+        bucket_key(kwargs.get('namespace'), str(kwargs.get('name')),
+                   bucket_of(item_name, buckets)))
+    return (bucket or {}).get(item_name, {})
+
+
+class ItemStore:
+    """
+    Item state kept in the OaatGroup status.
+
+    Base class for the item state storage backends.
+    """
+    def __init__(self, group: OaatGroup) -> None:
+        self.group = group
+
+    def items(self) -> Mapping[str, Mapping[str, Any]]:
+        """State of all items, keyed by item name."""
+        return (self.group.status or {}).get('items', {})
+
+    def get(self, item_name: str) -> Mapping[str, Any]:
+        """State of a single item."""
+        return self.items().get(item_name) or {}
+
+    def set(self, item_name: str, key: str,
+            value: Optional[str] = None) -> None:
+        """Set (or, if value is None, remove) a field of an item's state."""
+        self.group._set_status_item(item_name, key, value)
+
+    async def load_async(self,
+                         item_names: Optional[Iterable[str]] = None) -> None:
+        """
+        Retrieve the state of the given items (or all items) before use,
+        if it is not already available.
+        """
+
+    async def write_async(self) -> None:
+        """Write the changes made with set() (if not already written)."""
+
+
+class _BucketItems(Mapping[str, Mapping[str, Any]]):
+    """Read-only view of the state of all items in a ConfigMapItemStore."""
+    def __init__(self, store: ConfigMapItemStore) -> None:
+        self.store = store
+
+    def __getitem__(self, item_name: str) -> Mapping[str, Any]:
+        bucket = self.store._bucket(bucket_of(item_name, self.store.buckets))
+        return bucket[item_name]
+
+    def __iter__(self) -> Iterator[str]:
+        for bucket in range(self.store.buckets):
+            yield from self.store._bucket(bucket)
+
+    def __len__(self) -> int:
+        return sum(len(self.store._bucket(bucket))
+                   for bucket in range(self.store.buckets))
+
+
+class ConfigMapItemStore(ItemStore):
+    """Item state sharded across ConfigMaps (see module docstring)."""
+    def __init__(self,
+                 group: OaatGroup,
+                 namespace: Optional[str],
+                 group_name: str,
+                 owner: Mapping[str, Any],
+                 buckets: int = DEFAULT_BUCKETS,
+                 index: Optional[Mapping[Hashable, Any]] = None) -> None:
+        super().__init__(group)
+        self.namespace = namespace
+        self.group_name = group_name
+        self.owner = owner
+        self.buckets = buckets
+        self.index = index
+        self._loaded: Dict[int, Dict[str, dict]] = {}
+        self._changes: Dict[int, Dict[str, Dict[str, Optional[str]]]] = {}
+
+    def _bucket(self, bucket: int) -> Dict[str, dict]:
+        if bucket not in self._loaded:
+            if self.index is None:
+                raise InternalError(
+                    f'item state bucket {bucket} of {self.group_name} '
+                    'has not been loaded')
+            self._loaded[bucket] = index_lookup(
+                self.index,
+                bucket_key(self.namespace, self.group_name, bucket)) or {}
+        return self._loaded[bucket]
+
+    def _needed(self,
+                item_names: Optional[Iterable[str]]) -> Optional[set[int]]:
+        """Buckets which need to be retrieved (None for all)."""
+        if self.index is not None:
+            return set()
+        if item_names is None:
+            return None
+        return {bucket_of(name, self.buckets)
+                for name in item_names} - set(self._loaded)
+
+    def items(self) -> Mapping[str, Mapping[str, Any]]:
+        return _BucketItems(self)
+
+    def get(self, item_name: str) -> Mapping[str, Any]:
+        return self._bucket(bucket_of(item_name, self.buckets)).get(
+            item_name, {})
+
+    def set(self, item_name: str, key: str,
+            value: Optional[str] = None) -> None:
+        (self._changes.setdefault(bucket_of(item_name, self.buckets), {})
+         .setdefault(item_name, {}))[key] = value
+
+    def _bucket_doc(self, bucket: int, data: Dict[str, str]) -> dict:
+        doc = {
+            'apiVersion': 'v1',
+            'kind': 'ConfigMap',
+            'metadata': {
+                'name': bucket_name(self.group_name, bucket),
+                'namespace': self.namespace,
+                'labels': {
+                    'app': 'oaat-operator',
+                    'parent-name': self.group_name,
+                    BUCKET_LABEL: str(bucket),
+                },
+            },
+            'data': data,
+        }
+        kopf.append_owner_reference(doc, owner=self.owner)
+        return doc
+
+    def _data(self, bucket: int) -> Dict[str, Optional[str]]:
+        """
+        Changed fields of a bucket, as the data of a merge patch (a field
+        which has been removed is None).
+        """
+        return {field_key(item_name, key): value
+                for item_name, changes in self._changes[bucket].items()
+                for key, value in changes.items()}
+
+    @staticmethod
+    def _present(data: Dict[str, Optional[str]]) -> Dict[str, str]:
+        return {key: value for key, value in data.items()
+                if value is not None}
+
+    def _written(self, bucket: int) -> None:
+        """Apply the changes written to a bucket to the state as read."""
+        changes = self._changes.pop(bucket)
+        if bucket not in self._loaded and self.index is None:
+            return
+        # copied, so as not to change the itemstate index
+        items = dict(self._bucket(bucket))
+        for item_name, fields in changes.items():
+            state = dict(items.get(item_name, {}))
+            for key, value in fields.items():
+                if value is None:
+                    state.pop(key, None)
+                else:
+                    state[key] = value
+            items[item_name] = state
+        self._loaded[bucket] = items
+
+    async def load_async(self,
+                         item_names: Optional[Iterable[str]] = None) -> None:
+        needed = self._needed(item_names)
+        if needed is None:
+            self._store_all(await aioclient.list_objects(
+                aioclient.CONFIGMAP, self.namespace,
+                labels={'app': 'oaat-operator',
+                        'parent-name': self.group_name},
+                logger=self.group.logger))
+            return
+        for bucket in needed:
+            try:
+                obj = await aioclient.get_object(
+                    aioclient.CONFIGMAP, self.namespace,
+                    bucket_name(self.group_name, bucket),
+                    logger=self.group.logger)
+                self._loaded[bucket] = decode_bucket(obj.get('data'))
+            except aioclient.APINotFoundError:
+                self._loaded[bucket] = {}
+
+    def _store_all(self, objs: Iterable[Mapping[str, Any]]) -> None:
+        self._loaded = {bucket: {} for bucket in range(self.buckets)}
+        for obj in objs:
+            labels = obj.get('metadata', {}).get('labels', {})
+            try:
+                bucket = int(labels.get(BUCKET_LABEL, ''))
+            except ValueError:
+                continue
+            if bucket in self._loaded:
+                self._loaded[bucket] = decode_bucket(obj.get('data'))
+
+    async def write_async(self) -> None:
+        for bucket in list(self._changes):
+            data = self._data(bucket)
+            name = bucket_name(self.group_name, bucket)
+            try:
+                await aioclient.patch_object(
+                    aioclient.CONFIGMAP, self.namespace, name,
+                    {'data': data}, logger=self.group.logger)
+            except aioclient.APINotFoundError:
+                try:
+                    await aioclient.create_object(
+                        aioclient.CONFIGMAP, self.namespace,
+                        self._bucket_doc(bucket, self._present(data)),
+                        logger=self.group.logger)
+                except aioclient.APIConflictError:
+                    # created by another handler in the meantime
+                    await aioclient.patch_object(
+                        aioclient.CONFIGMAP, self.namespace, name,
+                        {'data': data}, logger=self.group.logger)
+            self._written(bucket)
+
+
+def make_store(group: OaatGroup,
+               obj: Mapping[str, Any],
+               index: Optional[Mapping[Hashable, Any]] = None) -> ItemStore:
+    """
+    Create the item store for a group, as selected by its spec.
+
+    obj is the OaatGroup body (or kopf kwargs); index is the itemstate
+    index, if available.
+    """
+    metadata = obj.get('metadata') or obj.get('meta') or {}
+    name = metadata.get('name') or obj.get('name') or ''
+    spec = obj.get('spec') or {}
+    storage, buckets = storage_settings(spec, name)
+    if storage == 'status':
+        return ItemStore(group)
+    owner = obj.get('body') or obj
+    return ConfigMapItemStore(
+        group,
+        metadata.get('namespace') or obj.get('namespace'),
+        name,
+        owner=owner,
+        buckets=buckets,
+        index=index)
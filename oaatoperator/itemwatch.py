@@ -0,0 +1,228 @@
+"""
+itemwatch.py
+
+Watch of the ConfigMaps holding the item state of OaatGroups with
+'configmap' item storage (see itemstore.py).
+
+kopf filters the objects its indices see by label client-side, so a kopf
+index of the item state ConfigMaps would still have kopf receive and
+decode every ConfigMap in the cluster. Instead, as for the operator's pods
+(see podwatch.py), the ConfigMaps are watched here with a server-side
+label selector, maintaining the itemstate index: the item state of each
+bucket, keyed by (namespace, parent-name, bucket) in the same shape as a
+kopf index, so OaatGroup handlers can read item state without retrieving
+the ConfigMaps.
+
+The ConfigMaps are first listed by the background task which watches
+them (as kopf has not yet logged in to the API when startup handlers
+run). Until then item_index() is None, and OaatGroup handlers retrieve
+item state from the API instead.
+
+An unexpected error in the watch is logged and the ConfigMaps listed
+again. If the watch task ends anyway, the operator is stopped (so it is
+restarted) rather than left running on item state which is no longer
+kept current.
+"""
+import asyncio
+import logging
+import os
+import signal
+from collections.abc import Mapping
+from functools import partial
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import aiohttp
+import kopf
+
+from oaatoperator import aioclient
+from oaatoperator.itemstore import BUCKET_LABEL, bucket_key, decode_bucket
+
+# only the item state ConfigMaps of OaatGroups
+SELECTOR = f'app=oaat-operator,parent-name,{BUCKET_LABEL}'
+# delay before re-establishing the watch after an error
+RETRY_DELAY = 5.0
+# longest time a single watch request is left open
+WATCH_TIMEOUT = 600.0
+
+ConfigMapRef = Tuple[Optional[str], str]
+
+
+class ItemStateIndex(Mapping):
+    """
+    Item state of each bucket, keyed by (namespace, parent-name, bucket)
+    as for a kopf index (see itemstore.bucket_key()).
+    """
+    def __init__(self) -> None:
+        self._buckets: Dict[tuple, Dict[str, dict]] = {}
+        self._keys: Dict[ConfigMapRef, tuple] = {}
+
+    def __getitem__(self, key: tuple) -> List[Dict[str, dict]]:
+        return [self._buckets[key]]
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self._buckets)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def store(self, ref: ConfigMapRef, key: tuple,
+              items: Dict[str, dict]) -> None:
+        self.discard(ref)
+        self._buckets[key] = items
+        self._keys[ref] = key
+
+    def discard(self, ref: ConfigMapRef) -> None:
+        key = self._keys.pop(ref, None)
+        if key is not None:
+            self._buckets.pop(key, None)
+
+    def clear(self) -> None:
+        self._buckets.clear()
+        self._keys.clear()
+
+
+index = ItemStateIndex()
+_listed = False
+_task: Optional[asyncio.Task] = None
+
+
+def item_index() -> Optional[Mapping]:
+    """The itemstate index, or None if the ConfigMaps have not been listed."""
+    return index if _listed else None
+
+
+def _ref(raw: dict) -> ConfigMapRef:
+    metadata = raw.get('metadata', {})
+    return (metadata.get('namespace'), metadata.get('name', ''))
+
+
+def index_entry(raw: dict) -> Optional[Tuple[tuple, Dict[str, dict]]]:
+    """Key and item state of a ConfigMap (None if it is not a bucket)."""
+    metadata = raw.get('metadata', {})
+    labels = metadata.get('labels') or {}
+    try:
+        bucket = int(labels.get(BUCKET_LABEL, ''))
+    except ValueError:
+        return None
+    return (bucket_key(metadata.get('namespace'),
+                       labels.get('parent-name', ''), bucket),
+            decode_bucket(raw.get('data')))
+
+
+def handle_event(event: dict) -> None:
+    """Update the itemstate index for a watch event."""
+    raw = event.get('object', {})
+    ref = _ref(raw)
+    entry = index_entry(raw)
+    if event.get('type') == 'DELETED' or entry is None:
+        index.discard(ref)
+        return
+    index.store(ref, *entry)
+
+
+async def list_configmaps(settings: kopf.OperatorSettings,
+                          logger: logging.Logger) -> str:
+    """
+    List the ConfigMaps, replacing the contents of the itemstate index.
+    Returns the resource version to watch from.
+    """
+    global _listed
+    result = await aioclient.api.get(
+        aioclient.url(aioclient.CONFIGMAP, None,
+                      query={'labelSelector': SELECTOR}),
+        settings=settings, logger=logger)
+    index.clear()
+    for raw in result.get('items', []):
+        handle_event({'type': 'ADDED', 'object': raw})
+    _listed = True
+    return result.get('metadata', {}).get('resourceVersion', '')
+
+
+async def watch_configmaps(settings: kopf.OperatorSettings,
+                           logger: logging.Logger,
+                           resource_version: str,
+                           timeout: float) -> Optional[str]:
+    """
+    Watch the ConfigMaps from resource_version for up to timeout seconds,
+    returning the resource version to continue from, or None if the
+    ConfigMaps need to be listed again.
+    """
+    query = {
+        'labelSelector': SELECTOR,
+        'watch': 'true',
+        'allowWatchBookmarks': 'true',
+        'resourceVersion': resource_version,
+        'timeoutSeconds': str(max(1, int(timeout))),
+    }
+    async for event in aioclient.api.stream(
+            aioclient.url(aioclient.CONFIGMAP, None, query=query),
+            settings=settings, logger=logger,
+            timeout=aiohttp.ClientTimeout(total=timeout + 60)):
+        if event.get('type') == 'ERROR':
+            # usually 410 Gone: the resource version is too old
+            logger.debug(f'item state watch error: {event.get("object")}')
+            return None
+        raw = event.get('object', {})
+        resource_version = raw.get('metadata', {}).get(
+            'resourceVersion', resource_version)
+        if event.get('type') != 'BOOKMARK':
+            handle_event(event)
+    return resource_version
+
+
+async def run(settings: kopf.OperatorSettings,
+              logger: logging.Logger) -> None:
+    """List the ConfigMaps, then watch them."""
+    version: Optional[str] = None
+    while True:
+        try:
+            if version is None:
+                version = await list_configmaps(settings, logger)
+            else:
+                version = await watch_configmaps(
+                    settings, logger, version,
+                    settings.watching.server_timeout or WATCH_TIMEOUT)
+        except (aioclient.APIError, aiohttp.ClientError,
+                asyncio.TimeoutError) as exc:
+            logger.warning(f'item state watch interrupted: {exc!r}')
+            await asyncio.sleep(RETRY_DELAY)
+        except Exception as exc:
+            # list the ConfigMaps again rather than trust the watch's
+            # position
+            logger.exception(f'item state watch failed: {exc!r}')
+            version = None
+            await asyncio.sleep(RETRY_DELAY)
+
+
+def _watch_done(logger: logging.Logger, task: asyncio.Task) -> None:
+    """Stop the operator if the watch ends other than by stop()."""
+    if task.cancelled():
+        return
+    exc = task.exception()
+    logger.critical(f'item state watch stopped: {exc!r}', exc_info=exc)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def start(settings: kopf.OperatorSettings,
+                logger: logging.Logger) -> None:
+    """
+    Watch the ConfigMaps in the background (without waiting for them to
+    be listed, see podwatch.start()).
+    """
+    global _task
+    _task = asyncio.create_task(run(settings, logger))
+    _task.add_done_callback(partial(_watch_done, logger))
+
+
+async def stop() -> None:
+    """Stop watching the ConfigMaps."""
+    global _task, _listed
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    _task = None
+    _listed = False
+    index.clear()
@@ -0,0 +1,24 @@
+"""
+job.py
+
+Helpers for the Jobs which run items for an OaatType with spec.type="job"
+(see also JobOverseer in pod.py).
+"""
+from typing import Any, Mapping, Optional
+
+# label added by Kubernetes to the pods of a Job
+JOB_NAME_LABEL = 'job-name'
+
+
+def job_condition(status: Mapping[str, Any]) -> Optional[dict]:
+    """The condition (Complete or Failed) of a finished Job, or None."""
+    for condition in status.get('conditions') or []:
+        if (condition.get('type') in ('Complete', 'Failed')
+                and condition.get('status') == 'True'):
+            return condition
+    return None
+
+
+def is_job_pod(labels: Mapping[str, str]) -> bool:
+    """Whether a pod was created by a Job (rather than by the operator)."""
+    return JOB_NAME_LABEL in labels
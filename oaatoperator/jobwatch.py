@@ -0,0 +1,193 @@
+"""
+jobwatch.py
+
+Watch of the Jobs created by the operator (for an OaatType with
+spec.type="job").
+
+kopf filters the objects its handlers see by label client-side, so a
+kopf handler for the operator's Jobs would still have kopf receive and
+decode the events of every Job in the cluster. Instead, as for the
+operator's pods (see podwatch.py), the Jobs are watched here with a
+server-side label selector. Each Job is dispatched once it has finished
+to the handlers registered with on_finished() (see handlers.py), with
+the same kwargs as podwatch provides, and their patch applied to the
+Job. A Job whose handlers fail with a temporary error is dispatched
+again on its next event or listing.
+
+Jobs are dispatched from the watch itself, one at a time: an item's Job
+finishes at most once per run of the item, so there are few to dispatch.
+
+The Jobs are first listed by the background task which watches them (as
+kopf has not yet logged in to the API when startup handlers run), and
+those which have already finished are dispatched, as kopf does for the
+objects it lists on startup. An unexpected error in the watch is logged
+and the Jobs listed again. If the watch task ends anyway, the operator
+is stopped (so it is restarted) rather than left running without its
+Job handler.
+"""
+import asyncio
+import logging
+import os
+import signal
+from functools import partial
+from typing import Callable, List, Optional, Set, Tuple
+
+import aiohttp
+import kopf
+
+from oaatoperator import aioclient, podwatch
+from oaatoperator.job import job_condition
+
+# only Jobs created by the operator for an OaatGroup
+SELECTOR = 'app=oaat-operator,parent-name'
+# delay before re-establishing the watch after an error
+RETRY_DELAY = 5.0
+# longest time a single watch request is left open
+WATCH_TIMEOUT = 600.0
+
+JobRef = Tuple[Optional[str], str]
+
+_on_finished: List[podwatch.Registration] = []
+# finished Jobs which have been dispatched successfully
+_dispatched: Set[JobRef] = set()
+_task: Optional[asyncio.Task] = None
+
+
+def on_finished() -> Callable:
+    """Register a handler for a Job which has finished."""
+    def decorator(fn: podwatch.Handler) -> podwatch.Handler:
+        _on_finished.append(podwatch.Registration(fn, None))
+        return fn
+    return decorator
+
+
+def _ref(raw: dict) -> JobRef:
+    metadata = raw.get('metadata', {})
+    return (metadata.get('namespace'), metadata.get('name', ''))
+
+
+def is_finished(raw: dict) -> bool:
+    """Whether a Job has finished (whether it succeeded or failed)."""
+    return job_condition(raw.get('status') or {}) is not None
+
+
+async def handle_event(event: dict,
+                       settings: kopf.OperatorSettings) -> None:
+    """Dispatch a Job the first time it is seen to have finished."""
+    raw = event.get('object', {})
+    ref = _ref(raw)
+    if event.get('type') == 'DELETED':
+        _dispatched.discard(ref)
+        return
+    if ref in _dispatched or not is_finished(raw):
+        return
+    _, succeeded = await podwatch.call_handlers(
+        podwatch.handler_kwargs(raw, 'finished', settings),
+        _on_finished, aioclient.JOB)
+    if succeeded:
+        _dispatched.add(ref)
+
+
+async def list_jobs(settings: kopf.OperatorSettings,
+                    logger: logging.Logger) -> str:
+    """
+    List the Jobs, dispatching those which have finished but not yet been
+    dispatched. Returns the resource version to watch from.
+    """
+    result = await aioclient.api.get(
+        aioclient.url(aioclient.JOB, None,
+                      query={'labelSelector': SELECTOR}),
+        settings=settings, logger=logger)
+    jobs = result.get('items', [])
+    _dispatched.intersection_update(_ref(raw) for raw in jobs)
+    for raw in jobs:
+        await handle_event({'type': 'ADDED', 'object': raw}, settings)
+    return result.get('metadata', {}).get('resourceVersion', '')
+
+
+async def watch_jobs(settings: kopf.OperatorSettings,
+                     logger: logging.Logger,
+                     resource_version: str,
+                     timeout: float) -> Optional[str]:
+    """
+    Watch the Jobs from resource_version for up to timeout seconds,
+    returning the resource version to continue from, or None if the Jobs
+    need to be listed again.
+    """
+    query = {
+        'labelSelector': SELECTOR,
+        'watch': 'true',
+        'allowWatchBookmarks': 'true',
+        'resourceVersion': resource_version,
+        'timeoutSeconds': str(max(1, int(timeout))),
+    }
+    async for event in aioclient.api.stream(
+            aioclient.url(aioclient.JOB, None, query=query),
+            settings=settings, logger=logger,
+            timeout=aiohttp.ClientTimeout(total=timeout + 60)):
+        if event.get('type') == 'ERROR':
+            # usually 410 Gone: the resource version is too old
+            logger.debug(f'job watch error: {event.get("object")}')
+            return None
+        raw = event.get('object', {})
+        resource_version = raw.get('metadata', {}).get(
+            'resourceVersion', resource_version)
+        if event.get('type') != 'BOOKMARK':
+            await handle_event(event, settings)
+    return resource_version
+
+
+async def run(settings: kopf.OperatorSettings,
+              logger: logging.Logger) -> None:
+    """List the Jobs, then watch them."""
+    version: Optional[str] = None
+    while True:
+        try:
+            if version is None:
+                version = await list_jobs(settings, logger)
+            else:
+                version = await watch_jobs(
+                    settings, logger, version,
+                    settings.watching.server_timeout or WATCH_TIMEOUT)
+        except (aioclient.APIError, aiohttp.ClientError,
+                asyncio.TimeoutError) as exc:
+            logger.warning(f'job watch interrupted: {exc!r}')
+            await asyncio.sleep(RETRY_DELAY)
+        except Exception as exc:
+            # list the Jobs again rather than trust the watch's position
+            logger.exception(f'job watch failed: {exc!r}')
+            version = None
+            await asyncio.sleep(RETRY_DELAY)
+
+
+def _watch_done(logger: logging.Logger, task: asyncio.Task) -> None:
+    """Stop the operator if the watch ends other than by stop()."""
+    if task.cancelled():
+        return
+    exc = task.exception()
+    logger.critical(f'job watch stopped: {exc!r}', exc_info=exc)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def start(settings: kopf.OperatorSettings,
+                logger: logging.Logger) -> None:
+    """
+    Watch the Jobs in the background (without waiting for them to be
+    listed, see podwatch.start()).
+    """
+    global _task
+    _task = asyncio.create_task(run(settings, logger))
+    _task.add_done_callback(partial(_watch_done, logger))
+
+
+async def stop() -> None:
+    """Stop watching the Jobs."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    _task = None
+    _dispatched.clear()
@@ -4,25 +4,56 @@ oaatgroup.py
 Overseer object for managing OaatGroup objects.
 """
 from __future__ import annotations
-from random import randrange
+import contextlib
+import hashlib
+import json
 import datetime
 from typing_extensions import Unpack
 import logging
 import pykube  # type: ignore
 import kopf
-from typing import Any, List, Set, Optional, TypedDict, Type, cast
+from typing import (Any, Iterator, List, Mapping, NoReturn, Optional,
+                    Tuple, TypedDict, Type, cast)
 from kopf._cogs.structs import bodies
 from kopf._cogs.helpers import typedefs
 
 # local imports
+import oaatoperator.aioclient
+import oaatoperator.cache
+import oaatoperator.deadline
+import oaatoperator.itemindex
+import oaatoperator.itemstore
+import oaatoperator.itemwatch
+import oaatoperator.job
+import oaatoperator.podgc
+import oaatoperator.podwatch
+import oaatoperator.selection
 import oaatoperator.utility
+import oaatoperator.windows
+import oaatoperator.worker
 import oaatoperator.py_types as py_types
-from oaatoperator.oaatitem import OaatItems, OaatItem
+from oaatoperator.oaatitem import OaatItems, OaatItem, batch_items
 from oaatoperator.oaattype import OaatType
 from oaatoperator.overseer import Overseer
+from oaatoperator.client import get_api
 from oaatoperator.common import (ProcessingComplete, KubeOaatGroup,
                                  InternalError)
-from oaatoperator.runtime_stats import RuntimeStatsManager
+from oaatoperator.runtime_stats import JobRuntimeStats, RuntimeStatsManager
+
+# number of candidates listed in status.find_job
+FIND_JOB_TOP_N = 5
+# annotation (with the oaatoperator.kawaja.net/ prefix) requesting the full
+# item table in status.find_job_table
+FIND_JOB_DUMP = 'find-job-dump'
+
+# largest number of items run by a single (batch) pod (see batchSize)
+MAX_BATCH_SIZE = 100
+
+# per-item status fields used to store runtime statistics before they were
+# combined into the single runtime_stats field
+LEGACY_RUNTIME_FIELDS = ('runtime_count', 'runtime_total',
+                         'runtime_sum_squares', 'runtime_min', 'runtime_max',
+                         'runtime_sample', 'runtime_last_updated')
 
 
 # TODO: I'm not convinced about this composite object. It's essentially
@@ -38,6 +69,29 @@ from oaatoperator.runtime_stats import RuntimeStatsManager
 # future non-POD run mechanisms (e.g. Job)
 
 
+def batch_settings(
+        spec: Mapping[str, Any],
+        name: str) -> Tuple[int, Optional[datetime.timedelta]]:
+    """
+    Validate the batch settings of an OaatGroup spec.
+
+    Returns (batch size, maximum predicted runtime of a batch or None).
+    """
+    size = spec.get('batchSize', 1)
+    if (not isinstance(size, int) or isinstance(size, bool)
+            or not 0 < size <= MAX_BATCH_SIZE):
+        raise kopf.PermanentError(f'invalid batchSize {size} in {name}')
+    max_runtime = None
+    if 'batchMaxRuntime' in spec:
+        max_runtime = oaatoperator.utility.parse_duration(
+            str(spec['batchMaxRuntime']))
+        if max_runtime is None:
+            raise kopf.PermanentError(
+                f'invalid batchMaxRuntime {spec["batchMaxRuntime"]} '
+                f'in {name}')
+    return size, max_runtime
+
+
 class OaatGroupOverseer(Overseer):
     """
     OaatGroupOverseer
@@ -51,6 +105,14 @@ class OaatGroupOverseer(Overseer):
     freq: datetime.timedelta = datetime.timedelta(hours=1)
     oaattype: Optional[OaatType] = None
     status: Optional[bodies.Status] = None
+    windows: oaatoperator.windows.BlackoutWindows = (
+        oaatoperator.windows.BlackoutWindows())
+    # for spec.type="worker", the worker pod verified by
+    # verify_running_async()
+    worker_pod: Optional[dict] = None
+    # the running (or pending) pod found by verify_running_async()
+    running_pod: Optional[pykube.Pod] = None
+    _counters = {'handler_status': ('loops',)}
 
     def __init__(self, parent: OaatGroup,
                  **kwargs: Unpack[py_types.CallbackArgs]) -> None:
@@ -65,9 +127,41 @@ class OaatGroupOverseer(Overseer):
                 f'invalid frequency specification {specfreq} in {self.name}')
         self.freq = freq
         self.oaattypename = self.spec.get('oaatType')
-        self.oaattype = OaatType(name=self.oaattypename)
+        self.oaattype = OaatType(name=self.oaattypename,
+                                 namespace=self.namespace,
+                                 api=self.api,
+                                 index=kwargs.get('oaattype_index'))
         self.cool_off = oaatoperator.utility.parse_duration(
             str(self.spec.get('failureCoolOff')))
+        self.item_index_type = self.spec.get('itemIndex', 'heap')
+        if self.item_index_type not in oaatoperator.itemindex.INDEX_TYPES:
+            raise kopf.PermanentError(
+                f'invalid itemIndex {self.item_index_type} in {self.name}')
+        oaatoperator.podgc.retention_settings(self.spec, self.name)
+        self.batch_size, self.batch_max_runtime = batch_settings(
+            self.spec, self.name)
+        oaatoperator.deadline.deadline_settings(self.spec, self.name)
+        self.pending_timeout = oaatoperator.deadline.pending_timeout(
+            self.spec, self.name)
+        self.windows = oaatoperator.windows.BlackoutWindows.from_spec(
+            self.spec, self.name)
+        self.item_selection = self.spec.get('itemSelection', 'oldest')
+        policy = oaatoperator.selection.POLICIES.get(self.item_selection)
+        if policy is None:
+            raise kopf.PermanentError(
+                f'invalid itemSelection {self.item_selection} in '
+                f'{self.name}')
+        self.selection = policy(parent)
+
+    def item_index(self) -> oaatoperator.itemindex.BaseItemIndex:
+        """Retrieve the index of item run history for this group."""
+        return oaatoperator.itemindex.get_index(
+            (self.namespace, self.name),
+            self.spec.get('oaatItems', []),
+            self.parent.item_store.items(),
+            self.freq,
+            self.cool_off,
+            self.item_index_type)
 
     # TODO: consider whether this should be a method of OaatItems()
     def find_job_to_run(self) -> OaatItem:
@@ -94,125 +188,259 @@ class OaatGroupOverseer(Overseer):
               the oldest failure, choose it
             - choose at random (this is likely to occur if no items have
               been run - i.e. first iteration)
+
+        No item is started during a blackout window (spec.windows) and,
+        before a window, items which are predicted to still be running
+        when it starts are not candidates (see windows.py).
+
+        Phase two is the default itemSelection ("oldest"): other
+        policies (see selection.py) choose differently from the same
+        candidates.
+
+        The candidates are found from the group's item index (see
+        itemindex.py) rather than by examining every item.
         """
         now = oaatoperator.utility.now()
 
-        # Phase One: Choose valid item candidates
-        oaat_items: List[OaatItem] = self.parent.items.list()
-        longest_item = max([len(item.name) for item in oaat_items]+[1])
-        item_status = {item.name: 'candidate' for item in oaat_items}
-        display_name = {
-            item.name: item.name.ljust(longest_item, ' ')
-            for item in oaat_items
-        }
-
-        if not oaat_items:
+        if not self.spec.get('oaatItems'):
             raise ProcessingComplete(
                 message='error in OaatGroup definition',
                 error='no items found. please set "oaatItems"')
 
-        self.debug('oaat_items: ' + ', '.join([i.name for i in oaat_items]))
+        index = self.item_index()
+        self.report_find_job(index, now)
 
-        # Filter out items which have been recently successful
+        blackout_end = self.windows.blackout_end(now)
+        if blackout_end is not None:
+            raise ProcessingComplete(
+                message='in blackout window until '
+                f'{blackout_end.isoformat()}')
+        allow = self._fits_before_window(now)
+
+        chosen = self._choose_item(index, now, allow)
+        if chosen is None:
+            self._no_item_to_run(index, now, allow)
+
+        # the index is maintained from status updates made by the operator:
+        # make sure it agrees with the status for the chosen item
+        item = self.parent.items.get(chosen)
+        if oaatoperator.itemindex.ItemRecord(
+                chosen, item.success(), item.failure(),
+                item.numfails()) != index.records[chosen]:
+            self.debug(f'item index out of date for {chosen}, rebuilding')
+            index = oaatoperator.itemindex.rebuild(
+                (self.namespace, self.name),
+                self.parent.item_store.items())
+            chosen = self._choose_item(index, now, allow)
+            if chosen is None:
+                self._no_item_to_run(index, now, allow)
+            item = self.parent.items.get(chosen)
+        return item
+
+    def _fits_before_window(
+            self, now: datetime.datetime
+    ) -> Optional[oaatoperator.itemindex.Allow]:
+        """
+        For a group with blackout windows, whether an item is predicted
+        to finish before the next window starts. Items with no runtime
+        history are allowed to run.
+        """
+        available = self.windows.available(now)
+        if available is None:
+            return None
+        predictions: dict[str, Optional[float]] = {}
+
+        def fits(name: str) -> bool:
+            if name not in predictions:
+                predictions[name] = self.parent.get_predicted_runtime(name)
+            predicted = predictions[name]
+            return predicted is None or predicted <= available
+
+        return fits
+
+    def _no_item_to_run(self,
+                        index: oaatoperator.itemindex.BaseItemIndex,
+                        now: datetime.datetime,
+                        allow: Optional[oaatoperator.itemindex.Allow]
+                        ) -> NoReturn:
+        """Raise ProcessingComplete when _choose_item() finds no item."""
+        if allow is not None and index.first_candidates(now, limit=1):
+            start = self.windows.next_start(now)
+            raise ProcessingComplete(
+                message='no item predicted to finish before blackout '
+                f'window at {start.isoformat() if start else None}')
+        raise ProcessingComplete(message='not time to run next item')
+
+    def find_batch(self, first: OaatItem) -> List[OaatItem]:
+        """
+        find_batch
+
+        Choose the items to run in a single pod, starting with the item
+        chosen by find_job_to_run(): for a group with a batchSize, add
+        further eligible items, those which have gone longest without
+        success first, up to batchSize items. With batchMaxRuntime (or
+        before a blackout window), only add items while the total of
+        their predicted runtimes fits (items with no runtime history are
+        not added). A worker (see worker.py) runs one item at a time, so
+        is never sent a batch.
+        """
+        batch = [first]
+        if (self.batch_size <= 1 or self.oaattype is None
+                or self.oaattype.backend() == 'worker'):
+            return batch
+        now = oaatoperator.utility.now()
+        index = self.item_index()
+        records = index.records
+        candidates = sorted(
+            (name for name in index.first_candidates(
+                now, limit=len(records)) if name != first.name),
+            key=lambda name: (records[name].success, records[name].failure,
+                              name))
+        limits = [self.windows.available(now)]
+        if self.batch_max_runtime is not None:
+            limits.append(self.batch_max_runtime.total_seconds())
+        remaining = min((limit for limit in limits if limit is not None),
+                        default=None)
+        if remaining is not None:
+            remaining -= self.parent.get_predicted_runtime(first.name) or 0
+        for name in candidates:
+            if len(batch) >= self.batch_size:
+                break
+            if remaining is not None:
+                predicted = self.parent.get_predicted_runtime(name)
+                if predicted is None or predicted > remaining:
+                    continue
+                remaining -= predicted
+            batch.append(self.parent.items.get(name))
+        self.debug('batch: ' + ', '.join(item.name for item in batch))
+        return batch
+
+    def report_find_job(self, index: oaatoperator.itemindex.BaseItemIndex,
+                        now: datetime.datetime) -> None:
+        """
+        Record a summary of the items, as seen by find_job_to_run(), in
+        status.find_job: the number of items for each reason (eligible to
+        run, successful within 'frequency' or within 'failureCoolOff' of
+        a failure), the first FIND_JOB_TOP_N candidates and when the next
+        item becomes eligible.
+
+        The summary is only written when it changes. Counting the items
+        for each reason takes a pass over every item, so the counts are
+        only worked out when the rest of the summary (the candidates or
+        when the next item is due) has changed. The full table of items
+        is written to status.find_job_table while the find-job-dump
+        annotation is set.
+        """
         self.debug(f'frequency: {self.freq}s')
         self.debug(f'now: {now}')
         self.debug(f'cool_off: {self.cool_off}')
 
-        candidates = set()
-        for item in oaat_items:
-            if now > item.success() + self.freq:
-                candidates.add(item)
-                item_status[item.name] = (
-                    f'not successful within last {self.freq}')
+        next_due = index.next_eligible()
+        summary: dict[str, Any] = {
+            'items': len(index.records),
+            'top_candidates': index.first_candidates(
+                now, limit=FIND_JOB_TOP_N),
+            'next_due': next_due.isoformat() if next_due else None,
+        }
+        digest = hashlib.sha256(json.dumps(
+            summary, sort_keys=True).encode()).hexdigest()[:16]
+        current = self.get_status('find_job')
+        if not isinstance(current, Mapping) or current.get('hash') != digest:
+            summary['reasons'] = index.reason_counts(now)
+            summary['hash'] = digest
+            self.info(f'find_job: {summary}')
+            self.set_status('find_job', summary)
+
+        annotations = (self.meta or {}).get('annotations', {})
+        if annotations.get(f'oaatoperator.kawaja.net/{FIND_JOB_DUMP}'):
+            table = self.find_job_table(index, now)
+            self.debug(table)
+            if self.get_status('find_job_table') != table:
+                self.set_status('find_job_table', table)
+        elif self.get_status('find_job_table') is not None:
+            self.set_status('find_job_table', None)
+
+    def find_job_table(self, index: oaatoperator.itemindex.BaseItemIndex,
+                       now: datetime.datetime) -> str:
+        """Status of each item, as seen by find_job_to_run()."""
+        longest_item = max([len(name) for name in index.items]+[1])
+        lines = []
+        for name in index.items:
+            record = index.records[name]
+            reason = index.reason(record, now)
+            if reason == 'recent_success':
+                item_status = f'successful within last {self.freq}'
+            elif reason == 'cool_off':
+                item_status = (
+                    f'cool_off ({self.cool_off}) not expired since '
+                    f'last failure')
             else:
-                item_status[item.name] = (
-                    f'successful within last {self.freq}')
-
-        self.debug('remaining items, based on last success & frequency: ' +
-                   ', '.join(sorted([i.name for i in candidates])))
-
-        # Filter out items which have failed within the cool off period
-        if self.cool_off is not None:
-            for item in candidates.copy():
-                if now < item.failure() + self.cool_off:
-                    candidates.remove(item)
-                    item_status[item.name] = (
-                        f'cool_off ({self.cool_off}) not expired since '
-                        f'last failure')
-
-            self.debug('remaining items, based on failure cool off: ' +
-                       ', '.join(sorted([i.name for i in candidates])))
-
-        find_job_status = (
-            f'find_job last run: {now.isoformat()}\n'
+                item_status = f'not successful within last {self.freq}'
+            lines.append(
+                ('* ' if reason == 'candidate' else '- ') +
+                f'{name.ljust(longest_item, " ")} ' +
+                f'{item_status} - ' +
+                f'success={record.success.isoformat()}, ' +
+                f'failure={record.failure.isoformat()}, ' +
+                f'numfails={record.numfails}')
+
+        return (
+            f'find_job run: {now.isoformat()}\n'
             'item status (* = candidate):\n' +
-            '\n'.join(sorted([
-                ('* ' if i in candidates else '- ') +
-                f'{display_name[i.name]} ' +
-                f'{item_status[i.name]} - ' +
-                f'success={i.success().isoformat()}, ' +
-                f'failure={i.failure().isoformat()}, ' +
-                f'numfails={i.numfails()}'
-                for i in oaat_items
-            ]))
+            '\n'.join(sorted(lines))
         )
-        self.info(find_job_status)
-        self.set_status('find_job', find_job_status)
 
-        if not candidates:
-            raise ProcessingComplete(
-                message='not time to run next item')
-
-        # return single candidate if there is only one left
-        if len(candidates) == 1:
-            return candidates.pop()
-
-        # Phase 2: Choose the item to run from the valid item candidates
-        # Get all items which are "oldest"
-        oldest_success_items = oaatoperator.utility.min_set(
-            candidates, lambda x: x.success())
-
-        self.debug('oldest_success_items: ' +
-                   ', '.join(sorted([i.name for i in oldest_success_items])))
-
-        # Choose based on last failure (but only if there has been
-        # a failure for the item)
-        failure_items = {
-            item
-            for item in candidates
-            if item.numfails() > 0}
-
-        self.debug('failure_items: ' +
-                   ', '.join(sorted([i.name for i in failure_items])))
-
-        remaining_items: Set[OaatItem] = set()
-        if len(failure_items) == 0:
-            # nothing has failed
-            remaining_items = oldest_success_items
-        else:
-            oldest_failure_items = oaatoperator.utility.min_set(
-                failure_items, lambda x: x.failure())
-
-            self.debug('oldest_failure_items: ' +
-                       ', '.join(sorted(
-                           [i.name for i in oldest_failure_items])))
-
-            # if we always choose the failed items, we can get stuck
-            # on items which consistently fail. So, 1 in 3 we should
-            # ignore the failed items and choose from the non-failed items
-            if randrange(3) == 0:
-                self.debug(
-                    'wildcard! selecting from previously-successful items')
-                remaining_items = oaatoperator.utility.min_set(
-                    candidates - failure_items, lambda x: x.success())
-            if not remaining_items:
-                remaining_items = oldest_failure_items
-
-        # Choose at random
-        self.debug('randomly choosing from: ' +
-                   ', '.join(sorted([i.name for i in remaining_items])))
-
-        return list(remaining_items)[randrange(len(remaining_items))]  # nosec
+    def _choose_item(
+            self, index: oaatoperator.itemindex.BaseItemIndex,
+            now: datetime.datetime,
+            allow: Optional[oaatoperator.itemindex.Allow] = None
+    ) -> Optional[str]:
+        """
+        Choose the item to run (see find_job_to_run()) from those for
+        which allow(name) is true (if given), using the group's
+        itemSelection policy.
+        """
+        return self.selection.choose(index, now, allow)
+
+    def next_due(self) -> Optional[datetime.datetime]:
+        """
+        next_due
+
+        Determine when this group next needs to be checked: the earliest
+        time at which an item becomes eligible to run (its last success
+        is older than 'frequency' and its last failure is older than
+        'failureCoolOff'), or the end of the blackout window it falls in.
+
+        While a pod is running (as found by verify_running_async()), the
+        group is due when the pod becomes a straggler, or, while the pod
+        is Pending, when it has been Pending for pendingTimeout (see
+        deadline.py), so it is failed on time; otherwise the pod's next
+        phase change will wake the group.
+
+        Returns None if there is nothing to wait for: there are no items,
+        or an item is currently running without a deadline. An item
+        running on a worker pod (see worker.py) is instead polled every
+        WORKER_POLL, as the worker pod stays Running when the item
+        completes, so no pod event wakes the group.
+        """
+        if self.running_pod is not None:
+            return (oaatoperator.deadline.stuck_pending_at(
+                        self.running_pod.obj, self.pending_timeout)
+                    or oaatoperator.deadline.straggler_at(
+                        self.running_pod.obj))
+        if (self.memo is not None and self.memo.get('state') == 'running'
+                and self.memo.get('pod')):
+            if (self.oaattype is not None
+                    and self.oaattype.backend() == 'worker'):
+                return (oaatoperator.utility.now()
+                        + oaatoperator.worker.WORKER_POLL)
+            return None
+        due = self.item_index().next_eligible()
+        if due is None:
+            return None
+        blackout_end = self.windows.blackout_end(
+            max(due, oaatoperator.utility.now()))
+        return due if blackout_end is None else blackout_end
 
     def validate_items(
             self, status_annotation=None, count_annotation=None) -> None:
@@ -246,38 +474,49 @@ class OaatGroupOverseer(Overseer):
         ordered_pods = sorted(pods, key=get_start_time)
         return ordered_pods[0]
 
-    def delete_non_survivor_pods(self, survivor) -> None:
-        found_rogue = 0
+    def _rogue_pods(self,
+                    survivor: pykube.Pod,
+                    running_pods: List[pykube.Pod]) -> List[pykube.Pod]:
+        rogue_pods = []
         self.debug('searching for rogue pods.')
         self.debug(f'  survivor={survivor.name}')
-        # (pykube needs Optional[str] for namespace)
-        all_pods: pykube.query.Query = (
-            pykube.Pod.objects(self.api).filter(
-                namespace=self.namespace)  # type: ignore
-            .filter(selector={
-                'app': 'oaat-operator',
-                'parent-name': self.name
-            }))
-        for pod in all_pods.iterator():
+        for pod in running_pods:
             self.debug(f'  checking {pod.name}')
             if pod.name == survivor.name:
                 self.debug(f'  skipping {pod.name} as this is the survivor')
                 continue    # skip over the surviving pod
             podphase = (pod.obj['status'].get('phase', 'unknown'))
             if podphase in ['Running', 'Pending']:
-                pod.delete()
                 self.warning(
                     f'rogue pod {pod.name} found (phase={podphase})')
-                found_rogue += 1
+                rogue_pods.append(pod)
+        return rogue_pods
 
+    def _rogue_pods_deleted(self, found_rogue: int) -> None:
         if found_rogue > 0:
             raise ProcessingComplete(
                 message='rogue pods running',
                 error=f'found {found_rogue} rogue pods running'
             )
 
-    def resume_running_pod(self) -> Optional[dict[str, str]]:
-        pod = self.identify_running_pod()
+    async def delete_non_survivor_pods_async(
+            self,
+            survivor: pykube.Pod,
+            running_pods: List[pykube.Pod]) -> None:
+        rogue_pods = self._rogue_pods(survivor, running_pods)
+        for pod in rogue_pods:
+            try:
+                await oaatoperator.aioclient.delete_object(
+                    oaatoperator.aioclient.POD, pod.namespace, pod.name,
+                    logger=self.logger)
+            except oaatoperator.aioclient.APINotFoundError:
+                self.debug(f'rogue pod {pod.name} already deleted')
+        self._rogue_pods_deleted(len(rogue_pods))
+
+    def resume_running_pod(
+            self,
+            running_pods: List[pykube.Pod]) -> Optional[dict[str, str]]:
+        pod = self.identify_running_pod(running_pods)
         if pod is not None:
             return {
                 'oaat-name': pod.labels.get('oaat-name', 'unknown'),
@@ -285,22 +524,50 @@ class OaatGroupOverseer(Overseer):
             }
         return None
 
-    def identify_running_pod(self) -> Optional[pykube.Pod]:
-        running_pods: List[pykube.Pod] = []
-        all_pods: pykube.query.Query = (
-            pykube.Pod.objects(self.api).filter(
-                namespace=self.namespace)  # type: ignore
-            .filter(selector={
-                'app': 'oaat-operator',
-                'parent-name': self.name
-            }))
-        for pod in all_pods.iterator():
-            self.debug(f'  checking {pod.name}')
-            podphase = (pod.obj['status'].get('phase', 'unknown'))
-            self.debug(f'    {pod.name} phase = {podphase}')
-            if podphase in ['Running', 'Pending']:
-                running_pods.append(pod)
+    async def _list_running_pods_async(self) -> List[pykube.Pod]:
+        objs = await oaatoperator.aioclient.list_objects(
+            oaatoperator.aioclient.POD,
+            self.namespace,
+            labels={'app': 'oaat-operator', 'parent-name': self.name},
+            logger=self.logger)
+        return [
+            pykube.Pod(self.api, obj)
+            for obj in objs
+            if (obj.get('status', {}).get('phase')
+                in oaatoperator.cache.RUNNING_PHASES)
+        ]
+
+    def _indexed_running_pods(self) -> Optional[List[pykube.Pod]]:
+        """
+        Find running pods using the pod index.
+
+        Returns None if the pods need to be listed from the API instead:
+        when there is no index, or when the index has no running pods
+        but the memo records one (the index may not yet reflect a pod
+        created on the previous run).
+        """
+        index = oaatoperator.podwatch.pod_index()
+        if index is None:
+            return None
+        pods = [pykube.Pod(self.api, obj)
+                for obj in oaatoperator.cache.get_running_pods(
+                    index, self.namespace, self.name)]
+        if not pods and self.memo is not None and self.memo.get('pod'):
+            self.debug('pod index has no running pods, but memo has '
+                       f'{self.memo.get("pod")}; checking with API')
+            return None
+        return pods
+
+    async def running_pods_async(self) -> List[pykube.Pod]:
+        """Find all Running or Pending pods for this OaatGroup (async)."""
+        pods = self._indexed_running_pods()
+        if pods is None:
+            pods = await self._list_running_pods_async()
+        return pods
 
+    def identify_running_pod(
+            self,
+            running_pods: List[pykube.Pod]) -> Optional[pykube.Pod]:
         self.debug(f'    found {len(running_pods)} running pods')
 
         if len(running_pods) == 0:
@@ -316,19 +583,23 @@ class OaatGroupOverseer(Overseer):
         """
         phase = pod.obj.get('status', {}).get('phase', 'unknown')
         item_name = pod.labels.get('oaat-name', 'unknown')
-        self._set_item_status(item_name, 'last_verified',
-                              oaatoperator.utility.now_iso())
+        self.parent.set_item_status(item_name, 'last_verified',
+                                    oaatoperator.utility.now_iso())
         raise ProcessingComplete(
             message=f'Pod {pod.name} exists and is in state {phase}')
 
-    def verify_running(self) -> None:
+    async def verify_running_async(self) -> None:
         """
-        verify_running
+        verify_running_async
 
         Verifies that a valid pod is running and no
-        other (ooat-operator) pods are running. `verify_running()` does
-        the latter by selecting the oldest Pod in `Running` or `Pending` state
-        and deletes all others.
+        other (ooat-operator) pods are running. `verify_running_async()`
+        does the latter by selecting the oldest Pod in `Running` or
+        `Pending` state and deletes all others. A pod still running well
+        after its deadline, or Pending for longer than pendingTimeout, is
+        failed (see deadline.py). For an OaatType with spec.type="worker",
+        verifies that the group's worker pod is ready for an item instead
+        (see worker.py).
 
         Returns:
         - ProcessingComplete exception
@@ -341,10 +612,84 @@ class OaatGroupOverseer(Overseer):
         - None
             - no pods running, OK to consider starting a new pod
         """
-        curpod = self.identify_running_pod()
+        if self.oaattype is not None and self.oaattype.backend() == 'worker':
+            self.worker_pod = await oaatoperator.worker.verify_worker_async(
+                self.parent)
+            return
+        running_pods = await self.running_pods_async()
+        curpod = self.identify_running_pod(running_pods)
         if curpod is not None:
-            self.delete_non_survivor_pods(curpod)
+            await self.delete_non_survivor_pods_async(curpod, running_pods)
+            self.running_pod = curpod
+            if oaatoperator.deadline.is_straggler(curpod.obj):
+                await self.fail_pod_async(curpod, 'exceeded its deadline')
+            if oaatoperator.deadline.is_stuck_pending(curpod.obj,
+                                                      self.pending_timeout):
+                reason = oaatoperator.deadline.pending_reason(curpod.obj)
+                await self.fail_pod_async(
+                    curpod, f'still pending after {self.pending_timeout} '
+                    f'({reason})')
             self.verify_running_pod(curpod)
+        await self._verify_job_async()
+
+    async def fail_pod_async(self, pod: pykube.Pod, why: str) -> None:
+        """
+        fail_pod_async
+
+        Fail the items of a pod which is not going to finish by itself
+        (why: e.g. it is still running after its deadline, or is stuck
+        Pending), removing the pod (or, for spec.type="job", its Job)
+        without waiting for it to stop, so that the group can move on to
+        its next item. The failure puts the items into cool-off.
+        """
+        labels = pod.labels
+        if oaatoperator.job.is_job_pod(labels):
+            kind, resource = 'Job', oaatoperator.aioclient.JOB
+            name = labels[oaatoperator.job.JOB_NAME_LABEL]
+        else:
+            kind, resource = 'pod', oaatoperator.aioclient.POD
+            name = pod.name
+        try:
+            await oaatoperator.aioclient.delete_object(
+                resource, pod.namespace, name, grace_period=0,
+                logger=self.logger)
+        except oaatoperator.aioclient.APINotFoundError:
+            self.debug(f'{kind} {name} already deleted')
+        except oaatoperator.aioclient.APIError as exc:
+            raise ProcessingComplete(
+                error=f'cannot delete {kind} {name} which {why}: {exc}',
+                message=f'cannot delete {kind} {name}')
+        self.running_pod = None
+        items = (batch_items(pod.obj['metadata'])
+                 or [labels.get('oaat-name', 'unknown')])
+        for item_name in items:
+            self.parent.mark_item_failed(item_name)
+        if self.memo is not None:
+            self.memo.job = None
+        raise ProcessingComplete(
+            message=f'{kind} {name} {why}',
+            error=f'{kind} {name} {why}, failed item {", ".join(items)}')
+
+    async def _verify_job_async(self) -> None:
+        """
+        For an OaatType with spec.type="job", verify that the Job started
+        on an earlier run has finished: a Job without a running pod may
+        not have created its pod yet.
+        """
+        name = self.memo.get('job') if self.memo is not None else None
+        if not name:
+            return
+        try:
+            job = await oaatoperator.aioclient.get_object(
+                oaatoperator.aioclient.JOB, self.namespace, name,
+                logger=self.logger)
+        except oaatoperator.aioclient.APINotFoundError:
+            job = None
+        if (job is not None and oaatoperator.job.job_condition(
+                job.get('status', {})) is None):
+            raise ProcessingComplete(
+                message=f'Job {name} exists and has not finished')
+        self.memo.job = None
 
     def _set_item_status(self,
                          item_name: str,
@@ -352,6 +697,11 @@ class OaatGroupOverseer(Overseer):
                          value: Optional[str] = None) -> None:
         if self.patch is None:
             raise kopf.PermanentError('kopf error: patch is None')
+        current = (self.get_status('items') or {}).get(item_name) or {}
+        if current.get(key) == value:
+            # drop any earlier change to this field in the same handler
+            self._drop_pending('status', 'items', item_name, key)
+            return
         patch: dict = (self.patch
                        .setdefault('status', {})
                        .setdefault('items', {})
@@ -385,6 +735,8 @@ class OaatGroup:
     status: dict
     memo: kopf.Memo
     items: OaatItems
+    item_store: oaatoperator.itemstore.ItemStore
+    _status_buffer: Optional[dict] = None
     passthrough_names: list = [
         i for i in dir(OaatGroupOverseer) if i[0] != '_'
     ] + ["name"]
@@ -394,16 +746,21 @@ class OaatGroup:
                  kube_object_name: Optional[str] = None,
                  kube_object_namespace: str = 'default',
                  memo: Optional[kopf.Memo] = None,
-                 logger: Optional[typedefs.Logger] = None) -> None:
-        self.api = pykube.HTTPClient(pykube.KubeConfig.from_env())
+                 logger: Optional[typedefs.Logger] = None,
+                 kube_object: Optional[KubeOaatGroup] = None) -> None:
+        self.api = get_api()
 
         # kopf object supplied
         if kopf_object is not None:
             self.kopf_object = OaatGroupOverseer(
                 self, **cast(py_types.CallbackArgs, kopf_object))
+            self.item_store = oaatoperator.itemstore.make_store(
+                self, cast(dict[str, Any], kopf_object),
+                oaatoperator.itemwatch.item_index())
             self.items = OaatItems(group=self,
                                    obj=cast(dict[str, Any], kopf_object))
             self.memo = kopf_object['memo']
+            self.logger = self.kopf_object.logger
             # Initialize runtime statistics manager
             self._init_runtime_stats()
             return
@@ -432,8 +789,12 @@ class OaatGroup:
         # retrieve kube object if we're provided a name
         # TODO: refactor to use self.group.get_kubeobj()
         self.kopf_object = None
-        self.kube_object = self.get_kube_object(kube_object_name,
-                                                kube_object_namespace)
+        if kube_object is None:
+            kube_object = self.get_kube_object(kube_object_name,
+                                               kube_object_namespace)
+        self.kube_object = kube_object
+        self.item_store = oaatoperator.itemstore.make_store(
+            self, self.kube_object.obj)
         self.items = OaatItems(group=self,
                                obj=cast(dict[str, Any], self.kube_object.obj))
         self.status = self.kube_object.obj.get('status', {})
@@ -442,37 +803,37 @@ class OaatGroup:
 
     def _init_runtime_stats(self) -> None:
         """
-        Initialize runtime statistics manager from stored per-item status.
-        """
-        self.runtime_stats = RuntimeStatsManager()
+        Initialize runtime statistics manager.
 
-        # Load existing statistics from per-item status if available
-        try:
-            # Get the items status section
-            if self.kopf_object:
-                items_status = self.kopf_object.get_status('items', {})
-            else:
-                items_status = self.status.get('items', {})
+        Stored per-item statistics are decoded lazily, the first time
+        they are needed for an item.
+        """
+        self.runtime_stats = RuntimeStatsManager(
+            loader=self._stored_runtime_stats)
 
-            # Load statistics for each item that has runtime data
-            for item_name, item_data in items_status.items():
-                if 'runtime_count' in item_data:
-                    self._load_item_runtime_stats(item_name, item_data)
+    def _item_runtime_status(self, item_name: str) -> Mapping[str, Any]:
+        return self.item_store.get(item_name)
 
-        except Exception as e:
-            if hasattr(self, 'logger'):
-                self.logger.warning(f'Failed to load runtime statistics: {e}')
-            # Continue with empty stats if loading fails
-            self.runtime_stats = RuntimeStatsManager()
+    def _stored_runtime_stats(
+            self, item_name: str) -> Optional[JobRuntimeStats]:
+        return self._load_item_runtime_stats(
+            item_name, self._item_runtime_status(item_name))
 
     def _load_item_runtime_stats(
-            self, item_name: str, item_data: dict) -> None:
-        """Load runtime statistics for a specific item from its status data."""
+            self, item_name: str,
+            item_data: dict) -> Optional[JobRuntimeStats]:
+        """Load runtime statistics for a specific item from its status data.
+
+        Reads the compact runtime_stats field, falling back to the
+        individual runtime_* fields written by earlier versions.
+        """
         try:
-            import json
-            from oaatoperator.runtime_stats import JobRuntimeStats
+            if 'runtime_stats' in item_data:
+                return JobRuntimeStats.decode(item_data['runtime_stats'])
+            if 'runtime_count' not in item_data:
+                return None
 
-            # Reconstruct statistics from flattened fields
+            # Reconstruct statistics from legacy flattened fields
             stats_dict = {
                 'count': int(item_data.get('runtime_count', 0)),
                 'total_runtime_seconds': float(item_data.get('runtime_total',
@@ -485,17 +846,13 @@ class OaatGroup:
                 'sample': json.loads(item_data.get('runtime_sample', '[]')),
                 'last_updated': item_data.get('runtime_last_updated')
             }
-
-            # Create JobRuntimeStats from the reconstructed dictionary
-            stats = JobRuntimeStats.from_dict(stats_dict)
-
-            # Add to the runtime stats manager
-            self.runtime_stats._stats[item_name] = stats
+            return JobRuntimeStats.from_dict(stats_dict)
 
         except Exception as e:
             if hasattr(self, 'logger'):
                 self.logger.warning(
                     f'Failed to load runtime statistics for {item_name}: {e}')
+            return None
 
     def _save_item_runtime_stats(self, item_name: str) -> None:
         """Save runtime statistics for a specific item to its status."""
@@ -504,35 +861,13 @@ class OaatGroup:
             if stats is None:
                 return
 
-            stats_dict = stats.to_dict()
-
-            # Flatten the statistics to individual fields for set_item_status
-            self.set_item_status(
-                item_name, 'runtime_count', str(stats_dict.get('count', 0)))
-            self.set_item_status(
-                item_name, 'runtime_total',
-                str(stats_dict.get('total_runtime_seconds', 0.0)))
-            self.set_item_status(
-                item_name, 'runtime_sum_squares',
-                str(stats_dict.get('sum_of_squares', 0.0)))
-            self.set_item_status(
-                item_name, 'runtime_min',
-                str(stats_dict.get('min_runtime', 0.0)))
-            self.set_item_status(
-                item_name, 'runtime_max',
-                str(stats_dict.get('max_runtime', 0.0)))
-
-            # Store sample as JSON string
-            import json
-            sample = stats_dict.get('sample', [])
-            self.set_item_status(
-                item_name, 'runtime_sample', json.dumps(sample))
-
-            # Store last updated timestamp
-            last_updated = stats_dict.get('last_updated')
-            if last_updated:
-                self.set_item_status(item_name, 'runtime_last_updated',
-                                     last_updated)
+            self.set_item_status(item_name, 'runtime_stats', stats.encode())
+
+            # Remove fields from the legacy format once migrated
+            item_data = self._item_runtime_status(item_name)
+            for key in LEGACY_RUNTIME_FIELDS:
+                if key in item_data:
+                    self.set_item_status(item_name, key, None)
 
         except Exception as e:
             if hasattr(self, 'logger'):
@@ -610,6 +945,18 @@ class OaatGroup:
         """
         return self.runtime_stats.predict_runtime(item_name, confidence_factor)
 
+    def get_expected_runtime(self, item_name: str) -> Optional[float]:
+        """Get the mean runtime of an item.
+
+        Args:
+            item_name: Name of the item
+
+        Returns:
+            Mean runtime in seconds or None if no data
+        """
+        stats = self.runtime_stats.get_stats(item_name)
+        return stats.get_mean() if stats else None
+
     def namespace(self) -> Optional[str]:
         if self.kopf_object:
             # (pykube needs Optional[str] for namespace)
@@ -621,6 +968,51 @@ class OaatGroup:
             f'{oaatoperator.utility.my_details(1)}'
         )
 
+    def pod_retention(self) -> tuple[datetime.timedelta, Optional[int]]:
+        """
+        Retention of this group's completed pods: (maximum age, number
+        to keep per item or None) (see podgc.py).
+        """
+        return oaatoperator.podgc.retention_settings(*self._spec())
+
+    def item_deadline(self, item_names: List[str]) -> Optional[int]:
+        """
+        Deadline (activeDeadlineSeconds) for a pod running the items, or
+        None for no deadline (see deadline.py).
+        """
+        factor, cap = oaatoperator.deadline.deadline_settings(*self._spec())
+        if factor is None:
+            return None
+        return oaatoperator.deadline.item_deadline(
+            (self.get_predicted_runtime(item_name)
+             for item_name in item_names), factor, cap)
+
+    def _spec(self) -> tuple[Mapping[str, Any], str]:
+        """The spec and name of this group."""
+        if self.kopf_object:
+            spec, name = self.kopf_object.spec, self.kopf_object.name
+        elif self.kube_object:
+            spec = self.kube_object.obj.get('spec', {})
+            name = self.kube_object.name
+        else:
+            raise InternalError(
+                'neither kopf_object nor kube_object is set '
+                f'{oaatoperator.utility.my_details(1)}'
+            )
+        return spec, name
+
+    def _index_key(self) -> tuple:
+        """Key of this group's item index (see itemindex.py)."""
+        if self.kopf_object:
+            return (self.kopf_object.namespace, self.kopf_object.name)
+        if self.kube_object:
+            return (self.kube_object.metadata.get('namespace'),
+                    self.kube_object.name)
+        raise InternalError(
+            'neither kopf_object nor kube_object is set '
+            f'{oaatoperator.utility.my_details(1)}'
+        )
+
     def get_kube_object(self, name: str, namespace: str) -> KubeOaatGroup:
         try:
             # (pykube needs Optional[str] for namespace)
@@ -666,11 +1058,15 @@ class OaatGroup:
             self.set_item_status(item_name, 'last_failure',
                                  finished_at.isoformat())
             self.set_item_status(item_name, 'last_verified')
+            oaatoperator.itemindex.record(
+                self._index_key(), item_name,
+                failure=finished_at, numfails=failure_count + 1)
 
             self.memo.currently_running = None
             self.memo.pod = None
             self.memo.state = 'idle'
-            # TODO: if via kopf, will this get overwritten by handler exit?
+            # TODO: if via kopf, will this get overwritten by handler
+            # exit?
             self.set_group_status(
                 'oaat_timer',
                 {
@@ -708,6 +1104,9 @@ class OaatGroup:
             self.set_item_status(item_name, 'last_success',
                                  finished_at.isoformat())
             self.set_item_status(item_name, 'last_verified')
+            oaatoperator.itemindex.record(
+                self._index_key(), item_name,
+                success=finished_at, numfails=0)
 
             self.memo.currently_running = None
             self.memo.pod = None
@@ -717,28 +1116,97 @@ class OaatGroup:
             # available
             self._record_item_runtime(item_name, started_at, finished_at)
 
-            # TODO: if via kopf, will this get overwritten by handler exit?
-            self.set_group_status('oaat_timer',
-                                  {'message': f'item {item_name} completed'})
+            # TODO: if via kopf, will this get overwritten by handler
+            # exit?
+            self.set_group_status(
+                'oaat_timer',
+                {'message': f'item {item_name} completed'})
             return True
         return False
 
+    @contextlib.contextmanager
+    def collect_status(self) -> Iterator[dict]:
+        """
+        collect_status
+
+        Outside of kopf, collect the status changes made within this
+        context into the yielded dict rather than writing them. The
+        caller is responsible for writing the collected changes.
+        (Under kopf, status changes are already collected in the handler
+        patch, so nothing is collected.)
+        """
+        if self.kopf_object is not None:
+            yield {}
+            return
+        if self._status_buffer is not None:
+            yield self._status_buffer
+            return
+        self._status_buffer = {}
+        try:
+            yield self._status_buffer
+        finally:
+            self._status_buffer = None
+
+    async def write_status_async(self, status: dict) -> None:
+        """
+        Write status changes gathered by collect_status() to the kube
+        object using the async API client.
+        """
+        if self.kopf_object is not None or not status:
+            return
+        # only what differs from the status as retrieved
+        status = oaatoperator.utility.patch_diff(
+            self.kube_object.obj.get('status', {}), status)
+        if status is oaatoperator.utility.UNCHANGED:
+            return
+        await oaatoperator.aioclient.patch_object(
+            oaatoperator.aioclient.OAATGROUP,
+            self.namespace(),
+            self.kube_object.name,
+            {'status': status},
+            logger=self.logger)
+
+    async def load_item_state_async(
+            self, item_names: Optional[List[str]] = None) -> None:
+        """
+        Retrieve the state of the given items (or all items), where it is
+        kept outside the OaatGroup and not already available (see
+        itemstore.py).
+        """
+        await self.item_store.load_async(item_names)
+
+    async def write_item_state_async(self) -> None:
+        """
+        Write item state changes kept outside the OaatGroup (see
+        itemstore.py), using the async API client.
+        """
+        await self.item_store.write_async()
+
+    def _update_status(self, patch: dict) -> None:
+        if self._status_buffer is None:
+            raise InternalError(
+                'status changes outside of kopf must be made within '
+                'collect_status()')
+        oaatoperator.utility.merge_dict(self._status_buffer, patch)
+
     def set_item_status(self,
                         item_name: str,
                         key: str,
                         value: Optional[str] = None) -> None:
+        self.item_store.set(item_name, key, value)
+
+    def _set_status_item(self,
+                         item_name: str,
+                         key: str,
+                         value: Optional[str] = None) -> None:
+        """Set a field of an item's state in the OaatGroup status."""
         if self.kopf_object is None:
-            self.kube_object.patch(
-                {'status': {
-                    'items': {
-                        item_name: {key: value}
-                    }
-                }})
+            self._update_status({'items': {item_name: {key: value}}})
         else:
             self.kopf_object._set_item_status(item_name, key, value)
 
     def set_group_status(self, key: str, value: Optional[Any] = None) -> None:
         if self.kopf_object is None:
-            self.kube_object.patch({'status': {key: value}})
+            self._update_status({key: value})
         else:
             self.kopf_object.set_status(key, value)
@@ -6,10 +6,15 @@ Manage OaatItems within an OaatGroup.
 
 from __future__ import annotations
 import datetime
+import functools
+import json
 import kopf
 import pykube  # type: ignore
-from typing import Any, Optional, TYPE_CHECKING
+from typing import (Any, Dict, List, Mapping, NamedTuple, Optional,
+                    TYPE_CHECKING)
 
+from oaatoperator import aioclient, podgc, worker
+from oaatoperator.deadline import DEADLINE_ANNOTATION
 from oaatoperator.utility import date_from_isostr, now
 from oaatoperator.common import ProcessingComplete
 
@@ -17,12 +22,85 @@ from oaatoperator.common import ProcessingComplete
 if TYPE_CHECKING:
     from oaatoperator.oaatgroup import OaatGroup
 
+# number of distinct item states to keep parsed (see _parse_state())
+STATE_CACHE_SIZE = 65536
+
+# annotation listing the items run by a batch pod (see pod_doc())
+BATCH_ANNOTATION = 'oaatoperator.kawaja.net/batch-items'
+
+
+def batch_items(metadata: Mapping[str, Any]) -> Optional[List[str]]:
+    """
+    The items run by a batch pod, from its BATCH_ANNOTATION annotation,
+    or None if the pod has no (valid) annotation.
+    """
+    encoded = (metadata.get('annotations') or {}).get(BATCH_ANNOTATION)
+    if not encoded:
+        return None
+    try:
+        items = json.loads(encoded)
+    except ValueError:
+        return None
+    if (isinstance(items, list) and items
+            and all(isinstance(item, str) for item in items)):
+        return items
+    return None
+
+
+class ItemState(NamedTuple):
+    """Parsed snapshot of the run history in an item's status."""
+    success: datetime.datetime
+    failure: datetime.datetime
+    started: datetime.datetime
+    verified: datetime.datetime
+    numfails: int
+
+    @classmethod
+    def from_status(cls, status: Mapping[str, Any]) -> ItemState:
+        return _parse_state(status.get('last_success'),
+                            status.get('last_failure'),
+                            status.get('last_started'),
+                            status.get('last_verified'),
+                            status.get('failure_count', '0'))
+
+
+@functools.lru_cache(maxsize=STATE_CACHE_SIZE)
+def _parse_state(success: Optional[str],
+                 failure: Optional[str],
+                 started: Optional[str],
+                 verified: Optional[str],
+                 failure_count: Any) -> ItemState:
+    """
+    Parse the run history of an item.
+
+    Cached on the raw status values, so an item whose status has not
+    changed since it was last seen (in this or an earlier handler call) is
+    not parsed again.
+    """
+    return ItemState(date_from_isostr(success),
+                     date_from_isostr(failure),
+                     date_from_isostr(started),
+                     date_from_isostr(verified),
+                     int(failure_count))
+
 
 class OaatItem:
     def __init__(self, group: OaatGroup, item_name: str) -> None:
         self.name = item_name
         self.group = group
-        self._status = (group.status.get('items', {}).get(self.name, {}))
+        store = getattr(group, 'item_store', None)
+        if store is not None:
+            self._status = store.get(self.name)
+        else:
+            self._status = group.status.get('items', {}).get(self.name, {})
+        self._state: Optional[ItemState] = None
+
+    @property
+    def state(self) -> ItemState:
+        """Parsed run history of the item (parsed on first use)."""
+        if self._state is None:
+            self._state = ItemState.from_status(self._status)
+        return self._state
 
     def set_status(self, key: str, value: Optional[str] = None) -> None:
         self.group.set_item_status(self.name, key, value)
@@ -38,26 +116,35 @@ class OaatItem:
         return date_from_isostr(self._status.get(key, default))
 
     def started(self) -> datetime.datetime:
-        return self.status_date('last_started')
+        return self.state.started
 
     def verified(self) -> datetime.datetime:
-        return self.status_date('last_verified')
+        return self.state.verified
 
     def success(self) -> datetime.datetime:
-        return self.status_date('last_success')
+        return self.state.success
 
     def failure(self) -> datetime.datetime:
-        return self.status_date('last_failure')
+        return self.state.failure
 
     def numfails(self) -> int:
-        return int(self.status('failure_count', '0'))
+        return self.state.numfails
 
-    def run(self) -> pykube.Pod:
+    def pod_doc(self, batch: Optional[List[str]] = None) -> dict:
         """
-        run
+        pod_doc
+
+        Build the Pod definition for an item job from the spec details of
+        the appropriate OaatType object.
 
-        Execute an item job Pod with the spec details from the appropriate
-        OaatType object.
+        For a batch pod, which runs several items (this item first), batch
+        lists the items: they are passed to the pod, one per line, in the
+        OAAT_ITEMS environment variable and recorded in the
+        BATCH_ANNOTATION annotation.
+
+        For a group with runtimeDeadlineFactor, the pod is given an
+        activeDeadlineSeconds based on the predicted runtime of its items
+        (see deadline.py).
         """
         # TODO: check oaatType
         spec = self.group.oaattype.podspec()
@@ -67,6 +154,11 @@ class OaatItem:
             'name': 'OAAT_ITEM',
             'value': self.name
         })
+        if batch:
+            contspec['env'].append({
+                'name': 'OAAT_ITEMS',
+                'value': '\n'.join(batch)
+            })
         for idx in range(len(contspec.get('command', []))):
             contspec['command'][idx] = (
                 contspec['command'][idx].replace('%%oaat_item%%', self.name))
@@ -87,7 +179,8 @@ class OaatItem:
                 'labels': {
                     'parent-name': self.group.name,
                     'oaat-name': self.name,
-                    'app': 'oaat-operator'
+                    'app': 'oaat-operator',
+                    podgc.RUN_LABEL: podgc.run_id()
                 }
             },
             'spec': {
@@ -97,20 +190,88 @@ class OaatItem:
             },
         }
 
+        annotations = {}
+        if batch:
+            annotations[BATCH_ANNOTATION] = json.dumps(batch)
+        deadline = self.group.item_deadline(batch or [self.name])
+        if deadline is not None:
+            if spec.get('activeDeadlineSeconds'):
+                deadline = min(deadline, spec['activeDeadlineSeconds'])
+            doc['spec']['activeDeadlineSeconds'] = deadline
+            annotations[DEADLINE_ANNOTATION] = str(deadline)
+        if annotations:
+            doc['metadata']['annotations'] = annotations
+
         kopf.adopt(doc)
-        pod = pykube.Pod(self.group.api, doc)
+        return doc
 
-        # TODO: add retry logic to handle 409?
+    def job_doc(self, batch: Optional[List[str]] = None) -> dict:
+        """
+        job_doc
+
+        Build the Job definition for an item job (for an OaatType with
+        spec.type="job"): a single attempt (backoffLimit 0) at running the
+        Pod from pod_doc(), which Kubernetes deletes, along with the Job,
+        ttlSecondsAfterFinished after it finishes.
+        """
+        pod = self.pod_doc(batch)
+        metadata = pod['metadata']
+        template = {key: metadata[key] for key in ('labels', 'annotations')
+                    if key in metadata}
+        doc = {
+            'apiVersion': 'batch/v1',
+            'kind': 'Job',
+            'metadata': {
+                'generateName': metadata['generateName'],
+                **{key: dict(value) for key, value in template.items()},
+            },
+            'spec': {
+                **self.group.oaattype.jobspec(),
+                'backoffLimit': 0,
+                'template': {
+                    'metadata': template,
+                    'spec': pod['spec'],
+                },
+            },
+        }
+
+        kopf.adopt(doc)
+        return doc
+
+    async def run_async(self, batch: Optional[List[str]] = None
+                        ) -> pykube.objects.NamespacedAPIObject:
+        """
+        run_async
+
+        Execute an item job Pod (or, for spec.type="job", a Job) with the
+        spec details from the appropriate OaatType object. For a batch
+        pod, batch lists the items to run (see pod_doc()). For
+        spec.type="worker", the item is instead sent to the group's
+        worker pod (see worker.py), which is returned.
+        """
+        backend = self.group.oaattype.backend()
+        if backend == 'worker':
+            return await worker.dispatch_async(self, self.group.worker_pod)
+        if backend == 'job':
+            kind, doc = 'job', self.job_doc(batch)
+            resource, objtype = aioclient.JOB, pykube.Job
+        else:
+            kind, doc = 'pod', self.pod_doc(batch)
+            resource, objtype = aioclient.POD, pykube.Pod
+        namespace = doc['metadata'].get('namespace', self.group.namespace())
         try:
-            pod.create()
-        except pykube.exceptions.KubernetesError as exc:
+            created = await aioclient.create_object(
+                resource, namespace, doc, logger=self.group.logger)
+        except aioclient.APIError as exc:
             self.group.mark_item_failed(self.name)
             raise ProcessingComplete(
-                error=f'could not create pod {doc}: {exc}',
-                message=f'error creating pod for {self.name}')
+                error=f'could not create {kind} {doc}: {exc}',
+                message=f'error creating {kind} for {self.name}')
 
-        self.set_status('last_started', now().isoformat())
-        return pod
+        for name in batch or [self.name]:
+            self.group.set_item_status(name, 'last_started',
+                                       now().isoformat())
+        return objtype(self.group.api, created)
 
 
 class OaatItems:
@@ -121,14 +282,17 @@ class OaatItems:
                 f'obj should be dict, not {type(obj)}={obj}')
         self.obj = obj
         self.group = group
+        self._items: Dict[str, OaatItem] = {}
 
     def get(self, item_name) -> OaatItem:
-        return OaatItem(self.group, item_name)
+        if item_name not in self._items:
+            self._items[item_name] = OaatItem(self.group, item_name)
+        return self._items[item_name]
 
     def list(self) -> list:
         """Return the names of all items in a list."""
         return [
-            OaatItem(self.group, item_name)
+            self.get(item_name)
             for item_name in self.obj.get('spec', {}).get('oaatItems', [])
         ]
 
@@ -4,11 +4,21 @@ oaattype.py
 Class for managing OaatType kubernetes objects.
 """
 from __future__ import annotations
-from typing import Optional
+from typing import Any, Hashable, Mapping, Optional
 import pykube
 
+from oaatoperator.cache import get_oaattype
+from oaatoperator.client import get_api
 from oaatoperator.common import ProcessingComplete, KubeOaatType
 
+# mechanisms to run an item (spec.type)
+BACKENDS = ('pod', 'job', 'worker')
+# for spec.type="job": Jobs (and their pods) are deleted by Kubernetes
+# this long after they finish, unless spec.jobspec specifies otherwise
+DEFAULT_JOB_TTL = 12 * 3600
+# for spec.type="worker": the port the worker pod accepts items on
+DEFAULT_WORKER_PORT = 8080
+
 
 class OaatType:
     """
@@ -19,17 +29,33 @@ class OaatType:
 
     def __init__(self,
                  name: Optional[str],
-                 namespace: Optional[str] = None) -> None:
+                 namespace: Optional[str] = None,
+                 api: Optional[pykube.HTTPClient] = None,
+                 index: Optional[Mapping[Hashable, Any]] = None) -> None:
         self.name = str(name)
         self.namespace = namespace
         if name is None:
             raise ProcessingComplete(message='OaatType invalid',
                                      error=f'cannot find OaatType {self.name}')
-        self.api = pykube.HTTPClient(pykube.KubeConfig.from_env())
+        self.api = api if api is not None else get_api()
+        self.index = index
         self.obj = self.get_oaattype()
 
     def get_oaattype(self) -> dict:
-        """Retrieve the OaatType object."""
+        """
+        Retrieve the OaatType object.
+
+        Uses the oaattype index if one is available. kopf keeps the index
+        complete, so the API is only used when there is no index.
+        """
+        if self.index is not None:
+            cached = get_oaattype(self.index, self.namespace, self.name)
+            if cached is None:
+                raise ProcessingComplete(
+                    error=(f'cannot find OaatType '
+                           f'{self.namespace}/{self.name}'),
+                    message=f'error retrieving "{self.name}" OaatType object')
+            return cached
         try:
             return (
                 KubeOaatType
@@ -43,17 +69,25 @@ class OaatType:
                     f'{exc}'),
                 message=f'error retrieving "{self.name}" OaatType object')
 
-    def podspec(self) -> dict:
-        """Retrieve Pod specification from this OaatType."""
-        msg = 'error in OaatType definition'
+    def backend(self) -> str:
+        """Retrieve the mechanism used to run an item (pod or job)."""
         spec = self.obj.get('spec')
         if spec is None:
             raise ProcessingComplete(
-                message=msg,
+                message='error in OaatType definition',
                 error='missing spec in OaatType definition')
-        if spec.get('type', '') not in ('pod',):
-            raise ProcessingComplete(message=msg,
-                                     error='spec.type must be "pod"')
+        backend = spec.get('type', '')
+        if backend not in BACKENDS:
+            raise ProcessingComplete(
+                message='error in OaatType definition',
+                error='spec.type must be "pod", "job" or "worker"')
+        return backend
+
+    def podspec(self) -> dict:
+        """Retrieve Pod specification from this OaatType."""
+        msg = 'error in OaatType definition'
+        backend = self.backend()
+        spec = self.obj['spec']
         podspec = spec.get('podspec')
         if not podspec:
             raise ProcessingComplete(message=msg,
@@ -70,6 +104,48 @@ class OaatType:
         if podspec.get('restartPolicy'):
             raise ProcessingComplete(
                 message=msg,
-                error='for spec.type="pod", you cannot specify '
+                error=f'for spec.type="{backend}", you cannot specify '
                 'a restartPolicy')
         return podspec
+
+    def workerspec(self) -> dict:
+        """
+        Retrieve the worker settings from this OaatType (for
+        spec.type="worker"): spec.worker.port (default DEFAULT_WORKER_PORT).
+        """
+        msg = 'error in OaatType definition'
+        workerspec = self.obj.get('spec', {}).get('worker') or {}
+        for key in workerspec:
+            if key != 'port':
+                raise ProcessingComplete(
+                    message=msg,
+                    error=f'spec.worker.{key} is not supported')
+        port = workerspec.get('port', DEFAULT_WORKER_PORT)
+        if (not isinstance(port, int) or isinstance(port, bool)
+                or not 0 < port < 65536):
+            raise ProcessingComplete(
+                message=msg,
+                error='spec.worker.port must be a port number')
+        return {'port': port}
+
+    def jobspec(self) -> dict:
+        """
+        Retrieve the Job settings from this OaatType (for spec.type="job"):
+        spec.jobspec.ttlSecondsAfterFinished (default DEFAULT_JOB_TTL) and,
+        optionally, spec.jobspec.activeDeadlineSeconds.
+        """
+        msg = 'error in OaatType definition'
+        jobspec = self.obj.get('spec', {}).get('jobspec') or {}
+        minimum = {'ttlSecondsAfterFinished': 0, 'activeDeadlineSeconds': 1}
+        for key, value in jobspec.items():
+            if key not in minimum:
+                raise ProcessingComplete(
+                    message=msg,
+                    error=f'spec.jobspec.{key} is not supported')
+            if (not isinstance(value, int) or isinstance(value, bool)
+                    or value < minimum[key]):
+                raise ProcessingComplete(
+                    message=msg,
+                    error=f'spec.jobspec.{key} must be an integer of at '
+                    f'least {minimum[key]}')
+        return {'ttlSecondsAfterFinished': DEFAULT_JOB_TTL, **jobspec}
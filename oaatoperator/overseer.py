@@ -2,16 +2,40 @@
 overseer.py
 
 Overseer base class for Kopf object processing.
+
+Status fields and annotations are only added to the handler's patch when
+they differ from the object as kopf last saw it, so a handler which
+"sets" what is already there does not cause a write to the API server.
+
+Configuration (environment variables):
+- OAAT_COUNTER_FLUSH_EVERY: informational counters (such as the number of
+  timer loops in handler_status) are only written when something else in
+  the same status field changes, or when the counter has moved on by at
+  least this much since it was last written (default 1, i.e. always)
 """
+import os
 from typing_extensions import Unpack
 import kopf
 import pykube  # type: ignore
 from typing import Any, Optional, Type, cast
+from oaatoperator.client import get_api
 from oaatoperator.common import ProcessingComplete
+from oaatoperator.utility import UNCHANGED, patch_diff
 from oaatoperator.py_types import CallbackArgs, Spec
 from kopf._cogs.structs import bodies
 from kopf._cogs.helpers import typedefs
 
+DEFAULT_COUNTER_FLUSH_EVERY = 1
+
+
+def counter_flush_every() -> int:
+    """Amount an informational counter must move on to be written."""
+    try:
+        return max(1, int(os.environ.get('OAAT_COUNTER_FLUSH_EVERY',
+                                         DEFAULT_COUNTER_FLUSH_EVERY)))
+    except ValueError:
+        return DEFAULT_COUNTER_FLUSH_EVERY
+
 
 class Overseer:
     """
@@ -21,8 +45,12 @@ class Overseer:
 
     Inheriting class must set self.my_pykube_objtype
     """
+    # keys within status fields which are purely informational counters
+    # (see counter_flush_every())
+    _counters: dict[str, tuple[str, ...]] = {}
+
     def __init__(self, **kwargs: Unpack[CallbackArgs]) -> None:
-        self.api = pykube.HTTPClient(pykube.KubeConfig.from_env())
+        self.api = get_api()
         self.name = str(kwargs.get('name', ''))
         self.patch = kwargs.get('patch')
         self.status: Optional[bodies.Status] = kwargs.get('status')
@@ -75,8 +103,51 @@ class Overseer:
         # setting value to None will delete the state
         if self.patch is None:
             raise kopf.PermanentError('kopf error: patch is None')
+        current = self.status.get(state) if self.status is not None else None
+        diff = self._counter_diff(state, current, patch_diff(current, value))
+        if diff is UNCHANGED:
+            # drop any earlier change to this field in the same handler
+            self._drop_pending('status', state)
+            return
         self.patch.setdefault('status', {})
-        self.patch['status'][state] = value
+        self.patch['status'][state] = diff
+
+    def _drop_pending(self, *path: str) -> None:
+        """
+        Remove a change from the patch, along with any sections left empty
+        (kopf would otherwise still send the patch).
+        """
+        assert self.patch is not None
+        parents = [self.patch]
+        for key in path[:-1]:
+            section = parents[-1].get(key)
+            if not isinstance(section, dict):
+                return
+            parents.append(section)
+        parents[-1].pop(path[-1], None)
+        for parent, key in zip(reversed(parents[:-1]), reversed(path[:-1])):
+            if parent[key]:
+                break
+            del parent[key]
+
+    def _counter_diff(self, state: str, current: Any, diff: Any) -> Any:
+        """
+        Treat a change of only informational counters in a status field as
+        no change, until one has moved on by counter_flush_every().
+        """
+        counters = self._counters.get(state)
+        if not counters or not isinstance(diff, dict) or not diff:
+            return diff
+        if not set(diff).issubset(counters):
+            return diff
+        flush_every = counter_flush_every()
+        for key in diff:
+            try:
+                if abs(diff[key] - current[key]) >= flush_every:
+                    return diff
+            except (TypeError, KeyError):
+                return diff
+        return UNCHANGED
 
     def set_object_status(self,
                           value: Optional[dict[str, Any]] = None) -> None:
@@ -123,12 +194,17 @@ class Overseer:
             value = str(value)
         if self.patch is None:
             raise kopf.PermanentError('kopf error: patch is None')
+        key = f'oaatoperator.kawaja.net/{annotation}'
+        current = (self.meta or {}).get('annotations', {}).get(key)
+        if current == value:
+            self._drop_pending('metadata', 'annotations', key)
+            return
         (
             self
             .patch
             .setdefault('metadata', {})
             .setdefault('annotations', {})
-            [f'oaatoperator.kawaja.net/{annotation}']) = value
+            [key]) = value
         if value:
             self.debug(f'added annotation {annotation}={value} to {self.name}')
         else:
@@ -1,15 +1,20 @@
 """
 pod.py
 
-Overseer object for managing Pod objects.
+Overseer objects for managing Pod (and Job) objects.
 """
 import datetime
+import json
+import kopf
 import pykube
-from typing import Optional
+from typing import Callable, Dict, List, NoReturn, Optional, Tuple
 
+from oaatoperator import aioclient
+from oaatoperator.job import job_condition
+from oaatoperator.oaatitem import BATCH_ANNOTATION, batch_items
 from oaatoperator.utility import date_from_isostr, now
 from oaatoperator.oaatgroup import OaatGroup
-from oaatoperator.common import ProcessingComplete
+from oaatoperator.common import ProcessingComplete, KubeOaatGroup
 from oaatoperator.overseer import Overseer
 
 
@@ -27,6 +32,7 @@ class PodOverseer(Overseer):
         self.my_pykube_objtype = pykube.Pod
         self.exitcode = -1
         self.reason: Optional[str] = None
+        self.message: Optional[str] = None
         self.finished_at: Optional[datetime.datetime] = None
         self.started_at: Optional[datetime.datetime] = None
         self.memo = kwargs['memo']
@@ -44,6 +50,7 @@ class PodOverseer(Overseer):
             terminated = (containerstatus.get('state', {}).get('terminated'))
             if terminated:
                 self.exitcode = terminated.get('exitCode', -1)
+                self.message = terminated.get('message')
                 self.finished_at = date_from_isostr(
                     terminated.get('finishedAt'))
                 # Extract startedAt for runtime calculation
@@ -59,16 +66,90 @@ class PodOverseer(Overseer):
                 f'unable to determine termination time for {self.name}')
             self.finished_at = now()
 
-    def update_failure_status(self) -> None:
+    def batch_items(self) -> List[str]:
         """
-        update_failure_status
+        The items run by the Pod: those listed in its BATCH_ANNOTATION
+        annotation for a batch pod, otherwise its oaat-name.
+        """
+        items = batch_items(self.meta)
+        if items is not None:
+            return items
+        if self.meta.get('annotations', {}).get(BATCH_ANNOTATION):
+            self.warning(f'ignoring invalid {BATCH_ANNOTATION} annotation '
+                         f'on {self.name}')
+        return [self.get_label('oaat-name', 'unknown')]
 
-        Update status of parent object with details of an
-        execution failure for the current Pod.
+    def item_results(self) -> Optional[Dict[str, Tuple[int, Optional[float]]]]:
+        """
+        The result of each item reported by a batch pod in its termination
+        message: a JSON object mapping each item run to its exit code, or
+        to an object with "exitCode" and (optionally) "runtime" in
+        seconds. Returns {item: (exit code, runtime)}, or None if the
+        pod did not report results (when its exit code applies to all
+        of its items).
         """
-        item_name = self.get_label('oaat-name', 'unknown')
         self._retrieve_terminated()
-        oaatgroup = self.get_parent()
+        if not self.message:
+            return None
+        try:
+            reported = json.loads(self.message)
+        except ValueError:
+            reported = None
+        if not isinstance(reported, dict):
+            self.warning(f'ignoring invalid results from {self.name}')
+            return None
+        results: Dict[str, Tuple[int, Optional[float]]] = {}
+        for item_name, result in reported.items():
+            if isinstance(result, dict):
+                runtime = result.get('runtime')
+                result = result.get('exitCode', -1)
+            else:
+                runtime = None
+            if isinstance(result, bool) or not isinstance(result, int):
+                result = -1
+            if isinstance(runtime, bool) or not isinstance(runtime,
+                                                           (int, float)):
+                runtime = None
+            results[item_name] = (result, runtime)
+        return results
+
+    def _mark_batch(self, oaatgroup: OaatGroup) -> NoReturn:
+        """Record the result of each of the items run by a batch pod."""
+        results = self.item_results()
+        succeeded: List[str] = []
+        failed: List[str] = []
+        for item_name in self.batch_items():
+            if results is None:
+                exitcode, runtime = self.exitcode, None
+            elif item_name in results:
+                exitcode, runtime = results[item_name]
+            else:
+                # not reported: presumably not run, so still a candidate
+                continue
+            if exitcode == 0:
+                started_at = None
+                if runtime is not None and self.finished_at is not None:
+                    started_at = (self.finished_at
+                                  - datetime.timedelta(seconds=runtime))
+                if oaatgroup.mark_item_success(item_name,
+                                               finished_at=self.finished_at,
+                                               started_at=started_at):
+                    succeeded.append(item_name)
+            elif oaatgroup.mark_item_failed(item_name,
+                                            finished_at=self.finished_at,
+                                            exit_code=exitcode):
+                failed.append(item_name)
+        message = (f'batch pod {self.name}: items succeeded: '
+                   f'{", ".join(succeeded) or "none"}, items failed: '
+                   f'{", ".join(failed) or "none"}')
+        if failed:
+            raise ProcessingComplete(error=message, message=message)
+        raise ProcessingComplete(message=message)
+
+    def _mark_failed(self, oaatgroup: OaatGroup) -> NoReturn:
+        if len(self.batch_items()) > 1:
+            self._mark_batch(oaatgroup)
+        item_name = self.get_label('oaat-name', 'unknown')
         if oaatgroup.mark_item_failed(
                 item_name,
                 finished_at=self.finished_at,
@@ -81,16 +162,10 @@ class PodOverseer(Overseer):
         raise ProcessingComplete(
             message=f'ignoring old failed job pod={self.name}')
 
-    def update_success_status(self) -> None:
-        """
-        update_success_status
-
-        Update status of parent object with details of an
-        execution success for the current Pod.
-        """
+    def _mark_succeeded(self, oaatgroup: OaatGroup) -> NoReturn:
+        if len(self.batch_items()) > 1:
+            self._mark_batch(oaatgroup)
         item_name = self.get_label('oaat-name', 'unknown')
-        self._retrieve_terminated()
-        oaatgroup = self.get_parent()
         if oaatgroup.mark_item_success(item_name,
                                        finished_at=self.finished_at,
                                        started_at=self.started_at):
@@ -98,20 +173,91 @@ class PodOverseer(Overseer):
         raise ProcessingComplete(
             message=f'ignoring old successful job pod={self.name}')
 
-    def update_phase(self) -> None:
-        item_name = self.get_label('oaat-name', 'unknown')
-        self.get_parent().set_item_status(item_name, 'podphase', self.phase)
+    def _set_phase(self, oaatgroup: OaatGroup) -> NoReturn:
+        for item_name in self.batch_items():
+            oaatgroup.set_item_status(item_name, 'podphase', self.phase)
         raise ProcessingComplete(
             message=f'updating phase for pod {self.name}: '
             f'new phase={self.phase}')
 
-    def get_parent(self) -> OaatGroup:
+    async def _update_parent_async(
+            self,
+            update: Callable[[OaatGroup], NoReturn]) -> NoReturn:
+        """
+        Retrieve the parent, apply update() to it and write the resulting
+        status changes as a single patch, using the async API client.
+        """
+        oaatgroup = await self.get_parent_async()
+        await oaatgroup.load_item_state_async(self.batch_items())
+        with oaatgroup.collect_status() as status:
+            try:
+                update(oaatgroup)
+            finally:
+                await oaatgroup.write_status_async(status)
+                await oaatgroup.write_item_state_async()
+
+    async def update_failure_status_async(self) -> None:
+        """
+        update_failure_status_async
+
+        Update status of parent object with details of an
+        execution failure for the current Pod.
+        """
+        self._retrieve_terminated()
+        await self._update_parent_async(self._mark_failed)
+
+    async def update_success_status_async(self) -> None:
+        """
+        update_success_status_async
+
+        Update status of parent object with details of an
+        execution success for the current Pod.
+        """
+        self._retrieve_terminated()
+        await self._update_parent_async(self._mark_succeeded)
+
+    def reconcile(self, oaatgroup: OaatGroup) -> NoReturn:
+        """
+        Apply the current state of the Pod to its parent: the completion
+        of a Succeeded or Failed pod, otherwise its phase.
+        """
+        if self.phase == 'Succeeded':
+            self._retrieve_terminated()
+            self._mark_succeeded(oaatgroup)
+        if self.phase == 'Failed':
+            self._retrieve_terminated()
+            self._mark_failed(oaatgroup)
+        self._set_phase(oaatgroup)
+
+    async def update_phase_async(self) -> None:
+        """Record the phase of the Pod in its parent."""
+        await self._update_parent_async(self._set_phase)
+
+    async def get_parent_async(self) -> OaatGroup:
         """Retrieve the Pod's parent from the parent-name label."""
+        name = self.meta.get('labels', {}).get('parent-name')
+        try:
+            body = await aioclient.get_object(
+                aioclient.OAATGROUP, self.namespace, name, logger=self.logger)
+        except aioclient.APINotFoundError as exc:
+            raise kopf.TemporaryError(f'cannot find Object {name}: {exc}')
         return OaatGroup(
-            kube_object_name=self.meta.get('labels', {}).get('parent-name'),
+            kube_object_name=name,
+            kube_object=KubeOaatGroup(self.api, body),
             memo=self.memo,
             logger=self.logger)
 
+    async def delete_async(self) -> None:
+        """Delete the Pod, using the async API client."""
+        try:
+            await aioclient.delete_object(
+                aioclient.POD, self.namespace, self.name, logger=self.logger)
+            self.debug(f'delete of {self.name} successful')
+        except aioclient.APIError as exc:
+            raise ProcessingComplete(
+                error=f'cannot delete Object {self.name}: {exc}',
+                message=f'cannot delete "{self.name}" object')
+
     def handle_processing_complete(self,
                                    exc: ProcessingComplete) -> Optional[dict]:
         if 'info' in exc.ret:
@@ -123,3 +269,66 @@ class PodOverseer(Overseer):
         if 'message' in exc.ret:
             self.info(exc.ret['message'])
         return None
+
+
+class JobOverseer(PodOverseer):
+    """
+    JobOverseer
+
+    Manager for Job objects.
+
+    Initialise with the kwargs for a Job kopf handler. The Job's phase is
+    presented as for a Pod ('Succeeded' or 'Failed' once the Job has
+    finished, otherwise 'Running'), so the completion of the Job's item is
+    recorded as for a Pod, from the Job status.
+    """
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.my_pykube_objtype = pykube.Job
+        self.condition = job_condition(kwargs['status'])
+        if self.condition is None:
+            self.phase = 'Running'
+        elif self.condition['type'] == 'Complete':
+            self.phase = 'Succeeded'
+        else:
+            self.phase = 'Failed'
+
+    def _retrieve_terminated(self) -> None:
+        started = self.get_status('startTime')
+        self.started_at = date_from_isostr(started) if started else None
+        condition = self.condition or {}
+        self.exitcode = 0 if self.phase == 'Succeeded' else -1
+        self.reason = condition.get('reason')
+        finished = (self.get_status('completionTime')
+                    or condition.get('lastTransitionTime'))
+        if finished:
+            self.finished_at = date_from_isostr(finished)
+        else:
+            self.warning(
+                f'unable to determine termination time for {self.name}')
+            self.finished_at = now()
+
+
+async def reconcile_pods_async(
+        pods: List[PodOverseer]) -> Optional[OaatGroup]:
+    """
+    Reconcile a number of pods with their (common) parent, retrieving the
+    parent once and writing the resulting status changes as a single
+    patch. Returns the parent (None if there are no pods).
+    """
+    if not pods:
+        return None
+    oaatgroup = await pods[0].get_parent_async()
+    await oaatgroup.load_item_state_async(
+        [item_name for pod in pods for item_name in pod.batch_items()])
+    with oaatgroup.collect_status() as status:
+        try:
+            for pod in pods:
+                try:
+                    pod.reconcile(oaatgroup)
+                except ProcessingComplete as exc:
+                    pod.handle_processing_complete(exc)
+        finally:
+            await oaatgroup.write_status_async(status)
+            await oaatgroup.write_item_state_async()
+    return oaatgroup
@@ -0,0 +1,131 @@
+"""
+podgc.py
+
+Garbage collection of completed item pods.
+
+Which completed (Succeeded or Failed) pods an OaatGroup keeps is set in
+its spec:
+- podRetention: how long after finishing a pod is kept (default 12h)
+- podRetentionCount: the number of most recent completed pods kept for
+  each item, however recently they finished (default: no limit)
+
+Pods are deleted with collection deletes: each pod is labelled with a
+run identifier (RUN_LABEL) when it is created, so the pods to delete for
+an OaatGroup can be selected exactly, DELETE_BATCH at a time. Pods
+created before the label was added are deleted individually.
+"""
+import datetime
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+import kopf
+from kopf._cogs.helpers import typedefs
+
+from oaatoperator import aioclient
+from oaatoperator.utility import date_from_isostr, now, parse_duration
+
+RUN_LABEL = 'oaat-run'
+DEFAULT_MAX_AGE = datetime.timedelta(hours=12)
+# number of pods selected by each collection delete (the selector is part
+# of the URL, so this bounds its length)
+DELETE_BATCH = 100
+COMPLETED_PHASES = ('Succeeded', 'Failed')
+
+
+def run_id() -> str:
+    """Value of RUN_LABEL for a new pod."""
+    return now().strftime('%Y%m%d%H%M%S%f')
+
+
+def retention_settings(spec: Mapping[str, Any],
+                       name: str) -> Tuple[datetime.timedelta, Optional[int]]:
+    """
+    Validate the pod retention settings of an OaatGroup spec.
+
+    Returns (maximum age, number to keep per item or None).
+    """
+    max_age = DEFAULT_MAX_AGE
+    if 'podRetention' in spec:
+        max_age = parse_duration(str(spec['podRetention']))
+        if max_age is None:
+            raise kopf.PermanentError(
+                f'invalid podRetention {spec["podRetention"]} in {name}')
+    keep = spec.get('podRetentionCount')
+    if keep is not None and (not isinstance(keep, int)
+                             or isinstance(keep, bool) or keep < 0):
+        raise kopf.PermanentError(
+            f'invalid podRetentionCount {keep} in {name}')
+    return max_age, keep
+
+
+def finished_at(pod: Mapping[str, Any]) -> datetime.datetime:
+    """When a completed pod finished (or started, if that is unknown)."""
+    status = pod.get('status', {})
+    finished = [
+        date_from_isostr(containerstatus.get('state', {})
+                         .get('terminated', {}).get('finishedAt', ''))
+        for containerstatus in status.get('containerStatuses', [])
+    ]
+    return max(finished or [date_from_isostr(status.get('startTime', ''))])
+
+
+def expired_pods(pods: List[Dict[str, Any]],
+                 max_age: datetime.timedelta,
+                 keep: Optional[int] = None,
+                 at: Optional[datetime.datetime] = None) -> List[dict]:
+    """
+    The completed pods to delete: those which finished more than max_age
+    ago and, if keep is set, those beyond the keep most recent for their
+    item.
+    """
+    at = now() if at is None else at
+    by_item: Dict[str, List[dict]] = {}
+    for pod in pods:
+        if pod.get('status', {}).get('phase') in COMPLETED_PHASES:
+            item = pod.get('metadata', {}).get('labels', {}).get('oaat-name')
+            by_item.setdefault(str(item), []).append(pod)
+    expired = []
+    for item_pods in by_item.values():
+        item_pods.sort(key=finished_at, reverse=True)
+        for position, pod in enumerate(item_pods):
+            if ((keep is not None and position >= keep)
+                    or at - finished_at(pod) > max_age):
+                expired.append(pod)
+    return expired
+
+
+async def delete_pods(namespace: Optional[str], parent: str,
+                      pods: List[Dict[str, Any]],
+                      *, logger: typedefs.Logger) -> int:
+    """
+    Delete completed pods of an OaatGroup, using as few API calls as
+    possible. Returns the number of API calls made.
+    """
+    runs = []
+    calls = 0
+    for pod in pods:
+        metadata = pod.get('metadata', {})
+        run = metadata.get('labels', {}).get(RUN_LABEL)
+        if run:
+            runs.append(run)
+            continue
+        try:
+            calls += 1
+            await aioclient.delete_object(
+                aioclient.POD, namespace, metadata.get('name'), logger=logger)
+        except aioclient.APINotFoundError:
+            pass
+    for start in range(0, len(runs), DELETE_BATCH):
+        batch = ','.join(runs[start:start + DELETE_BATCH])
+        calls += 1
+        await aioclient.delete_collection(
+            aioclient.POD, namespace,
+            label_selector=(f'app=oaat-operator,parent-name={parent},'
+                            f'{RUN_LABEL} in ({batch})'),
+            field_selector=','.join(
+                f'status.phase!={phase}'
+                for phase in ('Pending', 'Running', 'Unknown')),
+            logger=logger)
+    if pods:
+        logger.info(f'deleted {len(pods)} completed pods of {parent} '
+                    f'with {calls} API calls')
+    return calls
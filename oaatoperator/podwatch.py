@@ -0,0 +1,592 @@
+"""
+podwatch.py
+
+Watch of the operator's own pods.
+
+kopf filters the objects its handlers see by label client-side, so pod
+handlers restricted to oaat-operator pods still have kopf receive and
+decode the events of every pod in the cluster. Instead, the pods are
+watched here with a server-side label selector, and the events are
+dispatched in-process to the pod handlers registered with on_change()
+(see handlers.py). The handlers are called with the same kwargs as kopf
+would provide, except that their logger only logs locally (rather than
+also posting Kubernetes events).
+
+Pods are dispatched in the background, DISPATCH_CONCURRENCY at a time
+(as kopf runs the handlers of different objects concurrently), so a slow
+OaatGroup does not hold up the watch; the changes of each pod are
+dispatched in order. A handler which fails with a temporary error is
+retried with backoff, and if it still fails the pod is dispatched again
+on its next event or relisting, even if its phase has not changed.
+
+The watch also maintains the pod index (see cache.py), in the same shape
+as a kopf index, so OaatGroup handlers can find running pods without
+listing them from the API. The index keeps enough of each pod (its phase,
+creation time, why it is waiting or how it terminated, and the operator's
+annotations) to act on it.
+
+The pods are first listed by the background task which watches them, as
+kopf has not yet logged in to the API when startup handlers run. Until
+then pod_index() is None, and OaatGroup handlers list running pods from
+the API instead.
+
+Once the pods are first listed, and every SWEEP_INTERVAL after that, the
+on_sweep() handler is called once for each OaatGroup which has pods,
+with the pods from the index, as a safety net in case a phase change was
+missed. This takes the place of kopf's resume handlers and per-pod
+timers, so the operator holds no per-pod tasks, however many completed
+pods are retained.
+
+An unexpected error in the watch is logged and the pods listed again. If
+the watch task ends anyway, the operator is stopped (so it is restarted)
+rather than left running without its pod handlers.
+
+watch_stats counts the events received from the API and those handled,
+and is logged after each sweep, along with the hit/miss counts of the
+OaatType and pod caches.
+"""
+import asyncio
+import logging
+import os
+import signal
+from collections.abc import Mapping
+from functools import partial
+from typing import (Any, Awaitable, Callable, Dict, Iterator, List,
+                    NamedTuple, Optional, Set, Tuple)
+
+import aiohttp
+import kopf
+
+from oaatoperator import aioclient
+from oaatoperator.cache import oaattype_stats, pod_key, pod_stats
+
+# only pods created by the operator for an OaatGroup
+SELECTOR = 'app=oaat-operator,parent-name'
+# the operator's own annotations are kept in the pod index
+ANNOTATION_PREFIX = 'oaatoperator.kawaja.net/'
+SWEEP_INTERVAL = 0.5 * 3600
+# number of pods (or groups, for a sweep) dispatched to handlers
+# concurrently
+DISPATCH_CONCURRENCY = 10
+# delay before re-establishing the watch after an error
+RETRY_DELAY = 5.0
+# attempts made to call a pod handler which fails with a temporary error,
+# waiting DISPATCH_BACKOFF seconds before the first retry, doubling after
+DISPATCH_ATTEMPTS = 3
+DISPATCH_BACKOFF = 1.0
+TEMPORARY_ERRORS = (kopf.TemporaryError, aioclient.APIError,
+                    aiohttp.ClientError, asyncio.TimeoutError)
+
+Handler = Callable[..., Awaitable[Any]]
+Predicate = Callable[..., bool]
+PodRef = Tuple[Optional[str], str]
+
+
+class WatchStats:
+    """Counters for the pod watch."""
+    def __init__(self) -> None:
+        self.received = 0
+        self.handled = 0
+        self.listings = 0
+        self.sweeps = 0
+
+    def reset(self) -> None:
+        self.received = 0
+        self.handled = 0
+        self.listings = 0
+        self.sweeps = 0
+
+    def __str__(self) -> str:
+        return (f'pod watch: received={self.received}, '
+                f'handled={self.handled}, listings={self.listings}, '
+                f'sweeps={self.sweeps}')
+
+
+watch_stats = WatchStats()
+
+
+class PodIndex(Mapping):
+    """
+    Minimal copies of the watched pods, keyed by (namespace, parent-name,
+    phase) as for the kopf pod index (see cache.py).
+    """
+    def __init__(self) -> None:
+        self._pods: Dict[tuple, Dict[PodRef, dict]] = {}
+        self._keys: Dict[PodRef, tuple] = {}
+
+    def __getitem__(self, key: tuple) -> List[dict]:
+        return list(self._pods[key].values())
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self._pods)
+
+    def __len__(self) -> int:
+        return len(self._pods)
+
+    def refs(self) -> List[PodRef]:
+        return list(self._keys)
+
+    def by_group(self) -> Dict[Tuple[Optional[str], str], List[dict]]:
+        """The pods, grouped by (namespace, parent-name)."""
+        groups: Dict[Tuple[Optional[str], str], List[dict]] = {}
+        for (namespace, parent, _), pods in self._pods.items():
+            groups.setdefault((namespace, parent), []).extend(pods.values())
+        return groups
+
+    def phase(self, ref: PodRef) -> Optional[str]:
+        key = self._keys.get(ref)
+        return key[2] if key else None
+
+    def store(self, ref: PodRef, key: tuple, entry: dict) -> None:
+        self.discard(ref)
+        self._pods.setdefault(key, {})[ref] = entry
+        self._keys[ref] = key
+
+    def discard(self, ref: PodRef) -> None:
+        key = self._keys.pop(ref, None)
+        if key is None:
+            return
+        del self._pods[key][ref]
+        if not self._pods[key]:
+            del self._pods[key]
+
+    def clear(self) -> None:
+        self._pods.clear()
+        self._keys.clear()
+
+
+index = PodIndex()
+
+
+class Registration(NamedTuple):
+    """A registered handler, and the when= predicate filtering its calls."""
+    fn: Handler
+    when: Optional[Predicate]
+
+
+_on_change: List[Registration] = []
+_on_sweep: List[Handler] = []
+_listed = False
+_task: Optional[asyncio.Task] = None
+# pods whose handlers failed, to be dispatched again
+_undispatched: Set[PodRef] = set()
+
+
+def on_change(*, when: Optional[Predicate] = None) -> Callable:
+    """Register a handler for a change to a pod's phase."""
+    def decorator(fn: Handler) -> Handler:
+        _on_change.append(Registration(fn, when))
+        return fn
+    return decorator
+
+
+def on_sweep() -> Callable:
+    """
+    Register a handler for the sweep, called with the namespace, name
+    and pods of each OaatGroup.
+    """
+    def decorator(fn: Handler) -> Handler:
+        _on_sweep.append(fn)
+        return fn
+    return decorator
+
+
+def pod_index() -> Optional[Mapping]:
+    """The pod index, or None if the pods have not been listed."""
+    return index if _listed else None
+
+
+def index_entry(body: dict) -> Tuple[tuple, dict]:
+    """Key and minimal copy of a pod, for the pod index."""
+    metadata = body.get('metadata', {})
+    labels = metadata.get('labels', {})
+    status = body.get('status', {})
+    phase = status.get('phase', 'unknown')
+    entry = {
+        'apiVersion': 'v1',
+        'kind': 'Pod',
+        'metadata': {
+            'name': metadata.get('name'),
+            'namespace': metadata.get('namespace'),
+            'uid': metadata.get('uid'),
+            'creationTimestamp': metadata.get('creationTimestamp'),
+            'labels': dict(labels),
+            'annotations': {
+                key: value
+                for key, value in (metadata.get('annotations') or {}).items()
+                if key.startswith(ANNOTATION_PREFIX)},
+        },
+        'status': {
+            'phase': phase,
+            'startTime': status.get('startTime', ''),
+        },
+    }
+    containerstatuses = [
+        {'state': {state: {
+            key: containerstatus['state'][state][key]
+            for key in ('exitCode', 'reason', 'message', 'startedAt',
+                        'finishedAt')
+            if key in containerstatus['state'][state]}}}
+        for containerstatus in status.get('containerStatuses', [])
+        for state in ('terminated', 'waiting')
+        if containerstatus.get('state', {}).get(state)
+    ]
+    if containerstatuses:
+        entry['status']['containerStatuses'] = containerstatuses
+    unscheduled = [
+        {key: condition[key] for key in ('type', 'status', 'reason')
+         if key in condition}
+        for condition in status.get('conditions', [])
+        if condition.get('type') == 'PodScheduled'
+        and condition.get('status') == 'False'
+    ]
+    if unscheduled:
+        entry['status']['conditions'] = unscheduled
+    return pod_key(metadata.get('namespace'), labels['parent-name'],
+                   phase), entry
+
+
+def _ref(body: dict) -> PodRef:
+    metadata = body.get('metadata', {})
+    return (metadata.get('namespace'), metadata.get('name', ''))
+
+
+def handler_kwargs(raw: dict, reason: str,
+                   settings: kopf.OperatorSettings) -> Dict[str, Any]:
+    """Build the kwargs for a pod handler, as kopf would."""
+    body = kopf.Body(raw)
+    return {
+        'body': body,
+        'meta': body.meta,
+        'spec': body.spec,
+        'status': body.status,
+        'labels': body.metadata.labels,
+        'annotations': body.metadata.annotations,
+        'name': body.metadata.name,
+        'namespace': body.metadata.namespace,
+        'uid': body.metadata.uid,
+        'patch': kopf.Patch(),
+        'reason': reason,
+        'diff': (),
+        'logger': kopf.LocalObjectLogger(body=body, settings=settings),
+        'memo': kopf.Memo(),
+        'settings': settings,
+    }
+
+
+async def _call(registration: Registration, kwargs: Dict[str, Any]) -> bool:
+    """
+    Call a handler, retrying temporary errors with backoff. Returns False
+    if it still fails with a temporary error.
+    """
+    name = registration.fn.__name__
+    error: Optional[Exception] = None
+    for attempt in range(DISPATCH_ATTEMPTS):
+        if error is not None:
+            delay = DISPATCH_BACKOFF * 2 ** (attempt - 1)
+            kwargs['logger'].warning(
+                f'{name} failed: {error!r}, retrying in {delay}s')
+            await asyncio.sleep(delay)
+        try:
+            await registration.fn(**kwargs)
+            return True
+        except TEMPORARY_ERRORS as exc:
+            error = exc
+        except Exception as exc:
+            kwargs['logger'].exception(f'{name} failed: {exc!r}')
+            return True
+    kwargs['logger'].error(f'{name} failed: {error!r}')
+    return False
+
+
+async def call_handlers(kwargs: Dict[str, Any],
+                        registrations: List[Registration],
+                        resource: tuple) -> Tuple[bool, bool]:
+    """
+    Call each of the registered handlers which apply to an object, then
+    apply their patch to it (as kopf would). Returns whether any handler
+    applied, and whether all succeeded (a handler or the patch failing
+    with a temporary error means the object should be dispatched again).
+    """
+    handled = False
+    succeeded = True
+    for registration in registrations:
+        if registration.when is not None and not registration.when(**kwargs):
+            continue
+        handled = True
+        succeeded = await _call(registration, kwargs) and succeeded
+    if kwargs['patch']:
+        try:
+            await aioclient.patch_object(
+                resource, kwargs['namespace'], kwargs['name'],
+                dict(kwargs['patch']), logger=kwargs['logger'])
+        except TEMPORARY_ERRORS as exc:
+            kwargs['logger'].error(f'cannot patch {kwargs["name"]}: {exc!r}')
+            succeeded = False
+    return handled, succeeded
+
+
+async def dispatch(raw: dict, registrations: List[Registration],
+                   reason: str, settings: kopf.OperatorSettings) -> bool:
+    """
+    Call each of the registered handlers which apply to the pod,
+    returning whether any did. If a handler fails with a temporary error,
+    the pod is marked to be dispatched again.
+    """
+    handled, succeeded = await call_handlers(
+        handler_kwargs(raw, reason, settings), registrations, aioclient.POD)
+    if succeeded:
+        _undispatched.discard(_ref(raw))
+    else:
+        _undispatched.add(_ref(raw))
+    return handled
+
+
+class Dispatcher:
+    """
+    Dispatches pods to the on_change() handlers in the background, at
+    most DISPATCH_CONCURRENCY at a time (submit() waits until there is
+    room). Changes to the same pod are dispatched in the order submitted.
+    """
+    def __init__(self) -> None:
+        self.semaphore = asyncio.Semaphore(DISPATCH_CONCURRENCY)
+        self.tasks: Dict[PodRef, asyncio.Task] = {}
+
+    async def submit(self, raw: dict,
+                     settings: kopf.OperatorSettings) -> None:
+        await self.semaphore.acquire()
+        ref = _ref(raw)
+        task = asyncio.create_task(
+            self._dispatch(raw, settings, self.tasks.get(ref)))
+        self.tasks[ref] = task
+        task.add_done_callback(partial(self._done, ref))
+
+    async def _dispatch(self, raw: dict, settings: kopf.OperatorSettings,
+                        previous: Optional[asyncio.Task]) -> None:
+        try:
+            if previous is not None and not previous.done():
+                await asyncio.wait([previous])
+            if await dispatch(raw, _on_change, 'phase', settings):
+                watch_stats.handled += 1
+        finally:
+            self.semaphore.release()
+
+    def _done(self, ref: PodRef, task: asyncio.Task) -> None:
+        if self.tasks.get(ref) is task:
+            del self.tasks[ref]
+
+    async def drain(self) -> None:
+        """Wait until the pods submitted have been dispatched."""
+        while self.tasks:
+            await asyncio.wait(list(self.tasks.values()))
+
+    def cancel(self) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+
+
+_dispatcher: Optional[Dispatcher] = None
+
+
+def dispatcher() -> Dispatcher:
+    """The dispatcher of pod changes, created when first needed."""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = Dispatcher()
+    return _dispatcher
+
+
+async def handle_event(event: dict,
+                       settings: kopf.OperatorSettings) -> None:
+    """
+    Update the pod index for a watch event, and submit the pod to be
+    dispatched if its phase has changed (or its handlers failed).
+    """
+    raw = event.get('object', {})
+    ref = _ref(raw)
+    watch_stats.received += 1
+    if event.get('type') == 'DELETED':
+        index.discard(ref)
+        _undispatched.discard(ref)
+        return
+    previous = index.phase(ref)
+    index.store(ref, *index_entry(raw))
+    if previous == _phase(raw) and ref not in _undispatched:
+        return
+    await dispatcher().submit(raw, settings)
+
+
+def _phase(raw: dict) -> str:
+    return raw.get('status', {}).get('phase', 'unknown')
+
+
+async def list_pods(settings: kopf.OperatorSettings,
+                    logger: logging.Logger) -> Tuple[List[dict], str]:
+    """
+    List the pods, replacing the contents of the pod index. Returns the
+    pods and the resource version to watch from.
+    """
+    global _listed
+    result = await aioclient.api.get(
+        aioclient.url(aioclient.POD, None,
+                      query={'labelSelector': SELECTOR}),
+        settings=settings, logger=logger)
+    pods = result.get('items', [])
+    index.clear()
+    for raw in pods:
+        index.store(_ref(raw), *index_entry(raw))
+    _undispatched.intersection_update(index.refs())
+    _listed = True
+    watch_stats.listings += 1
+    watch_stats.received += len(pods)
+    return pods, result.get('metadata', {}).get('resourceVersion', '')
+
+
+async def relist(settings: kopf.OperatorSettings,
+                 logger: logging.Logger) -> str:
+    """
+    List the pods again (when the watch has fallen too far behind to
+    continue), and submit those whose phase has changed since they were
+    last seen (or whose handlers failed) to be dispatched. Returns the
+    resource version to watch from.
+    """
+    previous = {ref: index.phase(ref) for ref in index.refs()}
+    pods, resource_version = await list_pods(settings, logger)
+    for raw in pods:
+        ref = _ref(raw)
+        if previous.get(ref) != _phase(raw) or ref in _undispatched:
+            await dispatcher().submit(raw, settings)
+    return resource_version
+
+
+async def sweep(settings: kopf.OperatorSettings,
+                logger: logging.Logger) -> None:
+    """Call the sweep handlers for each OaatGroup, a few at a time."""
+    semaphore = asyncio.Semaphore(DISPATCH_CONCURRENCY)
+
+    async def one(namespace: Optional[str], parent: str,
+                  pods: List[dict]) -> None:
+        async with semaphore:
+            for fn in _on_sweep:
+                try:
+                    await fn(namespace=namespace, name=parent, pods=pods,
+                             settings=settings, logger=logger)
+                except Exception as exc:
+                    logger.error(f'{fn.__name__} failed for '
+                                 f'{namespace}/{parent}: {exc!r}')
+
+    await asyncio.gather(*(one(namespace, parent, pods) for
+                           (namespace, parent), pods in
+                           index.by_group().items()))
+    watch_stats.sweeps += 1
+    logger.info(str(watch_stats))
+    logger.info(str(oaattype_stats))
+    logger.info(str(pod_stats))
+
+
+async def watch_pods(settings: kopf.OperatorSettings,
+                     logger: logging.Logger,
+                     resource_version: str,
+                     timeout: float) -> Optional[str]:
+    """
+    Watch the pods from resource_version for up to timeout seconds,
+    returning the resource version to continue from, or None if the pods
+    need to be listed again.
+    """
+    query = {
+        'labelSelector': SELECTOR,
+        'watch': 'true',
+        'allowWatchBookmarks': 'true',
+        'resourceVersion': resource_version,
+        'timeoutSeconds': str(max(1, int(timeout))),
+    }
+    async for event in aioclient.api.stream(
+            aioclient.url(aioclient.POD, None, query=query),
+            settings=settings, logger=logger,
+            timeout=aiohttp.ClientTimeout(total=timeout + 60)):
+        if event.get('type') == 'ERROR':
+            # usually 410 Gone: the resource version is too old
+            logger.debug(f'pod watch error: {event.get("object")}')
+            return None
+        raw = event.get('object', {})
+        resource_version = raw.get('metadata', {}).get(
+            'resourceVersion', resource_version)
+        if event.get('type') != 'BOOKMARK':
+            await handle_event(event, settings)
+    return resource_version
+
+
+async def run(settings: kopf.OperatorSettings,
+              logger: logging.Logger) -> None:
+    """
+    List the pods, then watch them, sweeping them once listed and every
+    SWEEP_INTERVAL.
+    """
+    loop = asyncio.get_running_loop()
+    sweep_at = loop.time()
+    version: Optional[str] = None
+    while True:
+        try:
+            if not _listed:
+                _, version = await list_pods(settings, logger)
+            elif loop.time() >= sweep_at:
+                await sweep(settings, logger)
+                sweep_at = loop.time() + SWEEP_INTERVAL
+            elif version is None:
+                version = await relist(settings, logger)
+            else:
+                version = await watch_pods(
+                    settings, logger, version,
+                    min(settings.watching.server_timeout or SWEEP_INTERVAL,
+                        sweep_at - loop.time()))
+        except (aioclient.APIError, aiohttp.ClientError,
+                asyncio.TimeoutError) as exc:
+            logger.warning(f'pod watch interrupted: {exc!r}')
+            await asyncio.sleep(RETRY_DELAY)
+        except Exception as exc:
+            # list the pods again rather than trust the watch's position
+            logger.exception(f'pod watch failed: {exc!r}')
+            version = None
+            await asyncio.sleep(RETRY_DELAY)
+
+
+def _watch_done(logger: logging.Logger, task: asyncio.Task) -> None:
+    """
+    Stop the operator if the watch ends other than by stop(), rather than
+    run on without the pod handlers.
+    """
+    if task.cancelled():
+        return
+    exc = task.exception()
+    logger.critical(f'pod watch stopped: {exc!r}', exc_info=exc)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def start(settings: kopf.OperatorSettings,
+                logger: logging.Logger) -> None:
+    """
+    Watch the pods in the background. This does not wait for the pods to
+    be listed, as API requests made by startup handlers wait for kopf to
+    log in, which only happens once the startup handlers have finished.
+    """
+    global _task
+    _task = asyncio.create_task(run(settings, logger))
+    _task.add_done_callback(partial(_watch_done, logger))
+
+
+async def stop() -> None:
+    """Stop watching the pods."""
+    global _task, _listed, _dispatcher
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    if _dispatcher is not None:
+        _dispatcher.cancel()
+    _task = None
+    _dispatcher = None
+    _listed = False
+    _undispatched.clear()
+    index.clear()
@@ -36,6 +36,9 @@ class CallbackArgs(TypedDict):
     memo: kopf.Memo
     settings: NotRequired[kopf.OperatorSettings]
     param: NotRequired[Any]
+    stopped: NotRequired[kopf.DaemonStopped]
+    # operator index (see handlers.py)
+    oaattype_index: NotRequired[kopf.Index]
 
 
 # This doesn't work:
@@ -54,3 +57,4 @@ class CallbackArgs(TypedDict):
 #     logger: typedefs.Logger
 #     memo: kopf.Memo
 #     param: NotRequired[Any]
+    stopped: NotRequired[kopf.DaemonStopped]
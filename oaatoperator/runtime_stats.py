@@ -3,13 +3,50 @@
 This module implements progressive statistics collection using reservoir
 sampling to track job runtimes and provide runtime predictions for
 scheduling decisions.
+
+Statistics are stored in the OaatGroup status in a compact encoding (see
+JobRuntimeStats.encode()): a version byte, the summary statistics packed
+as binary and the sorted sample quantized to SAMPLE_SCALE and
+delta-encoded as varints, all base64-encoded into a single string.
 """
 
+import base64
 import bisect
 import math
 import random
-from datetime import datetime, timezone
-from typing import Dict, Optional, Any
+import struct
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Optional, Any
+
+ENCODING_VERSION = 1
+# samples are stored in 1/SAMPLE_SCALE seconds
+SAMPLE_SCALE = 100
+# version, count, total, sum of squares, min, max,
+# last updated (epoch microseconds, 0 if never), sample length
+_HEADER = struct.Struct('<BIddddqH')
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _encode_varint(value: int, out: bytearray) -> None:
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varints(data: bytes, offset: int, count: int) -> list[int]:
+    values = []
+    value = shift = 0
+    for byte in data[offset:]:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append(value)
+        if len(values) == count:
+            return values
+        value = shift = 0
+    raise ValueError('truncated runtime sample')
 
 
 class JobRuntimeStats:
@@ -204,6 +241,76 @@ class JobRuntimeStats:
 
         return stats
 
+    def encode(self) -> str:
+        """Encode statistics compactly for storage.
+
+        The sample is quantized to 1/SAMPLE_SCALE seconds and stored as
+        the differences between consecutive (sorted) values, so a full
+        sample usually takes two bytes per entry.
+
+        Returns:
+            Versioned, base64-encoded representation of the statistics
+        """
+        last_updated = 0
+        if self.last_updated is not None:
+            updated = self.last_updated
+            if updated.tzinfo is None:
+                updated = updated.replace(tzinfo=timezone.utc)
+            last_updated = (updated - _EPOCH) // timedelta(microseconds=1)
+        out = bytearray(_HEADER.pack(
+            ENCODING_VERSION, self.count, self.total_runtime_seconds,
+            self.sum_of_squares, self.min_runtime, self.max_runtime,
+            last_updated, len(self.sample)))
+        previous = 0
+        for runtime in self.sample:
+            quantized = max(round(runtime * SAMPLE_SCALE), previous)
+            _encode_varint(quantized - previous, out)
+            previous = quantized
+        return base64.b64encode(bytes(out)).decode('ascii')
+
+    @classmethod
+    def decode(cls,
+               encoded: str,
+               sample_size: int = 100) -> 'JobRuntimeStats':
+        """Create JobRuntimeStats from the output of encode().
+
+        Args:
+            encoded: Encoded statistics from Kubernetes status
+            sample_size: Maximum sample size to maintain
+
+        Returns:
+            JobRuntimeStats instance
+
+        Raises:
+            ValueError: if the encoding is invalid or an unknown version
+        """
+        try:
+            data = base64.b64decode(encoded, validate=True)
+            (version, count, total, sum_of_squares, min_runtime, max_runtime,
+             last_updated, length) = _HEADER.unpack_from(data)
+        except (ValueError, struct.error) as exc:
+            raise ValueError(f'invalid runtime statistics: {exc}') from exc
+        if version != ENCODING_VERSION:
+            raise ValueError(
+                f'unknown runtime statistics encoding version {version}')
+        stats = cls(sample_size=sample_size)
+        stats.count = count
+        stats.total_runtime_seconds = total
+        stats.sum_of_squares = sum_of_squares
+        stats.min_runtime = min_runtime
+        stats.max_runtime = max_runtime
+        if last_updated:
+            stats.last_updated = _EPOCH + \
+                last_updated * timedelta(microseconds=1)
+        quantized = 0
+        for delta in (_decode_varints(data, _HEADER.size, length)
+                      if length else []):
+            quantized += delta
+            stats.sample.append(quantized / SAMPLE_SCALE)
+        if len(stats.sample) > sample_size:
+            stats.sample = stats.sample[-sample_size:]
+        return stats
+
     def __str__(self) -> str:
         """String representation of statistics."""
         if self.count == 0:
@@ -218,17 +325,37 @@ class JobRuntimeStats:
                 f"p50={p50:.1f}s, p90={p90:.1f}s, predicted={predicted:.1f}s)")
 
 
+StatsLoader = Callable[[str], Optional[JobRuntimeStats]]
+
+
 class RuntimeStatsManager:
     """Manages runtime statistics for multiple job types."""
 
-    def __init__(self, sample_size: int = 100):
+    def __init__(
+            self,
+            sample_size: int = 100,
+            loader: Optional[StatsLoader] = None):
         """Initialize runtime statistics manager.
 
         Args:
             sample_size: Maximum sample size per job type
+            loader: Called to load the stored statistics for a job the
+                    first time they are needed (returns None if there are
+                    none)
         """
         self.sample_size = sample_size
+        self.loader = loader
         self._stats: Dict[str, JobRuntimeStats] = {}
+        self._loaded: set[str] = set()
+
+    def _load(self, job_name: str) -> None:
+        if self.loader is None or job_name in self._loaded:
+            return
+        self._loaded.add(job_name)
+        if job_name not in self._stats:
+            stats = self.loader(job_name)
+            if stats is not None:
+                self._stats[job_name] = stats
 
     def add_runtime(self, job_name: str, runtime_seconds: float) -> None:
         """Add runtime measurement for a job.
@@ -237,6 +364,7 @@ class RuntimeStatsManager:
             job_name: Name/identifier of the job
             runtime_seconds: Runtime in seconds
         """
+        self._load(job_name)
         if job_name not in self._stats:
             self._stats[job_name] = JobRuntimeStats(self.sample_size)
         self._stats[job_name].add_runtime(runtime_seconds)
@@ -250,6 +378,7 @@ class RuntimeStatsManager:
         Returns:
             JobRuntimeStats instance or None if no data
         """
+        self._load(job_name)
         return self._stats.get(job_name)
 
     def predict_runtime(self,
@@ -294,6 +423,8 @@ class RuntimeStatsManager:
     def get_all_job_names(self) -> list[str]:
         """Get list of all job names with statistics.
 
+        Only includes jobs whose stored statistics have been loaded.
+
         Returns:
             List of job names
         """
@@ -0,0 +1,183 @@
+"""
+scheduler.py
+
+Next-due scheduling for OaatGroups.
+
+Rather than checking every OaatGroup on a fixed interval, each group is
+given the time at which it next needs attention (when its earliest item
+becomes eligible to run). The oaat_timer handler for the group waits
+(asynchronously, without holding a thread) until that time arrives, or
+until an event which could change the schedule (a change to the
+OaatGroup, or to one of its pods) wakes the group early.
+
+Each waiting group is an asyncio timer, so the event loop's own timer
+heap orders the wake-ups: no per-group work is done while a group waits.
+"""
+import asyncio
+import datetime
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+import kopf
+
+import oaatoperator.utility
+
+# longest time a group will wait without being checked, as a safety net
+# in case an event is missed
+MAX_WAIT = datetime.timedelta(hours=1)
+# shortest time between checks of a group, unless it is woken by an event
+# (e.g. when an item is eligible but could not be started)
+MIN_INTERVAL = datetime.timedelta(seconds=60)
+# time allowed for a pod handler's status update to reach the OaatGroup
+# before the group is checked
+SETTLE_DELAY = datetime.timedelta(seconds=5)
+# how often to re-check whether an item's completion is visible
+SETTLE_POLL = 0.1
+# completions not visible after this long are no longer waited for
+COMPLETION_EXPIRY = datetime.timedelta(seconds=60)
+
+
+class _Entry:
+    def __init__(self, due: Optional[datetime.datetime]) -> None:
+        self.due = due
+        self.changed = asyncio.Event()
+        # item name -> (finished at, recorded at)
+        self.completions: Dict[str, Tuple[datetime.datetime,
+                                          datetime.datetime]] = {}
+
+
+class Scheduler:
+    """Record and wait for the next due time of each OaatGroup."""
+    def __init__(self, max_wait: datetime.timedelta = MAX_WAIT) -> None:
+        self.max_wait = max_wait
+        self._entries: Dict[Hashable, _Entry] = {}
+
+    def _entry(self, key: Hashable) -> _Entry:
+        if key not in self._entries:
+            # groups not seen before are due immediately
+            self._entries[key] = _Entry(oaatoperator.utility.now())
+        return self._entries[key]
+
+    def due(self, key: Hashable) -> Optional[datetime.datetime]:
+        """Return when the group is next due (None if not scheduled)."""
+        entry = self._entries.get(key)
+        return entry.due if entry else None
+
+    def schedule(self, key: Hashable,
+                 due: Optional[datetime.datetime]) -> None:
+        """
+        Set when the group is next due.
+
+        A due time of None means the group is only checked when woken (or
+        after max_wait).
+        """
+        entry = self._entry(key)
+        entry.due = due
+        entry.changed.set()
+
+    def reschedule(self, key: Hashable,
+                   due: Optional[datetime.datetime]) -> None:
+        """
+        Set when the group is next due, after it has been checked.
+
+        The group will not be due again for at least MIN_INTERVAL (unless
+        woken).
+        """
+        if due is not None:
+            due = max(due, oaatoperator.utility.now() + MIN_INTERVAL)
+        self.schedule(key, due)
+
+    def wake(self, key: Hashable,
+             delay: datetime.timedelta = datetime.timedelta(0)) -> None:
+        """Make the group due immediately (or after delay)."""
+        due = oaatoperator.utility.now() + delay
+        current = self.due(key)
+        if current is not None and current <= due:
+            return
+        self.schedule(key, due)
+
+    def complete(self, key: Hashable, item: str,
+                 finished_at: datetime.datetime) -> None:
+        """
+        Record that an item in the group has completed, and make the group
+        due immediately so the next item can be started.
+
+        The completion is recorded so the group's check can wait (see
+        settle()) until the completion is visible in the group's status,
+        rather than acting on status which still shows the item as due.
+        """
+        entry = self._entry(key)
+        entry.completions[item] = (finished_at, oaatoperator.utility.now())
+        self.wake(key)
+
+    async def settle(self, key: Hashable,
+                     visible: Callable[[str, datetime.datetime], bool],
+                     timeout: Optional[datetime.timedelta] = None) -> bool:
+        """
+        Wait until visible(item, finished_at) for each recorded completion.
+
+        Returns False if a completion is still not visible after timeout
+        (default SETTLE_DELAY).
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return True
+        if timeout is None:
+            timeout = SETTLE_DELAY
+        deadline = oaatoperator.utility.now() + timeout
+        while True:
+            now = oaatoperator.utility.now()
+            for item, (finished_at, recorded) in list(
+                    entry.completions.items()):
+                if (visible(item, finished_at)
+                        or now > recorded + COMPLETION_EXPIRY):
+                    del entry.completions[item]
+            if not entry.completions:
+                return True
+            if now >= deadline:
+                return False
+            await asyncio.sleep(SETTLE_POLL)
+
+    def forget(self, key: Hashable) -> None:
+        """Remove the group from the schedule."""
+        self._entries.pop(key, None)
+
+    def reset(self) -> None:
+        """Remove all groups from the schedule."""
+        self._entries.clear()
+
+    async def wait(self, key: Hashable,
+                   stopped: Optional[kopf.DaemonStopped] = None) -> bool:
+        """
+        Wait until the group is due.
+
+        Returns False if the wait was abandoned because stopped was set
+        (the OaatGroup is being deleted or the operator is exiting).
+        """
+        entry = self._entry(key)
+        deadline = oaatoperator.utility.now() + self.max_wait
+        while stopped is None or not stopped.is_set():
+            now = oaatoperator.utility.now()
+            due = deadline if entry.due is None else min(entry.due, deadline)
+            if due <= now:
+                return True
+            entry.changed.clear()
+            await _wait_any(entry.changed, stopped,
+                            (due - now).total_seconds())
+        return False
+
+
+async def _wait_any(event: asyncio.Event,
+                    stopped: Optional[kopf.DaemonStopped],
+                    timeout: float) -> None:
+    waiters = {asyncio.ensure_future(event.wait())}
+    if stopped is not None:
+        waiters.add(asyncio.ensure_future(stopped.wait()))
+    try:
+        await asyncio.wait(waiters, timeout=timeout,
+                           return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+
+scheduler = Scheduler()
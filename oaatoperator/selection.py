@@ -0,0 +1,206 @@
+"""
+selection.py
+
+Policies for choosing the next item of an OaatGroup to run, selected by
+the group's itemSelection setting (see POLICIES).
+
+A policy chooses from the candidates in the group's item index (see
+itemindex.py): items which have not succeeded within 'frequency' and are
+not in 'failureCoolOff', and for which the optional allow(name)
+predicate is true (see find_job_to_run(), which uses it to exclude items
+predicted to run into a blackout window).
+
+To add a policy, subclass SelectionPolicy and add it to POLICIES.
+"""
+from __future__ import annotations
+import datetime
+from random import choices, randrange
+from typing import Dict, Optional, Set, Type, TYPE_CHECKING
+
+from oaatoperator.itemindex import Allow, BaseItemIndex
+
+if TYPE_CHECKING:
+    from oaatoperator.oaatgroup import OaatGroup
+
+# an item which has gone this many times 'frequency' without success is
+# run ahead of shorter items by the "sjf" policy
+STARVATION_FACTOR = 2
+# largest overdue ratio used to weight an item by the "overdue" policy
+# (also used for items which have never succeeded)
+MAX_OVERDUE_RATIO = 10.0
+
+
+class SelectionPolicy:
+    """Base class of the item selection policies."""
+    def __init__(self, group: OaatGroup) -> None:
+        self.group = group
+
+    def choose(self, index: BaseItemIndex, now: datetime.datetime,
+               allow: Optional[Allow] = None) -> Optional[str]:
+        """
+        The name of the candidate item to run, or None if there are no
+        candidates.
+        """
+        raise NotImplementedError
+
+
+class OldestPolicy(SelectionPolicy):
+    """
+    Run the item which has gone longest without success, preferring the
+    item with the oldest failure (see find_job_to_run()).
+    """
+    def choose(self, index: BaseItemIndex, now: datetime.datetime,
+               allow: Optional[Allow] = None) -> Optional[str]:
+        # Phase One: Choose valid item candidates
+        candidates = index.first_candidates(now, allow=allow)
+        if not candidates:
+            return None
+
+        # return single candidate if there is only one left
+        if len(candidates) == 1:
+            return candidates[0]
+
+        # Phase 2: Choose the item to run from the valid item candidates
+        # Get all items which are "oldest"
+        oldest_success_items = index.oldest_success(now, allow=allow)
+
+        self.group.debug('oldest_success_items: ' +
+                         ', '.join(sorted(oldest_success_items)))
+
+        # Choose based on last failure (but only if there has been
+        # a failure for the item)
+        oldest_failure_items = index.oldest_failure(now, allow=allow)
+
+        remaining_items: Set[str] = set()
+        if len(oldest_failure_items) == 0:
+            # nothing has failed
+            remaining_items = oldest_success_items
+        else:
+            self.group.debug('oldest_failure_items: ' +
+                             ', '.join(sorted(oldest_failure_items)))
+
+            # if we always choose the failed items, we can get stuck
+            # on items which consistently fail. So, 1 in 3 we should
+            # ignore the failed items and choose from the non-failed items
+            if randrange(3) == 0:
+                self.group.debug(
+                    'wildcard! selecting from previously-successful items')
+                remaining_items = index.oldest_success(
+                    now, exclude_failed=True, allow=allow)
+            if not remaining_items:
+                remaining_items = oldest_failure_items
+
+        # Choose at random
+        self.group.debug('randomly choosing from: ' +
+                         ', '.join(sorted(remaining_items)))
+
+        return sorted(
+            remaining_items)[randrange(len(remaining_items))]  # nosec
+
+
+class BinpackPolicy(OldestPolicy):
+    """
+    Pack the time left before the next blackout window. Once a window is
+    approaching (a candidate is predicted to run past its start), run the
+    candidate with the longest predicted runtime which still finishes
+    before the window (the longest gone without success, if several are
+    predicted to take as long), leaving the shorter items for the time
+    which remains. Otherwise (no window is approaching, or no candidate
+    with runtime history fits) choose as for "oldest".
+    """
+    def choose(self, index: BaseItemIndex, now: datetime.datetime,
+               allow: Optional[Allow] = None) -> Optional[str]:
+        chosen = self._longest_fit(index, now, allow)
+        if chosen is None:
+            return super().choose(index, now, allow)
+        self.group.debug(f'binpack: longest which fits {chosen}')
+        return chosen
+
+    def _longest_fit(self, index: BaseItemIndex, now: datetime.datetime,
+                     allow: Optional[Allow]) -> Optional[str]:
+        available = self.group.windows.available(now)
+        if not available:
+            return None
+        predicted = {
+            name: self.group.get_predicted_runtime(name)
+            for name in index.first_candidates(now,
+                                               limit=len(index.records))}
+        if not any(runtime is not None and runtime > available
+                   for runtime in predicted.values()):
+            # no window approaching
+            return None
+        fits: Dict[str, float] = {
+            name: runtime for name, runtime in predicted.items()
+            if runtime is not None and runtime <= available
+            and (allow is None or allow(name))}
+        if not fits:
+            return None
+        return min(fits, key=lambda name: (
+            -fits[name], index.records[name].success, name))
+
+
+class ShortestFirstPolicy(SelectionPolicy):
+    """
+    Run the candidate with the shortest expected (mean) runtime, so that
+    short items are not held up behind long ones. Items with no runtime
+    history are run first, so their runtime is learned.
+
+    So that long items are not starved, an item which has gone more than
+    STARVATION_FACTOR times 'frequency' without success is run first.
+    """
+    def choose(self, index: BaseItemIndex, now: datetime.datetime,
+               allow: Optional[Allow] = None) -> Optional[str]:
+        oldest = index.oldest_success(now, allow=allow)
+        starved = sorted(
+            name for name in oldest if index.records[name].success
+            < now - STARVATION_FACTOR * self.group.freq)
+        if starved:
+            self.group.debug(f'sjf: starved {starved[0]}')
+            return starved[0]
+        candidates = index.first_candidates(
+            now, limit=len(index.records), allow=allow)
+        if not candidates:
+            return None
+
+        def key(name: str) -> tuple:
+            expected = self.group.get_expected_runtime(name)
+            return (expected is not None, expected or 0.0,
+                    index.records[name].success, name)
+
+        chosen = min(candidates, key=key)
+        self.group.debug(f'sjf: shortest {chosen}')
+        return chosen
+
+
+class OverduePolicy(SelectionPolicy):
+    """
+    Choose at random, weighting each candidate by its overdue ratio: the
+    time since its last success as a multiple of 'frequency' (at most
+    MAX_OVERDUE_RATIO, which is also the ratio of an item which has never
+    succeeded). The most overdue items are the most likely to run, but no
+    item (such as one which keeps failing) can block the others.
+    """
+    def choose(self, index: BaseItemIndex, now: datetime.datetime,
+               allow: Optional[Allow] = None) -> Optional[str]:
+        candidates = index.first_candidates(
+            now, limit=len(index.records), allow=allow)
+        if not candidates:
+            return None
+        freq = self.group.freq.total_seconds()
+        weights = [
+            min(MAX_OVERDUE_RATIO,
+                (now - index.records[name].success).total_seconds() / freq)
+            for name in candidates
+        ]
+        chosen = choices(candidates, weights=weights)[0]  # nosec
+        self.group.debug(f'overdue: chose {chosen} from '
+                         f'{len(candidates)} candidates')
+        return chosen
+
+
+POLICIES: Dict[str, Type[SelectionPolicy]] = {
+    'oldest': OldestPolicy,
+    'binpack': BinpackPolicy,
+    'sjf': ShortestFirstPolicy,
+    'overdue': OverduePolicy,
+}
@@ -3,7 +3,7 @@ utility.py
 
 Various stand-alone utility functions.
 """
-from typing import Any, Set, Optional, Callable
+from typing import Any, Set, Optional, Callable, Mapping
 import datetime
 import re
 import sys
@@ -145,6 +145,47 @@ def min_set(items: Set[Any], func: Callable) -> Set[Any]:
     return {item for item in items if func(item) == min_item}
 
 
+def merge_dict(target: dict, source: dict) -> dict:
+    """
+    Recursively merge source into target (in place), as for a merge-patch.
+
+    Dictionaries are merged, any other value (including None) replaces the
+    existing value.
+    """
+    for key, value in source.items():
+        if isinstance(value, dict):
+            if not isinstance(target.get(key), dict):
+                target[key] = {}
+            merge_dict(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+UNCHANGED = object()
+
+
+def patch_diff(current: Any, value: Any) -> Any:
+    """
+    Return the part of the merge-patch value which would change current,
+    or UNCHANGED if applying it would make no difference.
+
+    Keys of current which are not in value are left alone by a
+    merge-patch, so are not considered. A None value (deletion) of
+    a missing key is no change.
+    """
+    if isinstance(value, Mapping) and isinstance(current, Mapping):
+        diff = {}
+        for key, subvalue in value.items():
+            subdiff = patch_diff(current.get(key), subvalue)
+            if subdiff is not UNCHANGED:
+                diff[key] = subdiff
+        return diff if diff else UNCHANGED
+    if value == current:
+        return UNCHANGED
+    return value
+
+
 def my_details(parents=0) -> Optional[str]:
     """Return details of the calling function."""
     frameinfo = inspect.stack()[parents+1]
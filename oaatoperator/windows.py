@@ -0,0 +1,152 @@
+"""
+windows.py
+
+Blackout windows of an OaatGroup: times of day during which no item is
+started.
+
+Each window is an entry of spec.windows:
+
+    windows:
+      - noStartItem:
+          start: {time: "22:00", tz: "+10:00"}
+          end: {time: "02:00", tz: "+10:00"}
+
+Times are HH:MM (or HH), in UTC unless tz (a fixed offset) is given. A
+window whose end is before its start spans midnight. A window includes its
+start time, but not its end time.
+
+The windows are converted once to the sorted, merged boundaries (seconds
+after midnight UTC) of the blackout intervals of a day, so checking a time
+is a bisection of those boundaries rather than a walk through the spec.
+
+Outside a window, an item is only started if it is expected to finish
+before the next window starts (see find_job_to_run()), so runs are not
+cut short by, or do not collide with, whatever the window is for.
+"""
+import bisect
+import datetime
+import re
+from typing import Any, Iterable, List, Mapping, Optional, Tuple
+import kopf
+
+from oaatoperator.utility import UTC, TimeWindow
+
+DAY = 24 * 60 * 60
+
+TIMEMATCH = re.compile(r'([01]?\d|2[0-3])(:[0-5]\d)?')
+TZMATCH = re.compile(r'Z|[+-]\d\d:?\d\d|\+\d:\d\d')
+
+
+def _bound(bound: Any) -> Optional[dict]:
+    """A valid start or end of a window as a dict (or None)."""
+    if isinstance(bound, str):
+        bound = {'time': bound}
+    if not isinstance(bound, Mapping):
+        return None
+    if not TIMEMATCH.fullmatch(str(bound.get('time', ''))):
+        return None
+    if 'tz' in bound and not TZMATCH.fullmatch(str(bound['tz'])):
+        return None
+    return dict(bound)
+
+
+def _merge(intervals: Iterable[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Sort intervals and merge any which overlap or touch."""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class BlackoutWindows:
+    """
+    The blackout windows of an OaatGroup, as the disjoint intervals
+    [start, end) of a day, in seconds after midnight UTC.
+    """
+    def __init__(self, intervals: Iterable[Tuple[int, int]] = ()) -> None:
+        self.intervals = _merge(intervals)
+        self._starts = [start for start, _ in self.intervals]
+
+    @classmethod
+    def from_spec(cls, spec: Mapping[str, Any],
+                  name: str) -> 'BlackoutWindows':
+        """Validate and convert the windows of an OaatGroup spec."""
+        windows = spec.get('windows') or []
+        if not isinstance(windows, list):
+            raise kopf.PermanentError(f'invalid windows {windows} in {name}')
+        intervals = []
+        for window in windows:
+            nostart = (window.get('noStartItem')
+                       if isinstance(window, Mapping) else None)
+            start = end = None
+            if isinstance(nostart, Mapping):
+                start = _bound(nostart.get('start'))
+                end = _bound(nostart.get('end'))
+            if start is None or end is None:
+                raise kopf.PermanentError(
+                    f'invalid windows entry {window} in {name}')
+            timewindow = TimeWindow(start, end)
+            first = int(timewindow.start.total_seconds())
+            last = int(timewindow.end.total_seconds())
+            if first == last:
+                raise kopf.PermanentError(
+                    f'invalid windows entry {window} in {name}: '
+                    'start and end are the same')
+            if first < last:
+                intervals.append((first, last))
+            else:
+                intervals.extend([(first, DAY), (0, last)])
+        blackout = cls(intervals)
+        if blackout.intervals == [(0, DAY)]:
+            raise kopf.PermanentError(
+                f'invalid windows in {name}: no time is outside a window')
+        return blackout
+
+    def __bool__(self) -> bool:
+        return bool(self.intervals)
+
+    @staticmethod
+    def _locate(at: datetime.datetime) -> Tuple[datetime.datetime, float]:
+        """The (UTC) midnight before at, and the seconds since then."""
+        at = at.astimezone(UTC)
+        midnight = at.replace(hour=0, minute=0, second=0, microsecond=0)
+        return midnight, (at - midnight).total_seconds()
+
+    def blackout_end(self,
+                     at: datetime.datetime) -> Optional[datetime.datetime]:
+        """When the window containing at ends (None if at is outside)."""
+        midnight, seconds = self._locate(at)
+        pos = bisect.bisect_right(self._starts, seconds) - 1
+        if pos < 0 or seconds >= self.intervals[pos][1]:
+            return None
+        end = self.intervals[pos][1]
+        if end == DAY and self._starts[0] == 0:
+            # the window continues past midnight
+            end = DAY + self.intervals[0][1]
+        return midnight + datetime.timedelta(seconds=end)
+
+    def next_start(self,
+                   at: datetime.datetime) -> Optional[datetime.datetime]:
+        """When the first window after at starts (None if no windows)."""
+        if not self.intervals:
+            return None
+        midnight, seconds = self._locate(at)
+        pos = bisect.bisect_right(self._starts, seconds)
+        start = (self._starts[pos] if pos < len(self._starts)
+                 else DAY + self._starts[0])
+        return midnight + datetime.timedelta(seconds=start)
+
+    def available(self, at: datetime.datetime) -> Optional[float]:
+        """
+        Seconds from at until the next window starts: 0 if at is inside a
+        window, None if there are no windows.
+        """
+        start = self.next_start(at)
+        if start is None:
+            return None
+        if self.blackout_end(at) is not None:
+            return 0.0
+        return (start - at).total_seconds()
@@ -0,0 +1,224 @@
+"""
+worker.py
+
+Run the items of an OaatGroup whose OaatType has spec.type="worker" on a
+single long-lived worker pod, rather than creating a pod for each item.
+
+The worker pod (named <group>-worker) runs the OaatType's podspec and is
+sent one item at a time over HTTP on spec.worker.port, via the API
+server's pod proxy (so the operator needs no network route to the pod).
+Requests and replies are JSON:
+
+    POST /run     {"item": "<name>"}: start running the item (reply
+                  409 Conflict if an item is already running)
+    GET  /status  the item currently (or most recently) run:
+                  {"state": "idle"}
+                  {"item": "<name>", "state": "running"}
+                  {"item": "<name>", "state": "succeeded" or "failed",
+                   "exitCode": <int>, "startedAt": "<ISO time>",
+                   "finishedAt": "<ISO time>"}
+
+The one-at-a-time guarantee comes from the dispatcher rather than from
+counting pods: the next item is only sent once /status shows that the
+previous one has finished (and its result has been recorded). As the
+worker pod stays Running between items, no pod event marks an item's
+completion: while an item is running, the group polls /status every
+WORKER_POLL (see OaatGroup.next_due()).
+
+The worker pod is labelled with WORKER_LABEL rather than parent-name, so
+the pod watch, running_pods_async() and pod cleanup do not see it. It is owned
+by the OaatGroup, so is deleted along with it.
+"""
+from __future__ import annotations
+import asyncio
+import datetime
+import aiohttp
+import kopf
+import pykube  # type: ignore
+from typing import Any, Dict, Optional, TYPE_CHECKING
+
+from oaatoperator import aioclient
+from oaatoperator.common import ProcessingComplete
+from oaatoperator.utility import date_from_isostr, now, now_iso
+
+if TYPE_CHECKING:
+    from oaatoperator.oaatgroup import OaatGroup
+    from oaatoperator.oaatitem import OaatItem
+
+# label (with the name of the OaatGroup) identifying a worker pod
+WORKER_LABEL = 'oaat-worker'
+# seconds to wait for the worker to reply to a request
+WORKER_TIMEOUT = 10
+# how often the group is checked while an item runs on its worker pod
+# (the scheduler checks a group at most every MIN_INTERVAL)
+WORKER_POLL = datetime.timedelta(seconds=60)
+
+WORKER_ERRORS = (aioclient.APIError, aiohttp.ClientError,
+                 asyncio.TimeoutError, ValueError)
+
+
+def worker_name(group_name: str) -> str:
+    """The name of the worker pod of an OaatGroup."""
+    return f'{group_name}-worker'
+
+
+def worker_doc(oaatgroup: OaatGroup) -> dict:
+    """
+    Build the Pod definition for the worker pod of an OaatGroup from the
+    spec details of its OaatType. The port to accept items on is passed
+    to the pod in the OAAT_WORKER_PORT environment variable.
+    """
+    spec = oaatgroup.oaattype.podspec()
+    port = oaatgroup.oaattype.workerspec()['port']
+    contspec = spec.pop('container')
+    contspec.setdefault('env', []).append({
+        'name': 'OAAT_WORKER_PORT',
+        'value': str(port)
+    })
+    doc = {
+        'apiVersion': 'v1',
+        'kind': 'Pod',
+        'metadata': {
+            'name': worker_name(oaatgroup.name),
+            'labels': {
+                'app': 'oaat-operator',
+                WORKER_LABEL: oaatgroup.name,
+            }
+        },
+        'spec': {
+            'containers': [contspec],
+            **spec,
+            # a stopped worker is replaced (see verify_worker_async())
+            'restartPolicy': 'Never'
+        },
+    }
+    kopf.adopt(doc)
+    return doc
+
+
+def record_result(oaatgroup: OaatGroup, status: Dict[str, Any]) -> None:
+    """Record the result of an item reported by the worker's /status."""
+    item_name = status.get('item')
+    if not item_name:
+        return
+    finished_at = (date_from_isostr(status['finishedAt'])
+                   if status.get('finishedAt') else now())
+    if status.get('state') == 'succeeded':
+        started_at = (date_from_isostr(status['startedAt'])
+                      if status.get('startedAt') else None)
+        oaatgroup.mark_item_success(item_name, finished_at=finished_at,
+                                    started_at=started_at)
+    else:
+        exit_code = status.get('exitCode', -1)
+        oaatgroup.mark_item_failed(
+            item_name, finished_at=finished_at,
+            exit_code=exit_code if isinstance(exit_code, int) else -1)
+
+
+async def verify_worker_async(oaatgroup: OaatGroup) -> dict:
+    """
+    verify_worker_async
+
+    Verify that the worker pod of the OaatGroup is ready for an item:
+    create (or replace) the pod if it is not running, and record the
+    result of the item it last ran.
+
+    Returns the worker pod, or raises ProcessingComplete if it is not
+    ready (including while it is running an item).
+    """
+    namespace = oaatgroup.namespace()
+    name = worker_name(oaatgroup.name)
+    logger = oaatgroup.logger
+    running = oaatgroup.memo.get('currently_running')
+    try:
+        pod = await aioclient.get_object(aioclient.POD, namespace, name,
+                                         logger=logger)
+    except aioclient.APINotFoundError:
+        try:
+            await aioclient.create_object(aioclient.POD, namespace,
+                                          worker_doc(oaatgroup),
+                                          logger=logger)
+        except aioclient.APIError as exc:
+            raise ProcessingComplete(
+                error=f'could not create worker pod {name}: {exc}',
+                message=f'error creating worker pod {name}')
+        raise ProcessingComplete(message=f'started worker pod {name}')
+    except aioclient.APIError as exc:
+        raise ProcessingComplete(
+            error=f'could not retrieve worker pod {name}: {exc}',
+            message=f'error retrieving worker pod {name}')
+    phase = pod.get('status', {}).get('phase', 'unknown')
+    if phase in ('Succeeded', 'Failed'):
+        if running:
+            oaatgroup.mark_item_failed(running)
+        try:
+            await aioclient.delete_object(aioclient.POD, namespace, name,
+                                          logger=logger)
+        except aioclient.APINotFoundError:
+            pass
+        except aioclient.APIError as exc:
+            raise ProcessingComplete(
+                error=f'could not delete worker pod {name}: {exc}',
+                message=f'error deleting worker pod {name}')
+        raise ProcessingComplete(
+            message=f'worker pod {name} stopped ({phase}), replacing it')
+    if phase != 'Running' or pod.get('metadata', {}).get(
+            'deletionTimestamp'):
+        raise ProcessingComplete(
+            message=f'waiting for worker pod {name} ({phase})')
+
+    port = oaatgroup.oaattype.workerspec()['port']
+    try:
+        status = await aioclient.pod_proxy(namespace, name, port, 'status',
+                                           timeout=WORKER_TIMEOUT,
+                                           logger=logger)
+    except WORKER_ERRORS as exc:
+        raise ProcessingComplete(
+            message=f'worker pod {name} is not ready: {exc}')
+    state = status.get('state') if isinstance(status, dict) else None
+    if state == 'running':
+        oaatgroup.set_item_status(status.get('item', 'unknown'),
+                                  'last_verified', now_iso())
+        raise ProcessingComplete(
+            message=f'item {status.get("item")} is running on worker '
+            f'pod {name}')
+    if state in ('succeeded', 'failed'):
+        record_result(oaatgroup, status)
+    elif state != 'idle':
+        raise ProcessingComplete(
+            error=f'unexpected status from worker pod {name}: {status}',
+            message=f'worker pod {name} is not ready')
+    if running and (state == 'idle' or status.get('item') != running):
+        # the item dispatched earlier was lost (the worker reports
+        # neither running nor finishing it)
+        oaatgroup.mark_item_failed(running)
+    return pod
+
+
+async def dispatch_async(item: OaatItem,
+                         pod: Optional[dict]) -> pykube.Pod:
+    """
+    dispatch_async
+
+    Send an item to the worker pod (as verified by verify_worker_async())
+    to run. Returns the worker pod.
+    """
+    group = item.group
+    if pod is None:
+        raise ProcessingComplete(
+            error=f'no worker pod verified before dispatching {item.name}',
+            message=f'error dispatching {item.name}')
+    name = pod['metadata']['name']
+    port = group.oaattype.workerspec()['port']
+    try:
+        await aioclient.pod_proxy(group.namespace(), name, port, 'run',
+                                  payload={'item': item.name},
+                                  timeout=WORKER_TIMEOUT,
+                                  logger=group.logger)
+    except WORKER_ERRORS as exc:
+        raise ProcessingComplete(
+            error=f'could not dispatch {item.name} to worker pod {name}: '
+            f'{exc}',
+            message=f'error dispatching {item.name} to worker pod {name}')
+    item.set_status('last_started', now().isoformat())
+    return pykube.Pod(group.api, pod)
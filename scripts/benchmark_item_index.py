@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""Compare the cost of choosing the next item to run for a large OaatGroup.
+
+Times three ways of finding the candidates with the oldest success and
+oldest failure (the work done by OaatGroupOverseer.find_job_to_run() on
+each check):
+
+    objects  one OaatItem per item via OaatItems.list(), as find_job_to_run()
+             worked before the item index (parses every timestamp on every
+             check)
+    heap     the default item index (itemIndex: heap)
+    array    the array-backed item index (itemIndex: array)
+
+For the indices, both the (one-off) cost of building the index from the
+group status and the per-check selection cost are reported.
+
+Usage:
+
+    python3 scripts/benchmark_item_index.py --items 50000 --repeat 5
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from oaatoperator import itemindex  # noqa: E402
+from oaatoperator.oaatitem import OaatItems  # noqa: E402
+from oaatoperator.utility import min_set, now  # noqa: E402
+
+FREQ = datetime.timedelta(hours=1)
+COOL_OFF = datetime.timedelta(minutes=10)
+
+
+def make_status(count: int, seed: int) -> dict:
+    rand = random.Random(seed)
+    current = now()
+    status = {}
+    for pos in range(count):
+        entry = {}
+        success = current - datetime.timedelta(
+            seconds=rand.randrange(0, 7200))
+        if rand.random() < 0.9:
+            entry['last_success'] = success.isoformat()
+        if rand.random() < 0.2:
+            # failure_count is reset by a success, so items which have
+            # failed since (failure_count > 0) failed after their success
+            entry['last_failure'] = (success + datetime.timedelta(
+                seconds=rand.randrange(0, 600))).isoformat()
+            entry['failure_count'] = str(rand.randrange(1, 4))
+        status[f'item{pos}'] = entry
+    return status
+
+
+def select_objects(names: list, status: dict) -> tuple:
+    group = types.SimpleNamespace(status={'items': status})
+    items = OaatItems(group, {'spec': {'oaatItems': names}}).list()
+    current = now()
+    candidates = {i for i in items if current > i.success() + FREQ}
+    for item in candidates.copy():
+        if current < item.failure() + COOL_OFF:
+            candidates.remove(item)
+    oldest_success = min_set(candidates, lambda x: x.success())
+    failed = {i for i in candidates if i.numfails() > 0}
+    oldest_failure = min_set(failed, lambda x: x.failure())
+    return ({i.name for i in oldest_success}, {i.name for i in oldest_failure})
+
+
+def select_index(index: itemindex.BaseItemIndex) -> tuple:
+    current = now()
+    index.first_candidates(current)
+    return (index.oldest_success(current), index.oldest_failure(current))
+
+
+def timed(func, repeat: int) -> tuple:
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=10000,
+                        help='number of items in the group')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs (the best time is reported)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    status = make_status(args.items, args.seed)
+    names = list(status)
+
+    print(f'{args.items} items, best of {args.repeat} runs')
+    elapsed, expected = timed(lambda: select_objects(names, status),
+                              args.repeat)
+    print(f'{"objects":8} select {elapsed * 1000:10.2f}ms')
+    for index_type, cls in itemindex.INDEX_TYPES.items():
+        build, index = timed(
+            lambda: cls(names, status, FREQ, COOL_OFF), args.repeat)
+        elapsed, result = timed(lambda: select_index(index), args.repeat)
+        check = 'ok' if result == expected else 'MISMATCH'
+        print(f'{index_type:8} select {elapsed * 1000:10.2f}ms '
+              f'(build {build * 1000:.2f}ms) {check}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Unit tests for the async Kubernetes API client."""
+import asyncio
+import types
+import pytest
+from unittest.mock import MagicMock, patch
+
+from oaatoperator import aioclient
+
+
+pytestmark = pytest.mark.unit
+
+
+class TestUrl:
+    """Test building API URLs."""
+
+    def test_core(self):
+        """Test URLs for core (v1) resources."""
+        assert (aioclient.url(aioclient.POD, 'default', 'pod1') ==
+                '/api/v1/namespaces/default/pods/pod1')
+
+    def test_group(self):
+        """Test URLs for resources in an API group."""
+        assert (aioclient.url(aioclient.OAATGROUP, 'ns') ==
+                '/apis/kawaja.net/v1/namespaces/ns/oaatgroups')
+
+    def test_query(self):
+        """Test query parameters are encoded."""
+        selector = aioclient.label_selector(
+            {'app': 'oaat-operator', 'parent-name': 'kog'})
+        assert (aioclient.url(aioclient.POD, 'default',
+                              query={'labelSelector': selector}) ==
+                '/api/v1/namespaces/default/pods?labelSelector='
+                'app%3Doaat-operator%2Cparent-name%3Dkog')
+
+
+class TestRequests:
+    """Test requests are passed to the kopf API client."""
+
+    def test_list_objects(self):
+        """Test list_objects() returns the items."""
+        with patch('kopf._cogs.clients.api.get',
+                   return_value={'items': [{'a': 1}]}) as get:
+            items = asyncio.run(aioclient.list_objects(
+                aioclient.POD, 'default', labels={'app': 'x'},
+                logger=MagicMock()))
+        assert items == [{'a': 1}]
+        assert get.call_args.args[0] == (
+            '/api/v1/namespaces/default/pods?labelSelector=app%3Dx')
+        assert get.call_args.kwargs['settings'] is aioclient.get_settings()
+
+    def test_patch_object(self):
+        """Test patch_object() sends a merge-patch."""
+        with patch('kopf._cogs.clients.api.patch', return_value={}) as api:
+            asyncio.run(aioclient.patch_object(
+                aioclient.OAATGROUP, 'default', 'kog', {'status': {}},
+                logger=MagicMock()))
+        assert api.call_args.kwargs['headers'] == {
+            'Content-Type': 'application/merge-patch+json'}
+        assert api.call_args.kwargs['payload'] == {'status': {}}
+
+    def test_delete_collection(self):
+        """Test delete_collection() passes both selectors."""
+        with patch('kopf._cogs.clients.api.delete', return_value={}) as api:
+            asyncio.run(aioclient.delete_collection(
+                aioclient.POD, 'default', label_selector='app=x',
+                field_selector='status.phase!=Running', logger=MagicMock()))
+        assert api.call_args.args[0] == (
+            '/api/v1/namespaces/default/pods?labelSelector=app%3Dx'
+            '&fieldSelector=status.phase%21%3DRunning')
+        assert api.call_args.kwargs['payload'] == {
+            'propagationPolicy': 'Background'}
+
+    def test_delete_grace_period(self):
+        """Test delete_object() can remove a pod without waiting."""
+        with patch('kopf._cogs.clients.api.delete', return_value={}) as api:
+            asyncio.run(aioclient.delete_object(
+                aioclient.POD, 'default', 'pod1', grace_period=0,
+                logger=MagicMock()))
+        assert api.call_args.kwargs['payload'] == {
+            'propagationPolicy': 'Background', 'gracePeriodSeconds': 0}
+
+    def test_pod_proxy(self):
+        """Test pod_proxy() GETs, or POSTs a payload, via the pod proxy."""
+        with patch('kopf._cogs.clients.api.get',
+                   return_value={'state': 'idle'}) as get:
+            assert asyncio.run(aioclient.pod_proxy(
+                'default', 'kog-worker', 8080, 'status',
+                logger=MagicMock())) == {'state': 'idle'}
+        assert get.call_args.args[0] == (
+            '/api/v1/namespaces/default/pods/kog-worker:8080/proxy/status')
+        with patch('kopf._cogs.clients.api.post', return_value={}) as post:
+            asyncio.run(aioclient.pod_proxy(
+                'default', 'kog-worker', 8080, 'run',
+                payload={'item': 'item1'}, timeout=5, logger=MagicMock()))
+        assert post.call_args.args[0] == (
+            '/api/v1/namespaces/default/pods/kog-worker:8080/proxy/run')
+        assert post.call_args.kwargs['payload'] == {'item': 'item1'}
+        assert post.call_args.kwargs['timeout'].total == 5
+
+    def test_configure(self):
+        """Test the operator settings are used once configured."""
+        settings = MagicMock()
+        try:
+            aioclient.configure(settings)
+            assert aioclient.get_settings() is settings
+        finally:
+            aioclient.configure(None)  # type: ignore
+
+
+class TestKopfApi:
+    """Test the check of kopf's (private) API client."""
+
+    def test_supported(self):
+        """Test the installed kopf has the API functions used."""
+        aioclient.check_kopf_api()
+
+    def test_unsupported(self):
+        """Test a kopf API client without a function used is rejected."""
+        client = types.ModuleType('api')
+        for name in aioclient.API_FUNCTIONS:
+            if name != 'stream':
+                setattr(client, name, MagicMock())
+        with pytest.raises(ImportError, match='API client has no stream'):
+            aioclient.check_kopf_api(client)
@@ -0,0 +1,73 @@
+"""Unit tests for the kopf index lookups."""
+import pytest
+
+from oaatoperator.cache import (CacheStats, get_oaattype, get_running_pods,
+                                pod_stats, oaattype_stats)
+
+
+pytestmark = pytest.mark.unit
+
+
+class TestCacheStats:
+    """Test hit/miss counting."""
+
+    def test_counts(self):
+        """Test hits and misses are counted."""
+        stats = CacheStats('test')
+        assert stats.hit_ratio() is None
+        stats.hit()
+        stats.hit()
+        stats.miss()
+        assert (stats.hits, stats.misses) == (2, 1)
+        assert stats.hit_ratio() == pytest.approx(2 / 3)
+        assert str(stats) == 'test cache: hits=2, misses=1'
+        stats.reset()
+        assert (stats.hits, stats.misses) == (0, 0)
+
+
+class TestOaatTypeLookup:
+    """Test retrieving OaatTypes from the oaattype index."""
+
+    def setup_method(self):
+        oaattype_stats.reset()
+
+    def test_hit_returns_copy(self):
+        """Test a hit returns a copy of the indexed object."""
+        obj = {'spec': {'type': 'pod'}}
+        index = {('default', 'kot'): [obj]}
+        found = get_oaattype(index, 'default', 'kot')
+        assert found == obj
+        found['spec']['type'] = 'job'
+        assert obj['spec']['type'] == 'pod'
+        assert oaattype_stats.hits == 1
+
+    def test_miss(self):
+        """Test a missing OaatType (or missing index) is a miss."""
+        assert get_oaattype({}, 'default', 'kot') is None
+        assert get_oaattype(None, 'default', 'kot') is None
+        assert oaattype_stats.misses == 2
+
+
+class TestPodLookup:
+    """Test retrieving running pods from the pod index."""
+
+    def setup_method(self):
+        pod_stats.reset()
+
+    def test_running_and_pending(self):
+        """Test only Running and Pending pods are returned."""
+        index = {
+            ('default', 'kog', 'Running'): [{'name': 'p1'}],
+            ('default', 'kog', 'Pending'): [{'name': 'p2'}],
+            ('default', 'kog', 'Succeeded'): [{'name': 'p3'}],
+            ('default', 'other', 'Running'): [{'name': 'p4'}],
+        }
+        pods = get_running_pods(index, 'default', 'kog')
+        assert sorted(p['name'] for p in pods) == ['p1', 'p2']
+        assert pod_stats.hits == 1
+
+    def test_none_running(self):
+        """Test no running pods is a miss."""
+        index = {('default', 'kog', 'Failed'): [{'name': 'p1'}]}
+        assert get_running_pods(index, 'default', 'kog') == []
+        assert pod_stats.misses == 1
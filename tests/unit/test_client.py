@@ -0,0 +1,93 @@
+"""Unit tests for the shared Kubernetes API client."""
+import asyncio
+import pytest
+from unittest.mock import Mock, patch
+import pykube
+
+import oaatoperator.client
+from oaatoperator.client import get_api, reset_api, pool_size
+
+
+pytestmark = pytest.mark.unit
+
+
+class TestSharedClient:
+    """Test the process-wide client registry."""
+
+    def setup_method(self):
+        reset_api()
+
+    def teardown_method(self):
+        reset_api()
+
+    def test_get_api_reuses_client(self):
+        """Test repeated calls return the same client."""
+        with patch('pykube.HTTPClient') as http_client, \
+                patch('pykube.KubeConfig.from_env'):
+            first = get_api()
+            second = get_api()
+        assert first is second
+        http_client.assert_called_once()
+
+    def test_reset_api(self):
+        """Test reset_api() discards the shared client."""
+        with patch('pykube.HTTPClient', side_effect=[Mock(), Mock()]), \
+                patch('pykube.KubeConfig.from_env'):
+            first = get_api()
+            reset_api()
+            second = get_api()
+        assert first is not second
+        first.session.close.assert_called_once()
+
+    def test_pool_size_env(self, monkeypatch):
+        """Test the pool size is configured from the environment."""
+        monkeypatch.setenv('OAAT_API_POOL_SIZE', '25')
+        assert pool_size() == 25
+        with patch('pykube.HTTPClient') as http_client, \
+                patch('pykube.KubeConfig.from_env'):
+            get_api()
+        adapter = http_client.call_args.kwargs['http_adapter']
+        assert adapter._pool_maxsize == 25
+
+    def test_pool_size_invalid(self, monkeypatch):
+        """Test an invalid pool size falls back to the default."""
+        monkeypatch.setenv('OAAT_API_POOL_SIZE', 'lots')
+        assert pool_size() == oaatoperator.client.DEFAULT_POOL_SIZE
+
+    def test_refresh_credentials(self, monkeypatch):
+        """Test credentials are re-read but the session is retained."""
+        monkeypatch.setenv('OAAT_API_REFRESH_INTERVAL', '0')
+        old_config = Mock(cluster={'server': 'https://old'})
+        new_config = Mock(cluster={'server': 'https://new'})
+        # use the real client class so the session/adapter are genuine
+        with patch('pykube.HTTPClient', pykube.http.HTTPClient), \
+                patch('pykube.KubeConfig.from_env',
+                      side_effect=[old_config, new_config]):
+            api = get_api()
+            session = api.session
+            adapter = session.adapters['https://']
+            assert adapter.kube_config is old_config
+            refreshed = get_api()
+        assert refreshed is api
+        assert refreshed.session is session
+        assert refreshed.config is new_config
+        assert adapter.kube_config is new_config
+        assert isinstance(adapter, pykube.http.KubernetesHTTPAdapter)
+
+    def test_refresh_off_event_loop(self, monkeypatch):
+        """Test credentials due for refresh in a handler are re-read in a
+        worker thread, rather than on the event loop."""
+        monkeypatch.setenv('OAAT_API_REFRESH_INTERVAL', '0')
+        with patch('pykube.HTTPClient'), \
+                patch('pykube.KubeConfig.from_env'):
+            api = get_api()
+
+        async def refresh():
+            loop = asyncio.get_running_loop()
+            with patch.object(loop, 'run_in_executor') as executor, \
+                    patch('pykube.KubeConfig.from_env') as from_env:
+                assert get_api() is api
+            from_env.assert_not_called()
+            executor.assert_called_once_with(
+                None, oaatoperator.client._refresh_in_background, api)
+        asyncio.run(refresh())
@@ -0,0 +1,129 @@
+"""Unit tests for item pod deadlines."""
+import datetime
+
+import kopf
+import pytest
+
+from oaatoperator import deadline
+
+
+pytestmark = pytest.mark.unit
+
+NOW = datetime.datetime(2022, 1, 2, tzinfo=datetime.timezone.utc)
+HOUR = datetime.timedelta(hours=1)
+
+
+def pod(deadline_seconds=None, minutes_ago=60):
+    annotations = {}
+    if deadline_seconds is not None:
+        annotations[deadline.DEADLINE_ANNOTATION] = str(deadline_seconds)
+    started = NOW - datetime.timedelta(minutes=minutes_ago)
+    return {'metadata': {'name': 'pod1', 'annotations': annotations},
+            'status': {'phase': 'Running', 'startTime': started.isoformat()}}
+
+
+class TestSettings:
+    def test_default(self):
+        assert deadline.deadline_settings({}, 'kog') == (None, None)
+
+    def test_settings(self):
+        assert deadline.deadline_settings(
+            {'runtimeDeadlineFactor': 2.5, 'runtimeDeadlineMax': '1h'},
+            'kog') == (2.5, HOUR)
+
+    @pytest.mark.parametrize('spec', [{'runtimeDeadlineFactor': 0},
+                                      {'runtimeDeadlineFactor': '2'},
+                                      {'runtimeDeadlineFactor': True},
+                                      {'runtimeDeadlineMax': 'later'}])
+    def test_invalid(self, spec):
+        with pytest.raises(kopf.PermanentError,
+                           match='invalid runtimeDeadline'):
+            deadline.deadline_settings(spec, 'kog')
+
+
+class TestItemDeadline:
+    def test_disabled(self):
+        assert deadline.item_deadline([100.0], None, HOUR) is None
+
+    def test_predicted(self):
+        assert deadline.item_deadline([100.2], 3, None) == 301
+        assert deadline.item_deadline([100, 200], 2, None) == 600
+
+    def test_cap(self):
+        assert deadline.item_deadline([3000], 3, HOUR) == 3600
+
+    def test_minimum(self):
+        assert deadline.item_deadline([5], 2, None) == deadline.MIN_DEADLINE
+
+    def test_no_history(self):
+        """Test an item without runtime history gets the cap."""
+        assert deadline.item_deadline([100, None], 3, HOUR) == 3600
+        assert deadline.item_deadline([None], 3, None) is None
+
+
+class TestStraggler:
+    def test_straggler(self):
+        assert deadline.is_straggler(pod(600), at=NOW)
+
+    def test_within_grace(self):
+        grace = int(deadline.STRAGGLER_GRACE.total_seconds())
+        assert not deadline.is_straggler(pod(3600 - grace + 60), at=NOW)
+
+    def test_no_deadline(self):
+        assert not deadline.is_straggler(pod(), at=NOW)
+        assert not deadline.is_straggler(pod('soon'), at=NOW)
+
+    def test_not_started(self):
+        body = pod(60)
+        del body['status']['startTime']
+        assert not deadline.is_straggler(body, at=NOW)
+        assert deadline.straggler_at(body) is None
+
+    def test_straggler_at(self):
+        assert deadline.straggler_at(pod(600)) == (
+            NOW - HOUR + datetime.timedelta(seconds=600)
+            + deadline.STRAGGLER_GRACE)
+        assert deadline.straggler_at(pod()) is None
+
+
+class TestPending:
+    def pending(self, minutes_ago=60, **status):
+        created = NOW - datetime.timedelta(minutes=minutes_ago)
+        return {'metadata': {'name': 'pod1',
+                             'creationTimestamp': created.isoformat()},
+                'status': {'phase': 'Pending', **status}}
+
+    def test_timeout(self):
+        assert deadline.pending_timeout({}, 'kog') == (
+            deadline.DEFAULT_PENDING_TIMEOUT)
+        assert deadline.pending_timeout({'pendingTimeout': '1h'},
+                                        'kog') == HOUR
+        with pytest.raises(kopf.PermanentError,
+                           match='invalid pendingTimeout soon in kog'):
+            deadline.pending_timeout({'pendingTimeout': 'soon'}, 'kog')
+
+    def test_stuck(self):
+        assert deadline.is_stuck_pending(self.pending(61), HOUR, at=NOW)
+        assert not deadline.is_stuck_pending(self.pending(59), HOUR, at=NOW)
+        running = self.pending(61)
+        running['status']['phase'] = 'Running'
+        assert not deadline.is_stuck_pending(running, HOUR, at=NOW)
+
+    def test_stuck_pending_at(self):
+        assert deadline.stuck_pending_at(self.pending(10), HOUR) == (
+            NOW + datetime.timedelta(minutes=50))
+        running = self.pending(10)
+        running['status']['phase'] = 'Running'
+        assert deadline.stuck_pending_at(running, HOUR) is None
+        unknown = self.pending(10)
+        del unknown['metadata']['creationTimestamp']
+        assert deadline.stuck_pending_at(unknown, HOUR) is None
+
+    def test_reason(self):
+        assert deadline.pending_reason(self.pending(conditions=[
+            {'type': 'PodScheduled', 'status': 'False',
+             'reason': 'Unschedulable'}])) == 'Unschedulable'
+        assert deadline.pending_reason(self.pending(containerStatuses=[
+            {'state': {'waiting': {'reason': 'ImagePullBackOff'}}}])) == (
+            'ImagePullBackOff')
+        assert deadline.pending_reason(self.pending()) == 'Pending'
@@ -1,4 +1,6 @@
 from __future__ import annotations
+import asyncio
+import datetime
 import sys
 import os
 import pykube
@@ -6,7 +8,7 @@ import kopf
 from kopf._cogs.structs import credentials
 
 import unittest
-from unittest.mock import patch, MagicMock, Mock
+from unittest.mock import patch, AsyncMock, MagicMock, Mock
 import pytest
 
 pytestmark = pytest.mark.unit
@@ -22,6 +24,7 @@ from oaatoperator.common import ProcessingComplete  # noqa: E402
 from oaatoperator.oaatitem import OaatItem  # noqa: E402
 import oaatoperator.oaatgroup  # noqa: E402
 import oaatoperator.handlers  # noqa: E402
+from oaatoperator.scheduler import scheduler  # noqa: E402
 
 status_running = {'status': {'phase': 'Running'}}
 status_pending = {'status': {'phase': 'Pending'}}
@@ -51,10 +54,47 @@ class TestHelpers(unittest.TestCase):
         self.assertFalse(f(**status_failed))
         self.assertTrue(f(**status_succeeded))
 
+    def test_is_item_completed(self):
+        """Test the completion of a Job's pod is left to the Job."""
+        succeeded = oaatoperator.handlers.is_item_succeeded
+        failed = oaatoperator.handlers.is_item_failed
+        job_pod = {'labels': {'job-name': 'job1'}}
+        self.assertTrue(succeeded(labels={}, **status_succeeded))
+        self.assertFalse(succeeded(**job_pod, **status_succeeded))
+        self.assertFalse(succeeded(labels={}, **status_failed))
+        self.assertTrue(failed(labels={}, **status_failed))
+        self.assertFalse(failed(**job_pod, **status_failed))
+
+    def test_pod_handlers_registered(self):
+        """Test the pod handlers are dispatched from the pod watch."""
+        handlers = oaatoperator.handlers
+        on_change = [r.fn for r in oaatoperator.podwatch._on_change]
+        for fn in (handlers.pod_phasechange, handlers.pod_succeeded,
+                   handlers.pod_failed):
+            self.assertIn(fn, on_change)
+        self.assertEqual(oaatoperator.podwatch._on_sweep,
+                         [handlers.pod_sweep])
+        self.assertEqual([r.fn for r in oaatoperator.jobwatch._on_finished],
+                         [handlers.job_finished])
+
     def test_configure(self):
         oaatoperator.handlers.configure(
             settings=kopf.OperatorSettings())
 
+    def test_oaattype_index(self):
+        body = kopf.Body(TestData.kot_spec)
+        idx = asyncio.run(oaatoperator.handlers.oaattype_index(
+            name='test-kot', namespace='default', body=body))
+        entry = idx[('default', 'test-kot')]
+        self.assertEqual(entry['spec'], TestData.kot_spec['spec'])
+        self.assertEqual(entry['metadata'],
+                         {'name': 'test-kot', 'namespace': 'default'})
+        # index entry must not share state with the watched body
+        entry['spec']['podspec']['container']['name'] = 'changed'
+        self.assertNotEqual(
+            TestData.kot_spec['spec']['podspec']['container']['name'],
+            'changed')
+
     @patch('pykube.KubeConfig')
     def test_login(self, kc):
         kci = kc.from_service_account.return_value
@@ -90,7 +130,7 @@ class TestHandlerOaatAction(unittest.TestCase):
         ogi.set_status = Mock(return_value=None)
         ogi.info = print
         ogi.name = 'name'
-        oaatoperator.handlers.oaat_action(**kw)
+        asyncio.run(oaatoperator.handlers.oaat_action(**kw))
         result = ogi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(result.get('message'), 'validated')
 
@@ -100,7 +140,7 @@ class TestHandlerOaatAction(unittest.TestCase):
         og.side_effect = [
             ProcessingComplete(message='ogmessage', error='ogerror')
         ]
-        result = oaatoperator.handlers.oaat_action(**kw)
+        result = asyncio.run(oaatoperator.handlers.oaat_action(**kw))
         self.assertEqual(result.get('message'), 'Error: ogerror')
 
     @patch('oaatoperator.handlers.OaatGroup', autospec=True)
@@ -113,45 +153,91 @@ class TestHandlerOaatAction(unittest.TestCase):
         ogi.set_status = Mock(return_value=None)
         ogi.info = print
         ogi.name = 'name'
-        oaatoperator.handlers.oaat_action(**kw)
+        asyncio.run(oaatoperator.handlers.oaat_action(**kw))
         result = ogi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(result.get('message'), 'ogmessage')
 
 
-class TestHandlerCleanupPod(unittest.TestCase):
-    @patch('oaatoperator.handlers.PodOverseer', spec_set=False, autospec=True)
-    def test_cleanup_pod_sunny(self, p):
-        kw = TestData.setup_kwargs(TestData.kog_attrs)
-        pi = p.return_value
-        pi.name = 'name'
-        pi.info.side_effect = [None]
-        pi.delete.side_effect = [None]
-        oaatoperator.handlers.cleanup_pod(**kw)
-        result = pi.handle_processing_complete.call_args[0][0].ret
-        self.assertEqual(result.get('message'), '[cleanup_pod] deleted')
-
-    @patch('oaatoperator.handlers.PodOverseer', autospec=True)
-    def test_cleanup_pod_pod_error(self, p):
-        kw = TestData.setup_kwargs(TestData.kog_attrs)
-        p.side_effect = [
-            ProcessingComplete(message='pmessage', error='perror')
-        ]
-        oaatoperator.handlers.cleanup_pod(**kw)
-        kw['logger'].error.assert_called_with('Error: perror')
-
-    @patch('oaatoperator.handlers.PodOverseer', autospec=True)
-    def test_cleanup_pod_delete_error(self, p):
-        kw = TestData.setup_kwargs(TestData.kog_attrs)
-        pi = p.return_value
-        pi.name = 'name'
-        pi.info.side_effect = [None]
-        pi.delete.side_effect = [
-            ProcessingComplete(message='pmessage', error='perror')
-        ]
-        oaatoperator.handlers.cleanup_pod(**kw)
-        result = pi.handle_processing_complete.call_args[0][0].ret
-        self.assertEqual(result.get('message'), 'pmessage')
-        self.assertEqual(result.get('error'), 'perror')
+class TestHandlerPodSweep(unittest.TestCase):
+    @staticmethod
+    def pod(name, phase, finished):
+        return {
+            'metadata': {'name': name, 'namespace': 'default', 'uid': name,
+                         'labels': {'parent-name': 'test-kog',
+                                    'app': 'oaat-operator',
+                                    'oaat-name': name}},
+            'status': {'phase': phase, 'startTime': finished,
+                       'containerStatuses': [{'state': {'terminated': {
+                           'exitCode': 0, 'finishedAt': finished}}}]},
+        }
+
+    @patch('oaatoperator.podgc.delete_pods', new_callable=AsyncMock)
+    @patch('oaatoperator.handlers.reconcile_pods_async',
+           new_callable=AsyncMock)
+    def test_pod_sweep(self, reconcile, delete):
+        """
+        Test the pods are reconciled and those beyond retention deleted.
+        """
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        old = (now - datetime.timedelta(hours=13)).isoformat()
+        recent = (now - datetime.timedelta(hours=1)).isoformat()
+        pods = [self.pod('new', 'Succeeded', recent),
+                self.pod('old', 'Succeeded', old),
+                self.pod('older', 'Running', old)]
+        pods[2]['status']['containerStatuses'] = []
+        reconcile.return_value = MagicMock()
+        reconcile.return_value.pod_retention.return_value = (
+            datetime.timedelta(hours=12), None)
+        asyncio.run(oaatoperator.handlers.pod_sweep(
+            namespace='default', name='test-kog', pods=pods,
+            settings=kopf.OperatorSettings(), logger=MagicMock()))
+        overseers = reconcile.call_args.args[0]
+        self.assertEqual([o.name for o in overseers], ['old', 'older', 'new'])
+        self.assertEqual(delete.call_args.args[:2], ('default', 'test-kog'))
+        self.assertEqual(
+            [p['metadata']['name'] for p in delete.call_args.args[2]],
+            ['old'])
+
+    @patch('oaatoperator.podgc.delete_pods', new_callable=AsyncMock)
+    @patch('oaatoperator.handlers.reconcile_pods_async',
+           new_callable=AsyncMock)
+    def test_pod_sweep_job_pods(self, reconcile, delete):
+        """Test the pods of Jobs are left to the Jobs."""
+        pod = self.pod('job1-x', 'Succeeded', '2022-01-01T00:00:00Z')
+        pod['metadata']['labels']['job-name'] = 'job1'
+        reconcile.return_value = None
+        asyncio.run(oaatoperator.handlers.pod_sweep(
+            namespace='default', name='test-kog', pods=[pod],
+            settings=kopf.OperatorSettings(), logger=MagicMock()))
+        self.assertEqual(reconcile.call_args.args[0], [])
+        delete.assert_not_awaited()
+
+    @patch('oaatoperator.podgc.delete_pods', new_callable=AsyncMock)
+    @patch('oaatoperator.handlers.reconcile_pods_async',
+           new_callable=AsyncMock)
+    def test_pod_sweep_invalid_retention(self, reconcile, delete):
+        reconcile.return_value = MagicMock()
+        reconcile.return_value.pod_retention.side_effect = (
+            kopf.PermanentError('invalid podRetention x in test-kog'))
+        logger = MagicMock()
+        asyncio.run(oaatoperator.handlers.pod_sweep(
+            namespace='default', name='test-kog',
+            pods=[self.pod('pod', 'Succeeded', '2022-01-01T00:00:00Z')],
+            settings=kopf.OperatorSettings(), logger=logger))
+        delete.assert_not_awaited()
+        self.assertRegex(logger.error.call_args.args[0],
+                         'cannot clean up pods of default/test-kog')
+
+    @patch('oaatoperator.handlers.reconcile_pods_async',
+           new_callable=AsyncMock)
+    def test_pod_sweep_no_parent(self, reconcile):
+        reconcile.side_effect = kopf.TemporaryError('cannot find Object')
+        logger = MagicMock()
+        asyncio.run(oaatoperator.handlers.pod_sweep(
+            namespace='default', name='test-kog', pods=[],
+            settings=kopf.OperatorSettings(), logger=logger))
+        self.assertRegex(logger.warning.call_args.args[0],
+                         'cannot reconcile pods of default/test-kog')
 
 
 class TestHandlerPodStatus(unittest.TestCase):
@@ -161,11 +247,11 @@ class TestHandlerPodStatus(unittest.TestCase):
         pi = p.return_value
         pi.name = 'name'
         pi.info.side_effect = [None]
-        pi.update_failure_status.side_effect = [
+        pi.update_failure_status_async.side_effect = [
             ProcessingComplete(message='item failed message',
                                error='item failed error')
         ]
-        oaatoperator.handlers.pod_failed(**kw)  # type: ignore
+        asyncio.run(oaatoperator.handlers.pod_failed(**kw))  # type: ignore
         result = pi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(result.get('message'), 'item failed message')
         self.assertEqual(result.get('error'), 'item failed error')
@@ -176,7 +262,7 @@ class TestHandlerPodStatus(unittest.TestCase):
         p.side_effect = [
             ProcessingComplete(message='pmessage', error='perror')
         ]
-        oaatoperator.handlers.pod_failed(**kw)
+        asyncio.run(oaatoperator.handlers.pod_failed(**kw))
         kw['logger'].error.assert_called_with('Error: perror')
 
     @patch('oaatoperator.handlers.PodOverseer', autospec=True)
@@ -185,7 +271,7 @@ class TestHandlerPodStatus(unittest.TestCase):
         pi = p.return_value
         pi.name = 'name'
         pi.info.side_effect = [None]
-        result = oaatoperator.handlers.pod_failed(**kw)
+        result = asyncio.run(oaatoperator.handlers.pod_failed(**kw))
         self.assertIsNone(result)
         kw['logger'].error.assert_called_with(
             '[pod_failed] should never happen')
@@ -195,11 +281,11 @@ class TestHandlerPodStatus(unittest.TestCase):
         kw = TestData.setup_kwargs(TestData.kog_attrs)
         pi = p.return_value
         pi.info.side_effect = [None]
-        pi.update_success_status.side_effect = [
+        pi.update_success_status_async.side_effect = [
             ProcessingComplete(message='item succeeded message',
                                error='item succeeded error')
         ]
-        oaatoperator.handlers.pod_succeeded(**kw)
+        asyncio.run(oaatoperator.handlers.pod_succeeded(**kw))
         result = pi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(result.get('message'), 'item succeeded message')
         self.assertEqual(result.get('error'), 'item succeeded error')
@@ -210,7 +296,7 @@ class TestHandlerPodStatus(unittest.TestCase):
         p.side_effect = [
             ProcessingComplete(message='pmessage', error='perror')
         ]
-        oaatoperator.handlers.pod_succeeded(**kw)
+        asyncio.run(oaatoperator.handlers.pod_succeeded(**kw))
         kw['logger'].error.assert_called_with('Error: perror')
 
     @patch('oaatoperator.handlers.PodOverseer', autospec=True)
@@ -218,7 +304,7 @@ class TestHandlerPodStatus(unittest.TestCase):
         kw = TestData.setup_kwargs(TestData.kog_attrs)
         pi = p.return_value
         pi.info.side_effect = [None]
-        oaatoperator.handlers.pod_succeeded(**kw)
+        asyncio.run(oaatoperator.handlers.pod_succeeded(**kw))
         kw['logger'].error.assert_called_with(
             '[pod_succeeded] should never happen')
 
@@ -228,10 +314,10 @@ class TestHandlerPodStatus(unittest.TestCase):
         pi = p.return_value
         pi.name = 'name'
         pi.info.side_effect = [None]
-        pi.update_phase.side_effect = [
+        pi.update_phase_async.side_effect = [
             ProcessingComplete(message='item phasechange message')
         ]
-        oaatoperator.handlers.pod_phasechange(**kw)
+        asyncio.run(oaatoperator.handlers.pod_phasechange(**kw))
         result = pi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(result.get('message'), 'item phasechange message')
 
@@ -241,7 +327,7 @@ class TestHandlerPodStatus(unittest.TestCase):
         p.side_effect = [
             ProcessingComplete(message='pmessage', error='perror')
         ]
-        oaatoperator.handlers.pod_phasechange(**kw)
+        asyncio.run(oaatoperator.handlers.pod_phasechange(**kw))
         kw['logger'].error.assert_called_with('Error: perror')
 
     @patch('oaatoperator.handlers.PodOverseer', autospec=True)
@@ -250,13 +336,51 @@ class TestHandlerPodStatus(unittest.TestCase):
         pi = p.return_value
         pi.name = 'name'
         pi.info.side_effect = [None]
-        pi.update_phase.side_effect = [None]
-        oaatoperator.handlers.pod_phasechange(**kw)
+        pi.update_phase_async.side_effect = [None]
+        asyncio.run(oaatoperator.handlers.pod_phasechange(**kw))
 
         kw['logger'].error.assert_called_with(
             '[pod_phasechange] should never happen')
 
 
+class TestHandlerJobFinished(unittest.TestCase):
+    @staticmethod
+    def kwargs(condition):
+        kw = TestData.setup_kwargs(TestData.kp_spec)
+        kw['status'] = {'conditions': [{'type': condition,
+                                        'status': 'True'}]}
+        return kw
+
+    @patch('oaatoperator.handlers.JobOverseer', autospec=True)
+    def test_job_succeeded(self, j):
+        ji = j.return_value
+        ji.phase = 'Succeeded'
+        ji.finished_at = None
+        ji.get_label.return_value = 'item'
+        ji.update_success_status_async.side_effect = [
+            ProcessingComplete(message='item item completed')]
+        with patch.object(scheduler, 'complete') as complete:
+            asyncio.run(oaatoperator.handlers.job_finished(
+                **self.kwargs('Complete')))
+        result = ji.handle_processing_complete.call_args[0][0].ret
+        self.assertEqual(result.get('message'), 'item item completed')
+        ji.update_failure_status_async.assert_not_called()
+        self.assertEqual(complete.call_args.args[:2],
+                         (('default', 'test-kog'), 'item'))
+
+    @patch('oaatoperator.handlers.JobOverseer', autospec=True)
+    def test_job_failed(self, j):
+        ji = j.return_value
+        ji.phase = 'Failed'
+        ji.finished_at = None
+        ji.update_failure_status_async.side_effect = [
+            ProcessingComplete(message='item failed')]
+        asyncio.run(oaatoperator.handlers.job_finished(
+            **self.kwargs('Failed')))
+        ji.update_success_status_async.assert_not_called()
+        ji.update_failure_status_async.assert_awaited_once()
+
+
 class TestHandlerOaatTimer(unittest.TestCase):
     def setUp(self) -> None:
         patcher = patch('oaatoperator.handlers.OaatGroup',
@@ -268,32 +392,63 @@ class TestHandlerOaatTimer(unittest.TestCase):
         self.ogi.debug = MagicMock()
         self.ogi.get_status = MagicMock(side_effect=[5])
         self.ogi.validate_items = MagicMock(side_effect=[None])
-        self.ogi.verify_running = MagicMock(side_effect=[None])
+        self.ogi.verify_running_async = AsyncMock(side_effect=[None])
         self.ogi.verify_running_pod = MagicMock(side_effect=[None])
         self.ogi.identify_running_pod = MagicMock(side_effect=[None])
         self.ogi.resume_running_pod = MagicMock(side_effect=[None])
-        self.ogi.delete_non_survivor_pods = MagicMock(side_effect=[None])
         self.ogi.select_survivor = MagicMock(side_effect=[None])
         self.ogi.find_job_to_run = MagicMock(spec=OaatItem)
         item = self.ogi.find_job_to_run.return_value
         item.name = 'item'  # name is special
+        item.run_async = AsyncMock()
+        self.ogi.find_batch = MagicMock(side_effect=lambda first: [first])
         self.ogi.set_status = MagicMock(side_effect=None)
         self.pi = MagicMock(spec_set=pykube.Pod).return_value
         self.pi.metadata.return_value = {'name': 'podname'}
         self.ogi.handle_processing_complete = MagicMock(return_value=None)
+        self.ogi.next_due = MagicMock(return_value=None)
+        scheduler.reset()
+        self.addCleanup(scheduler.reset)
         return super().setUp()
 
     def test_oaat_timer_sunny(self):
         kw = TestData.setup_kwargs(TestData.kog_attrs)
-        oaatoperator.handlers.oaat_timer(**kw)  # type: ignore
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
         result = self.ogi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(self.ogi.validate_items.call_count, 1)
-        self.assertEqual(self.ogi.verify_running.call_count, 1)
+        self.assertEqual(self.ogi.verify_running_async.call_count, 1)
         self.assertEqual(self.ogi.find_job_to_run.call_count, 1)
         self.assertEqual(
-            self.ogi.find_job_to_run.return_value.run.call_count, 1)
+            self.ogi.find_job_to_run.return_value.run_async.call_count, 1)
         self.assertEqual(result.get('message'), 'started item item')
 
+    def test_oaat_timer_batch(self):
+        """Test a batch of items is run in a single pod."""
+        item = self.ogi.find_job_to_run.return_value
+        other = MagicMock(spec=OaatItem)
+        other.name = 'other'
+        self.ogi.find_batch = MagicMock(return_value=[item, other])
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        result = self.ogi.handle_processing_complete.call_args[0][0].ret
+        item.run_async.assert_awaited_once_with(['item', 'other'])
+        other.run_async.assert_not_called()
+        self.assertEqual(result.get('message'), 'started item item, other')
+
+    def test_oaat_timer_result_unchanged(self):
+        """Test a result already in the status is not stored again."""
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        kw['status'] = {'oaat_timer': {'message': 'not time to run'}}
+        self.ogi.handle_processing_complete.return_value = {
+            'message': 'not time to run'}
+        result = asyncio.run(
+            oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.assertIsNone(result)
+        self.assertEqual(
+            oaatoperator.handlers.changed_result(
+                kw, 'oaat_timer', {'message': 'started item item'}),
+            {'message': 'started item item'})
+
     def test_oaat_timer_paused(self):
         kw = TestData.setup_kwargs(TestData.kog_attrs)
         kw['body'].setdefault('metadata',
@@ -301,13 +456,13 @@ class TestHandlerOaatTimer(unittest.TestCase):
                                              {})['pause_new_jobs'] = 'yes'
         kw['meta'].setdefault('annotations', {})['pause_new_jobs'] = 'yes'
         kw['annotations']['pause_new_jobs'] = 'yes'
-        oaatoperator.handlers.oaat_timer(**kw)  # type: ignore
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
         result = self.ogi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(self.ogi.validate_items.call_count, 1)
-        self.assertEqual(self.ogi.verify_running.call_count, 1)
+        self.assertEqual(self.ogi.verify_running_async.call_count, 1)
         self.assertEqual(self.ogi.find_job_to_run.call_count, 0)
         self.assertEqual(
-            self.ogi.find_job_to_run.return_value.run.call_count, 0)
+            self.ogi.find_job_to_run.return_value.run_async.call_count, 0)
         self.assertEqual(result.get('message'),
                          'paused via pause_new_jobs annotation')
 
@@ -316,13 +471,13 @@ class TestHandlerOaatTimer(unittest.TestCase):
         self.ogi.validate_items.side_effect = [
             ProcessingComplete(message='ogmessage', error='ogerror')
         ]
-        oaatoperator.handlers.oaat_timer(**kw)  # type: ignore
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
         result = self.ogi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(self.ogi.validate_items.call_count, 1)
-        self.assertEqual(self.ogi.verify_running.call_count, 0)
+        self.assertEqual(self.ogi.verify_running_async.call_count, 0)
         self.assertEqual(self.ogi.find_job_to_run.call_count, 0)
         self.assertEqual(
-            self.ogi.find_job_to_run.return_value.run.call_count, 0)
+            self.ogi.find_job_to_run.return_value.run_async.call_count, 0)
         self.assertEqual(result.get('message'), 'ogmessage')
         self.assertEqual(result.get('error'), 'ogerror')
 
@@ -331,22 +486,22 @@ class TestHandlerOaatTimer(unittest.TestCase):
         self.og.side_effect = [
             ProcessingComplete(message='ogmessage', error='ogerror')
         ]
-        result = oaatoperator.handlers.oaat_timer(**kw)  # type: ignore
+        result = asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
         self.assertEqual(result.get('message'), 'Error: ogerror')
 
     def test_oaat_timer_expected_pod_found_bad_running_function(self):
         kw = TestData.setup_kwargs(TestData.kog_attrs)
-        self.ogi.verify_running.side_effect = [
+        self.ogi.verify_running_async.side_effect = [
             ProcessingComplete(message='item item failed during validation',
                                info='Cleaned up missing/deleted item')
         ]
-        oaatoperator.handlers.oaat_timer(**kw)  # type: ignore
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
         result = self.ogi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(self.ogi.validate_items.call_count, 1)
-        self.assertEqual(self.ogi.verify_running.call_count, 1)
+        self.assertEqual(self.ogi.verify_running_async.call_count, 1)
         self.assertEqual(self.ogi.find_job_to_run.call_count, 0)
         self.assertEqual(
-            self.ogi.find_job_to_run.return_value.run.call_count, 0)
+            self.ogi.find_job_to_run.return_value.run_async.call_count, 0)
         self.assertRegex(result.get('message'),
                          'item item failed during validation')
 
@@ -358,8 +513,8 @@ class TestHandlerOaatTimer(unittest.TestCase):
         self.ogi.find_job_to_run.side_effect = [
             ProcessingComplete(message='not time to run next item')
         ]
-        oaatoperator.handlers.oaat_timer(**kw)  # type: ignore
-        self.assertEqual(self.ogi.verify_running.call_count, 1)
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.assertEqual(self.ogi.verify_running_async.call_count, 1)
         state, memo = self.ogi.set_status.call_args[0]
         self.assertEqual(state, 'handler_status')
         self.assertEqual(memo.state, 'idle')
@@ -368,20 +523,222 @@ class TestHandlerOaatTimer(unittest.TestCase):
 
     def test_oaat_timer_expected_pod_found(self):
         kw = TestData.setup_kwargs(TestData.kog_attrs)
-        self.ogi.verify_running.side_effect = [
+        self.ogi.verify_running_async.side_effect = [
             ProcessingComplete(
                 message='pod xxx exists and is in state Running')
         ]
-        oaatoperator.handlers.oaat_timer(**kw)  # type: ignore
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
         result = self.ogi.handle_processing_complete.call_args[0][0].ret
         self.assertEqual(self.ogi.validate_items.call_count, 1)
-        self.assertEqual(self.ogi.verify_running.call_count, 1)
+        self.assertEqual(self.ogi.verify_running_async.call_count, 1)
         self.assertEqual(self.ogi.find_job_to_run.call_count, 0)
         self.assertEqual(
-            self.ogi.find_job_to_run.return_value.run.call_count, 0)
+            self.ogi.find_job_to_run.return_value.run_async.call_count, 0)
         self.assertRegex(result.get('message'),
                          'pod xxx exists and is in state Running')
 
+    def test_oaat_timer_reschedules(self):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        due = oaatoperator.utility.now() + datetime.timedelta(hours=2)
+        self.ogi.next_due.return_value = due
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.assertEqual(scheduler.due((kw['namespace'], kw['name'])), due)
+
+    def test_oaat_timer_reschedule_min_interval(self):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        self.ogi.next_due.return_value = oaatoperator.utility.now()
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        due = scheduler.due((kw['namespace'], kw['name']))
+        self.assertGreater(due, oaatoperator.utility.now() +
+                           datetime.timedelta(seconds=50))
+
+    def test_oaat_timer_invalid_group_backs_off(self):
+        """Test a group which cannot be loaded is not retried every tick."""
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        self.og.side_effect = kopf.PermanentError('invalid frequency')
+        with self.assertRaises(kopf.PermanentError):
+            asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        due = scheduler.due((kw['namespace'], kw['name']))
+        self.assertGreater(due, oaatoperator.utility.now() +
+                           datetime.timedelta(seconds=50))
+
+    def test_oaat_timer_error_backs_off(self):
+        """Test an unexpected error does not make the group due at once."""
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        self.ogi.verify_running_async.side_effect = RuntimeError('boom')
+        with self.assertRaises(RuntimeError):
+            asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        due = scheduler.due((kw['namespace'], kw['name']))
+        self.assertGreater(due, oaatoperator.utility.now() +
+                           datetime.timedelta(seconds=50))
+
+    def test_oaat_timer_paused_not_scheduled(self):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        kw['annotations']['pause_new_jobs'] = 'yes'
+        self.ogi.next_due.return_value = oaatoperator.utility.now()
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.assertIsNone(scheduler.due((kw['namespace'], kw['name'])))
+        self.assertEqual(self.ogi.next_due.call_count, 0)
+
+    def test_oaat_timer_not_due(self):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        scheduler.schedule((kw['namespace'], kw['name']), None)
+        stopped = Mock()
+        stopped.is_set.return_value = True
+        kw['stopped'] = stopped
+        result = asyncio.run(
+            oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.assertIsNone(result)
+        self.assertEqual(self.og.call_count, 0)
+        self.assertIsNone(scheduler.due((kw['namespace'], kw['name'])))
+
+    def test_oaat_timer_completion_visible(self):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        finished_at = oaatoperator.utility.now()
+        kw['status'] = {'items': {
+            'item1': {'last_success': finished_at.isoformat()}}}
+        scheduler.complete((kw['namespace'], kw['name']), 'item1',
+                           finished_at)
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.assertEqual(self.ogi.find_job_to_run.call_count, 1)
+
+    def test_oaat_timer_completion_visible_configmap(self):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        kw['spec'] = {'itemStorage': 'configmap', 'itemStorageBuckets': 1}
+        finished_at = oaatoperator.utility.now()
+        index = {('default', 'test-kog', 0): [{
+            'item1': {'last_failure': finished_at.isoformat()}}]}
+        scheduler.complete((kw['namespace'], kw['name']), 'item1',
+                           finished_at)
+        with patch('oaatoperator.itemwatch.item_index', return_value=index):
+            asyncio.run(
+                oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.assertEqual(self.ogi.find_job_to_run.call_count, 1)
+
+    def test_oaat_timer_item_state(self):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        asyncio.run(oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.ogi.load_item_state_async.assert_awaited_once_with()
+        self.ogi.write_item_state_async.assert_awaited_once_with()
+
+    @patch('oaatoperator.scheduler.SETTLE_DELAY',
+           datetime.timedelta(milliseconds=50))
+    def test_oaat_timer_completion_not_visible(self):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        kw['status'] = {'items': {'item1': {
+            'last_success': TestData.success_time.isoformat()}}}
+        key = (kw['namespace'], kw['name'])
+        scheduler.complete(key, 'item1', oaatoperator.utility.now())
+        result = asyncio.run(
+            oaatoperator.handlers.oaat_timer(**kw))  # type: ignore
+        self.assertIsNone(result)
+        self.assertEqual(self.og.call_count, 0)
+        self.assertGreater(scheduler.due(key), oaatoperator.utility.now())
+
+
+class TestHandlerWorker(unittest.TestCase):
+    """Test items are run one after another on a worker pod."""
+    def setUp(self) -> None:
+        scheduler.reset()
+        self.addCleanup(scheduler.reset)
+        self.worker_status: dict = {'state': 'idle'}
+        self.dispatched: list = []
+
+    async def pod_proxy(self, namespace, name, port, path, **kwargs):
+        if path == 'run':
+            self.dispatched.append(kwargs['payload']['item'])
+            self.worker_status = {'item': kwargs['payload']['item'],
+                                  'state': 'running'}
+        return self.worker_status
+
+    @patch('oaatoperator.oaatgroup.OaatType', autospec=True)
+    @patch('oaatoperator.aioclient.get_object', new_callable=AsyncMock)
+    def test_two_items(self, get_mock, kot):
+        kot.return_value.backend.return_value = 'worker'
+        kot.return_value.workerspec.return_value = {'port': 8080}
+        get_mock.return_value = {
+            'metadata': {'name': 'test-kog-worker', 'namespace': 'default',
+                         'uid': 'uid1'},
+            'status': {'phase': 'Running'}}
+        kw = TestData.setup_kwargs(TestData.kog5_attrs)
+        key = (kw['namespace'], kw['name'])
+        with patch('oaatoperator.aioclient.pod_proxy', self.pod_proxy):
+            asyncio.run(oaatoperator.handlers.oaat_timer(**kw))
+            self.assertEqual(len(self.dispatched), 1)
+            self.assertEqual(kw['memo'].pod, 'test-kog-worker')
+            # polled while the item runs, rather than waiting MAX_WAIT
+            due = scheduler.due(key)
+            self.assertIsNotNone(due)
+            self.assertLessEqual(
+                due, oaatoperator.utility.now() + datetime.timedelta(
+                    seconds=61))
+            self.worker_status = {
+                'item': self.dispatched[0], 'state': 'succeeded',
+                'exitCode': 0, 'finishedAt': oaatoperator.utility.now_iso()}
+            # as kopf would: the status patch is applied before the next
+            # check of the group
+            kw['status'] = kw['body']['status'] = kw['patch']['status']
+            kw['patch'] = {}
+            scheduler.schedule(key, oaatoperator.utility.now())
+            asyncio.run(oaatoperator.handlers.oaat_timer(**kw))
+        self.assertEqual(len(self.dispatched), 2)
+        self.assertNotEqual(self.dispatched[0], self.dispatched[1])
+        self.assertIn('last_success',
+                      kw['patch']['status']['items'][self.dispatched[0]])
+
+
+class TestHandlerWakeParent(unittest.TestCase):
+    def setUp(self) -> None:
+        scheduler.reset()
+        self.addCleanup(scheduler.reset)
+        return super().setUp()
+
+    @patch('oaatoperator.handlers.PodOverseer', autospec=True)
+    def test_pod_succeeded_wakes_parent(self, p):
+        kw = TestData.setup_kwargs(TestData.kp_success)
+        pi = p.return_value
+        pi.update_success_status_async.side_effect = [
+            ProcessingComplete(message='item succeeded')
+        ]
+        pi.get_label.return_value = 'item'
+        pi.finished_at = TestData.success_time
+        scheduler.schedule(('default', 'test-kog'), None)
+        asyncio.run(oaatoperator.handlers.pod_succeeded(**kw))
+        key = ('default', 'test-kog')
+        self.assertLessEqual(scheduler.due(key), oaatoperator.utility.now())
+        self.assertEqual(
+            scheduler._entries[key].completions['item'][0],
+            TestData.success_time)
+
+    @patch('oaatoperator.handlers.PodOverseer', autospec=True)
+    def test_pod_phasechange_wakes_parent_later(self, p):
+        kw = TestData.setup_kwargs(TestData.kp_success)
+        pi = p.return_value
+        pi.name = 'name'
+        pi.update_phase_async.side_effect = [
+            ProcessingComplete(message='phase changed')
+        ]
+        scheduler.schedule(('default', 'test-kog'), None)
+        asyncio.run(oaatoperator.handlers.pod_phasechange(**kw))
+        due = scheduler.due(('default', 'test-kog'))
+        self.assertGreater(due, oaatoperator.utility.now())
+        self.assertLessEqual(due, oaatoperator.utility.now() +
+                             oaatoperator.scheduler.SETTLE_DELAY)
+
+    @patch('oaatoperator.handlers.OaatGroup', autospec=True)
+    def test_oaat_action_wakes_group(self, og):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        ogi = og.return_value
+        ogi.validate_items = Mock(side_effect=[None])
+        ogi.handle_processing_complete = Mock(return_value={})
+        ogi.set_status = Mock(return_value=None)
+        ogi.info = Mock()
+        ogi.name = 'name'
+        scheduler.schedule((kw['namespace'], kw['name']), None)
+        asyncio.run(oaatoperator.handlers.oaat_action(**kw))
+        self.assertLessEqual(scheduler.due((kw['namespace'], kw['name'])),
+                             oaatoperator.utility.now())
+
 
 if __name__ == '__main__':
     unittest.main()
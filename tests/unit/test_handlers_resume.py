@@ -1,5 +1,7 @@
 """Integration tests for handlers.py resume functionality."""
 
+import asyncio
+
 from oaatoperator.common import ProcessingComplete, KubeOaatGroup
 from oaatoperator.handlers import oaat_resume
 from tests.unit.mocks_pykube import KubeObject
@@ -7,7 +9,7 @@ from tests.unit.testdata import TestData
 import pytest
 import unittest
 import unittest.mock
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
 # Test setup imports
 import sys
@@ -38,7 +40,7 @@ class TestHandlersResume(unittest.TestCase):
                 message="Failed to create OaatGroup"
             )
 
-            result = oaat_resume(**kopf_obj)
+            result = asyncio.run(oaat_resume(**kopf_obj))
 
             # Should return error message from ProcessingComplete
             self.assertEqual(
@@ -62,13 +64,14 @@ class TestHandlersResume(unittest.TestCase):
             with patch('oaatoperator.handlers.OaatGroup') as mock_oaatgroup_class:
                 mock_oaatgroup = Mock()
                 mock_oaatgroup.name = 'test-group'
+                mock_oaatgroup.running_pods_async = AsyncMock(return_value=[])
                 mock_oaatgroup.resume_running_pod.return_value = running_pod_info
                 mock_oaatgroup.info = Mock()
                 mock_oaatgroup.set_status = Mock()
                 mock_oaatgroup.handle_processing_complete = Mock()
                 mock_oaatgroup_class.return_value = mock_oaatgroup
 
-                result = oaat_resume(**kopf_obj)
+                result = asyncio.run(oaat_resume(**kopf_obj))
 
                 # Verify memo was updated with running pod info (lines 268-270)
                 self.assertEqual(memo.state, 'running')
@@ -95,6 +98,7 @@ class TestHandlersResume(unittest.TestCase):
             with patch('oaatoperator.handlers.OaatGroup') as mock_oaatgroup_class:
                 mock_oaatgroup = Mock()
                 mock_oaatgroup.name = 'test-group'
+                mock_oaatgroup.running_pods_async = AsyncMock(return_value=[])
                 mock_oaatgroup.resume_running_pod.return_value = None  # No running pod
                 mock_oaatgroup.info = Mock()
                 mock_oaatgroup.set_status = Mock()
@@ -103,7 +107,7 @@ class TestHandlersResume(unittest.TestCase):
                 # Record initial memo state
                 initial_attrs = set(dir(memo))
 
-                result = oaat_resume(**kopf_obj)
+                result = asyncio.run(oaat_resume(**kopf_obj))
 
                 # Verify no new memo attributes were added for running state
                 final_attrs = set(dir(memo))
@@ -140,12 +144,13 @@ class TestHandlersResume(unittest.TestCase):
             with patch('oaatoperator.handlers.OaatGroup') as mock_oaatgroup_class:
                 mock_oaatgroup = Mock()
                 mock_oaatgroup.name = 'test-group'
+                mock_oaatgroup.running_pods_async = AsyncMock(return_value=[])
                 mock_oaatgroup.resume_running_pod.return_value = running_pod_info
                 mock_oaatgroup.info = Mock()
                 mock_oaatgroup.set_status = Mock()
                 mock_oaatgroup_class.return_value = mock_oaatgroup
 
-                result = oaat_resume(**kopf_obj)
+                result = asyncio.run(oaat_resume(**kopf_obj))
 
                 # Verify memo was updated with available info, defaults for missing
                 self.assertEqual(memo.state, 'running')
@@ -0,0 +1,211 @@
+"""Unit tests for the per-group item index."""
+import datetime
+import heapq
+import random
+
+import pytest
+
+import oaatoperator.itemindex as itemindex
+from oaatoperator.itemindex import (ArrayItemIndex, ItemIndex, ItemRecord,
+                                    _ordered)
+from oaatoperator.utility import min_set, now
+
+
+pytestmark = pytest.mark.unit
+
+FREQ = datetime.timedelta(hours=1)
+COOL_OFF = datetime.timedelta(minutes=10)
+
+
+def ago(minutes: int) -> str:
+    return (now() - datetime.timedelta(minutes=minutes)).isoformat()
+
+
+class TestOrdered:
+    """Test in-order iteration over a heap."""
+
+    def test_ordered(self):
+        """Test entries are returned in order and the heap is unchanged."""
+        heap = [(random.random(), str(i)) for i in range(100)]
+        heapq.heapify(heap)
+        before = list(heap)
+        assert list(_ordered(heap)) == sorted(heap)
+        assert heap == before
+
+    def test_empty(self):
+        assert list(_ordered([])) == []
+
+
+@pytest.fixture(params=[ItemIndex, ArrayItemIndex], ids=['heap', 'array'])
+def index_cls(request):
+    return request.param
+
+
+class TestItemIndex:
+    """Test building, updating and querying both kinds of index."""
+
+    def test_from_status(self, index_cls):
+        """Test records are built from the item status."""
+        status = {'item1': {'last_success': ago(5), 'failure_count': '2'}}
+        index = index_cls(['item1', 'item2'], status, FREQ, COOL_OFF)
+        assert index.records['item1'].numfails == 2
+        assert index.records['item2'].success.year == 1970
+
+    def test_candidates(self, index_cls):
+        """Test recent successes and failures in cool-off are excluded."""
+        status = {
+            'item1': {'last_success': ago(5)},
+            'item2': {'last_failure': ago(5), 'failure_count': '1'},
+            'item3': {'last_success': ago(120)},
+            'item4': {'last_failure': ago(30), 'failure_count': '1'},
+        }
+        index = index_cls(['item1', 'item2', 'item3', 'item4'], status,
+                          FREQ, COOL_OFF)
+        assert sorted(index.first_candidates(now(), limit=10)) == [
+            'item3', 'item4']
+        assert index.oldest_success(now()) == {'item4'}
+        assert index.oldest_success(now(), exclude_failed=True) == {'item3'}
+        assert index.oldest_failure(now()) == {'item4'}
+
+    def test_allow(self, index_cls):
+        """Test only items allowed by the predicate are returned."""
+        status = {
+            'item1': {'last_success': ago(90)},
+            'item2': {'last_failure': ago(30), 'failure_count': '1'},
+            'item3': {'last_success': ago(120)},
+            'item4': {'last_failure': ago(60), 'failure_count': '1'},
+        }
+        index = index_cls(['item1', 'item2', 'item3', 'item4'], status,
+                          FREQ, COOL_OFF)
+        allowed = {'item1', 'item2'}
+        asked = []
+
+        def allow(name):
+            asked.append(name)
+            return name in allowed
+
+        assert sorted(index.first_candidates(now(), limit=10,
+                                             allow=allow)) == [
+            'item1', 'item2']
+        assert index.oldest_success(now(), allow=allow) == {'item2'}
+        assert index.oldest_success(now(), exclude_failed=True,
+                                    allow=allow) == {'item1'}
+        assert index.oldest_failure(now(), allow=allow) == {'item2'}
+        allowed.clear()
+        assert index.first_candidates(now(), allow=allow) == []
+        # the predicate is not consulted for items which are not eligible
+        index.record('item1', success=now())
+        asked.clear()
+        index.first_candidates(now(), limit=10, allow=allow)
+        assert 'item1' not in asked
+
+    def test_ties(self, index_cls):
+        """Test all items sharing the oldest time are returned."""
+        index = index_cls(['a', 'b', 'c'], {'c': {'last_success': ago(90)}},
+                          FREQ, None)
+        assert index.oldest_success(now()) == {'a', 'b'}
+
+    def test_record(self, index_cls):
+        """Test updating an item replaces its earlier entries."""
+        index = index_cls(['a', 'b'], {}, FREQ, COOL_OFF)
+        finished = now()
+        index.record('a', success=finished, numfails=0)
+        assert index.first_candidates(now()) == ['b']
+        index.record('b', failure=finished, numfails=1)
+        assert index.first_candidates(now()) == []
+        assert index.records['b'].success.year == 1970
+        # unknown items are ignored
+        index.record('c', success=finished)
+        assert 'c' not in index.records
+
+    def test_compaction(self):
+        """Test heaps are compacted as stale entries build up."""
+        index = ItemIndex(['a', 'b'], {}, FREQ, None)
+        for minutes in range(100):
+            index.record('a', success=now() - datetime.timedelta(
+                minutes=minutes))
+        assert len(index._by_success) <= 2 * len(index.records) + 16
+        assert index.oldest_success(now()) == {'b'}
+
+    def test_next_eligible(self, index_cls):
+        """Test the earliest eligible time, following updates."""
+        status = {
+            'a': {'last_success': ago(30)},
+            'b': {'last_success': ago(10)},
+        }
+        index = index_cls(['a', 'b'], status, FREQ, None)
+        assert index.next_eligible() == index.records['a'].success + FREQ
+        index.record('a', success=now())
+        assert index.next_eligible() == index.records['b'].success + FREQ
+        assert index_cls([], {}, FREQ, None).next_eligible() is None
+
+    def test_matches_brute_force(self, index_cls):
+        """Test the index chooses the same items as examining every item."""
+        rand = random.Random(1234)
+        current = now()
+        names = [f'item{i}' for i in range(200)]
+        status = {}
+        for name in names:
+            entry = {}
+            if rand.random() < 0.8:
+                entry['last_success'] = (current - datetime.timedelta(
+                    minutes=rand.randrange(0, 180, 15))).isoformat()
+            if rand.random() < 0.3:
+                entry['last_failure'] = (current - datetime.timedelta(
+                    minutes=rand.randrange(0, 180, 15))).isoformat()
+                entry['failure_count'] = str(rand.randrange(0, 3))
+            status[name] = entry
+        index = index_cls(names, status, FREQ, COOL_OFF)
+        records = {n: ItemRecord.from_status(n, status[n]) for n in names}
+        candidates = {n for n in names
+                      if index.is_candidate(records[n], current)}
+        failed = {n for n in candidates if records[n].numfails > 0}
+
+        assert index.oldest_success(current) == min_set(
+            candidates, lambda n: records[n].success)
+        assert index.oldest_failure(current) == min_set(
+            failed, lambda n: records[n].failure)
+        assert index.oldest_success(current, exclude_failed=True) == \
+            min_set(candidates - failed, lambda n: records[n].success)
+        assert len(index.first_candidates(current)) == min(len(candidates), 2)
+        reasons = [index.reason(records[n], current) for n in names]
+        assert index.reason_counts(current) == {
+            reason: reasons.count(reason) for reason in itemindex.REASONS}
+
+
+class TestRegistry:
+    """Test the per-group registry of indices."""
+
+    def setup_method(self):
+        itemindex.reset()
+
+    def test_reused(self):
+        """Test the index is reused while the group definition matches."""
+        index = itemindex.get_index('kog', ['a'], {}, FREQ, None)
+        assert itemindex.get_index('kog', ['a'], {}, FREQ, None) is index
+        assert itemindex.get_index('kog', ['a', 'b'], {}, FREQ,
+                                   None) is not index
+
+    def test_index_type(self):
+        """Test the index is rebuilt if the index type changes."""
+        index = itemindex.get_index('kog', ['a'], {}, FREQ, None)
+        assert isinstance(index, ItemIndex)
+        index = itemindex.get_index('kog', ['a'], {}, FREQ, None, 'array')
+        assert isinstance(index, ArrayItemIndex)
+        assert itemindex.get_index('kog', ['a'], {}, FREQ, None,
+                                   'array') is index
+
+    def test_rebuilt_after_interval(self):
+        """Test the index is rebuilt after REBUILD_INTERVAL."""
+        index = itemindex.get_index('kog', ['a'], {}, FREQ, None)
+        index.built -= itemindex.REBUILD_INTERVAL
+        assert itemindex.get_index('kog', ['a'], {}, FREQ, None) is not index
+
+    def test_record(self):
+        """Test recording against a group with no index is ignored."""
+        itemindex.record('other', 'a', success=now())
+        index = itemindex.get_index('kog', ['a'], {}, FREQ, None)
+        itemindex.record('kog', 'a', success=now())
+        assert index.first_candidates(now()) == []
+        itemindex.discard('kog')
+        assert itemindex.get_index('kog', ['a'], {}, FREQ, None) is not index
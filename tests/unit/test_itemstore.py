@@ -0,0 +1,257 @@
+"""Unit tests for item state storage."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import kopf
+import pytest
+
+from oaatoperator import aioclient, itemstore
+from oaatoperator.common import InternalError
+from oaatoperator.itemstore import (BUCKET_LABEL, ConfigMapItemStore,
+                                    ItemStore, bucket_key, bucket_name,
+                                    bucket_of, field_key)
+
+
+pytestmark = pytest.mark.unit
+
+OWNER = {
+    'apiVersion': 'kawaja.net/v1',
+    'kind': 'OaatGroup',
+    'metadata': {'name': 'kog', 'namespace': 'default', 'uid': 'uid1'},
+}
+
+
+def group():
+    return MagicMock(status={}, logger=MagicMock())
+
+
+def indexed_store(buckets=4, items=None):
+    """ConfigMapItemStore reading from an itemstate index."""
+    index = {}
+    for name, state in (items or {}).items():
+        key = bucket_key('default', 'kog', bucket_of(name, buckets))
+        index.setdefault(key, [{}])[0][name] = state
+    return ConfigMapItemStore(group(), 'default', 'kog', OWNER,
+                              buckets=buckets, index=index)
+
+
+def bucket_obj(bucket, items):
+    return {
+        'metadata': {'name': bucket_name('kog', bucket),
+                     'labels': {BUCKET_LABEL: str(bucket)}},
+        'data': {field_key(name, key): value
+                 for name, state in items.items()
+                 for key, value in state.items()},
+    }
+
+
+class TestSettings:
+    """Test selecting and validating the item storage."""
+
+    def test_bucket_of(self):
+        """Test items are spread across buckets, consistently."""
+        buckets = {bucket_of(f'item{i}', 16) for i in range(1000)}
+        assert buckets == set(range(16))
+        assert bucket_of('item1', 16) == bucket_of('item1', 16)
+
+    def test_defaults(self):
+        assert itemstore.storage_settings({}, 'kog') == (
+            'status', itemstore.DEFAULT_BUCKETS)
+
+    @pytest.mark.parametrize('spec', [
+        {'itemStorage': 'etcd'},
+        {'itemStorageBuckets': 0},
+        {'itemStorageBuckets': '8'},
+        {'itemStorageBuckets': itemstore.MAX_BUCKETS + 1},
+    ])
+    def test_invalid(self, spec):
+        with pytest.raises(kopf.PermanentError):
+            itemstore.storage_settings(spec, 'kog')
+
+    def test_bucket_capacity(self):
+        """Test a group with more items than its buckets hold is rejected."""
+        spec = {'itemStorage': 'configmap', 'itemStorageBuckets': 2,
+                'oaatItems': [f'item{i}' for i in range(
+                    2 * itemstore.MAX_ITEMS_PER_BUCKET)]}
+        assert itemstore.storage_settings(spec, 'kog') == ('configmap', 2)
+        spec['oaatItems'].append('one-more')
+        with pytest.raises(kopf.PermanentError,
+                           match='at least 3 are needed'):
+            itemstore.storage_settings(spec, 'kog')
+        # the limit only applies to 'configmap' storage
+        spec['itemStorage'] = 'status'
+        assert itemstore.storage_settings(spec, 'kog') == ('status', 2)
+
+    def test_make_store(self):
+        """Test the store is chosen from the spec."""
+        obj = dict(OWNER, spec={'itemStorage': 'configmap',
+                                'itemStorageBuckets': 8})
+        store = itemstore.make_store(group(), obj)
+        assert isinstance(store, ConfigMapItemStore)
+        assert (store.namespace, store.group_name, store.buckets) == (
+            'default', 'kog', 8)
+        assert type(itemstore.make_store(group(), OWNER)) is ItemStore
+
+    def test_live_item_status(self):
+        """Test reading an item's state from handler kwargs."""
+        state = {'last_success': '2024-01-01T00:00:00+00:00'}
+        kwargs = {'namespace': 'default', 'name': 'kog', 'spec': {},
+                  'status': {'items': {'item1': state}}}
+        assert itemstore.live_item_status(kwargs, 'item1', None) == state
+        kwargs['spec'] = {'itemStorage': 'configmap'}
+        assert itemstore.live_item_status(kwargs, 'item1', None) == {}
+        index = {bucket_key(
+            'default', 'kog', bucket_of('item1', itemstore.DEFAULT_BUCKETS)):
+            [{'item1': state}]}
+        assert itemstore.live_item_status(kwargs, 'item1', index) == state
+
+
+class TestStatusStore:
+    """Test item state kept in the OaatGroup status."""
+
+    def test_get_set(self):
+        og = group()
+        og.status = {'items': {'item1': {'failure_count': '1'}}}
+        store = ItemStore(og)
+        assert store.get('item1') == {'failure_count': '1'}
+        assert store.get('item2') == {}
+        store.set('item1', 'podphase', 'Running')
+        og._set_status_item.assert_called_once_with(
+            'item1', 'podphase', 'Running')
+
+
+class TestConfigMapStore:
+    """Test item state sharded across ConfigMaps."""
+
+    def test_read_from_index(self):
+        state = {'failure_count': '2'}
+        store = indexed_store(items={'item1': state, 'item2': {}})
+        assert store.get('item1') == state
+        assert store.get('item3') == {}
+        items = store.items()
+        assert sorted(items) == ['item1', 'item2']
+        assert len(items) == 2
+        assert items.get('item1') == state
+        assert items.get('item3', {}) == {}
+
+    def test_not_loaded(self):
+        """Test reading a bucket which has not been loaded is an error."""
+        store = ConfigMapItemStore(group(), 'default', 'kog', OWNER)
+        with pytest.raises(InternalError):
+            store.get('item1')
+
+    @patch('oaatoperator.aioclient.get_object', new_callable=AsyncMock)
+    def test_load_async_items(self, get_mock):
+        """Test only the buckets holding the items are retrieved."""
+        bucket = bucket_of('item1', 4)
+        get_mock.return_value = bucket_obj(bucket, {'item1': {'a': '1'}})
+        store = ConfigMapItemStore(group(), 'default', 'kog', OWNER,
+                                   buckets=4)
+        asyncio.run(store.load_async(['item1']))
+        asyncio.run(store.load_async(['item1']))
+        get_mock.assert_awaited_once()
+        assert get_mock.call_args.args == (
+            aioclient.CONFIGMAP, 'default', bucket_name('kog', bucket))
+        assert store.get('item1') == {'a': '1'}
+
+    @patch('oaatoperator.aioclient.get_object', new_callable=AsyncMock)
+    def test_load_async_missing(self, get_mock):
+        get_mock.side_effect = aioclient.APINotFoundError(
+            status=404, headers={})
+        store = ConfigMapItemStore(group(), 'default', 'kog', OWNER)
+        asyncio.run(store.load_async(['item1']))
+        assert store.get('item1') == {}
+
+    @patch('oaatoperator.aioclient.list_objects', new_callable=AsyncMock)
+    def test_load_async_all(self, list_mock):
+        list_mock.return_value = [bucket_obj(bucket_of('item1', 4),
+                                             {'item1': {'a': '1'}})]
+        store = ConfigMapItemStore(group(), 'default', 'kog', OWNER,
+                                   buckets=4)
+        asyncio.run(store.load_async())
+        assert list_mock.call_args.kwargs['labels'] == {
+            'app': 'oaat-operator', 'parent-name': 'kog'}
+        assert dict(store.items()) == {'item1': {'a': '1'}}
+
+    def test_load_with_index(self):
+        """Test nothing is retrieved when the index is available."""
+        store = indexed_store()
+        with patch('oaatoperator.aioclient.list_objects') as list_mock:
+            asyncio.run(store.load_async())
+        list_mock.assert_not_called()
+
+    def test_decode_bucket(self):
+        """Test each data key is a field of an item."""
+        assert itemstore.decode_bucket({
+            'item1.failure_count': '1', 'item1.podphase': 'Running',
+            'item.v2.failure_count': '2', 'nofield': 'x'}) == {
+                'item1': {'failure_count': '1', 'podphase': 'Running'},
+                'item.v2': {'failure_count': '2'}}
+        assert itemstore.decode_bucket(None) == {}
+
+    @patch('oaatoperator.aioclient.patch_object', new_callable=AsyncMock)
+    def test_write_async(self, patch_mock):
+        """Test only the changed fields of the changed bucket are written."""
+        store = indexed_store(items={
+            'item1': {'failure_count': '1', 'last_verified': 'x'},
+            'item2': {'failure_count': '3'}})
+        store.set('item1', 'failure_count', '0')
+        store.set('item1', 'last_verified')
+        asyncio.run(store.write_async())
+        patch_mock.assert_awaited_once()
+        resource, namespace, name, body = patch_mock.call_args.args
+        assert (resource, namespace, name) == (
+            aioclient.CONFIGMAP, 'default',
+            bucket_name('kog', bucket_of('item1', 4)))
+        assert body == {'data': {'item1.failure_count': '0',
+                                 'item1.last_verified': None}}
+        # the written state is seen by later reads, and not written again
+        assert store.get('item1') == {'failure_count': '0'}
+        assert store.index[bucket_key('default', 'kog', bucket_of(
+            'item1', 4))][0]['item1']['failure_count'] == '1'
+        asyncio.run(store.write_async())
+        patch_mock.assert_awaited_once()
+
+    @patch('oaatoperator.aioclient.create_object', new_callable=AsyncMock)
+    @patch('oaatoperator.aioclient.patch_object', new_callable=AsyncMock)
+    def test_write_async_creates(self, patch_mock, create_mock):
+        """Test the bucket ConfigMap is created if it does not exist."""
+        patch_mock.side_effect = aioclient.APINotFoundError(
+            status=404, headers={})
+        store = indexed_store()
+        store.set('item1', 'podphase', 'started')
+        asyncio.run(store.write_async())
+        doc = create_mock.call_args.args[2]
+        assert doc['metadata']['name'] == bucket_name(
+            'kog', bucket_of('item1', 4))
+        assert doc['metadata']['labels'] == {
+            'app': 'oaat-operator', 'parent-name': 'kog',
+            BUCKET_LABEL: str(bucket_of('item1', 4))}
+        assert doc['metadata']['ownerReferences'][0]['uid'] == 'uid1'
+        assert doc['data'] == {'item1.podphase': 'started'}
+
+    @patch('oaatoperator.aioclient.create_object', new_callable=AsyncMock)
+    @patch('oaatoperator.aioclient.patch_object', new_callable=AsyncMock)
+    def test_write_async_created_meanwhile(self, patch_mock, create_mock):
+        """Test the bucket is patched if created by another handler."""
+        patch_mock.side_effect = [
+            aioclient.APINotFoundError(status=404, headers={}), None]
+        create_mock.side_effect = aioclient.APIConflictError(
+            status=409, headers={})
+        store = indexed_store()
+        store.set('item1', 'last_verified', 'x')
+        asyncio.run(store.write_async())
+        assert patch_mock.await_count == 2
+        assert patch_mock.call_args.args[3] == {
+            'data': {'item1.last_verified': 'x'}}
+
+    @patch('oaatoperator.aioclient.patch_object')
+    def test_set_outside_kopf(self, patch_mock):
+        """Test changes outside of kopf are kept until write_async()."""
+        store = indexed_store()
+        store.group.kopf_object = None
+        store.set('item1', 'podphase', 'Running')
+        patch_mock.assert_not_called()
+        asyncio.run(store.write_async())
+        assert patch_mock.call_args.args[3] == {
+            'data': {'item1.podphase': 'Running'}}
@@ -0,0 +1,131 @@
+"""Unit tests for the item state ConfigMap watch."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import kopf
+import pytest
+
+from oaatoperator import itemwatch
+
+
+pytestmark = pytest.mark.unit
+
+SETTINGS = kopf.OperatorSettings()
+
+
+def configmap(name, bucket='3', data=None, version='1'):
+    return {
+        'apiVersion': 'v1',
+        'kind': 'ConfigMap',
+        'metadata': {
+            'name': name,
+            'namespace': 'default',
+            'resourceVersion': version,
+            'labels': {'app': 'oaat-operator', 'parent-name': 'kog',
+                       'oaat-item-bucket': bucket},
+        },
+        'data': data if data is not None else {
+            'item1.failure_count': '1', 'item.v2.podphase': 'Running'},
+    }
+
+
+@pytest.fixture(autouse=True)
+def reset_watch():
+    """Isolate the module state of each test."""
+    itemwatch.index.clear()
+    yield
+    asyncio.run(itemwatch.stop())
+
+
+class TestIndex:
+    def test_index_entry(self):
+        assert itemwatch.index_entry(configmap('kog-items-3')) == (
+            ('default', 'kog', 3),
+            {'item1': {'failure_count': '1'},
+             'item.v2': {'podphase': 'Running'}})
+        assert itemwatch.index_entry(configmap('kog-items-x', 'x')) is None
+
+    def test_handle_event(self):
+        """Test the index follows added, modified and deleted buckets."""
+        itemwatch.handle_event(
+            {'type': 'ADDED', 'object': configmap('kog-items-3')})
+        key = ('default', 'kog', 3)
+        assert itemwatch.index[key][0]['item1'] == {'failure_count': '1'}
+        itemwatch.handle_event({'type': 'MODIFIED', 'object': configmap(
+            'kog-items-3', data={'item1.failure_count': '2'})})
+        assert itemwatch.index[key] == [{'item1': {'failure_count': '2'}}]
+        itemwatch.handle_event(
+            {'type': 'DELETED', 'object': configmap('kog-items-3')})
+        assert key not in itemwatch.index
+        # a ConfigMap relabelled out of the buckets is dropped
+        itemwatch.handle_event(
+            {'type': 'ADDED', 'object': configmap('kog-items-3')})
+        itemwatch.handle_event({'type': 'MODIFIED',
+                                'object': configmap('kog-items-3', 'x')})
+        assert len(itemwatch.index) == 0
+
+
+class TestWatch:
+    @patch('kopf._cogs.clients.api.get', new_callable=AsyncMock)
+    def test_list_configmaps(self, get_mock):
+        """Test listing uses the label selector and fills the index."""
+        get_mock.return_value = {'metadata': {'resourceVersion': '10'},
+                                 'items': [configmap('kog-items-3')]}
+        itemwatch.index.store(('default', 'gone'), ('default', 'kog', 1), {})
+        assert itemwatch.item_index() is None
+        version = asyncio.run(
+            itemwatch.list_configmaps(SETTINGS, MagicMock()))
+        assert version == '10'
+        assert ('labelSelector=app%3Doaat-operator%2Cparent-name'
+                '%2Coaat-item-bucket') in get_mock.call_args.args[0]
+        assert itemwatch.item_index() is itemwatch.index
+        assert list(itemwatch.index) == [('default', 'kog', 3)]
+
+    def test_watch_configmaps(self):
+        """Test watch events are handled and the version followed."""
+        events = [
+            {'type': 'ADDED',
+             'object': configmap('kog-items-3', version='12')},
+            {'type': 'BOOKMARK',
+             'object': {'metadata': {'resourceVersion': '13'}}},
+        ]
+
+        async def stream(url, **_):
+            assert 'watch=true' in url
+            assert 'resourceVersion=11' in url
+            for event in events:
+                yield event
+
+        with patch('kopf._cogs.clients.api.stream', stream):
+            assert asyncio.run(itemwatch.watch_configmaps(
+                SETTINGS, MagicMock(), '11', 600)) == '13'
+        assert ('default', 'kog', 3) in itemwatch.index
+        events.append({'type': 'ERROR', 'object': {'code': 410}})
+        with patch('kopf._cogs.clients.api.stream', stream):
+            assert asyncio.run(itemwatch.watch_configmaps(
+                SETTINGS, MagicMock(), '11', 600)) is None
+
+    @patch('kopf._cogs.clients.api.get', new_callable=AsyncMock)
+    def test_start_stop(self, get_mock):
+        """Test the ConfigMaps are listed in the background until stop()."""
+        get_mock.return_value = {'metadata': {'resourceVersion': '10'},
+                                 'items': [configmap('kog-items-3')]}
+        watching = []
+
+        async def stream(url, **_):
+            watching.append(url)
+            await asyncio.Event().wait()
+            yield
+
+        async def start():
+            await itemwatch.start(SETTINGS, MagicMock())
+            assert itemwatch.item_index() is None
+            while not watching:
+                await asyncio.sleep(0)
+            assert itemwatch.item_index() is itemwatch.index
+            await itemwatch.stop()
+            assert itemwatch.item_index() is None
+            assert len(itemwatch.index) == 0
+        with patch('kopf._cogs.clients.api.stream', stream):
+            asyncio.run(asyncio.wait_for(start(), 5))
+        assert 'resourceVersion=10' in watching[0]
@@ -0,0 +1,181 @@
+"""Unit tests for the Job watch."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import kopf
+import pytest
+
+from oaatoperator import jobwatch
+
+
+pytestmark = pytest.mark.unit
+
+SETTINGS = kopf.OperatorSettings()
+
+
+def job(name, condition=None, version='1'):
+    status = {'active': 1}
+    if condition is not None:
+        status = {'conditions': [{'type': condition, 'status': 'True'}]}
+    return {
+        'apiVersion': 'batch/v1',
+        'kind': 'Job',
+        'metadata': {
+            'name': name,
+            'namespace': 'default',
+            'resourceVersion': version,
+            'labels': {'app': 'oaat-operator', 'parent-name': 'kog',
+                       'oaat-name': 'item1'},
+        },
+        'status': status,
+    }
+
+
+@pytest.fixture(autouse=True)
+def reset_watch(monkeypatch):
+    """Isolate the module state (and handlers) of each test."""
+    monkeypatch.setattr(jobwatch, '_on_finished', [])
+    yield
+    asyncio.run(jobwatch.stop())
+
+
+def register(**kwargs):
+    handler = AsyncMock(__name__='handler', **kwargs)
+    jobwatch.on_finished()(handler)
+    return handler
+
+
+class TestDispatch:
+    def test_is_finished(self):
+        assert not jobwatch.is_finished(job('job1'))
+        assert not jobwatch.is_finished({'status': {'conditions': [
+            {'type': 'Complete', 'status': 'False'}]}})
+        assert jobwatch.is_finished(job('job1', 'Complete'))
+        assert jobwatch.is_finished(job('job1', 'Failed'))
+
+    def test_handle_event(self):
+        """Test a Job is dispatched once, when it has finished."""
+        handler = register()
+
+        async def events():
+            for event in [
+                    {'type': 'ADDED', 'object': job('job1')},
+                    {'type': 'MODIFIED', 'object': job('job1', 'Complete')},
+                    {'type': 'MODIFIED', 'object': job('job1', 'Complete')},
+                    {'type': 'DELETED', 'object': job('job1', 'Complete')}]:
+                await jobwatch.handle_event(event, SETTINGS)
+        asyncio.run(events())
+        handler.assert_awaited_once()
+        kwargs = handler.call_args.kwargs
+        assert kwargs['name'] == 'job1'
+        assert kwargs['reason'] == 'finished'
+        assert kwargs['status']['conditions'][0]['type'] == 'Complete'
+        assert not jobwatch._dispatched
+
+    def test_temporary_error(self, monkeypatch):
+        """Test a Job is dispatched again if its handler failed."""
+        monkeypatch.setattr(jobwatch.podwatch, 'DISPATCH_ATTEMPTS', 1)
+        handler = register(side_effect=[kopf.TemporaryError('no parent'),
+                                        None])
+        event = {'type': 'MODIFIED', 'object': job('job1', 'Failed')}
+
+        async def events():
+            await jobwatch.handle_event(event, SETTINGS)
+            await jobwatch.handle_event(event, SETTINGS)
+            await jobwatch.handle_event(event, SETTINGS)
+        asyncio.run(events())
+        assert handler.await_count == 2
+
+    @patch('oaatoperator.aioclient.patch_object', new_callable=AsyncMock)
+    def test_patch(self, patch_mock):
+        """Test the handlers' patch is applied to the Job."""
+        async def handler(patch, **_):
+            patch.setdefault('metadata', {})['annotations'] = {'a': 'b'}
+        handler.__name__ = 'handler'
+        jobwatch.on_finished()(handler)
+        asyncio.run(jobwatch.handle_event(
+            {'type': 'ADDED', 'object': job('job1', 'Complete')}, SETTINGS))
+        assert patch_mock.call_args.args[:3] == (
+            jobwatch.aioclient.JOB, 'default', 'job1')
+
+
+class TestWatch:
+    @patch('kopf._cogs.clients.api.get', new_callable=AsyncMock)
+    def test_list_jobs(self, get_mock):
+        """Test listing uses the label selector and dispatches finished
+        Jobs not yet dispatched."""
+        handler = register()
+        jobwatch._dispatched.update({('default', 'job1'),
+                                     ('default', 'gone')})
+        get_mock.return_value = {'metadata': {'resourceVersion': '10'},
+                                 'items': [job('job1', 'Complete'),
+                                           job('job2', 'Failed'),
+                                           job('job3')]}
+        version = asyncio.run(jobwatch.list_jobs(SETTINGS, MagicMock()))
+        assert version == '10'
+        assert 'labelSelector=app%3Doaat-operator%2Cparent-name' in \
+            get_mock.call_args.args[0]
+        assert '/apis/batch/v1/jobs' in get_mock.call_args.args[0]
+        assert [c.kwargs['name'] for c in handler.call_args_list] == ['job2']
+        assert jobwatch._dispatched == {('default', 'job1'),
+                                        ('default', 'job2')}
+
+    def test_watch_jobs(self):
+        """Test watch events are handled and the version followed."""
+        handler = register()
+        events = [
+            {'type': 'MODIFIED',
+             'object': job('job1', 'Complete', version='12')},
+            {'type': 'BOOKMARK',
+             'object': {'metadata': {'resourceVersion': '13'}}},
+        ]
+
+        async def stream(url, **_):
+            assert 'watch=true' in url
+            assert 'resourceVersion=11' in url
+            for event in events:
+                yield event
+
+        with patch('kopf._cogs.clients.api.stream', stream):
+            assert asyncio.run(jobwatch.watch_jobs(
+                SETTINGS, MagicMock(), '11', 600)) == '13'
+        handler.assert_awaited_once()
+        events.append({'type': 'ERROR', 'object': {'code': 410}})
+        with patch('kopf._cogs.clients.api.stream', stream):
+            assert asyncio.run(jobwatch.watch_jobs(
+                SETTINGS, MagicMock(), '11', 600)) is None
+
+    @patch('kopf._cogs.clients.api.get', new_callable=AsyncMock)
+    def test_start(self, get_mock):
+        """Test the Jobs are listed in the background, then watched."""
+        get_mock.return_value = {'metadata': {'resourceVersion': '10'},
+                                 'items': []}
+        watching = []
+
+        async def stream(url, **_):
+            watching.append(url)
+            await asyncio.Event().wait()
+            yield
+
+        async def start():
+            await jobwatch.start(SETTINGS, MagicMock())
+            get_mock.assert_not_awaited()
+            while not watching:
+                await asyncio.sleep(0)
+            await jobwatch.stop()
+        with patch('kopf._cogs.clients.api.stream', stream):
+            asyncio.run(asyncio.wait_for(start(), 5))
+        assert 'resourceVersion=10' in watching[0]
+
+    @patch('oaatoperator.jobwatch.os.kill')
+    def test_watch_done(self, kill_mock):
+        """Test the operator is stopped if the watch task ends."""
+        async def fail():
+            raise RuntimeError('bug')
+
+        async def watch():
+            task = asyncio.create_task(fail())
+            await asyncio.wait([task])
+            jobwatch._watch_done(MagicMock(), task)
+        asyncio.run(watch())
+        kill_mock.assert_called_once()
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import os
 from copy import deepcopy
@@ -7,7 +8,7 @@ from typing import cast
 
 import unittest
 import unittest.mock
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
 import pytest
 
 pytestmark = pytest.mark.unit
@@ -17,18 +18,31 @@ pytestmark = pytest.mark.unit
 sys.path.append(
     os.path.dirname(os.path.realpath(__file__)) + "/../../oaatoperator")
 
-from tests.unit.mocks_pykube import KubeObject, KubeObjectPod  # noqa: E402
+from tests.unit.mocks_pykube import KubeObject  # noqa: E402
 from tests.unit.testdata import TestData  # noqa: E402
 
 from oaatoperator.oaatgroup import OaatGroup, OaatGroupOverseer  # noqa: E402
 from oaatoperator.py_types import CallbackArgs  # noqa: E402
+from oaatoperator.runtime_stats import JobRuntimeStats  # noqa: E402
 from oaatoperator.common import (KubeOaatGroup,  # noqa: E402
-                                 ProcessingComplete)
+                                 InternalError, ProcessingComplete)
+from oaatoperator import aioclient  # noqa: E402
+import oaatoperator.deadline  # noqa: E402
+import oaatoperator.itemindex  # noqa: E402
+import oaatoperator.job  # noqa: E402
+import oaatoperator.itemstore  # noqa: E402
 import oaatoperator.utility  # noqa: E402
+import oaatoperator.worker  # noqa: E402
 
 UTC = datetime.timezone.utc
 
 
+@pytest.fixture(autouse=True)
+def reset_item_index():
+    """Item indices are kept between checks: don't share between tests."""
+    oaatoperator.itemindex.reset()
+
+
 class BasicTests(unittest.TestCase):
     def setUp(self):
         # Mock API client instead of real k3d connection
@@ -93,6 +107,18 @@ class BasicTests(unittest.TestCase):
                 str(exc.exception),
                 'invalid frequency specification nofreq in test-kog')
 
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_invalid_item_index(self, _):
+        kog = deepcopy(TestData.kog_attrs)
+        kog['spec']['itemIndex'] = 'tree'
+        with KubeObject(KubeOaatGroup, kog):
+            with self.assertRaisesRegex(kopf.PermanentError,
+                                        'invalid itemIndex tree in test-kog'):
+                OaatGroup(kopf_object=cast(
+                    CallbackArgs, TestData.setup_kwargs(kog)))
+
 
 class FindJobTests(unittest.TestCase):
     def setUp(self):
@@ -202,9 +228,11 @@ class FindJobTests(unittest.TestCase):
             with self.assertRaisesRegex(ProcessingComplete,
                                         'not time to run next item'):
                 og.find_job_to_run()
-            print(og.kopf_object.info.call_args.args[0])  # type: ignore
+            summary = og.kopf_object.patch['status']['find_job']
+            self.assertEqual(summary['reasons']['cool_off'], 1)
             self.assertRegex(
-                og.kopf_object.info.call_args.args[0],  # type: ignore
+                og.find_job_table(og.item_index(),
+                                  oaatoperator.utility.now()),
                 'item1 cool_off.*not expired since last failure')
 
     # inside frequency but outside cooloff => valid job
@@ -285,7 +313,7 @@ class FindJobTests(unittest.TestCase):
     @patch('oaatoperator.oaatgroup.OaatType',
            autospec=True,
            obj=TestData.kot_mock)
-    @patch('oaatoperator.oaatgroup.randrange')
+    @patch('oaatoperator.selection.randrange')
     def test_5_noprevious_run(self, mock_rand_range, _):
         mock_rand_range.side_effect = [3]
         with KubeObject(KubeOaatGroup, TestData.kog5_attrs):
@@ -318,6 +346,28 @@ class FindJobTests(unittest.TestCase):
             job = og.find_job_to_run()
             self.assertEqual(job.name, 'item3')
 
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_5_single_oldest_array_index(self, _):
+        kog = deepcopy(TestData.kog5_attrs)
+        kog['spec']['itemIndex'] = 'array'
+        success = (datetime.datetime.now(tz=UTC) -
+                   datetime.timedelta(minutes=5)).isoformat()
+        kog['status'] = {'items': {
+            i: {'last_success': success, 'failure_count': '0'}
+            for i in kog['spec']['oaatItems']}}
+        kog['status']['items']['item3']['last_success'] = (
+            datetime.datetime.now(tz=UTC) -
+            datetime.timedelta(minutes=7)).isoformat()
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            job = og.find_job_to_run()
+            self.assertEqual(job.name, 'item3')
+            self.assertIsInstance(og.item_index(),
+                                  oaatoperator.itemindex.ArrayItemIndex)
+
     @unittest.skip(
             "need to rewrite test to support randomness in item selection")
     @patch('oaatoperator.oaatgroup.OaatType',
@@ -373,6 +423,483 @@ class FindJobTests(unittest.TestCase):
             self.assertIn(job.name, ('item4', 'item2'))
 
 
+class FindBatchTests(unittest.TestCase):
+    def group(self, **spec):
+        kog = deepcopy(TestData.kog5_attrs)
+        kog['spec'].update(spec)
+        now = datetime.datetime.now(tz=UTC)
+        kog['status'] = {'items': {
+            item: {'last_success': (now - datetime.timedelta(
+                minutes=10 + number)).isoformat(), 'failure_count': '0'}
+            for number, item in enumerate(kog['spec']['oaatItems'])}}
+        return kog
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_invalid_batch_settings(self, _):
+        for spec, message in (
+                ({'batchSize': 0}, 'invalid batchSize 0 in test-kog'),
+                ({'batchSize': 'two'}, 'invalid batchSize two in test-kog'),
+                ({'batchMaxRuntime': 'soon'},
+                 'invalid batchMaxRuntime soon in test-kog')):
+            kog = self.group(**spec)
+            with KubeObject(KubeOaatGroup, kog):
+                with self.assertRaisesRegex(kopf.PermanentError, message):
+                    OaatGroup(kopf_object=cast(
+                        CallbackArgs, TestData.setup_kwargs(kog)))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_item_deadline(self, _):
+        kog = self.group(runtimeDeadlineFactor=3, runtimeDeadlineMax='1h')
+        predicted = {'item1': 200, 'item2': 2000}
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            with patch.object(og, 'get_predicted_runtime',
+                              side_effect=predicted.get):
+                self.assertEqual(og.item_deadline(['item1']), 600)
+                self.assertEqual(og.item_deadline(['item2']), 3600)
+                self.assertEqual(og.item_deadline(['item3']), 3600)
+        kog = self.group()
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            self.assertIsNone(og.item_deadline(['item1']))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_no_batch(self, _):
+        kog = self.group()
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            first = og.find_job_to_run()
+            self.assertEqual(og.find_batch(first), [first])
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_batch_size(self, _):
+        kog = self.group(batchSize=3)
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            first = og.items.get('item2')
+            self.assertEqual([item.name for item in og.find_batch(first)],
+                             ['item2', 'item5', 'item4'])
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_batch_max_runtime(self, _):
+        kog = self.group(batchSize=5, batchMaxRuntime='10m')
+        predicted = {'item1': 200, 'item2': 240, 'item3': 320, 'item5': 100}
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            with patch.object(og, 'get_predicted_runtime',
+                              side_effect=predicted.get):
+                first = og.items.get('item1')
+                # item4 has no runtime history; item3 does not fit
+                self.assertEqual(
+                    [item.name for item in og.find_batch(first)],
+                    ['item1', 'item5', 'item2'])
+
+
+class FindJobReportTests(unittest.TestCase):
+    @staticmethod
+    def kwargs(items=20, annotations=None):
+        kog = deepcopy(TestData.kog_attrs)
+        kog['spec']['oaatItems'] = [f'item{i}' for i in range(items)]
+        kog['status'] = {'items': {'item0': {
+            'last_success': oaatoperator.utility.now_iso()}}}
+        kw = TestData.setup_kwargs(kog)
+        kw['meta']['annotations'] = annotations or {}
+        return kog, kw
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_summary(self, _):
+        kog, kw = self.kwargs()
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+            og.find_job_to_run()
+        summary = kw['patch']['status']['find_job']
+        self.assertEqual(summary['items'], 20)
+        self.assertEqual(summary['reasons'], {
+            'candidate': 19, 'recent_success': 1, 'cool_off': 0})
+        self.assertEqual(len(summary['top_candidates']),
+                         oaatoperator.oaatgroup.FIND_JOB_TOP_N)
+        self.assertNotIn('item0', summary['top_candidates'])
+        self.assertIsNotNone(summary['next_due'])
+        self.assertNotIn('find_job_table', kw['patch']['status'])
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_summary_unchanged(self, _):
+        """Test the summary is not rewritten if it has not changed."""
+        kog, kw = self.kwargs()
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+            og.find_job_to_run()
+            kw['status']['find_job'] = kw['patch']['status'].pop('find_job')
+            with patch.object(oaatoperator.itemindex.ItemIndex,
+                              'reason_counts') as counts:
+                og.find_job_to_run()
+        self.assertNotIn('find_job', kw['patch']['status'])
+        # the reasons are only counted when the summary is written
+        counts.assert_not_called()
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_table_dump(self, _):
+        """Test the full table is written while the annotation is set."""
+        kog, kw = self.kwargs(annotations={
+            'oaatoperator.kawaja.net/find-job-dump': 'yes'})
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+            og.find_job_to_run()
+        table = kw['patch']['status']['find_job_table']
+        self.assertRegex(table, r'- item0 +successful within last')
+        self.assertEqual(len(table.splitlines()), 22)
+
+        # the table is removed once the annotation is removed
+        kog, kw = self.kwargs()
+        kw['status']['find_job_table'] = table
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+            og.find_job_to_run()
+        self.assertIsNone(kw['patch']['status']['find_job_table'])
+
+
+class NextDueTests(unittest.TestCase):
+    def _group(self, kog, items):
+        kog = deepcopy(kog)
+        kog['status'] = {'items': items}
+        kw = cast(CallbackArgs, TestData.setup_kwargs(kog))
+        return OaatGroup(kopf_object=kw)
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_next_due_earliest_success(self, _):
+        now = oaatoperator.utility.now()
+        kog = deepcopy(TestData.kog5_attrs)
+        kog['spec']['frequency'] = '1h'
+        og = self._group(kog, {
+            'item1': {'last_success': (now - datetime.timedelta(
+                minutes=10)).isoformat()},
+            'item2': {'last_success': (now - datetime.timedelta(
+                minutes=40)).isoformat()},
+            'item3': {'last_success': now.isoformat()},
+            'item4': {'last_success': now.isoformat()},
+            'item5': {'last_success': now.isoformat()},
+        })
+        self.assertEqual(og.next_due(),
+                         now + datetime.timedelta(minutes=20))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_next_due_cool_off(self, _):
+        now = oaatoperator.utility.now()
+        kog = deepcopy(TestData.kog_attrs)
+        kog['spec']['frequency'] = '10m'
+        kog['spec']['failureCoolOff'] = '30m'
+        og = self._group(kog, {
+            'item1': {'last_failure': now.isoformat()},
+        })
+        self.assertEqual(og.next_due(),
+                         now + datetime.timedelta(minutes=30))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_next_due_running(self, _):
+        og = self._group(TestData.kog_attrs, {})
+        og.memo.state = 'running'
+        og.memo.pod = 'podname'
+        self.assertIsNone(og.next_due())
+
+    @patch('oaatoperator.oaatgroup.OaatType', autospec=True)
+    @patch('oaatoperator.utility.now')
+    def test_next_due_running_worker(self, now, kot):
+        """Test an item running on a worker pod is polled."""
+        now.return_value = TestData.success_time
+        kot.return_value.backend.return_value = 'worker'
+        og = self._group(TestData.kog_attrs, {})
+        og.memo.state = 'running'
+        og.memo.pod = 'test-kog-worker'
+        self.assertEqual(og.next_due(),
+                         TestData.success_time
+                         + oaatoperator.worker.WORKER_POLL)
+
+
+class WindowTests(unittest.TestCase):
+    # 01:30 UTC, half an hour before the 02:00-04:00 window
+    now = datetime.datetime(2022, 1, 2, 1, 30, tzinfo=UTC)
+
+    def group(self, **spec):
+        kog = deepcopy(TestData.kog5_attrs)
+        kog['spec']['windows'] = [{'noStartItem': {
+            'start': {'time': '02:00'}, 'end': {'time': '04:00'}}}]
+        kog['spec'].update(spec)
+        kog['status'] = {'items': {
+            item: {'last_success': (self.now - datetime.timedelta(
+                hours=2, minutes=number)).isoformat(), 'failure_count': '0'}
+            for number, item in enumerate(kog['spec']['oaatItems'])}}
+        return kog
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_invalid_windows(self, _):
+        kog = self.group(windows=[{'noStartItem': {'start': '2am'}}])
+        with KubeObject(KubeOaatGroup, kog):
+            with self.assertRaisesRegex(kopf.PermanentError,
+                                        'invalid windows entry'):
+                OaatGroup(kopf_object=cast(
+                    CallbackArgs, TestData.setup_kwargs(kog)))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.utility.now')
+    def test_in_blackout(self, now, _):
+        now.return_value = self.now + datetime.timedelta(hours=1)
+        kog = self.group()
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            with self.assertRaisesRegex(
+                    ProcessingComplete,
+                    'in blackout window until 2022-01-02T04:00:00'):
+                og.find_job_to_run()
+            self.assertEqual(og.next_due(),
+                             datetime.datetime(2022, 1, 2, 4, tzinfo=UTC))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.utility.now')
+    def test_predicted_to_fit(self, now, _):
+        """Test items predicted to run into the window are not chosen."""
+        now.return_value = self.now
+        kog = self.group()
+        # item5 is the oldest, item4 next oldest
+        predicted = {'item5': 3600, 'item4': 1200, 'item3': 60}
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            with patch.object(og, 'get_predicted_runtime',
+                              side_effect=predicted.get):
+                self.assertEqual(og.find_job_to_run().name, 'item4')
+                og.kopf_object.batch_size = 5
+                # item1 and item2 have no history, so are not batched
+                self.assertEqual(
+                    [item.name
+                     for item in og.find_batch(og.items.get('item4'))],
+                    ['item4', 'item3'])
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.utility.now')
+    def test_binpack(self, now, _):
+        """Test the longest item which fits before the window is chosen."""
+        now.return_value = self.now
+        kog = self.group(itemSelection='binpack')
+        # item5 and item4 are the oldest, but do not fit, so "oldest"
+        # would choose item3
+        predicted = {'item5': 3600, 'item4': 3600, 'item3': 600,
+                     'item2': 900, 'item1': 1200}
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            with patch.object(og, 'get_predicted_runtime',
+                              side_effect=predicted.get):
+                self.assertEqual(og.find_job_to_run().name, 'item1')
+            # with no window approaching, the oldest item is chosen
+            predicted.update(item5=1500, item4=1500)
+            with patch.object(og, 'get_predicted_runtime',
+                              side_effect=predicted.get):
+                self.assertEqual(og.find_job_to_run().name, 'item5')
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.utility.now')
+    def test_sjf(self, now, _):
+        """Test the selection policy is taken from the spec."""
+        now.return_value = self.now
+        kog = self.group(itemSelection='sjf', windows=[], frequency='90m')
+        expected = {'item1': 60, 'item2': 30, 'item3': 600,
+                    'item4': 900, 'item5': 3600}
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            with patch.object(og, 'get_expected_runtime',
+                              side_effect=expected.get):
+                self.assertEqual(og.find_job_to_run().name, 'item2')
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_invalid_item_selection(self, _):
+        kog = self.group(itemSelection='fastest')
+        with KubeObject(KubeOaatGroup, kog):
+            with self.assertRaisesRegex(
+                    kopf.PermanentError,
+                    'invalid itemSelection fastest in test-kog'):
+                OaatGroup(kopf_object=cast(
+                    CallbackArgs, TestData.setup_kwargs(kog)))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.utility.now')
+    def test_nothing_fits(self, now, _):
+        now.return_value = self.now
+        kog = self.group(oaatItems=['item1'])
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            with patch.object(og, 'get_predicted_runtime',
+                              return_value=3600):
+                with self.assertRaisesRegex(
+                        ProcessingComplete,
+                        'no item predicted to finish before blackout '
+                        'window at 2022-01-02T02:00:00'):
+                    og.find_job_to_run()
+
+
+class ItemIndexTests(unittest.TestCase):
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_mark_item_success_updates_index(self, _):
+        with KubeObject(KubeOaatGroup, TestData.kog_attrs):
+            og = OaatGroup(kube_object_name='test-kog',
+                           memo=MagicMock(),
+                           logger=MagicMock())
+            index = oaatoperator.itemindex.get_index(
+                og._index_key(), ['item1'], {},
+                datetime.timedelta(hours=1), None)
+            finished_at = oaatoperator.utility.now()
+            with og.collect_status():
+                self.assertTrue(og.mark_item_success(
+                    'item1', finished_at=finished_at))
+        self.assertEqual(index.records['item1'].success, finished_at)
+        self.assertEqual(index.records['item1'].numfails, 0)
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_find_job_stale_index(self, _):
+        kog = deepcopy(TestData.kog_attrs)
+        kog['status'] = {'items': {'item1': {
+            'last_success': oaatoperator.utility.now_iso()}}}
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(
+                CallbackArgs, TestData.setup_kwargs(kog)))
+            # index built before item1's success was recorded
+            oaatoperator.itemindex.get_index(
+                og._index_key(), ['item1'], {}, og.freq,
+                og.kopf_object.cool_off)
+            with self.assertRaisesRegex(ProcessingComplete,
+                                        'not time to run next item'):
+                og.find_job_to_run()
+
+
+class ItemStoreTests(unittest.TestCase):
+    def configmap_kwargs(self, items_state):
+        kog = deepcopy(TestData.kog5_attrs)
+        kog['spec']['itemStorage'] = 'configmap'
+        kog['spec']['itemStorageBuckets'] = 4
+        kw = TestData.setup_kwargs(kog)
+        index: dict = {}
+        for name, state in items_state.items():
+            key = oaatoperator.itemstore.bucket_key(
+                'default', 'test-kog',
+                oaatoperator.itemstore.bucket_of(name, 4))
+            index.setdefault(key, [{}])[0][name] = state
+        patcher = patch('oaatoperator.itemwatch.item_index',
+                        return_value=index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return kog, kw
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_invalid_item_storage(self, _):
+        kog = deepcopy(TestData.kog_attrs)
+        kog['spec']['itemStorage'] = 'etcd'
+        with KubeObject(KubeOaatGroup, kog):
+            with self.assertRaisesRegex(kopf.PermanentError,
+                                        'invalid itemStorage etcd'):
+                OaatGroup(kopf_object=cast(
+                    CallbackArgs, TestData.setup_kwargs(kog)))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_find_job_configmap_storage(self, _):
+        """Test item state is read from the itemstate index."""
+        recent = oaatoperator.utility.now_iso()
+        kog, kw = self.configmap_kwargs({
+            name: {'last_success': recent}
+            for name in ['item1', 'item2', 'item4', 'item5']})
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+            self.assertEqual(og.find_job_to_run().name, 'item3')
+            self.assertEqual(og.items.get('item1').success().isoformat(),
+                             recent)
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_set_item_status_configmap_storage(self, _):
+        """Test item state changes are not written to the group status."""
+        kog, kw = self.configmap_kwargs({})
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+            og.set_item_status('item1', 'podphase', 'started')
+            self.assertNotIn('items', kw['patch'].get('status', {}))
+            with patch('oaatoperator.aioclient.patch_object',
+                       new_callable=AsyncMock) as patch_mock:
+                asyncio.run(og.write_item_state_async())
+            body = patch_mock.call_args.args[3]
+            self.assertEqual(body, {'data': {
+                'item1.podphase': 'started'}})
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_set_item_status_unchanged(self, _):
+        """Test an item field which already has the value is not patched."""
+        kog = deepcopy(TestData.kog_attrs)
+        kog['status'] = {'items': {'item1': {'podphase': 'Running'}}}
+        kw = TestData.setup_kwargs(kog)
+        with KubeObject(KubeOaatGroup, kog):
+            og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+            og.set_item_status('item1', 'podphase', 'Running')
+            og.set_item_status('item2', 'podphase', None)
+            self.assertEqual(kw['patch'], {})
+            og.set_item_status('item1', 'podphase', 'Succeeded')
+            og.set_item_status('item1', 'failure_count', '0')
+            og.set_item_status('item1', 'podphase', 'Running')
+            self.assertEqual(kw['patch'], {'status': {'items': {
+                'item1': {'failure_count': '0'}}}})
+
+
 class ValidateTests(unittest.TestCase):
     def setUp(self):
         # Mock API client instead of real k3d connection
@@ -434,102 +961,317 @@ class ValidateTests(unittest.TestCase):
                 ['annotations'].get('oaatoperator.kawaja.net/test-items'),
                 '1')
 
+    def pod_obj(self, name, phase='Running',
+                start_time='2022-01-01T00:00:00Z'):
+        pod = deepcopy(TestData.pod_spec)
+        pod['metadata'].update({'name': name, 'namespace': 'default'})
+        pod['status'] = {'phase': phase, 'startTime': start_time}
+        return pod
+
+    def kopf_kwargs(self, pod=None, item=None):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        kw.setdefault('status', {})['pod'] = pod
+        kw.setdefault('status', {})['currently_running'] = item
+        return kw
+
     @patch('oaatoperator.oaatgroup.OaatType',
            autospec=True,
            obj=TestData.kot_mock)
-    def test_delete_rogue_none(self, _):
-        with KubeObjectPod(TestData.pod_spec) as pod1:
-            with KubeObject(KubeOaatGroup, TestData.kog_attrs):
-                kw = TestData.setup_kwargs(TestData.kog_attrs)
-                kw.setdefault('status', {})['pod'] = pod1.name
-                kw.setdefault('status', {})['currently_running'] = 'itemname'
-                og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
-                og.kopf_object.warning = print  # type: ignore
-                self.assertEqual(og.get_status('pod'), pod1.name)
-                # no rogue pod
-                with self.assertRaisesRegex(
-                        ProcessingComplete,
-                        'Pod .* exists and is in state Running'):
-                    og.verify_running()
+    @patch('oaatoperator.aioclient.list_objects')
+    def test_delete_rogue_none(self, list_mock, _):
+        list_mock.return_value = [self.pod_obj('pod1')]
+        kw = self.kopf_kwargs('pod1', 'itemname')
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        og.kopf_object.warning = print  # type: ignore
+        self.assertEqual(og.get_status('pod'), 'pod1')
+        # no rogue pod
+        with self.assertRaisesRegex(
+                ProcessingComplete,
+                'Pod pod1 exists and is in state Running'):
+            asyncio.run(og.verify_running_async())
 
     @patch('oaatoperator.oaatgroup.OaatType',
            autospec=True,
            obj=TestData.kot_mock)
-    def test_delete_rogue_skip_unrelated_xxx(self, _):
-        with KubeObjectPod(TestData.pod_spec) as pod1:
-            with KubeObjectPod(TestData.pod_spec_noapp):
-                with KubeObject(KubeOaatGroup, TestData.kog_attrs):
-                    kw = TestData.setup_kwargs(TestData.kog_attrs)
-                    kw.setdefault('status', {})['pod'] = pod1.name
-                    kw.setdefault('status',
-                                  {})['currently_running'] = 'itemname'
-                    og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
-                    # no rogue pod
-                    with self.assertRaisesRegex(
-                            ProcessingComplete,
-                            'Pod .* exists and is in state Running'):
-                        og.verify_running()
+    @patch('oaatoperator.aioclient.delete_object')
+    @patch('oaatoperator.aioclient.list_objects')
+    def test_delete_rogue_skip_unrelated(self, list_mock, delete_mock, _):
+        list_mock.return_value = [self.pod_obj('pod1'),
+                                  self.pod_obj('pod0', 'Succeeded')]
+        kw = self.kopf_kwargs('pod1', 'itemname')
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        # no rogue pod
+        with self.assertRaisesRegex(
+                ProcessingComplete,
+                'Pod pod1 exists and is in state Running'):
+            asyncio.run(og.verify_running_async())
+        self.assertEqual(list_mock.call_args.kwargs['labels'],
+                         {'app': 'oaat-operator', 'parent-name': 'test-kog'})
+        delete_mock.assert_not_called()
 
     @patch('oaatoperator.oaatgroup.OaatType',
            autospec=True,
            obj=TestData.kot_mock)
-    def test_delete_rogue_skip_unrelated(self, _):
-        with KubeObjectPod(TestData.pod_spec) as pod1:
-            with KubeObjectPod(TestData.pod_spec_noapp):
-                with KubeObject(KubeOaatGroup, TestData.kog_attrs):
-                    kw = TestData.setup_kwargs(TestData.kog_attrs)
-                    kw.setdefault('status', {})['pod'] = pod1.name
-                    kw.setdefault('status',
-                                  {})['currently_running'] = 'itemname'
-                    og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
-                    # no rogue pod
-                    with self.assertRaisesRegex(
-                            ProcessingComplete,
-                            'Pod .* exists and is in state Running'):
-                        og.verify_running()
+    @patch('oaatoperator.aioclient.delete_object')
+    @patch('oaatoperator.aioclient.list_objects')
+    def test_delete_rogue(self, list_mock, delete_mock, _):
+        list_mock.return_value = [
+            self.pod_obj('pod1', 'Running', '2022-01-01T00:00:00Z'),
+            self.pod_obj('pod2', 'Running', '2022-01-02T00:00:00Z')]
+        kw = self.kopf_kwargs('pod1', 'itemname')
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'rogue pods running'):
+            asyncio.run(og.verify_running_async())
+        delete_mock.assert_awaited_once()
+        self.assertEqual(delete_mock.call_args.args[1:],
+                         ('default', 'pod2'))
 
     @patch('oaatoperator.oaatgroup.OaatType',
            autospec=True,
            obj=TestData.kot_mock)
-    def test_delete_rogue(self, _):
-        with KubeObjectPod(TestData.pod_spec) as pod1:
-            with KubeObjectPod(TestData.pod_spec):
-                with KubeObject(KubeOaatGroup, TestData.kog_attrs):
-                    kw = TestData.setup_kwargs(TestData.kog_attrs)
-                    kw.setdefault('status', {})['pod'] = pod1.name
-                    kw.setdefault('status',
-                                  {})['currently_running'] = 'itemname'
-                    og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
-                    with self.assertRaisesRegex(ProcessingComplete,
-                                                'rogue pods running'):
-                        og.verify_running()
+    @patch('oaatoperator.aioclient.list_objects')
+    def test_verify_running_nopod_nocr(self, list_mock, _):
+        list_mock.return_value = []
+        og = OaatGroup(kopf_object=cast(CallbackArgs, self.kopf_kwargs()))
+        self.assertIsNone(asyncio.run(og.verify_running_async()))
 
     @patch('oaatoperator.oaatgroup.OaatType',
            autospec=True,
            obj=TestData.kot_mock)
-    def test_verify_running_nopod_nocr(self, _):
-        with KubeObject(KubeOaatGroup, TestData.kog_attrs):
-            kw = TestData.setup_kwargs(TestData.kog_attrs)
-            og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
-            kw.setdefault('status', {})['pod'] = None
-            kw.setdefault('status', {})['currently_running'] = None
-            self.assertIsNone(og.verify_running())
+    @patch('oaatoperator.aioclient.list_objects')
+    def test_verify_running_expected_running_and_is(self, list_mock, _):
+        list_mock.return_value = [self.pod_obj('pod1', 'Pending')]
+        kw = self.kopf_kwargs('pod1', 'itemname')
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaisesRegex(
+                ProcessingComplete,
+                'Pod pod1 exists and is in state Pending'):
+            asyncio.run(og.verify_running_async())
+
+
+class PodIndexTests(unittest.TestCase):
+    def pod_obj(self, name, phase, start_time='2022-01-01T00:00:00Z'):
+        return {
+            'apiVersion': 'v1',
+            'kind': 'Pod',
+            'metadata': {
+                'name': name,
+                'namespace': 'default',
+                'labels': {
+                    'parent-name': 'test-kog',
+                    'app': 'oaat-operator',
+                    'oaat-name': 'item1'
+                }
+            },
+            'status': {'phase': phase, 'startTime': start_time}
+        }
+
+    def setup_kwargs(self, pods):
+        kw = TestData.setup_kwargs(TestData.kog_attrs)
+        index: dict = {}
+        for pod in pods:
+            index.setdefault(
+                ('default', 'test-kog', pod['status']['phase']),
+                []).append(pod)
+        patcher = patch('oaatoperator.podwatch.pod_index',
+                        return_value=index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return kw
 
     @patch('oaatoperator.oaatgroup.OaatType',
            autospec=True,
            obj=TestData.kot_mock)
-    def test_verify_running_expected_running_and_is(self, _):
-        with KubeObjectPod(TestData.pod_spec) as pod1:
-            with KubeObject(KubeOaatGroup, TestData.kog_attrs):
-                kw = TestData.setup_kwargs(TestData.kog_attrs)
-                kw.setdefault('status', {})['pod'] = pod1.name
-                kw.setdefault('status', {})['currently_running'] = 'itemname'
-                og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
-                self.assertEqual(og.get_status('pod'), pod1.name)
-                with self.assertRaisesRegex(
-                        ProcessingComplete,
-                        'Pod .* exists and is in state Running'):
-                    og.verify_running()
+    @patch('oaatoperator.aioclient.list_objects')
+    def test_running_from_index_async(self, list_mock, _):
+        kw = self.setup_kwargs([self.pod_obj('pod1', 'Running'),
+                                self.pod_obj('pod0', 'Succeeded')])
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaisesRegex(
+                ProcessingComplete,
+                'Pod pod1 exists and is in state Running'):
+            asyncio.run(og.verify_running_async())
+        list_mock.assert_not_called()
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.aioclient.list_objects')
+    def test_nothing_running_from_index_async(self, list_mock, _):
+        kw = self.setup_kwargs([self.pod_obj('pod0', 'Failed')])
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        self.assertIsNone(asyncio.run(og.verify_running_async()))
+        list_mock.assert_not_called()
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.aioclient.delete_object')
+    def test_rogue_from_index_async(self, delete_mock, _):
+        kw = self.setup_kwargs([
+            self.pod_obj('pod1', 'Running', '2022-01-01T00:00:00Z'),
+            self.pod_obj('pod2', 'Pending', '2022-01-02T00:00:00Z')])
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'rogue pods running'):
+            asyncio.run(og.verify_running_async())
+        delete_mock.assert_awaited_once()
+        self.assertEqual(delete_mock.call_args.args[1:],
+                         ('default', 'pod2'))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.aioclient.list_objects')
+    def test_index_lag_falls_back_to_api_async(self, list_mock, _):
+        list_mock.return_value = [self.pod_obj('pod1', 'Running'),
+                                  self.pod_obj('pod0', 'Succeeded')]
+        kw = self.setup_kwargs([])
+        kw['memo'].pod = 'pod1'
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaisesRegex(
+                ProcessingComplete,
+                'Pod pod1 exists and is in state Running'):
+            asyncio.run(og.verify_running_async())
+        self.assertEqual(list_mock.call_args.kwargs['labels'],
+                         {'app': 'oaat-operator', 'parent-name': 'test-kog'})
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.aioclient.delete_object')
+    def test_straggler_async(self, delete_mock, _):
+        """Test a pod running long after its deadline is failed."""
+        started = datetime.datetime.now(tz=UTC) - datetime.timedelta(hours=1)
+        pod = self.pod_obj('pod1', 'Running', started.isoformat())
+        pod['metadata']['annotations'] = {
+            oaatoperator.deadline.DEADLINE_ANNOTATION: '600'}
+        kw = self.setup_kwargs([pod])
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaises(ProcessingComplete) as exc:
+            asyncio.run(og.verify_running_async())
+        self.assertEqual(exc.exception.ret['message'],
+                         'pod pod1 exceeded its deadline')
+        self.assertEqual(delete_mock.call_args.args,
+                         (aioclient.POD, 'default', 'pod1'))
+        self.assertEqual(delete_mock.call_args.kwargs['grace_period'], 0)
+        self.assertEqual(
+            kw['patch']['status']['items']['item1']['failure_count'], '1')
+        # the failed pod no longer holds up the next item
+        self.assertIsNone(og.running_pod)
+
+        # within its deadline (and grace), the pod is left to run, and
+        # the group is next due when it becomes a straggler
+        pod['metadata']['annotations'][
+            oaatoperator.deadline.DEADLINE_ANNOTATION] = '3600'
+        delete_mock.reset_mock()
+        og = OaatGroup(kopf_object=cast(CallbackArgs,
+                                        self.setup_kwargs([pod])))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'Pod pod1 exists and is in state'):
+            asyncio.run(og.verify_running_async())
+        delete_mock.assert_not_called()
+        self.assertEqual(og.next_due(),
+                         started + datetime.timedelta(hours=1)
+                         + oaatoperator.deadline.STRAGGLER_GRACE)
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.aioclient.delete_object')
+    def test_straggler_job_async(self, delete_mock, _):
+        """Test the Job of a pod running after its deadline is deleted."""
+        started = datetime.datetime.now(tz=UTC) - datetime.timedelta(hours=1)
+        pod = self.pod_obj('job1-abcde', 'Running', started.isoformat())
+        pod['metadata']['labels'][oaatoperator.job.JOB_NAME_LABEL] = 'job1'
+        pod['metadata']['annotations'] = {
+            oaatoperator.deadline.DEADLINE_ANNOTATION: '600'}
+        kw = self.setup_kwargs([pod])
+        kw['memo'].job = 'job1'
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaises(ProcessingComplete) as exc:
+            asyncio.run(og.verify_running_async())
+        self.assertEqual(exc.exception.ret['message'],
+                         'Job job1 exceeded its deadline')
+        self.assertEqual(delete_mock.call_args.args,
+                         (aioclient.JOB, 'default', 'job1'))
+        self.assertEqual(delete_mock.call_args.kwargs['grace_period'], 0)
+        self.assertIsNone(kw['memo'].job)
+        self.assertEqual(
+            kw['patch']['status']['items']['item1']['failure_count'], '1')
+
+        # a Job which cannot be deleted is left in place
+        delete_mock.side_effect = aioclient.APIError(
+            {'message': 'forbidden', 'code': 403}, status=403, headers={})
+        kw = self.setup_kwargs([pod])
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaises(ProcessingComplete) as exc:
+            asyncio.run(og.verify_running_async())
+        self.assertEqual(exc.exception.ret['message'],
+                         'cannot delete Job job1')
+        self.assertNotIn('items', kw['patch'].get('status', {}))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.aioclient.delete_object')
+    def test_stuck_pending_async(self, delete_mock, _):
+        """Test a pod Pending for longer than pendingTimeout is failed."""
+        created = datetime.datetime.now(tz=UTC) - datetime.timedelta(hours=1)
+        pod = self.pod_obj('pod1', 'Pending', '')
+        pod['metadata']['creationTimestamp'] = created.isoformat()
+        pod['status']['containerStatuses'] = [
+            {'state': {'waiting': {'reason': 'ImagePullBackOff'}}}]
+        kw = self.setup_kwargs([pod])
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaisesRegex(
+                ProcessingComplete,
+                'pod pod1 still pending after 0:30:00 '
+                r'\(ImagePullBackOff\)'):
+            asyncio.run(og.verify_running_async())
+        self.assertEqual(delete_mock.call_args.args,
+                         (aioclient.POD, 'default', 'pod1'))
+        self.assertEqual(
+            kw['patch']['status']['items']['item1']['failure_count'], '1')
+
+        # with a longer pendingTimeout, the pod is left to start, and the
+        # group is next due when the pod times out
+        delete_mock.reset_mock()
+        kw = self.setup_kwargs([pod])
+        kw['spec']['pendingTimeout'] = '2h'
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'Pod pod1 exists and is in state'):
+            asyncio.run(og.verify_running_async())
+        delete_mock.assert_not_called()
+        self.assertEqual(og.next_due(),
+                         created + datetime.timedelta(hours=2))
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    @patch('oaatoperator.aioclient.list_objects')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_job_without_pod_async(self, get_mock, list_mock, _):
+        """
+        Test a Job started on the previous run which has not created its
+        pod yet counts as running, until it has finished.
+        """
+        list_mock.return_value = []
+        get_mock.return_value = {'status': {'active': 1}}
+        kw = self.setup_kwargs([])
+        kw['memo'].pod = kw['memo'].job = 'job1'
+        og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'Job job1 exists and has not finished'):
+            asyncio.run(og.verify_running_async())
+        self.assertEqual(get_mock.call_args.args,
+                         (aioclient.JOB, 'default', 'job1'))
+        get_mock.return_value = {'status': {'conditions': [
+            {'type': 'Failed', 'status': 'True'}]}}
+        self.assertIsNone(asyncio.run(og.verify_running_async()))
+        self.assertIsNone(kw['memo'].job)
 
 
 class OaatGroupTests(unittest.TestCase):
@@ -573,20 +1315,11 @@ class OaatGroupTests(unittest.TestCase):
                     kopf.PermanentError,
                     'attempt to retrieve identify_running_pod '
                     'outside of kopf'):
-                og.identify_running_pod()
+                og.identify_running_pod([])
             with self.assertRaisesRegex(
                     kopf.PermanentError,
                     'attempt to retrieve verify_running_pod outside of kopf'):
                 og.verify_running_pod()
-            with self.assertRaisesRegex(
-                    kopf.PermanentError,
-                    'attempt to retrieve verify_running outside of kopf'):
-                og.verify_running()
-            with self.assertRaisesRegex(
-                    kopf.PermanentError,
-                    'attempt to retrieve delete_non_survivor_pods '
-                    'outside of kopf'):
-                og.delete_non_survivor_pods('item')
             with self.assertRaisesRegex(
                     kopf.PermanentError,
                     'attempt to retrieve resume_running_pod outside of kopf'):
@@ -760,6 +1493,63 @@ class OaatGroupTests(unittest.TestCase):
             og = OaatGroup(kopf_object=cast(CallbackArgs, kw))
             self.assertTrue(og.mark_item_success('item1'))
 
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_mark_item_success_collect_status(self, _):
+        with KubeObject(KubeOaatGroup,
+                        TestData.kog_previous_success_attrs) as kog:
+            og = OaatGroup(kube_object_name='test-kog',
+                           memo=MagicMock(),
+                           logger=MagicMock())
+            finished_at = TestData.success_time + datetime.timedelta(hours=2)
+            with og.collect_status() as status:
+                self.assertTrue(og.mark_item_success(
+                    'item1',
+                    finished_at=finished_at,
+                    started_at=finished_at - datetime.timedelta(minutes=5)))
+            kog.patch.assert_not_called()
+            self.assertEqual(status['items']['item1']['failure_count'], '0')
+            self.assertEqual(status['items']['item1']['last_success'],
+                             finished_at.isoformat())
+            self.assertIsNone(status['items']['item1']['last_verified'])
+            self.assertEqual(JobRuntimeStats.decode(
+                status['items']['item1']['runtime_stats']).count, 1)
+            self.assertEqual(status['oaat_timer'],
+                             {'message': 'item item1 completed'})
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_mark_item_failed_collect_status(self, _):
+        with KubeObject(KubeOaatGroup, TestData.kog_previous_fail_attrs) as kog:
+            og = OaatGroup(kube_object_name='test-kog',
+                           memo=MagicMock(),
+                           logger=MagicMock())
+            with og.collect_status() as status:
+                self.assertTrue(og.mark_item_failed(
+                    'item1',
+                    finished_at=(TestData.failure_time +
+                                 datetime.timedelta(hours=2)),
+                    exit_code=3))
+            kog.patch.assert_not_called()
+            self.assertIn('last_failure', status['items']['item1'])
+            self.assertEqual(
+                status['oaat_timer'],
+                {'message': 'item item1 failed with exit code 3'})
+
+    @patch('oaatoperator.oaatgroup.OaatType',
+           autospec=True,
+           obj=TestData.kot_mock)
+    def test_status_outside_collect_status(self, _):
+        with KubeObject(KubeOaatGroup, TestData.kog_attrs) as kog:
+            og = OaatGroup(kube_object_name='test-kog',
+                           memo=MagicMock(),
+                           logger=MagicMock())
+            with self.assertRaisesRegex(InternalError, 'collect_status'):
+                og.set_item_status('item1', 'podphase', 'Running')
+            kog.patch.assert_not_called()
+
     @patch('oaatoperator.oaatgroup.OaatType',
            autospec=True,
            obj=TestData.kot_mock)
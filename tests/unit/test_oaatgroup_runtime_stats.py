@@ -14,7 +14,7 @@ sys.path.append(os.path.dirname(
 
 from tests.unit.testdata import TestData
 from tests.unit.mocks_pykube import KubeObject
-from oaatoperator.oaatgroup import OaatGroup
+from oaatoperator.oaatgroup import LEGACY_RUNTIME_FIELDS, OaatGroup
 from oaatoperator.runtime_stats import JobRuntimeStats, RuntimeStatsManager
 from oaatoperator.common import KubeOaatGroup
 import oaatoperator.utility
@@ -124,22 +124,83 @@ class TestOaatGroupRuntimeStatsIntegration(unittest.TestCase):
         # Verify set_item_status was called with correct statistics
         call_args = [call.args for call in og.set_item_status.call_args_list]
 
-        # Should have calls for runtime_count, runtime_total, etc.
-        expected_calls = [
-            ('test-item', 'runtime_count'),
-            ('test-item', 'runtime_total'),
-            ('test-item', 'runtime_sum_squares'),
-            ('test-item', 'runtime_min'),
-            ('test-item', 'runtime_max'),
-            ('test-item', 'runtime_sample'),
-            ('test-item', 'runtime_last_updated')
-        ]
+        # Should store the statistics in the compact runtime_stats field
+        stored = [call for call in call_args
+                  if call[:2] == ('test-item', 'runtime_stats')]
+        self.assertEqual(len(stored), 1)
+        self.assertEqual(JobRuntimeStats.decode(stored[0][2]).count, 1)
+        self.assertFalse(any(call[1] in LEGACY_RUNTIME_FIELDS
+                             for call in call_args))
+
+    @patch('oaatoperator.oaatgroup.OaatType', autospec=True)
+    def test_init_with_compact_runtime_stats(self, oaat_type_mock):
+        """Test statistics are read from the compact encoding lazily."""
+        original = JobRuntimeStats()
+        for runtime in [90, 95, 100, 105, 110]:
+            original.add_runtime(runtime)
+        kopf_obj = TestData.setup_kwargs(TestData.kog_empty_attrs)
+        kopf_obj['status'] = {
+            'items': {'item1': {'runtime_stats': original.encode()}}
+        }
+
+        with KubeObject(KubeOaatGroup, TestData.kog_empty_attrs):
+            og = OaatGroup(kopf_object=kopf_obj)
+
+        with patch.object(JobRuntimeStats, 'decode',
+                          wraps=JobRuntimeStats.decode) as decode:
+            og.get_predicted_runtime('item2')
+            decode.assert_not_called()
+            self.assertEqual(og.get_predicted_runtime('item1'),
+                             original.predict_runtime())
+            og.get_predicted_runtime('item1')
+            decode.assert_called_once()
+
+    @patch('oaatoperator.oaatgroup.OaatType', autospec=True)
+    def test_expected_runtime(self, oaat_type_mock):
+        """Test the expected runtime is the mean of the item's runtimes."""
+        original = JobRuntimeStats()
+        for runtime in [90, 95, 100, 105, 110]:
+            original.add_runtime(runtime)
+        kopf_obj = TestData.setup_kwargs(TestData.kog_empty_attrs)
+        kopf_obj['status'] = {
+            'items': {'item1': {'runtime_stats': original.encode()}}
+        }
+
+        with KubeObject(KubeOaatGroup, TestData.kog_empty_attrs):
+            og = OaatGroup(kopf_object=kopf_obj)
+
+        self.assertEqual(og.get_expected_runtime('item1'), 100)
+        self.assertIsNone(og.get_expected_runtime('item2'))
+
+    @patch('oaatoperator.oaatgroup.OaatType', autospec=True)
+    def test_legacy_runtime_stats_migrated(self, oaat_type_mock):
+        """Test saving removes the legacy runtime_* fields."""
+        kopf_obj = TestData.setup_kwargs(TestData.kog_empty_attrs)
+        kopf_obj['status'] = {
+            'items': {
+                'item1': {
+                    'runtime_count': '2',
+                    'runtime_total': '200.0',
+                    'runtime_sum_squares': '20000.0',
+                    'runtime_sample': '[100, 100]',
+                }
+            }
+        }
+
+        with KubeObject(KubeOaatGroup, TestData.kog_empty_attrs):
+            og = OaatGroup(kopf_object=kopf_obj)
+        og.set_item_status = Mock()
+
+        og.record_item_runtime('item1', 100.0)
 
-        for expected_call in expected_calls:
-            self.assertTrue(
-                any(call[:2] == expected_call for call in call_args),
-                f"Expected call {expected_call} not found in {call_args}"
-            )
+        calls = {call.args[1]: call.args[2:]
+                 for call in og.set_item_status.call_args_list}
+        self.assertEqual(JobRuntimeStats.decode(
+            calls['runtime_stats'][0]).count, 3)
+        for key in ('runtime_count', 'runtime_total', 'runtime_sum_squares',
+                    'runtime_sample'):
+            self.assertEqual(calls[key], (None,))
+        self.assertNotIn('runtime_min', calls)
 
     @patch('oaatoperator.oaatgroup.OaatType', autospec=True)
     def test_runtime_recording_no_start_time(self, oaat_type_mock):
@@ -1,10 +1,11 @@
+import asyncio
 import sys
 import os
 import kopf
 import pykube
 from copy import deepcopy
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 import unittest
 import pytest
 
@@ -17,8 +18,11 @@ sys.path.append(
 
 from tests.unit.testdata import TestData  # noqa: E402
 from tests.unit.utility import ExtendedTestCase, get_env  # noqa: E402
-from oaatoperator.oaatitem import OaatItem, OaatItems  # noqa: E402
+from oaatoperator import oaatitem  # noqa: E402
+from oaatoperator.oaatitem import ItemState, OaatItem, OaatItems  # noqa: E402
 from oaatoperator.common import ProcessingComplete  # noqa: E402
+from oaatoperator.deadline import DEADLINE_ANNOTATION  # noqa: E402
+from oaatoperator import aioclient  # noqa: E402
 
 
 class OaatItemTests(unittest.TestCase):
@@ -34,49 +38,170 @@ class OaatItemTests(unittest.TestCase):
         self.assertEqual(oi.failure(), TestData.failure_time)
         self.assertEqual(oi.numfails(), TestData.failure_count)
 
+    def test_state_parsed_once(self):
+        oi = OaatItem(TestData.kog_previous_fail_mock, 'item1')
+        with patch('oaatoperator.oaatitem.date_from_isostr',
+                   wraps=oaatitem.date_from_isostr) as parse:
+            oaatitem._parse_state.cache_clear()
+            state = oi.state
+            self.assertIsInstance(state, ItemState)
+            self.assertEqual(oi.failure(), TestData.failure_time)
+            self.assertEqual(oi.success(), state.success)
+            self.assertEqual(parse.call_count, 4)
+            # the same status seen again (e.g. in a later handler call) is
+            # not parsed again
+            other = OaatItem(TestData.kog_previous_fail_mock, 'item1')
+            self.assertEqual(other.state, state)
+            self.assertEqual(parse.call_count, 4)
 
-class RunItemTests(unittest.TestCase):
-    def setUp(self):
-        return super().setUp()
 
+class RunItemAsyncTests(unittest.TestCase):
     @patch('kopf.adopt')
     @patch('oaatoperator.oaatgroup.OaatGroup', autospec=True)
-    @patch('pykube.Pod')
-    def test_sunny(self, pod_mock, og_mock, kopf_adopt_mock):
+    @patch('oaatoperator.aioclient.create_object')
+    def test_sunny(self, create_mock, og_mock, kopf_adopt_mock):
         TestData.add_og_mock_attributes(og_mock)
+        og_mock.logger = MagicMock()
+        og_mock.namespace.return_value = 'default'
         og_mock.oaattype.podspec.return_value = deepcopy(
             TestData.kot_typespec.get('podspec', {}))
+        create_mock.return_value = {
+            'apiVersion': 'v1', 'kind': 'Pod',
+            'metadata': {'name': 'item1-abcde', 'uid': 'uid1'}}
         oi = OaatItem(og_mock, 'item1')
-        oi.run()
-        og_mock.oaattype.podspec.assert_called_once()
-        kopf_adopt_mock.assert_called_once()
-        pod = pod_mock.call_args.args[1]
-        self.assertEqual(pod['metadata']['labels']['oaat-name'], 'item1')
+        pod = asyncio.run(oi.run_async())
+        self.assertEqual(pod.name, 'item1-abcde')
+        namespace, doc = create_mock.call_args.args[1:]
+        self.assertEqual(namespace, 'default')
+        self.assertEqual(doc['metadata']['labels']['oaat-name'], 'item1')
         self.assertEqual(
-            get_env(pod['spec']['containers'][0]['env'], 'OAAT_ITEM'), 'item1')
+            get_env(doc['spec']['containers'][0]['env'], 'OAAT_ITEM'), 'item1')
+        self.assertEqual(og_mock.set_item_status.call_args.args[:2],
+                         ('item1', 'last_started'))
 
     @patch('kopf.adopt')
     @patch('oaatoperator.oaatgroup.OaatGroup', autospec=True)
-    @patch('pykube.Pod')
-    def test_podfail(self, pod_mock, og_mock, kopf_adopt_mock):
+    @patch('oaatoperator.aioclient.create_object')
+    def test_podfail(self, create_mock, og_mock, kopf_adopt_mock):
         TestData.add_og_mock_attributes(og_mock)
+        og_mock.logger = MagicMock()
+        og_mock.namespace.return_value = 'default'
         og_mock.oaattype.podspec.return_value = deepcopy(
             TestData.kot_typespec.get('podspec', {}))
-        pod_instance_mock = pod_mock.return_value
-        pod_instance_mock.create.side_effect = pykube.KubernetesError(
-            'test error')
+        create_mock.side_effect = aioclient.APIError(status=500, headers={})
         oi = OaatItem(og_mock, 'item1')
         with self.assertRaisesRegex(ProcessingComplete,
                                     'error creating pod for item1'):
-            oi.run()
-        og_mock.oaattype.podspec.assert_called_once()
-        kopf_adopt_mock.assert_called_once()
+            asyncio.run(oi.run_async())
+        og_mock.mark_item_failed.assert_called_once_with('item1')
+
+    @patch('kopf.adopt')
+    @patch('oaatoperator.oaatgroup.OaatGroup', autospec=True)
+    @patch('oaatoperator.aioclient.create_object')
+    def test_job(self, create_mock, og_mock, kopf_adopt_mock):
+        """Test a Job is created for an OaatType with type: job."""
+        TestData.add_og_mock_attributes(og_mock)
+        og_mock.logger = MagicMock()
+        og_mock.namespace.return_value = 'default'
+        og_mock.oaattype.backend.return_value = 'job'
+        og_mock.oaattype.podspec.return_value = deepcopy(
+            TestData.kot_typespec.get('podspec', {}))
+        og_mock.oaattype.jobspec.return_value = {
+            'ttlSecondsAfterFinished': 600, 'activeDeadlineSeconds': 60}
+        create_mock.return_value = {
+            'apiVersion': 'batch/v1', 'kind': 'Job',
+            'metadata': {'name': 'item1-abcde', 'uid': 'uid1'}}
+        oi = OaatItem(og_mock, 'item1')
+        job = asyncio.run(oi.run_async())
+        self.assertIsInstance(job, pykube.Job)
+        resource, namespace, doc = create_mock.call_args.args
+        self.assertEqual(resource, aioclient.JOB)
+        self.assertEqual(doc['kind'], 'Job')
+        self.assertEqual(doc['metadata']['labels']['oaat-name'], 'item1')
+        spec = doc['spec']
+        self.assertEqual(
+            (spec['backoffLimit'], spec['ttlSecondsAfterFinished'],
+             spec['activeDeadlineSeconds']), (0, 600, 60))
+        template = spec['template']
+        self.assertEqual(template['metadata']['labels']['parent-name'],
+                         og_mock.name)
+        self.assertEqual(template['spec']['restartPolicy'], 'Never')
+        self.assertEqual(
+            get_env(template['spec']['containers'][0]['env'], 'OAAT_ITEM'),
+            'item1')
+
+    @patch('kopf.adopt')
+    @patch('oaatoperator.oaatgroup.OaatGroup', autospec=True)
+    @patch('oaatoperator.aioclient.create_object')
+    def test_deadline(self, create_mock, og_mock, kopf_adopt_mock):
+        """Test the pod is given the item's deadline."""
+        TestData.add_og_mock_attributes(og_mock)
+        og_mock.logger = MagicMock()
+        og_mock.namespace.return_value = 'default'
+        og_mock.item_deadline.return_value = 900
+        og_mock.oaattype.podspec.return_value = deepcopy(
+            TestData.kot_typespec.get('podspec', {}))
+        create_mock.return_value = {
+            'apiVersion': 'v1', 'kind': 'Pod',
+            'metadata': {'name': 'item1-abcde', 'uid': 'uid1'}}
+        asyncio.run(OaatItem(og_mock, 'item1').run_async())
+        og_mock.item_deadline.assert_called_once_with(['item1'])
+        doc = create_mock.call_args.args[2]
+        self.assertEqual(doc['spec']['activeDeadlineSeconds'], 900)
+        self.assertEqual(
+            doc['metadata']['annotations'][DEADLINE_ANNOTATION], '900')
+
+    @patch('oaatoperator.oaatgroup.OaatGroup', autospec=True)
+    @patch('oaatoperator.aioclient.create_object')
+    @patch('oaatoperator.worker.dispatch_async')
+    def test_worker(self, dispatch_mock, create_mock, og_mock):
+        """Test an item is sent to the worker rather than run in a pod."""
+        TestData.add_og_mock_attributes(og_mock)
+        og_mock.oaattype.backend.return_value = 'worker'
+        og_mock.worker_pod = {'metadata': {'name': 'kog-worker'}}
+        oi = OaatItem(og_mock, 'item1')
+        pod = asyncio.run(oi.run_async())
+        self.assertEqual(pod, dispatch_mock.return_value)
+        dispatch_mock.assert_awaited_once_with(oi, og_mock.worker_pod)
+        create_mock.assert_not_called()
+
+    @patch('kopf.adopt')
+    @patch('oaatoperator.oaatgroup.OaatGroup', autospec=True)
+    @patch('oaatoperator.aioclient.create_object')
+    def test_batch(self, create_mock, og_mock, kopf_adopt_mock):
+        """Test a single pod is created to run a batch of items."""
+        TestData.add_og_mock_attributes(og_mock)
+        og_mock.logger = MagicMock()
+        og_mock.namespace.return_value = 'default'
+        og_mock.oaattype.podspec.return_value = deepcopy(
+            TestData.kot_typespec.get('podspec', {}))
+        create_mock.return_value = {
+            'apiVersion': 'v1', 'kind': 'Pod',
+            'metadata': {'name': 'item1-abcde', 'uid': 'uid1'}}
+        oi = OaatItem(og_mock, 'item1')
+        asyncio.run(oi.run_async(['item1', 'item2']))
+        create_mock.assert_awaited_once()
+        doc = create_mock.call_args.args[2]
+        env = doc['spec']['containers'][0]['env']
+        self.assertEqual(get_env(env, 'OAAT_ITEM'), 'item1')
+        self.assertEqual(get_env(env, 'OAAT_ITEMS'), 'item1\nitem2')
+        self.assertEqual(
+            doc['metadata']['annotations'][oaatitem.BATCH_ANNOTATION],
+            '["item1", "item2"]')
+        self.assertEqual(
+            [c.args[:2] for c in og_mock.set_item_status.call_args_list],
+            [('item1', 'last_started'), ('item2', 'last_started')])
 
     @patch('kopf.adopt')
     @patch('oaatoperator.oaatgroup.OaatGroup', autospec=True)
-    @patch('pykube.Pod')
-    def test_substitute(self, pod_mock, og_mock, kopf_adopt_mock):
+    @patch('oaatoperator.aioclient.create_object')
+    def test_substitute(self, create_mock, og_mock, kopf_adopt_mock):
         TestData.add_og_mock_attributes(og_mock)
+        og_mock.logger = MagicMock()
+        og_mock.namespace.return_value = 'default'
+        create_mock.return_value = {
+            'apiVersion': 'v1', 'kind': 'Pod',
+            'metadata': {'name': 'item1-abcde', 'uid': 'uid1'}}
         kot_substitutions_podspec = deepcopy(
             TestData.kot_typespec.get('podspec', {}))
         kot_substitutions_podspec['container']['command'] = [
@@ -91,11 +216,11 @@ class RunItemTests(unittest.TestCase):
         ]
         og_mock.oaattype.podspec.return_value = kot_substitutions_podspec
         oi = OaatItem(og_mock, 'item1')
-        oi.run()
+        asyncio.run(oi.run_async())
         og_mock.oaattype.podspec.assert_called_once()
         kopf_adopt_mock.assert_called_once()
 
-        pod = pod_mock.call_args.args[1]
+        pod = create_mock.call_args.args[2]
         self.assertEqual(pod['metadata']['labels']['oaat-name'], 'item1')
         self.assertEqual(pod['spec']['containers'][0]['command'][0], 'a')
         self.assertEqual(pod['spec']['containers'][0]['command'][1], 'b')
@@ -162,6 +287,8 @@ class TestOaatItems(ExtendedTestCase):
         self.assertEqual(ois.group, og_mock)
         items = ois.list()
         self.assertIsInstance(items, list)
+        # items are only created once per OaatItems
+        self.assertIs(ois.get('item1'), items[0])
 
     @patch('oaatoperator.oaatgroup.OaatGroup', autospec=True)
     def test_list_kopfobj(self, og_mock):
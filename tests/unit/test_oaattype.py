@@ -1,8 +1,11 @@
 import unittest
+from copy import deepcopy
+from unittest.mock import patch
 import pytest
 
 from tests.unit.mocks_pykube import KubeObject
 from tests.unit.testdata import TestData
+from oaatoperator.cache import oaattype_stats
 from oaatoperator.oaattype import OaatType
 from oaatoperator.common import KubeOaatType, ProcessingComplete
 
@@ -83,10 +86,99 @@ class BasicTests(unittest.TestCase):
             with self.assertRaises(ProcessingComplete) as exc:
                 ot.podspec()
             self.assertEqual(exc.exception.ret['error'],
-                             'spec.type must be "pod"')
+                             'spec.type must be "pod", "job" or "worker"')
 
     def test_podspec(self):
         with KubeObject(KubeOaatType, TestData.kot_spec):
             ot = OaatType('test-kot')
             podspec = ot.podspec()
             self.assertEqual(podspec['container']['name'], 'test')
+            self.assertEqual(ot.backend(), 'pod')
+
+    def test_jobspec(self):
+        kot = deepcopy(TestData.kot_spec)
+        kot['spec']['type'] = 'job'
+        with KubeObject(KubeOaatType, kot):
+            ot = OaatType('test-kot')
+            self.assertEqual(ot.backend(), 'job')
+            self.assertEqual(ot.podspec()['container']['name'], 'test')
+            self.assertEqual(ot.jobspec(), {'ttlSecondsAfterFinished': 43200})
+        kot['spec']['jobspec'] = {'ttlSecondsAfterFinished': 0,
+                                  'activeDeadlineSeconds': 600}
+        with KubeObject(KubeOaatType, kot):
+            self.assertEqual(OaatType('test-kot').jobspec(),
+                             {'ttlSecondsAfterFinished': 0,
+                              'activeDeadlineSeconds': 600})
+
+    def test_jobspec_invalid(self):
+        kot = deepcopy(TestData.kot_spec)
+        kot['spec']['type'] = 'job'
+        for jobspec, error in [
+                ({'activeDeadlineSeconds': 0},
+                 'spec.jobspec.activeDeadlineSeconds must be an integer of '
+                 'at least 1'),
+                ({'ttlSecondsAfterFinished': '1h'},
+                 'spec.jobspec.ttlSecondsAfterFinished must be an integer '
+                 'of at least 0'),
+                ({'backoffLimit': 3},
+                 'spec.jobspec.backoffLimit is not supported')]:
+            kot['spec']['jobspec'] = jobspec
+            with KubeObject(KubeOaatType, kot):
+                with self.assertRaises(ProcessingComplete) as exc:
+                    OaatType('test-kot').jobspec()
+                self.assertEqual(exc.exception.ret['error'], error)
+
+    def test_workerspec(self):
+        kot = deepcopy(TestData.kot_spec)
+        kot['spec']['type'] = 'worker'
+        with KubeObject(KubeOaatType, kot):
+            ot = OaatType('test-kot')
+            self.assertEqual(ot.backend(), 'worker')
+            self.assertEqual(ot.workerspec(), {'port': 8080})
+        for workerspec, error in [
+                ({'port': 0}, 'spec.worker.port must be a port number'),
+                ({'path': '/run'}, 'spec.worker.path is not supported')]:
+            kot['spec']['worker'] = workerspec
+            with KubeObject(KubeOaatType, kot):
+                with self.assertRaises(ProcessingComplete) as exc:
+                    OaatType('test-kot').workerspec()
+                self.assertEqual(exc.exception.ret['error'], error)
+
+
+class IndexTests(unittest.TestCase):
+    def setUp(self):
+        oaattype_stats.reset()
+        self.index = {('default', 'test-kot'): [deepcopy(TestData.kot_spec)]}
+        return super().setUp()
+
+    def test_from_index(self):
+        with patch.object(KubeOaatType, 'objects') as objects:
+            ot = OaatType('test-kot', namespace='default', index=self.index)
+        objects.assert_not_called()
+        self.assertEqual(ot.podspec()['container']['name'], 'test')
+        self.assertEqual(oaattype_stats.hits, 1)
+        self.assertEqual(oaattype_stats.misses, 0)
+
+    def test_from_index_is_copy(self):
+        ot = OaatType('test-kot', namespace='default', index=self.index)
+        ot.podspec()['container']['name'] = 'changed'
+        ot2 = OaatType('test-kot', namespace='default', index=self.index)
+        self.assertEqual(ot2.podspec()['container']['name'], 'test')
+
+    def test_index_miss(self):
+        with patch.object(KubeOaatType, 'objects') as objects:
+            with self.assertRaises(ProcessingComplete) as exc:
+                OaatType('test-kot', namespace='other', index=self.index)
+        objects.assert_not_called()
+        self.assertEqual(exc.exception.ret['error'],
+                         'cannot find OaatType other/test-kot')
+        self.assertEqual(oaattype_stats.hits, 0)
+        self.assertEqual(oaattype_stats.misses, 1)
+
+    def test_deleted_from_index(self):
+        del self.index[('default', 'test-kot')]
+        with self.assertRaises(ProcessingComplete) as exc:
+            OaatType('test-kot', namespace='default', index=self.index)
+        self.assertRegex(exc.exception.ret['error'],
+                         'cannot find OaatType default/test-kot')
+        self.assertEqual(oaattype_stats.misses, 1)
@@ -161,9 +161,51 @@ class TestOverseerStatus:
 
     def test_set_status_none_value(self):
         """Test set_status with None value."""
+        self.status['state_to_delete'] = 'value'
         self.overseer.set_status('state_to_delete', None)
         assert self.patch['status']['state_to_delete'] is None
 
+    def test_set_status_unchanged(self):
+        """Test set_status does not patch a value which is already set."""
+        self.overseer.set_status('existing_state', 'existing_value')
+        self.overseer.set_status('missing_key', None)
+        assert self.patch == {}
+
+    def test_set_status_reverted(self):
+        """Test a change reverted within the handler is not patched."""
+        self.overseer.set_status('existing_state', 'new_value')
+        self.overseer.set_status('existing_state', 'existing_value')
+        assert self.patch == {}
+
+    def test_set_status_changed_fields(self):
+        """Test only the changed fields of a dict are patched."""
+        self.status['handler_status'] = {'state': 'idle', 'loops': 3}
+        self.overseer.set_status('handler_status',
+                                 {'state': 'running', 'loops': 3})
+        assert self.patch['status']['handler_status'] == {'state': 'running'}
+
+    @pytest.mark.parametrize('flush_every,loops,written', [
+        (None, 4, True),
+        ('10', 4, False),
+        ('10', 13, True),
+        ('junk', 4, True),
+    ])
+    def test_set_status_counters(self, monkeypatch, flush_every, loops,
+                                 written):
+        """Test informational counters are written at a coarser interval."""
+        if flush_every is not None:
+            monkeypatch.setenv('OAAT_COUNTER_FLUSH_EVERY', flush_every)
+        self.overseer._counters = {'handler_status': ('loops',)}
+        self.status['handler_status'] = {'state': 'idle', 'loops': 3}
+        self.overseer.set_status('handler_status',
+                                 {'state': 'idle', 'loops': loops})
+        assert ('handler_status' in self.patch.get('status', {})) == written
+        # any other change writes the counter too
+        self.overseer.set_status('handler_status',
+                                 {'state': 'running', 'loops': loops})
+        assert self.patch['status']['handler_status'] == {
+            'state': 'running', 'loops': loops}
+
     def test_set_status_none_patch(self):
         """Test set_status raises error when patch is None."""
         self.overseer.patch = None
@@ -342,12 +384,23 @@ class TestOverseerAnnotations:
 
     def test_set_annotation_none_value(self):
         """Test set_annotation with None value (removal)."""
+        self.overseer.meta['annotations'] = {
+            'oaatoperator.kawaja.net/remove_annotation': 'value'}
         self.overseer.set_annotation('remove_annotation', None)
 
         expected_key = 'oaatoperator.kawaja.net/remove_annotation'
         assert self.patch['metadata']['annotations'][expected_key] is None
         self.mock_logger.debug.assert_called_once_with('removed annotation remove_annotation from test-pod')
 
+    def test_set_annotation_unchanged(self):
+        """Test set_annotation does not patch an unchanged annotation."""
+        self.overseer.meta['annotations'] = {
+            'oaatoperator.kawaja.net/count': '42'}
+        self.overseer.set_annotation('count', 42)
+        self.overseer.set_annotation('missing', None)
+        assert self.patch == {}
+        self.mock_logger.debug.assert_not_called()
+
     def test_set_annotation_none_patch(self):
         """Test set_annotation raises error when patch is None."""
         self.overseer.patch = None
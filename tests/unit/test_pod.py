@@ -1,13 +1,15 @@
+import asyncio
 import sys
 import os
 import datetime
 import copy
+import json
 import kopf
 from pykube import Pod
 
 import unittest
 import unittest.mock
-from unittest.mock import patch, call
+from unittest.mock import create_autospec, patch, call
 import pytest
 
 pytestmark = pytest.mark.unit
@@ -19,12 +21,21 @@ sys.path.append(
 
 from tests.unit.testdata import TestData  # noqa: E402
 from tests.unit.mocks_pykube import KubeObject  # noqa: E402
-from oaatoperator.pod import PodOverseer  # noqa: E402
+from oaatoperator import aioclient  # noqa: E402
+from oaatoperator.pod import (JobOverseer, PodOverseer,  # noqa: E402
+                              reconcile_pods_async)
 from oaatoperator.common import ProcessingComplete  # noqa: E402
+from oaatoperator.oaatgroup import OaatGroup  # noqa: E402
+from oaatoperator.oaatitem import BATCH_ANNOTATION  # noqa: E402
 
 UTC = datetime.timezone.utc
 
 
+def parent():
+    """Mock of the OaatGroup retrieved as the parent of a pod."""
+    return create_autospec(OaatGroup, instance=True)
+
+
 class OldTestData:
     kog_empty = {
         'apiVersion': 'kawaja.net/v1',
@@ -80,27 +91,219 @@ class BasicTests(unittest.TestCase):
             PodOverseer(None)  # type: ignore
 
 
+class AsyncStatusTests(unittest.TestCase):
+    def setUp(self):
+        self.kog = copy.deepcopy(TestData.kog_attrs)
+        self.kog['metadata']['namespace'] = 'default'
+        return super().setUp()
+
+    @patch('oaatoperator.aioclient.patch_object')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_success_async(self, get_mock, patch_mock):
+        get_mock.return_value = self.kog
+        p = PodOverseer(**TestData.setup_kwargs(TestData.kp_success))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'item item completed'):
+            asyncio.run(p.update_success_status_async())
+        self.assertEqual(get_mock.call_args.args[1:],
+                         ('default', 'test-kog'))
+        patch_mock.assert_awaited_once()
+        resource, namespace, name, body = patch_mock.call_args.args
+        self.assertEqual((resource, namespace, name),
+                         (aioclient.OAATGROUP, 'default', 'test-kog'))
+        self.assertEqual(body['status']['items']['item']['last_success'],
+                         TestData.success_time.isoformat())
+        self.assertEqual(body['status']['oaat_timer'],
+                         {'message': 'item item completed'})
+
+    @patch('oaatoperator.aioclient.patch_object')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_success_async_configmap_storage(self, get_mock, patch_mock):
+        self.kog['spec']['itemStorage'] = 'configmap'
+        self.kog['spec']['itemStorageBuckets'] = 1
+        bucket = {'data': {'item.failure_count': '2'}}
+        get_mock.side_effect = [self.kog, bucket]
+        p = PodOverseer(**TestData.setup_kwargs(TestData.kp_success))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'item item completed'):
+            asyncio.run(p.update_success_status_async())
+        self.assertEqual(get_mock.call_args.args,
+                         (aioclient.CONFIGMAP, 'default',
+                          'test-kog-items-000'))
+        group_patch, item_patch = [c.args for c in patch_mock.call_args_list]
+        self.assertNotIn('items', group_patch[3]['status'])
+        self.assertEqual(item_patch[:3], (aioclient.CONFIGMAP, 'default',
+                                          'test-kog-items-000'))
+        data = item_patch[3]['data']
+        self.assertEqual(data['item.failure_count'], '0')
+        self.assertEqual(data['item.last_success'],
+                         TestData.success_time.isoformat())
+
+    @patch('oaatoperator.aioclient.patch_object')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_failure_async(self, get_mock, patch_mock):
+        get_mock.return_value = self.kog
+        p = PodOverseer(**TestData.setup_kwargs(TestData.kp_failure))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'item failed with exit code'):
+            asyncio.run(p.update_failure_status_async())
+        patch_mock.assert_awaited_once()
+        body = patch_mock.call_args.args[3]
+        self.assertEqual(body['status']['items']['item']['failure_count'],
+                         '1')
+
+    @patch('oaatoperator.aioclient.patch_object')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_phase_async(self, get_mock, patch_mock):
+        get_mock.return_value = self.kog
+        p = PodOverseer(**TestData.setup_kwargs(TestData.kp_spec))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'new phase=Running'):
+            asyncio.run(p.update_phase_async())
+        patch_mock.assert_awaited_once()
+        self.assertEqual(
+            patch_mock.call_args.args[3],
+            {'status': {'items': {'item': {'podphase': 'Running'}}}})
+
+    @patch('oaatoperator.aioclient.patch_object')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_reconcile_pods_async(self, get_mock, patch_mock):
+        """
+        Test several pods of a group are reconciled with one retrieval
+        and one patch of the group.
+        """
+        get_mock.return_value = self.kog
+        running = copy.deepcopy(TestData.kp_spec)
+        running['metadata']['labels']['oaat-name'] = 'item2'
+        succeeded = copy.deepcopy(TestData.kp_success)
+        succeeded['status']['phase'] = 'Succeeded'
+        pods = [PodOverseer(**TestData.setup_kwargs(pod))
+                for pod in (TestData.kp_failure, succeeded, running)]
+        oaatgroup = asyncio.run(reconcile_pods_async(pods))
+        self.assertEqual(oaatgroup.kube_object.name, 'test-kog')
+        get_mock.assert_awaited_once()
+        patch_mock.assert_awaited_once()
+        items = patch_mock.call_args.args[3]['status']['items']
+        self.assertEqual(items['item']['last_success'],
+                         TestData.success_time.isoformat())
+        self.assertEqual(items['item2'], {'podphase': 'Running'})
+
+    @patch('oaatoperator.aioclient.patch_object')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_reconcile_pods_async_unchanged(self, get_mock, patch_mock):
+        """Test nothing is written when the group is up to date."""
+        self.kog['status'] = {'items': {'item': {'podphase': 'Running'}}}
+        get_mock.return_value = self.kog
+        asyncio.run(reconcile_pods_async(
+            [PodOverseer(**TestData.setup_kwargs(TestData.kp_spec))]))
+        patch_mock.assert_not_awaited()
+        self.assertIsNone(asyncio.run(reconcile_pods_async([])))
+
+    @patch('oaatoperator.aioclient.get_object')
+    def test_parent_missing_async(self, get_mock):
+        get_mock.side_effect = aioclient.APINotFoundError(
+            status=404, headers={})
+        p = PodOverseer(**TestData.setup_kwargs(TestData.kp_success))
+        with self.assertRaisesRegex(kopf.TemporaryError,
+                                    'cannot find Object test-kog'):
+            asyncio.run(p.update_success_status_async())
+
+    @patch('oaatoperator.aioclient.delete_object')
+    def test_delete_async(self, delete_mock):
+        p = PodOverseer(**TestData.setup_kwargs(TestData.kp_success))
+        asyncio.run(p.delete_async())
+        self.assertEqual(delete_mock.call_args.args,
+                         (aioclient.POD, 'default', 'test-kp'))
+
+    @patch('oaatoperator.aioclient.delete_object')
+    def test_delete_async_error(self, delete_mock):
+        delete_mock.side_effect = aioclient.APIError(status=500, headers={})
+        p = PodOverseer(**TestData.setup_kwargs(TestData.kp_success))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'cannot delete "test-kp" object'):
+            asyncio.run(p.delete_async())
+
+
+class JobTests(unittest.TestCase):
+    def setUp(self):
+        self.kog = copy.deepcopy(TestData.kog_attrs)
+        self.kog['metadata']['namespace'] = 'default'
+        return super().setUp()
+
+    @staticmethod
+    def job(condition=None, **status):
+        job = copy.deepcopy(TestData.kp_spec)
+        job['apiVersion'], job['kind'] = 'batch/v1', 'Job'
+        job['status'] = {'startTime': TestData.start_time.isoformat(),
+                         **status}
+        if condition:
+            job['status']['conditions'] = [
+                {'type': 'Suspended', 'status': 'False'},
+                {'type': condition, 'status': 'True',
+                 'reason': 'DeadlineExceeded',
+                 'lastTransitionTime': TestData.failure_time.isoformat()}]
+        return job
+
+    def test_phase(self):
+        self.assertEqual(
+            JobOverseer(**TestData.setup_kwargs(self.job())).phase,
+            'Running')
+        self.assertEqual(JobOverseer(**TestData.setup_kwargs(
+            self.job('Complete'))).phase, 'Succeeded')
+        self.assertEqual(JobOverseer(**TestData.setup_kwargs(
+            self.job('Failed'))).phase, 'Failed')
+
+    @patch('oaatoperator.aioclient.patch_object')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_success_async(self, get_mock, patch_mock):
+        """Test a completed Job records the item's success and runtime."""
+        get_mock.return_value = self.kog
+        j = JobOverseer(**TestData.setup_kwargs(self.job(
+            'Complete', completionTime=TestData.success_time.isoformat())))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'item item completed'):
+            asyncio.run(j.update_success_status_async())
+        self.assertEqual((j.started_at, j.finished_at),
+                         (TestData.start_time, TestData.success_time))
+        items = patch_mock.call_args.args[3]['status']['items']
+        self.assertEqual(items['item']['last_success'],
+                         TestData.success_time.isoformat())
+        self.assertIn('runtime_stats', items['item'])
+
+    @patch('oaatoperator.aioclient.patch_object')
+    @patch('oaatoperator.aioclient.get_object')
+    def test_failure_async(self, get_mock, patch_mock):
+        get_mock.return_value = self.kog
+        j = JobOverseer(**TestData.setup_kwargs(self.job('Failed')))
+        with self.assertRaisesRegex(ProcessingComplete,
+                                    'item failed with exit code: -1, '
+                                    'reason: DeadlineExceeded'):
+            asyncio.run(j.update_failure_status_async())
+        items = patch_mock.call_args.args[3]['status']['items']
+        self.assertEqual(items['item']['last_failure'],
+                         TestData.failure_time.isoformat())
+
+
 class StatusTests(unittest.TestCase):
 
     def setUp(self):
         return super().setUp()
 
-    @patch('oaatoperator.pod.OaatGroup', autospec=True)
-    def test_success(self, og_mock):
-        og_mock.kopf_object = TestData.setup_kwargs(TestData.kog_empty_attrs)
+    @patch('oaatoperator.pod.PodOverseer.get_parent_async')
+    def test_success(self, get_parent):
+        get_parent.return_value = og = parent()
         op = TestData.setup_kwargs(TestData.kp_success)
         p = PodOverseer(**op)
         self.assertIsInstance(p, PodOverseer)
         with self.assertRaises(ProcessingComplete):
-            p.update_success_status()
+            asyncio.run(p.update_success_status_async())
         self.assertEqual(
-            og_mock().mark_item_success.call_args,
+            og.mark_item_success.call_args,
             call(op['labels']['oaat-name'], finished_at=TestData.success_time, started_at=TestData.start_time))
 
-    @patch('oaatoperator.pod.OaatGroup', autospec=True)
-    def test_failure(self, og_mock):
-        og_mock.kopf_object = TestData.setup_kwargs(
-            TestData.kog_previous_success_attrs)
+    @patch('oaatoperator.pod.PodOverseer.get_parent_async')
+    def test_failure(self, get_parent):
+        get_parent.return_value = og = parent()
         op = TestData.setup_kwargs(TestData.kp_failure)
         p = PodOverseer(**op)
         exit_code = (op['status']['containerStatuses'][0]['state']
@@ -109,19 +312,17 @@ class StatusTests(unittest.TestCase):
         with self.assertRaisesRegex(
                 ProcessingComplete,
                 f'item failed with exit code: {exit_code}'):
-            p.update_failure_status()
+            asyncio.run(p.update_failure_status_async())
         self.assertEqual(
-            og_mock().mark_item_failed.call_args,
+            og.mark_item_failed.call_args,
             call(op['labels']['oaat-name'],
                  finished_at=TestData.failure_time,
                  exit_code=exit_code))
 
-    @patch('oaatoperator.pod.OaatGroup', autospec=True)
-    def test_success_old(self, og_mock):
-        og_mock.kopf_object = TestData.setup_kwargs(
-            TestData.kog_previous_success_attrs)
-        og_instance_mock = og_mock.return_value
-        og_instance_mock.mark_item_success.return_value = False
+    @patch('oaatoperator.pod.PodOverseer.get_parent_async')
+    def test_success_old(self, get_parent):
+        get_parent.return_value = og = parent()
+        og.mark_item_success.return_value = False
         op = TestData.setup_kwargs(TestData.kp_success)
         finished_at = (TestData.success_time - datetime.timedelta(hours=2))
         op['status']['containerStatuses'][0]['state']['terminated'][
@@ -130,25 +331,23 @@ class StatusTests(unittest.TestCase):
         self.assertIsInstance(p, PodOverseer)
         with self.assertRaisesRegex(ProcessingComplete,
                                     'ignoring old successful job pod=test-kp'):
-            p.update_success_status()
+            asyncio.run(p.update_success_status_async())
         self.assertEqual(p.finished_at, finished_at)
         self.assertEqual(
-            og_instance_mock.mark_item_success.call_args,
+            og.mark_item_success.call_args,
             call(op['labels']['oaat-name'], finished_at=finished_at, started_at=TestData.start_time))
         newFA = (TestData.success_time - datetime.timedelta(days=2))
         p.finished_at = newFA
         with self.assertRaisesRegex(ProcessingComplete,
                                     'ignoring old successful job pod=test-kp'):
-            p.update_success_status()
+            asyncio.run(p.update_success_status_async())
         # insure finished_at is not changed
         self.assertEqual(p.finished_at, newFA)
 
-    @patch('oaatoperator.pod.OaatGroup', autospec=True)
-    def test_failure_old(self, og_mock):
-        og_mock.kopf_object = TestData.setup_kwargs(
-            TestData.kog_previous_fail_attrs)
-        og_instance_mock = og_mock.return_value
-        og_instance_mock.mark_item_failed.return_value = False
+    @patch('oaatoperator.pod.PodOverseer.get_parent_async')
+    def test_failure_old(self, get_parent):
+        get_parent.return_value = og = parent()
+        og.mark_item_failed.return_value = False
         op = TestData.setup_kwargs(TestData.kp_failure)
         finished_at = (TestData.success_time - datetime.timedelta(hours=2))
         op['status']['containerStatuses'][0]['state']['terminated'][
@@ -157,23 +356,95 @@ class StatusTests(unittest.TestCase):
         self.assertIsInstance(p, PodOverseer)
         with self.assertRaisesRegex(ProcessingComplete,
                                     'ignoring old failed job pod=test-kp'):
-            p.update_failure_status()
+            asyncio.run(p.update_failure_status_async())
         self.assertEqual(p.finished_at, finished_at)
         self.assertEqual(
-            og_instance_mock.mark_item_failed.call_args,
+            og.mark_item_failed.call_args,
             call(op['labels']['oaat-name'],
                  finished_at=finished_at,
                  exit_code=op['status']['containerStatuses'][0]['state']
                  ['terminated']['exitCode']))
 
-    @patch('oaatoperator.pod.OaatGroup', autospec=True)
-    def test_update_phase(self, og_mock):
-        og_mock.kopf_object = TestData.setup_kwargs(TestData.kog_empty_attrs)
+    @patch('oaatoperator.pod.PodOverseer.get_parent_async')
+    def test_update_phase(self, get_parent):
+        get_parent.return_value = og = parent()
         op = TestData.setup_kwargs(TestData.kp_spec)
         p = PodOverseer(**op)
         self.assertIsInstance(p, PodOverseer)
         with self.assertRaisesRegex(
                 ProcessingComplete, f'updating phase for pod {op["name"]}: '
                 f'new phase={op["status"]["phase"]}'):
-            p.update_phase()
-        print(og_mock.call_args_list)
+            asyncio.run(p.update_phase_async())
+        og.set_item_status.assert_called_once_with(
+            op['labels']['oaat-name'], 'podphase', op['status']['phase'])
+
+
+class BatchTests(unittest.TestCase):
+    def batch_pod(self, base, message=None):
+        pod = copy.deepcopy(base)
+        pod['metadata'].setdefault('annotations', {})[BATCH_ANNOTATION] = (
+            json.dumps(['item1', 'item2', 'item3']))
+        if message is not None:
+            (pod['status']['containerStatuses'][0]['state']['terminated']
+             ['message']) = message
+        return TestData.setup_kwargs(pod)
+
+    def test_batch_items(self):
+        p = PodOverseer(**self.batch_pod(TestData.kp_success))
+        self.assertEqual(p.batch_items(), ['item1', 'item2', 'item3'])
+        p = PodOverseer(**TestData.setup_kwargs(TestData.kp_success))
+        self.assertEqual(p.batch_items(), ['item'])
+
+    def test_item_results(self):
+        p = PodOverseer(**self.batch_pod(
+            TestData.kp_success,
+            '{"item1": 0, "item2": {"exitCode": 3, "runtime": 12.5}}'))
+        self.assertEqual(p.item_results(),
+                         {'item1': (0, None), 'item2': (3, 12.5)})
+        p = PodOverseer(**self.batch_pod(TestData.kp_success, 'not json'))
+        self.assertIsNone(p.item_results())
+
+    @patch('oaatoperator.pod.PodOverseer.get_parent_async')
+    def test_success_without_results(self, get_parent):
+        get_parent.return_value = og = parent()
+        p = PodOverseer(**self.batch_pod(TestData.kp_success))
+        with self.assertRaisesRegex(
+                ProcessingComplete,
+                'items succeeded: item1, item2, item3, items failed: none'):
+            asyncio.run(p.update_success_status_async())
+        self.assertEqual(
+            og.mark_item_success.call_args_list,
+            [call(name, finished_at=TestData.success_time, started_at=None)
+             for name in ('item1', 'item2', 'item3')])
+
+    @patch('oaatoperator.pod.PodOverseer.get_parent_async')
+    def test_failure_with_results(self, get_parent):
+        get_parent.return_value = og = parent()
+        p = PodOverseer(**self.batch_pod(
+            TestData.kp_failure,
+            '{"item1": {"exitCode": 0, "runtime": 60}, "item2": 2}'))
+        with self.assertRaises(ProcessingComplete) as exc:
+            asyncio.run(p.update_failure_status_async())
+        self.assertEqual(
+            exc.exception.ret['error'],
+            f'batch pod {p.name}: items succeeded: item1, items failed: '
+            'item2')
+        og.mark_item_success.assert_called_once_with(
+            'item1', finished_at=TestData.failure_time,
+            started_at=TestData.failure_time - datetime.timedelta(
+                seconds=60))
+        # item3 was not reported, so it is left to run again
+        og.mark_item_failed.assert_called_once_with(
+            'item2', finished_at=TestData.failure_time, exit_code=2)
+
+    @patch('oaatoperator.pod.PodOverseer.get_parent_async')
+    def test_update_phase(self, get_parent):
+        get_parent.return_value = og = parent()
+        pod = self.batch_pod(TestData.kp_spec)
+        p = PodOverseer(**pod)
+        with self.assertRaises(ProcessingComplete):
+            asyncio.run(p.update_phase_async())
+        self.assertEqual(
+            og.set_item_status.call_args_list,
+            [call(name, 'podphase', pod['status']['phase'])
+             for name in ('item1', 'item2', 'item3')])
@@ -0,0 +1,111 @@
+"""Unit tests for the garbage collection of completed pods."""
+import asyncio
+import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import kopf
+import pytest
+
+from oaatoperator import aioclient, podgc
+
+
+pytestmark = pytest.mark.unit
+
+NOW = datetime.datetime(2022, 1, 2, tzinfo=datetime.timezone.utc)
+
+
+def pod(name, item, phase, hours_ago, run=None):
+    finished = (NOW - datetime.timedelta(hours=hours_ago)).isoformat()
+    labels = {'app': 'oaat-operator', 'parent-name': 'kog',
+              'oaat-name': item}
+    if run:
+        labels[podgc.RUN_LABEL] = run
+    return {
+        'metadata': {'name': name, 'namespace': 'default', 'labels': labels},
+        'status': {'phase': phase, 'startTime': finished,
+                   'containerStatuses': [{'state': {'terminated': {
+                       'exitCode': 0, 'finishedAt': finished}}}]},
+    }
+
+
+def names(pods):
+    return sorted(p['metadata']['name'] for p in pods)
+
+
+class TestRetention:
+    def test_default(self):
+        assert podgc.retention_settings({}, 'kog') == (
+            datetime.timedelta(hours=12), None)
+
+    def test_settings(self):
+        assert podgc.retention_settings(
+            {'podRetention': '3d', 'podRetentionCount': 2}, 'kog') == (
+            datetime.timedelta(days=3), 2)
+
+    @pytest.mark.parametrize('spec', [{'podRetention': 'soon'},
+                                      {'podRetentionCount': -1},
+                                      {'podRetentionCount': '2'},
+                                      {'podRetentionCount': True}])
+    def test_invalid(self, spec):
+        with pytest.raises(kopf.PermanentError, match='invalid podRetention'):
+            podgc.retention_settings(spec, 'kog')
+
+
+class TestExpired:
+    pods = [pod('a1', 'a', 'Succeeded', 1),
+            pod('a2', 'a', 'Failed', 2),
+            pod('a3', 'a', 'Succeeded', 3),
+            pod('a4', 'a', 'Succeeded', 20),
+            pod('b1', 'b', 'Failed', 13),
+            pod('b2', 'b', 'Running', 30),
+            pod('b3', 'b', 'Pending', 30)]
+
+    def test_max_age(self):
+        assert names(podgc.expired_pods(
+            self.pods, datetime.timedelta(hours=12), at=NOW)) == ['a4', 'b1']
+
+    def test_keep_last(self):
+        """Test only the most recent completed pods of each item are kept."""
+        assert names(podgc.expired_pods(
+            self.pods, datetime.timedelta(days=7), 2, at=NOW)) == [
+                'a3', 'a4']
+        assert names(podgc.expired_pods(
+            self.pods, datetime.timedelta(days=7), 0, at=NOW)) == [
+                'a1', 'a2', 'a3', 'a4', 'b1']
+
+    def test_finished_at(self):
+        """Test the start time is used if the finish time is unknown."""
+        started = pod('a', 'a', 'Failed', 5)
+        started['status']['containerStatuses'] = []
+        assert podgc.finished_at(started) == NOW - datetime.timedelta(hours=5)
+
+
+class TestDelete:
+    @patch('oaatoperator.aioclient.delete_object', new_callable=AsyncMock)
+    @patch('oaatoperator.aioclient.delete_collection', new_callable=AsyncMock)
+    def test_delete_pods(self, collection, single):
+        """Test labelled pods are deleted in batches with selectors."""
+        pods = [pod(f'p{n}', 'a', 'Succeeded', 20, run=f'r{n}')
+                for n in range(podgc.DELETE_BATCH + 1)]
+        pods.append(pod('legacy', 'a', 'Failed', 20))
+        single.side_effect = aioclient.APINotFoundError(
+            status=404, headers={})
+        logger = MagicMock()
+        calls = asyncio.run(podgc.delete_pods('default', 'kog', pods,
+                                              logger=logger))
+        assert calls == 3
+        assert single.call_args.args == (aioclient.POD, 'default', 'legacy')
+        assert collection.await_count == 2
+        first, second = collection.call_args_list
+        assert first.kwargs['label_selector'].startswith(
+            'app=oaat-operator,parent-name=kog,oaat-run in (r0,r1,')
+        assert second.kwargs['label_selector'].endswith(
+            f'oaat-run in (r{podgc.DELETE_BATCH})')
+        assert 'status.phase!=Running' in first.kwargs['field_selector']
+        assert 'with 3 API calls' in logger.info.call_args.args[0]
+
+    @patch('oaatoperator.aioclient.delete_collection', new_callable=AsyncMock)
+    def test_nothing_to_delete(self, collection):
+        assert asyncio.run(podgc.delete_pods('default', 'kog', [],
+                                             logger=MagicMock())) == 0
+        collection.assert_not_awaited()
@@ -0,0 +1,387 @@
+"""Unit tests for the pod watch."""
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import kopf
+import pytest
+
+from oaatoperator import podwatch
+from oaatoperator.cache import get_running_pods
+
+
+pytestmark = pytest.mark.unit
+
+SETTINGS = kopf.OperatorSettings()
+
+
+def pod(name, phase, parent='kog'):
+    return {
+        'apiVersion': 'v1',
+        'kind': 'Pod',
+        'metadata': {
+            'name': name,
+            'namespace': 'default',
+            'uid': f'uid-{name}',
+            'labels': {'app': 'oaat-operator', 'parent-name': parent,
+                       'oaat-name': 'item1'},
+        },
+        'status': {'phase': phase, 'startTime': '2022-01-01T00:00:00Z'},
+    }
+
+
+@pytest.fixture(autouse=True)
+def reset_watch(monkeypatch):
+    """Isolate the module state (and handlers) of each test."""
+    monkeypatch.setattr(podwatch, '_on_change', [])
+    monkeypatch.setattr(podwatch, '_on_sweep', [])
+    podwatch.index.clear()
+    podwatch.watch_stats.reset()
+    yield
+    asyncio.run(podwatch.stop())
+
+
+def register(when=None):
+    handler = AsyncMock(__name__='handler')
+    podwatch.on_change(when=when)(handler)
+    return handler
+
+
+def handle(*events):
+    """Handle watch events, waiting until they are dispatched."""
+    async def watch():
+        for event in events:
+            await podwatch.handle_event(event, SETTINGS)
+        await podwatch.dispatcher().drain()
+    asyncio.run(watch())
+
+
+class TestIndex:
+    def test_index_entry(self):
+        key, entry = podwatch.index_entry(pod('pod1', 'Running'))
+        assert key == ('default', 'kog', 'Running')
+        assert entry['metadata']['name'] == 'pod1'
+        assert entry['metadata']['labels']['oaat-name'] == 'item1'
+        assert entry['status'] == {'phase': 'Running',
+                                   'startTime': '2022-01-01T00:00:00Z'}
+
+    def test_index_entry_terminated(self):
+        """Test the termination details of a completed pod are kept."""
+        body = pod('pod1', 'Failed')
+        body['status']['containerStatuses'] = [
+            {'name': 'c', 'image': 'busybox', 'state': {'terminated': {
+                'exitCode': 1, 'finishedAt': '2022-01-01T00:01:00Z',
+                'containerID': 'x'}}},
+            {'name': 'd', 'state': {'running': {}}}]
+        _, entry = podwatch.index_entry(body)
+        assert entry['status']['containerStatuses'] == [
+            {'state': {'terminated': {
+                'exitCode': 1, 'finishedAt': '2022-01-01T00:01:00Z'}}}]
+
+    def test_index_entry_pending(self):
+        """Test why a pod is pending, and since when, are kept."""
+        body = pod('pod1', 'Pending')
+        body['metadata']['creationTimestamp'] = '2022-01-01T00:00:00Z'
+        body['status']['conditions'] = [
+            {'type': 'PodScheduled', 'status': 'False',
+             'reason': 'Unschedulable', 'message': '0/3 nodes available'},
+            {'type': 'Ready', 'status': 'False'}]
+        body['status']['containerStatuses'] = [
+            {'name': 'c', 'state': {'waiting': {
+                'reason': 'ContainerCreating'}}}]
+        _, entry = podwatch.index_entry(body)
+        assert entry['metadata']['creationTimestamp'] == (
+            '2022-01-01T00:00:00Z')
+        assert entry['status']['conditions'] == [
+            {'type': 'PodScheduled', 'status': 'False',
+             'reason': 'Unschedulable'}]
+        assert entry['status']['containerStatuses'] == [
+            {'state': {'waiting': {'reason': 'ContainerCreating'}}}]
+
+    def test_index_entry_batch(self):
+        """Test the batch items and results of a batch pod are kept."""
+        body = pod('pod1', 'Succeeded')
+        body['metadata']['annotations'] = {
+            'oaatoperator.kawaja.net/batch-items': '["item1", "item2"]',
+            'kubectl.kubernetes.io/last-applied-configuration': '{}'}
+        body['status']['containerStatuses'] = [
+            {'name': 'c', 'state': {'terminated': {
+                'exitCode': 0, 'message': '{"item1": 0}'}}}]
+        _, entry = podwatch.index_entry(body)
+        assert entry['metadata']['annotations'] == {
+            'oaatoperator.kawaja.net/batch-items': '["item1", "item2"]'}
+        assert entry['status']['containerStatuses'] == [
+            {'state': {'terminated': {'exitCode': 0,
+                                      'message': '{"item1": 0}'}}}]
+
+    def test_phase_change(self):
+        """Test a pod moves between index keys as its phase changes."""
+        index = podwatch.index
+        ref = ('default', 'pod1')
+        index.store(ref, *podwatch.index_entry(pod('pod1', 'Pending')))
+        index.store(('default', 'pod2'),
+                    *podwatch.index_entry(pod('pod2', 'Running')))
+        assert len(get_running_pods(index, 'default', 'kog')) == 2
+        index.store(ref, *podwatch.index_entry(pod('pod1', 'Succeeded')))
+        assert index.phase(ref) == 'Succeeded'
+        assert [p['metadata']['name'] for p in
+                get_running_pods(index, 'default', 'kog')] == ['pod2']
+        index.discard(ref)
+        index.discard(ref)
+        assert ('default', 'kog', 'Succeeded') not in index
+        assert index.refs() == [('default', 'pod2')]
+
+    def test_by_group(self):
+        index = podwatch.index
+        for name, phase, parent in [('pod1', 'Running', 'kog'),
+                                    ('pod2', 'Succeeded', 'kog'),
+                                    ('pod3', 'Failed', 'kog2')]:
+            index.store(('default', name),
+                        *podwatch.index_entry(pod(name, phase, parent)))
+        groups = index.by_group()
+        assert sorted(p['metadata']['name']
+                      for p in groups[('default', 'kog')]) == ['pod1', 'pod2']
+        assert len(groups[('default', 'kog2')]) == 1
+
+
+class TestDispatch:
+    def test_handle_event(self):
+        """Test handlers are only called when the phase changes."""
+        handler = register()
+        succeeded = register(when=lambda status, **_:
+                             status.get('phase') == 'Succeeded')
+        handle(*[{'type': 'MODIFIED', 'object': pod('pod1', phase)}
+                 for phase in ('Pending', 'Pending', 'Running', 'Succeeded')])
+        assert [c.kwargs['status']['phase'] for c in handler.call_args_list
+                ] == ['Pending', 'Running', 'Succeeded']
+        assert succeeded.await_count == 1
+        kwargs = succeeded.call_args.kwargs
+        assert kwargs['name'] == 'pod1'
+        assert kwargs['labels']['parent-name'] == 'kog'
+        assert kwargs['status']['phase'] == 'Succeeded'
+        handle({'type': 'DELETED', 'object': pod('pod1', 'Succeeded')})
+        assert podwatch.index.refs() == []
+        assert (podwatch.watch_stats.received,
+                podwatch.watch_stats.handled) == (5, 3)
+        assert 'received=5, handled=3' in str(podwatch.watch_stats)
+
+    def test_handler_error(self):
+        """Test a failing handler does not stop the others."""
+        failing = register()
+        failing.side_effect = ValueError('bug')
+        handler = register()
+        assert asyncio.run(podwatch.dispatch(
+            pod('pod1', 'Running'), podwatch._on_change, 'phase', SETTINGS))
+        failing.assert_awaited_once()
+        handler.assert_awaited_once()
+        assert not podwatch._undispatched
+
+    def test_temporary_error(self, monkeypatch):
+        """Test a temporary error is retried, then on the next event."""
+        monkeypatch.setattr(podwatch, 'DISPATCH_BACKOFF', 0)
+        failing = register()
+        failing.side_effect = kopf.TemporaryError('no parent')
+        handle({'type': 'MODIFIED', 'object': pod('pod1', 'Succeeded')})
+        assert failing.await_count == podwatch.DISPATCH_ATTEMPTS
+        assert podwatch._undispatched == {('default', 'pod1')}
+        assert podwatch.index.phase(('default', 'pod1')) == 'Succeeded'
+        # the phase has not changed, but the pod is dispatched again
+        failing.side_effect = [kopf.TemporaryError('no parent'), None]
+        handle({'type': 'MODIFIED', 'object': pod('pod1', 'Succeeded')})
+        assert failing.await_count == podwatch.DISPATCH_ATTEMPTS + 2
+        assert not podwatch._undispatched
+        handle({'type': 'MODIFIED', 'object': pod('pod1', 'Succeeded')})
+        assert failing.await_count == podwatch.DISPATCH_ATTEMPTS + 2
+
+    def test_concurrent(self):
+        """Test a slow handler holds up neither the watch nor other pods."""
+        release = asyncio.Event()
+        calls = []
+
+        async def handler(name, status, **_):
+            calls.append((name, status['phase']))
+            if name == 'pod1':
+                await release.wait()
+        podwatch.on_change()(handler)
+
+        async def watch():
+            for name, phase in [('pod1', 'Running'), ('pod1', 'Succeeded'),
+                                ('pod2', 'Running')]:
+                await podwatch.handle_event(
+                    {'type': 'MODIFIED', 'object': pod(name, phase)},
+                    SETTINGS)
+            while len(calls) < 2:
+                await asyncio.sleep(0)
+            # pod1 Succeeded waits for pod1 Running to be handled
+            assert calls == [('pod1', 'Running'), ('pod2', 'Running')]
+            release.set()
+            await podwatch.dispatcher().drain()
+        asyncio.run(asyncio.wait_for(watch(), 5))
+        assert calls[2] == ('pod1', 'Succeeded')
+
+    @patch('oaatoperator.aioclient.patch_object', new_callable=AsyncMock)
+    def test_patch(self, patch_mock):
+        """Test changes made to the patch by a handler are applied."""
+        async def handler(patch, **_):
+            patch.setdefault('metadata', {})['annotations'] = {'a': 'b'}
+        podwatch.on_change()(handler)
+        asyncio.run(podwatch.dispatch(
+            pod('pod1', 'Running'), podwatch._on_change, 'phase', SETTINGS))
+        assert patch_mock.call_args.args[1:] == (
+            'default', 'pod1', {'metadata': {'annotations': {'a': 'b'}}})
+
+
+class TestWatch:
+    @patch('kopf._cogs.clients.api.get', new_callable=AsyncMock)
+    def test_list_pods(self, get_mock):
+        """Test listing uses the label selector and fills the index."""
+        get_mock.return_value = {'metadata': {'resourceVersion': '10'},
+                                 'items': [pod('pod1', 'Running')]}
+        assert podwatch.pod_index() is None
+        pods, version = asyncio.run(
+            podwatch.list_pods(SETTINGS, MagicMock()))
+        assert version == '10'
+        assert len(pods) == 1
+        assert 'labelSelector=app%3Doaat-operator%2Cparent-name' in \
+            get_mock.call_args.args[0]
+        assert podwatch.pod_index() is podwatch.index
+        assert podwatch.index.phase(('default', 'pod1')) == 'Running'
+
+    @patch('kopf._cogs.clients.api.get', new_callable=AsyncMock)
+    def test_relist(self, get_mock):
+        """Test a relisting only dispatches pods which have changed."""
+        change = register()
+        podwatch.index.store(('default', 'pod1'),
+                             *podwatch.index_entry(pod('pod1', 'Running')))
+        get_mock.return_value = {'metadata': {'resourceVersion': '11'},
+                                 'items': [pod('pod1', 'Running'),
+                                           pod('pod2', 'Pending')]}
+
+        async def relist():
+            version = await podwatch.relist(SETTINGS, MagicMock())
+            await podwatch.dispatcher().drain()
+            return version
+        assert asyncio.run(relist()) == '11'
+        assert [c.kwargs['name'] for c in change.call_args_list] == ['pod2']
+
+    def test_sweep(self):
+        """Test the sweep handler is called once for each group."""
+        handler = AsyncMock(__name__='handler')
+        podwatch.on_sweep()(handler)
+        failing = AsyncMock(__name__='failing',
+                            side_effect=kopf.TemporaryError('no parent'))
+        podwatch.on_sweep()(failing)
+        for name, parent in [('pod1', 'kog'), ('pod2', 'kog'),
+                             ('pod3', 'kog2')]:
+            podwatch.index.store(('default', name), *podwatch.index_entry(
+                pod(name, 'Succeeded', parent)))
+        logger = MagicMock()
+        asyncio.run(podwatch.sweep(SETTINGS, logger))
+        calls = {c.kwargs['name']: len(c.kwargs['pods'])
+                 for c in handler.call_args_list}
+        assert calls == {'kog': 2, 'kog2': 1}
+        assert failing.await_count == 2
+        assert podwatch.watch_stats.sweeps == 1
+        assert logger.error.call_count == 2
+        logged = [c.args[0] for c in logger.info.call_args_list]
+        assert any(msg.startswith('oaattype cache:') for msg in logged)
+        assert any(msg.startswith('pod cache:') for msg in logged)
+
+    def test_watch_pods(self):
+        """Test watch events are handled and the version followed."""
+        handler = register()
+        events = [
+            {'type': 'ADDED', 'object': dict(
+                pod('pod1', 'Pending'),
+                metadata=dict(pod('pod1', 'Pending')['metadata'],
+                              resourceVersion='12'))},
+            {'type': 'BOOKMARK',
+             'object': {'metadata': {'resourceVersion': '13'}}},
+        ]
+
+        async def stream(url, **_):
+            assert 'watch=true' in url
+            assert 'resourceVersion=11' in url
+            for event in events:
+                yield event
+
+        async def watch():
+            version = await podwatch.watch_pods(
+                SETTINGS, MagicMock(), '11', 600)
+            await podwatch.dispatcher().drain()
+            return version
+        with patch('kopf._cogs.clients.api.stream', stream):
+            assert asyncio.run(watch()) == '13'
+        handler.assert_awaited_once()
+        events.append({'type': 'ERROR', 'object': {'code': 410}})
+        with patch('kopf._cogs.clients.api.stream', stream):
+            assert asyncio.run(podwatch.watch_pods(
+                SETTINGS, MagicMock(), '11', 600)) is None
+
+    @patch('kopf._cogs.clients.api.get', new_callable=AsyncMock)
+    def test_start(self, get_mock):
+        """Test the pods are listed in the background, then swept."""
+        get_mock.return_value = {'metadata': {'resourceVersion': '10'},
+                                 'items': [pod('pod1', 'Running')]}
+        swept = AsyncMock(__name__='swept')
+        podwatch.on_sweep()(swept)
+        versions = []
+
+        async def stream(url, **_):
+            versions.append(url)
+            await asyncio.Event().wait()
+            yield
+
+        async def start():
+            await podwatch.start(SETTINGS, MagicMock())
+            assert podwatch.pod_index() is None
+            get_mock.assert_not_awaited()
+            while not versions:
+                await asyncio.sleep(0)
+            assert podwatch.pod_index() is podwatch.index
+            await podwatch.stop()
+        with patch('kopf._cogs.clients.api.stream', stream):
+            asyncio.run(asyncio.wait_for(start(), 5))
+        get_mock.assert_awaited_once()
+        assert swept.call_args.kwargs['name'] == 'kog'
+        assert 'resourceVersion=10' in versions[0]
+
+    @patch('kopf._cogs.clients.api.get', new_callable=AsyncMock)
+    def test_run_error(self, get_mock, monkeypatch):
+        """Test an unexpected error is logged and the pods listed again."""
+        monkeypatch.setattr(podwatch, 'RETRY_DELAY', 0)
+        get_mock.side_effect = [
+            RuntimeError('bug'),
+            {'metadata': {'resourceVersion': '10'}, 'items': []}]
+        logger = MagicMock()
+        watching = []
+
+        async def stream(url, **_):
+            watching.append(url)
+            await asyncio.Event().wait()
+            yield
+
+        async def start():
+            await podwatch.start(SETTINGS, logger)
+            while not watching:
+                await asyncio.sleep(0)
+            await podwatch.stop()
+        with patch('kopf._cogs.clients.api.stream', stream):
+            asyncio.run(asyncio.wait_for(start(), 5))
+        assert get_mock.await_count == 2
+        assert 'bug' in logger.exception.call_args.args[0]
+        logger.critical.assert_not_called()
+
+    @patch('oaatoperator.podwatch.os.kill')
+    def test_watch_done(self, kill_mock):
+        """Test the operator is stopped if the watch task ends."""
+        async def fail():
+            raise RuntimeError('bug')
+
+        async def watch():
+            task = asyncio.create_task(fail())
+            await asyncio.wait([task])
+            return task
+        logger = MagicMock()
+        podwatch._watch_done(logger, asyncio.run(watch()))
+        logger.critical.assert_called_once()
+        kill_mock.assert_called_once()
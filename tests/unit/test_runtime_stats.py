@@ -1,9 +1,14 @@
 """Unit tests for runtime statistics collection and prediction."""
 
+import base64
+import json
+import random
+
 import pytest
 import math
 
-from oaatoperator.runtime_stats import JobRuntimeStats, RuntimeStatsManager
+from oaatoperator.runtime_stats import (SAMPLE_SCALE, JobRuntimeStats,
+                                        RuntimeStatsManager)
 
 
 class TestJobRuntimeStats:
@@ -281,6 +286,73 @@ class TestJobRuntimeStats:
         assert "p50=150.0s" in str_repr
 
 
+class TestEncoding:
+    """Test the compact encoding of JobRuntimeStats."""
+
+    def test_round_trip(self):
+        """Test statistics survive encoding and decoding."""
+        stats = JobRuntimeStats()
+        for runtime in [90, 95, 100, 105.5, 110]:
+            stats.add_runtime(runtime)
+        decoded = JobRuntimeStats.decode(stats.encode())
+        assert decoded.count == 5
+        assert decoded.total_runtime_seconds == stats.total_runtime_seconds
+        assert decoded.sum_of_squares == stats.sum_of_squares
+        assert decoded.min_runtime == 90.0
+        assert decoded.max_runtime == 110.0
+        assert decoded.sample == [90, 95, 100, 105.5, 110]
+        assert decoded.last_updated == stats.last_updated
+        assert decoded.predict_runtime() == stats.predict_runtime()
+
+    def test_empty(self):
+        """Test encoding statistics with no data."""
+        decoded = JobRuntimeStats.decode(JobRuntimeStats().encode())
+        assert decoded.count == 0
+        assert decoded.sample == []
+        assert decoded.min_runtime == float('inf')
+        assert decoded.last_updated is None
+
+    def test_quantized(self):
+        """Test the sample is quantized but stays sorted."""
+        stats = JobRuntimeStats()
+        for runtime in [1.234567, 1.2351, 3600.987654]:
+            stats.add_runtime(runtime)
+        decoded = JobRuntimeStats.decode(stats.encode())
+        assert decoded.sample == sorted(decoded.sample)
+        for original, value in zip(stats.sample, decoded.sample):
+            assert abs(original - value) <= 1 / SAMPLE_SCALE
+        # summary statistics are not quantized
+        assert decoded.max_runtime == 3600.987654
+
+    def test_invalid(self):
+        """Test invalid or unknown encodings are rejected."""
+        encoded = JobRuntimeStats().encode()
+        unknown = base64.b64encode(
+            b'\x09' + base64.b64decode(encoded)[1:]).decode('ascii')
+        for bad in ['not base64!', encoded[:8], unknown]:
+            with pytest.raises(ValueError):
+                JobRuntimeStats.decode(bad)
+
+    def test_size_reduction(self):
+        """Test the encoding is at least 5x smaller than the legacy fields."""
+        rand = random.Random(42)
+        stats = JobRuntimeStats()
+        for _ in range(500):
+            stats.add_runtime(rand.uniform(60, 3600))
+        data = stats.to_dict()
+        legacy = {
+            'runtime_count': str(data['count']),
+            'runtime_total': str(data['total_runtime_seconds']),
+            'runtime_sum_squares': str(data['sum_of_squares']),
+            'runtime_min': str(data['min_runtime']),
+            'runtime_max': str(data['max_runtime']),
+            'runtime_sample': json.dumps(data['sample']),
+            'runtime_last_updated': data['last_updated'],
+        }
+        compact = {'runtime_stats': stats.encode()}
+        assert len(json.dumps(legacy)) >= 5 * len(json.dumps(compact))
+
+
 class TestRuntimeStatsManager:
     """Test the RuntimeStatsManager class."""
 
@@ -391,6 +463,24 @@ class TestRuntimeStatsManager:
         job_names = manager.get_all_job_names()
         assert set(job_names) == {'job1', 'job2'}
 
+    def test_loader(self):
+        """Test stored statistics are loaded once, when first needed."""
+        stored = JobRuntimeStats()
+        stored.add_runtime(100.0)
+        loaded = []
+
+        def loader(job_name):
+            loaded.append(job_name)
+            return stored if job_name == 'job1' else None
+
+        manager = RuntimeStatsManager(loader=loader)
+        assert loaded == []
+        manager.add_runtime('job1', 200.0)
+        assert manager.get_stats('job1').count == 2
+        assert manager.get_stats('job2') is None
+        assert manager.get_stats('job2') is None
+        assert loaded == ['job1', 'job2']
+
 
 class TestIntegration:
     """Integration tests for the runtime statistics system."""
@@ -0,0 +1,153 @@
+"""Unit tests for the next-due scheduler."""
+import asyncio
+import datetime
+
+import pytest
+
+import oaatoperator.utility
+from oaatoperator.scheduler import COMPLETION_EXPIRY, MIN_INTERVAL, Scheduler
+
+
+pytestmark = pytest.mark.unit
+
+KEY = ('default', 'kog')
+
+
+def now() -> datetime.datetime:
+    return oaatoperator.utility.now()
+
+
+class TestSchedule:
+    """Test recording due times."""
+
+    def test_unknown_group(self):
+        """Test a group not seen before is not scheduled."""
+        assert Scheduler().due(KEY) is None
+
+    def test_schedule(self):
+        """Test setting and forgetting a due time."""
+        sched = Scheduler()
+        due = now() + datetime.timedelta(minutes=5)
+        sched.schedule(KEY, due)
+        assert sched.due(KEY) == due
+        sched.forget(KEY)
+        assert sched.due(KEY) is None
+
+    def test_reschedule_min_interval(self):
+        """Test a group is not rescheduled sooner than MIN_INTERVAL."""
+        sched = Scheduler()
+        sched.reschedule(KEY, now())
+        assert sched.due(KEY) >= now() + MIN_INTERVAL - \
+            datetime.timedelta(seconds=1)
+        sched.reschedule(KEY, None)
+        assert sched.due(KEY) is None
+
+    def test_wake_earlier_only(self):
+        """Test waking does not delay a group which is already due."""
+        sched = Scheduler()
+        earlier = now()
+        sched.schedule(KEY, earlier)
+        sched.wake(KEY, delay=datetime.timedelta(seconds=30))
+        assert sched.due(KEY) == earlier
+        sched.schedule(KEY, None)
+        sched.wake(KEY)
+        assert sched.due(KEY) <= now()
+
+
+class TestWait:
+    """Test waiting for a group to become due."""
+
+    def test_new_group_due_immediately(self):
+        """Test a group not seen before does not wait."""
+        assert asyncio.run(Scheduler().wait(KEY)) is True
+
+    def test_due_time_reached(self):
+        """Test waiting until the due time."""
+        sched = Scheduler()
+        sched.schedule(KEY, now() + datetime.timedelta(milliseconds=50))
+        assert asyncio.run(sched.wait(KEY)) is True
+        assert sched.due(KEY) <= now()
+
+    def test_woken(self):
+        """Test a waiting group is woken early."""
+        sched = Scheduler()
+        sched.schedule(KEY, None)
+
+        async def waker():
+            await asyncio.sleep(0.05)
+            sched.wake(KEY)
+
+        async def run():
+            task = asyncio.ensure_future(waker())
+            result = await asyncio.wait_for(sched.wait(KEY), timeout=5)
+            await task
+            return result
+
+        assert asyncio.run(run()) is True
+
+    def test_max_wait(self):
+        """Test an unscheduled group is checked after max_wait."""
+        sched = Scheduler(max_wait=datetime.timedelta(milliseconds=50))
+        sched.schedule(KEY, None)
+        assert asyncio.run(sched.wait(KEY)) is True
+
+    def test_stopped(self):
+        """Test the wait is abandoned when stopped."""
+        sched = Scheduler()
+        sched.schedule(KEY, None)
+
+        async def run():
+            stopped = asyncio.Event()
+            asyncio.get_running_loop().call_later(0.05, stopped.set)
+            return await asyncio.wait_for(sched.wait(KEY, stopped),
+                                          timeout=5)
+
+        assert asyncio.run(run()) is False
+
+
+class TestSettle:
+    """Test waiting for completions to become visible."""
+
+    def test_nothing_recorded(self):
+        """Test settling with no completions recorded."""
+        assert asyncio.run(Scheduler().settle(KEY, lambda i, f: False))
+
+    def test_complete_wakes(self):
+        """Test recording a completion makes the group due."""
+        sched = Scheduler()
+        sched.schedule(KEY, None)
+        sched.complete(KEY, 'item1', now())
+        assert sched.due(KEY) <= now()
+
+    def test_becomes_visible(self):
+        """Test settling waits until the completion is visible."""
+        sched = Scheduler()
+        finished_at = now()
+        sched.complete(KEY, 'item1', finished_at)
+        seen = []
+
+        def visible(item, when):
+            seen.append((item, when))
+            return len(seen) > 2
+
+        assert asyncio.run(sched.settle(KEY, visible)) is True
+        assert seen[0] == ('item1', finished_at)
+        # once visible, the completion is no longer waited for
+        assert asyncio.run(sched.settle(KEY, lambda i, f: False)) is True
+
+    def test_not_visible(self):
+        """Test settling gives up after the timeout."""
+        sched = Scheduler()
+        sched.complete(KEY, 'item1', now())
+        assert asyncio.run(sched.settle(
+            KEY, lambda i, f: False,
+            timeout=datetime.timedelta(milliseconds=50))) is False
+
+    def test_expired(self):
+        """Test old completions are no longer waited for."""
+        sched = Scheduler()
+        sched.complete(KEY, 'item1', now())
+        finished_at, recorded = sched._entries[KEY].completions['item1']
+        sched._entries[KEY].completions['item1'] = (
+            finished_at, recorded - COMPLETION_EXPIRY * 2)
+        assert asyncio.run(sched.settle(KEY, lambda i, f: False)) is True
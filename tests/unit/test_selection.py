@@ -0,0 +1,147 @@
+"""Unit tests for the item selection policies."""
+import datetime
+from collections import Counter
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from oaatoperator import selection
+from oaatoperator.itemindex import ArrayItemIndex, ItemIndex
+from oaatoperator.utility import now
+
+
+pytestmark = pytest.mark.unit
+
+FREQ = datetime.timedelta(hours=1)
+
+
+def ago(minutes: int) -> str:
+    return (now() - datetime.timedelta(minutes=minutes)).isoformat()
+
+
+def group(expected=None):
+    oaatgroup = MagicMock()
+    oaatgroup.freq = FREQ
+    oaatgroup.get_expected_runtime.side_effect = (expected or {}).get
+    return oaatgroup
+
+
+@pytest.fixture(params=[ItemIndex, ArrayItemIndex], ids=['heap', 'array'])
+def index_cls(request):
+    return request.param
+
+
+def test_policies():
+    assert set(selection.POLICIES) == {'oldest', 'binpack', 'sjf', 'overdue'}
+    for policy in selection.POLICIES.values():
+        assert issubclass(policy, selection.SelectionPolicy)
+
+
+class TestOldest:
+    def test_oldest(self, index_cls):
+        index = index_cls(['a', 'b', 'c'], {'a': {'last_success': ago(90)},
+                                            'b': {'last_success': ago(5)},
+                                            'c': {'last_success': ago(120)}},
+                          FREQ, None)
+        policy = selection.OldestPolicy(group())
+        assert policy.choose(index, now()) == 'c'
+        assert policy.choose(index, now(),
+                             allow=lambda name: name != 'c') == 'a'
+
+    def test_wildcard(self, index_cls):
+        """Test 1 in 3 choices ignore items which have failed."""
+        index = index_cls(['a', 'b'], {
+            'a': {'last_failure': ago(90), 'failure_count': '1'},
+            'b': {'last_success': ago(120)}}, FREQ, None)
+        policy = selection.OldestPolicy(group())
+        with patch('oaatoperator.selection.randrange', side_effect=[0, 0]):
+            assert policy.choose(index, now()) == 'b'
+        with patch('oaatoperator.selection.randrange', side_effect=[1, 0]):
+            assert policy.choose(index, now()) == 'a'
+
+
+class TestBinpack:
+    def policy(self, available, predicted):
+        oaatgroup = group()
+        oaatgroup.windows.available.return_value = available
+        oaatgroup.get_predicted_runtime.side_effect = predicted.get
+        return selection.BinpackPolicy(oaatgroup)
+
+    def test_longest_fit(self, index_cls):
+        index = index_cls(['a', 'b', 'c', 'd'], {
+            'a': {'last_success': ago(300)}, 'b': {'last_success': ago(200)},
+            'c': {'last_success': ago(100)}, 'd': {'last_success': ago(90)}},
+            FREQ, None)
+        policy = self.policy(1800, {'a': 3600, 'b': 600, 'c': 1200,
+                                    'd': 1200})
+        # of the equally long c and d, c has gone longer without success
+        assert policy.choose(index, now()) == 'c'
+        assert policy.choose(index, now(),
+                             allow=lambda name: name not in 'ac') == 'd'
+
+    def test_fallback(self, index_cls):
+        """Test "oldest" is used unless a window is approaching."""
+        index = index_cls(['a', 'b'], {'a': {'last_success': ago(300)},
+                                       'b': {'last_success': ago(100)}},
+                          FREQ, None)
+        # everything fits
+        assert self.policy(1800, {'a': 60, 'b': 600}).choose(
+            index, now()) == 'a'
+        # no windows
+        assert self.policy(None, {'a': 60, 'b': 600}).choose(
+            index, now()) == 'a'
+        # nothing with runtime history fits
+        assert self.policy(1800, {'b': 3600}).choose(index, now()) == 'a'
+
+
+class TestShortestFirst:
+    def test_shortest(self, index_cls):
+        index = index_cls(['a', 'b', 'c', 'd'], {
+            name: {'last_success': ago(70)} for name in 'abcd'}, FREQ, None)
+        policy = selection.ShortestFirstPolicy(
+            group({'a': 7200, 'b': 10, 'c': 60}))
+        # d has no runtime history
+        assert policy.choose(index, now()) == 'd'
+        assert policy.choose(index, now(),
+                             allow=lambda name: name != 'd') == 'b'
+
+    def test_starved(self, index_cls):
+        """Test an item long overdue is run ahead of shorter items."""
+        index = index_cls(['a', 'b'], {'a': {'last_success': ago(150)},
+                                       'b': {'last_success': ago(70)}},
+                          FREQ, None)
+        policy = selection.ShortestFirstPolicy(group({'a': 7200, 'b': 10}))
+        assert policy.choose(index, now()) == 'a'
+
+    def test_no_candidates(self, index_cls):
+        index = index_cls(['a'], {'a': {'last_success': ago(5)}}, FREQ, None)
+        assert selection.ShortestFirstPolicy(group()).choose(
+            index, now()) is None
+
+
+class TestOverdue:
+    def test_weighted(self, index_cls):
+        """Test items are chosen in proportion to their overdue ratio."""
+        index = index_cls(['a', 'b', 'c'], {'a': {'last_success': ago(480)},
+                                            'b': {'last_success': ago(120)},
+                                            'c': {'last_success': ago(5)}},
+                          FREQ, None)
+        policy = selection.OverduePolicy(group())
+        with patch('oaatoperator.selection.choices',
+                   return_value=['a']) as choices:
+            assert policy.choose(index, now()) == 'a'
+        weights = dict(zip(choices.call_args.args[0],
+                           choices.call_args.kwargs['weights']))
+        assert weights == pytest.approx({'a': 8, 'b': 2}, rel=0.01)
+        counts = Counter(policy.choose(index, now()) for _ in range(200))
+        assert set(counts) == {'a', 'b'}
+        assert counts['a'] > counts['b']
+
+    def test_never_succeeded(self, index_cls):
+        index = index_cls(['a'], {}, FREQ, None)
+        policy = selection.OverduePolicy(group())
+        with patch('oaatoperator.selection.choices',
+                   return_value=['a']) as choices:
+            assert policy.choose(index, now()) == 'a'
+        assert choices.call_args.kwargs['weights'] == [
+            selection.MAX_OVERDUE_RATIO]
@@ -404,6 +404,40 @@ class MinSetTests(unittest.TestCase):
         self.assertSetEqual(ret_set, expected)
 
 
+class MergeDictTests(unittest.TestCase):
+    def test_merge_nested(self):
+        target = {'items': {'a': {'x': '1'}}, 'keep': 'yes'}
+        oaatoperator.utility.merge_dict(
+            target, {'items': {'a': {'y': '2'}, 'b': {'x': '3'}}})
+        self.assertEqual(target, {
+            'items': {'a': {'x': '1', 'y': '2'}, 'b': {'x': '3'}},
+            'keep': 'yes'})
+
+    def test_merge_replace_and_none(self):
+        target = {'a': {'x': '1'}, 'b': 'old'}
+        oaatoperator.utility.merge_dict(target, {'a': None, 'b': {'c': 1}})
+        self.assertEqual(target, {'a': None, 'b': {'c': 1}})
+
+    def test_merge_does_not_share_source(self):
+        source = {'a': {'x': '1'}}
+        target: dict = {}
+        oaatoperator.utility.merge_dict(target, source)
+        oaatoperator.utility.merge_dict(target, {'a': {'y': '2'}})
+        self.assertEqual(source, {'a': {'x': '1'}})
+
+    def test_patch_diff(self):
+        diff = oaatoperator.utility.patch_diff
+        unchanged = oaatoperator.utility.UNCHANGED
+        current = {'a': {'x': '1', 'y': '2'}, 'b': [1, 2]}
+        self.assertIs(diff(current, {'a': {'x': '1'}, 'b': [1, 2]}),
+                      unchanged)
+        self.assertIs(diff(current, {'c': None}), unchanged)
+        self.assertEqual(diff(current, {'a': {'x': '1', 'y': None},
+                                        'b': [1]}),
+                         {'a': {'y': None}, 'b': [1]})
+        self.assertEqual(diff(None, {'a': '1'}), {'a': '1'})
+
+
 class MiscTests(unittest.TestCase):
     def test_now(self):
         self.assertIsInstance(oaatoperator.utility.now(), dt)
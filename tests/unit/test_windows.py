@@ -0,0 +1,95 @@
+"""Unit tests for blackout windows."""
+import datetime
+
+import kopf
+import pytest
+
+from oaatoperator.windows import DAY, BlackoutWindows
+
+
+pytestmark = pytest.mark.unit
+
+UTC = datetime.timezone.utc
+HOUR = 60 * 60
+
+
+def at(hour, minute=0, day=2):
+    return datetime.datetime(2022, 1, day, hour, minute, tzinfo=UTC)
+
+
+def windows(*bounds):
+    return BlackoutWindows.from_spec(
+        {'windows': [{'noStartItem': {'start': start, 'end': end}}
+                     for start, end in bounds]}, 'kog')
+
+
+class TestFromSpec:
+    def test_none(self):
+        assert not BlackoutWindows.from_spec({}, 'kog')
+        assert BlackoutWindows.from_spec({}, 'kog').available(at(1)) is None
+
+    def test_intervals(self):
+        assert windows(({'time': '22:00'}, {'time': '23:30'})).intervals == [
+            (22 * HOUR, 23 * HOUR + 30 * 60)]
+        # windows are merged, and split at midnight
+        assert windows(('23:00', '02:00'), ('01:00', '03:00'),
+                       ('12', '13')).intervals == [
+            (0, 3 * HOUR), (12 * HOUR, 13 * HOUR), (23 * HOUR, DAY)]
+
+    def test_tz(self):
+        assert windows(({'time': '22:00', 'tz': '+10:00'},
+                        {'time': '02:00', 'tz': '+10:00'})).intervals == [
+            (12 * HOUR, 16 * HOUR)]
+
+    @pytest.mark.parametrize('window', [
+        {'noStartItem': {'start': {'time': '25:00'},
+                         'end': {'time': '02:00'}}},
+        {'noStartItem': {'start': {'time': '01:00'}}},
+        {'noStartItem': {'start': '01:00', 'end': {'time': '2',
+                                                   'tz': 'AEST'}}},
+        {'noStartItem': {'start': '01:00', 'end': '01:00'}},
+        {'noStart': {}},
+        'always'])
+    def test_invalid(self, window):
+        with pytest.raises(kopf.PermanentError,
+                           match='invalid windows entry .* in kog'):
+            BlackoutWindows.from_spec({'windows': [window]}, 'kog')
+
+    def test_whole_day(self):
+        with pytest.raises(kopf.PermanentError,
+                           match='no time is outside a window'):
+            windows(('00:00', '12:00'), ('12:00', '00:00'))
+
+
+class TestWindows:
+    def test_blackout_end(self):
+        blackout = windows(('02:00', '04:00'))
+        assert blackout.blackout_end(at(1, 59)) is None
+        assert blackout.blackout_end(at(2)) == at(4)
+        assert blackout.blackout_end(at(3, 59)) == at(4)
+        assert blackout.blackout_end(at(4)) is None
+
+    def test_blackout_end_midnight(self):
+        """Test a window spanning midnight ends the following day."""
+        blackout = windows(('22:00', '02:00'))
+        assert blackout.blackout_end(at(23)) == at(2, day=3)
+        assert blackout.blackout_end(at(1)) == at(2)
+
+    def test_next_start(self):
+        blackout = windows(('02:00', '04:00'), ('12:00', '13:00'))
+        assert blackout.next_start(at(1)) == at(2)
+        assert blackout.next_start(at(5)) == at(12)
+        assert blackout.next_start(at(14)) == at(2, day=3)
+
+    def test_available(self):
+        blackout = windows(('02:00', '04:00'))
+        assert blackout.available(at(1, 30)) == 30 * 60
+        assert blackout.available(at(3)) == 0
+        assert blackout.available(at(4)) == 22 * HOUR
+
+    def test_local_time(self):
+        """Test times given in another time zone are handled."""
+        blackout = windows(('02:00', '04:00'))
+        local = at(3).astimezone(datetime.timezone(
+            datetime.timedelta(hours=10)))
+        assert blackout.blackout_end(local) == at(4)
@@ -0,0 +1,175 @@
+"""Unit tests for dispatching items to a worker pod."""
+import asyncio
+import datetime
+from copy import deepcopy
+from unittest.mock import MagicMock, patch
+
+import kopf
+import pytest
+
+from oaatoperator import aioclient, worker
+from oaatoperator.common import ProcessingComplete
+from tests.unit.testdata import TestData
+
+
+pytestmark = pytest.mark.unit
+
+UTC = datetime.timezone.utc
+
+
+def group(running=None):
+    oaatgroup = MagicMock()
+    oaatgroup.name = 'kog'
+    oaatgroup.namespace.return_value = 'default'
+    oaatgroup.memo = kopf.Memo(currently_running=running)
+    oaatgroup.oaattype.podspec.return_value = deepcopy(
+        TestData.kot_typespec['podspec'])
+    oaatgroup.oaattype.workerspec.return_value = {'port': 8080}
+    return oaatgroup
+
+
+def worker_pod(phase='Running'):
+    return {'metadata': {'name': 'kog-worker', 'namespace': 'default',
+                         'uid': 'uid1'},
+            'status': {'phase': phase}}
+
+
+NOT_FOUND = aioclient.APINotFoundError({}, status=404, headers={})
+
+
+@pytest.fixture
+def api():
+    """Patch the API calls made for the worker pod."""
+    with patch('oaatoperator.aioclient.get_object') as get, \
+            patch('oaatoperator.aioclient.pod_proxy') as proxy, \
+            patch('oaatoperator.aioclient.create_object') as create, \
+            patch('oaatoperator.aioclient.delete_object') as delete, \
+            patch('kopf.adopt'):
+        yield MagicMock(get=get, proxy=proxy, create=create, delete=delete)
+
+
+def verify(api, oaatgroup, pod=None, status=None):
+    """Run verify_worker_async() with the worker pod and its /status."""
+    api.get.side_effect = NOT_FOUND if pod is None else None
+    api.get.return_value = pod
+    api.proxy.return_value = status
+    return asyncio.run(worker.verify_worker_async(oaatgroup))
+
+
+class TestWorkerDoc:
+    def test_worker_doc(self):
+        with patch('kopf.adopt') as adopt:
+            doc = worker.worker_doc(group())
+        adopt.assert_called_once_with(doc)
+        assert doc['metadata']['name'] == 'kog-worker'
+        assert doc['metadata']['labels'] == {'app': 'oaat-operator',
+                                             worker.WORKER_LABEL: 'kog'}
+        assert 'parent-name' not in doc['metadata']['labels']
+        assert doc['spec']['restartPolicy'] == 'Never'
+        assert {'name': 'OAAT_WORKER_PORT', 'value': '8080'} in (
+            doc['spec']['containers'][0]['env'])
+
+
+class TestVerifyWorker:
+    def test_create(self, api):
+        with pytest.raises(ProcessingComplete,
+                           match='started worker pod kog-worker'):
+            verify(api, group())
+        namespace, doc = api.create.call_args.args[1:]
+        assert namespace == 'default'
+        assert doc['metadata']['name'] == 'kog-worker'
+
+    def test_pending(self, api):
+        with pytest.raises(ProcessingComplete,
+                           match='waiting for worker pod kog-worker'):
+            verify(api, group(), worker_pod('Pending'))
+        api.proxy.assert_not_called()
+
+    def test_stopped(self, api):
+        """Test a stopped worker is replaced, failing its item."""
+        oaatgroup = group(running='item1')
+        with pytest.raises(ProcessingComplete,
+                           match='worker pod kog-worker stopped'):
+            verify(api, oaatgroup, worker_pod('Failed'))
+        oaatgroup.mark_item_failed.assert_called_once_with('item1')
+        assert api.delete.call_args.args[1:] == ('default', 'kog-worker')
+
+    def test_not_ready(self, api):
+        api.proxy.side_effect = aioclient.APIError({}, status=503,
+                                                   headers={})
+        with pytest.raises(ProcessingComplete, match='is not ready'):
+            verify(api, group(), worker_pod())
+
+    def test_running(self, api):
+        oaatgroup = group(running='item1')
+        with pytest.raises(ProcessingComplete,
+                           match='item item1 is running on worker pod'):
+            verify(api, oaatgroup, worker_pod(),
+                   {'item': 'item1', 'state': 'running'})
+        assert api.proxy.call_args.args == ('default', 'kog-worker',
+                                            8080, 'status')
+        assert oaatgroup.set_item_status.call_args.args[:2] == (
+            'item1', 'last_verified')
+        oaatgroup.mark_item_failed.assert_not_called()
+
+    def test_succeeded(self, api):
+        oaatgroup = group(running='item1')
+        pod = worker_pod()
+        assert verify(api, oaatgroup, pod, {
+            'item': 'item1', 'state': 'succeeded', 'exitCode': 0,
+            'startedAt': '2022-01-01T00:00:00Z',
+            'finishedAt': '2022-01-01T00:01:00Z'}) == pod
+        oaatgroup.mark_item_success.assert_called_once_with(
+            'item1',
+            finished_at=datetime.datetime(2022, 1, 1, 0, 1, tzinfo=UTC),
+            started_at=datetime.datetime(2022, 1, 1, tzinfo=UTC))
+        oaatgroup.mark_item_failed.assert_not_called()
+
+    def test_failed(self, api):
+        oaatgroup = group()
+        verify(api, oaatgroup, worker_pod(), {
+            'item': 'item2', 'state': 'failed', 'exitCode': 3,
+            'finishedAt': '2022-01-01T00:01:00Z'})
+        oaatgroup.mark_item_failed.assert_called_once_with(
+            'item2',
+            finished_at=datetime.datetime(2022, 1, 1, 0, 1, tzinfo=UTC),
+            exit_code=3)
+
+    def test_lost(self, api):
+        """Test an item the worker does not know about is failed."""
+        oaatgroup = group(running='item1')
+        verify(api, oaatgroup, worker_pod(), {'state': 'idle'})
+        oaatgroup.mark_item_failed.assert_called_once_with('item1')
+
+    def test_unexpected(self, api):
+        with pytest.raises(ProcessingComplete) as exc:
+            verify(api, group(), worker_pod(), {'state': 'confused'})
+        assert 'unexpected status' in exc.value.ret['error']
+
+
+class TestDispatch:
+    def test_dispatch(self):
+        oaatgroup = group()
+        item = MagicMock()
+        item.name = 'item1'
+        item.group = oaatgroup
+        with patch('oaatoperator.aioclient.pod_proxy',
+                   return_value={'item': 'item1',
+                                 'state': 'running'}) as proxy:
+            pod = asyncio.run(worker.dispatch_async(item, worker_pod()))
+        assert pod.name == 'kog-worker'
+        assert proxy.call_args.args == ('default', 'kog-worker', 8080, 'run')
+        assert proxy.call_args.kwargs['payload'] == {'item': 'item1'}
+        assert item.set_status.call_args.args[0] == 'last_started'
+
+    def test_dispatch_busy(self):
+        item = MagicMock()
+        item.name = 'item1'
+        item.group = group()
+        with patch('oaatoperator.aioclient.pod_proxy',
+                   side_effect=aioclient.APIConflictError(
+                       {}, status=409, headers={})):
+            with pytest.raises(ProcessingComplete,
+                               match='error dispatching item1'):
+                asyncio.run(worker.dispatch_async(item, worker_pod()))
+        item.set_status.assert_not_called()
@@ -25,6 +25,7 @@ class TestData:
 
     @classmethod
     def add_og_mock_attributes(cls, og_mock):
+        og_mock.item_deadline.return_value = None
         og_mock.oaattype = MagicMock(spec=OaatType)
         og_mock.status = {}
         og_mock.name = ''
@@ -41,7 +42,7 @@ class TestData:
                 'name': obj.get('metadata', {}).get('name', 'unknown'),
                 'uid': 'uid',
                 'labels': obj.get('metadata', {}).get('labels', {}),
-                'annotations': obj.get('metadata', {}.get('annotations', {}))
+                'annotations': obj.get('metadata', {}).get('annotations', {})
             },
             'status': obj.get('status')
         }